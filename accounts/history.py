@@ -0,0 +1,249 @@
+"""
+Location history for after-action review.
+
+UserLocation only holds the latest fix. Every position written to it is also
+appended here as a compact row (user, time, coordinates, accuracy), always
+with bulk inserts. Raw rows are downsampled into per-minute and per-hour
+averages by the ``downsample_location_history`` Celery task, and each
+resolution is deleted once it is older than its retention, so the table stays
+bounded while tracks remain available for a year at hourly resolution.
+
+Rows are never updated and are always read and pruned by (resolution,
+recorded_at) ranges, which keeps the table ready for time-based partitioning.
+"""
+import logging
+from datetime import timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, FloatField, Max, Min, Sum
+from django.db.models.functions import TruncHour, TruncMinute
+from django.utils import timezone
+
+from cddp.models import SweepWatermark
+from .models import User, UserLocationHistory
+
+logger = logging.getLogger(__name__)
+
+
+RAW = UserLocationHistory.RAW
+MINUTE = UserLocationHistory.MINUTE
+HOUR = UserLocationHistory.HOUR
+
+# Resolution -> (source resolution, bucket truncation, bucket width)
+ROLLUPS = {
+    MINUTE: (RAW, TruncMinute, timedelta(minutes=1)),
+    HOUR: (MINUTE, TruncHour, timedelta(hours=1)),
+}
+
+# Pings reach the table up to this late (see accounts.pings.MAX_PING_AGE)
+LATE_ARRIVAL = timedelta(minutes=15)
+
+# Source time range aggregated per statement while catching up
+ROLLUP_WINDOW = {
+    MINUTE: timedelta(hours=6),
+    HOUR: timedelta(days=7),
+}
+
+# Rows deleted per statement while pruning
+PRUNE_BATCH_SIZE = 10000
+
+# Most points one track query returns
+MAX_TRACK_POINTS = 5000
+
+
+def retention(resolution):
+    days = {
+        RAW: settings.LOCATION_HISTORY_RAW_DAYS,
+        MINUTE: settings.LOCATION_HISTORY_MINUTE_DAYS,
+        HOUR: settings.LOCATION_HISTORY_HOUR_DAYS,
+    }[resolution]
+    return timedelta(days=days)
+
+
+# Recording
+
+def _accuracy(value):
+    return None if value is None else min(round(value), 32767)
+
+
+def record(points):
+    """
+    Append raw points, each (user_id, recorded_at, latitude, longitude, accuracy).
+    Points without coordinates are skipped.
+    """
+    rows = [
+        UserLocationHistory(
+            user_id=user_id,
+            recorded_at=recorded_at,
+            latitude=latitude,
+            longitude=longitude,
+            accuracy=_accuracy(accuracy),
+        )
+        for user_id, recorded_at, latitude, longitude, accuracy in points
+        if user_id is not None and latitude is not None and longitude is not None
+    ]
+    UserLocationHistory.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def record_locations(locations, recorded_at=None):
+    """
+    Append the current position of UserLocation rows to their users' tracks.
+    recorded_at maps location pks to fix times and defaults to the time of the
+    stored fix.
+    """
+    recorded_at = recorded_at or {}
+    locations = [location for location in locations if location.latitude is not None]
+    if not locations:
+        return 0
+    owners = dict(
+        User.objects.filter(location__in=locations).values_list('location_id', 'pk')
+    )
+    return record(
+        (
+            owners.get(location.pk),
+            (
+                recorded_at.get(location.pk) or location.location_recorded_at
+                or location.location_updated_at or timezone.now()
+            ),
+            location.latitude,
+            location.longitude,
+            location.location_accuracy,
+        )
+        for location in locations
+    )
+
+
+# Downsampling
+
+def _watermark_name(resolution):
+    return f'location_history_{UserLocationHistory.RESOLUTION_NAMES[resolution].lower()}'
+
+
+def _rollup_range(resolution, start, end):
+    """Replace the resolution's buckets in [start, end) with averages of the source rows"""
+    source, truncate, _ = ROLLUPS[resolution]
+    grouped = (
+        UserLocationHistory.objects
+        .filter(resolution=source, recorded_at__gte=start, recorded_at__lt=end)
+        .annotate(bucket=truncate('recorded_at', tzinfo=dt_timezone.utc))
+        .values('user_id', 'bucket')
+        .annotate(
+            sample_count=Sum('samples'),
+            latitude_sum=Sum(F('latitude') * F('samples'), output_field=FloatField()),
+            longitude_sum=Sum(F('longitude') * F('samples'), output_field=FloatField()),
+            worst_accuracy=Max('accuracy'),
+        )
+        .order_by()
+    )
+    rows = [
+        UserLocationHistory(
+            user_id=group['user_id'],
+            resolution=resolution,
+            recorded_at=group['bucket'],
+            latitude=group['latitude_sum'] / group['sample_count'],
+            longitude=group['longitude_sum'] / group['sample_count'],
+            accuracy=group['worst_accuracy'],
+            samples=group['sample_count'],
+        )
+        for group in grouped
+    ]
+    with transaction.atomic():
+        UserLocationHistory.objects.filter(
+            resolution=resolution, recorded_at__gte=start, recorded_at__lt=end
+        ).delete()
+        UserLocationHistory.objects.bulk_create(rows, batch_size=1000)
+        SweepWatermark.advance(_watermark_name(resolution), end)
+    return len(rows)
+
+
+def _floor(moment, resolution):
+    if resolution == MINUTE:
+        return moment.replace(second=0, microsecond=0)
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def downsample(resolution, now=None):
+    """Roll every closed bucket since the last run up into the given resolution"""
+    source, _, width = ROLLUPS[resolution]
+    now = (now or timezone.now()).astimezone(dt_timezone.utc)
+    # Hour buckets wait for the minute buckets they are built from
+    lag = LATE_ARRIVAL if source == RAW else LATE_ARRIVAL + width
+    end = _floor(now - lag, resolution)
+
+    start = SweepWatermark.get(_watermark_name(resolution))
+    if start is None:
+        oldest = (
+            UserLocationHistory.objects.filter(resolution=source)
+            .aggregate(oldest=Min('recorded_at'))['oldest']
+        )
+        if oldest is None:
+            return 0
+        start = _floor(oldest.astimezone(dt_timezone.utc), resolution)
+
+    created = 0
+    while start < end:
+        window_end = min(start + ROLLUP_WINDOW[resolution], end)
+        created += _rollup_range(resolution, start, window_end)
+        start = window_end
+    return created
+
+
+# Retention
+
+def prune(now=None):
+    """Delete rows past their resolution's retention, returning the number deleted"""
+    now = now or timezone.now()
+    deleted = 0
+    for resolution in (RAW, MINUTE, HOUR):
+        cutoff = now - retention(resolution)
+        if resolution in (RAW, MINUTE):
+            # Never drop rows the next resolution has not absorbed yet
+            coarser = resolution + 1
+            absorbed = SweepWatermark.get(_watermark_name(coarser))
+            if absorbed is None:
+                continue
+            cutoff = min(cutoff, absorbed)
+
+        expired = UserLocationHistory.objects.filter(resolution=resolution, recorded_at__lt=cutoff)
+        while True:
+            batch = list(expired.values_list('pk', flat=True)[:PRUNE_BATCH_SIZE])
+            if not batch:
+                break
+            deleted += UserLocationHistory.objects.filter(pk__in=batch).delete()[0]
+    return deleted
+
+
+# Querying
+
+def pick_resolution(start, end, now=None):
+    """The finest resolution still retained at start whose track fits in MAX_TRACK_POINTS"""
+    now = now or timezone.now()
+    span = end - start
+    # Raw tracks are assumed to hold about one point per ping interval
+    for resolution, width in ((RAW, timedelta(seconds=5)), (MINUTE, timedelta(minutes=1))):
+        if start >= now - retention(resolution) and span / width <= MAX_TRACK_POINTS:
+            return resolution
+    return HOUR
+
+
+def track(user_id, start, end, resolution=None, limit=MAX_TRACK_POINTS):
+    """
+    Positions of a user between start and end, oldest first, as
+    (recorded_at, latitude, longitude, accuracy) tuples.
+
+    A single range scan of the (user, resolution, recorded_at) index capped
+    at limit rows. Returns (resolution, points, truncated).
+    """
+    if resolution is None:
+        resolution = pick_resolution(start, end)
+    if resolution != RAW:
+        # Include the bucket start falls into
+        start = _floor(start.astimezone(dt_timezone.utc), resolution)
+    points = list(
+        UserLocationHistory.objects
+        .filter(user_id=user_id, resolution=resolution, recorded_at__gte=start, recorded_at__lte=end)
+        .order_by('recorded_at')
+        .values_list('recorded_at', 'latitude', 'longitude', 'accuracy')[:limit + 1]
+    )
+    return resolution, points[:limit], len(points) > limit
@@ -0,0 +1,67 @@
+# Generated by Django 4.2.16 on 2026-10-18 10:11
+
+from django.db import migrations, models
+import math
+
+
+BATCH_SIZE = 1000
+CELL_SIZE_DEGREES = 0.05
+
+
+def backfill_coordinates(apps, schema_editor):
+    UserLocation = apps.get_model('accounts', 'UserLocation')
+    batch = []
+    queryset = UserLocation.objects.exclude(location__isnull=True).exclude(location='')
+    for location in queryset.only('id', 'location').iterator(chunk_size=BATCH_SIZE):
+        try:
+            latitude, longitude = map(float, location.location.split(','))
+        except ValueError:
+            continue
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            continue
+        location.latitude = latitude
+        location.longitude = longitude
+        location.geocell = "{}:{}".format(
+            int(math.floor(latitude / CELL_SIZE_DEGREES)),
+            int(math.floor(longitude / CELL_SIZE_DEGREES)),
+        )
+        batch.append(location)
+        if len(batch) >= BATCH_SIZE:
+            UserLocation.objects.bulk_update(batch, ['latitude', 'longitude', 'geocell'])
+            batch = []
+    if batch:
+        UserLocation.objects.bulk_update(batch, ['latitude', 'longitude', 'geocell'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userlocation',
+            name='geocell',
+            field=models.CharField(blank=True, editable=False, help_text='Coarse grid cell key for proximity prefiltering', max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='userlocation',
+            name='latitude',
+            field=models.FloatField(blank=True, editable=False, help_text='Latitude parsed from location, kept in sync on save', null=True),
+        ),
+        migrations.AddField(
+            model_name='userlocation',
+            name='longitude',
+            field=models.FloatField(blank=True, editable=False, help_text='Longitude parsed from location, kept in sync on save', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='userlocation',
+            index=models.Index(fields=['latitude', 'longitude'], name='accounts_us_latitud_2e7683_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userlocation',
+            index=models.Index(fields=['geocell'], name='accounts_us_geocell_4a6f38_idx'),
+        ),
+        migrations.RunPython(backfill_coordinates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.16 on 2026-10-18 10:43
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_userlocation_coordinates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserLocationHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.PositiveSmallIntegerField(choices=[(0, 'Raw'), (1, 'Minute'), (2, 'Hour')], default=0)),
+                ('recorded_at', models.DateTimeField(help_text='Time of the fix, or start of the bucket when downsampled')),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('accuracy', models.PositiveSmallIntegerField(blank=True, help_text='Accuracy in whole meters; the worst in the bucket when downsampled', null=True)),
+                ('samples', models.PositiveIntegerField(default=1, help_text='Raw fixes averaged into this row')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='location_history', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'user location history',
+                'indexes': [models.Index(fields=['user', 'resolution', 'recorded_at'], name='accounts_us_user_id_eebc3d_idx'), models.Index(fields=['resolution', 'recorded_at'], name='accounts_us_resolut_97f668_idx')],
+            },
+        ),
+    ]
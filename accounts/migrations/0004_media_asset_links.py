@@ -0,0 +1,44 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+BATCH_SIZE = 1000
+
+
+def copy_references(model, old_name, new_name, assets):
+    rows = model.objects.exclude(**{f'{old_name}_id': None}).only('pk', f'{old_name}_id')
+    batch = []
+    for row in rows.iterator(chunk_size=BATCH_SIZE):
+        setattr(row, f'{new_name}_id', assets[getattr(row, f'{old_name}_id')])
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            model.objects.bulk_update(batch, [new_name])
+            batch = []
+    if batch:
+        model.objects.bulk_update(batch, [new_name])
+
+
+def relink_media(apps, schema_editor):
+    """Point at the MediaAsset each legacy profile-pics row was copied to"""
+    MediaAsset = apps.get_model('cloud_resource', 'MediaAsset')
+    assets = dict(MediaAsset.objects.filter(owner_type='profile-pics').values_list('legacy_id', 'pk'))
+    copy_references(apps.get_model('accounts', 'User'), 'profile_picture', 'profile_picture_asset', assets)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cloud_resource', '0003_media_asset'),
+        ('accounts', '0003_location_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='profile_picture_asset',
+            field=models.OneToOneField(blank=True, limit_choices_to={'owner_type': 'profile-pics'}, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='cloud_resource.mediaasset'),
+        ),
+        migrations.RunPython(relink_media, migrations.RunPython.noop),
+    ]
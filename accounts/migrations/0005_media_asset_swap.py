@@ -0,0 +1,30 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Separate from 0004_media_asset_links so PostgreSQL has checked the copied
+# references before the tables are altered
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_media_asset_links'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='user',
+            name='profile_picture',
+        ),
+        migrations.RenameField(
+            model_name='user',
+            old_name='profile_picture_asset',
+            new_name='profile_picture',
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='profile_picture',
+            field=models.OneToOneField(blank=True, limit_choices_to={'owner_type': 'profile-pics'}, null=True, on_delete=django.db.models.deletion.SET_NULL, to='cloud_resource.mediaasset'),
+        ),
+    ]
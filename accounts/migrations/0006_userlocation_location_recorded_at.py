@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_media_asset_swap'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userlocation',
+            name='location_recorded_at',
+            field=models.DateTimeField(blank=True, help_text='When the device took the stored fix; buffered fixes are written some seconds later', null=True),
+        ),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import  AbstractUser
 from django.core.validators import RegexValidator, MinLengthValidator
 from django.utils import timezone
@@ -11,7 +11,8 @@ from django.core.validators import MinValueValidator, MaxValueValidator
 import logging
 from django.core.exceptions import ValidationError
 # from django.contrib.gis.db import models
-from cloud_resource.models import ProfilePicResource
+from cloud_resource.models import MediaAsset
+from .spatial import location_index, parse_location, geocell_key
 from django.utils.crypto import get_random_string
 # Create your models here.
 logger = logging.getLogger(__name__)
@@ -27,6 +28,25 @@ class UserLocation(models.Model):
         blank=True,
         help_text="Geographic location in 'latitude,longitude' format"
     )
+    latitude = models.FloatField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="Latitude parsed from location, kept in sync on save"
+    )
+    longitude = models.FloatField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="Longitude parsed from location, kept in sync on save"
+    )
+    geocell = models.CharField(
+        max_length=32,
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="Coarse grid cell key for proximity prefiltering"
+    )
     location_accuracy = models.FloatField(
         null=True,
         blank=True,
@@ -37,6 +57,11 @@ class UserLocation(models.Model):
         auto_now=True,
         help_text="Last time location was updated"
     )
+    location_recorded_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="When the device took the stored fix; buffered fixes are written some seconds later"
+    )
     address = models.TextField(
         blank=True,
         help_text="Human-readable address"
@@ -49,6 +74,8 @@ class UserLocation(models.Model):
     class Meta:
         indexes = [
             models.Index(fields=['location_updated_at']),
+            models.Index(fields=['latitude', 'longitude']),
+            models.Index(fields=['geocell']),
         ]
         ordering = ['-location_updated_at']
 
@@ -58,14 +85,37 @@ class UserLocation(models.Model):
             return f"Location at {coords[0]:.6f}, {coords[1]:.6f}"
         return "Location not set"
 
-    def update_location(self, latitude: float, longitude: float, accuracy: Optional[float] = None):
-        """Update location with new coordinates"""
+    def save(self, *args, **kwargs):
+        self.sync_coordinates()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'location' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'latitude', 'longitude', 'geocell'}
+        super().save(*args, **kwargs)
+
+    def sync_coordinates(self):
+        """Refresh the numeric coordinate columns from the location string"""
+        coords = parse_location(self.location)
+        if coords:
+            self.latitude, self.longitude = coords
+            self.geocell = geocell_key(*coords)
+        else:
+            self.latitude = self.longitude = self.geocell = None
+
+    def update_location(self, latitude: float, longitude: float, accuracy: Optional[float] = None,
+                        recorded_at=None):
+        """Update location with new coordinates, taken at recorded_at or now"""
         try:
-            self.location = f"{latitude},{longitude}"
+            self.location = f"{float(latitude)},{float(longitude)}"
+            self.location_recorded_at = recorded_at or timezone.now()
+            update_fields = ['location', 'location_updated_at', 'location_recorded_at']
             if accuracy is not None:
                 self.location_accuracy = accuracy
-            self.save()
-            logger.info(f"Location updated for user to: {self.coordinates} with accuracy {accuracy}")
+                update_fields.append('location_accuracy')
+            self.save(update_fields=update_fields)
+            location_index.update(self.pk, self.latitude, self.longitude)
+            from .history import record_locations
+            record_locations([self])
+            logger.debug(f"Location updated for user to: {self.coordinates} with accuracy {accuracy}")
             return True
         except (ValueError, TypeError) as e:
             logger.error(f"Location update failed: {e}")
@@ -74,13 +124,13 @@ class UserLocation(models.Model):
     @property
     def coordinates(self) -> Optional[Tuple[float, float]]:
         """Return tuple of (latitude, longitude)"""
+        if self.latitude is not None and self.longitude is not None:
+            return self.latitude, self.longitude
         if self.location:
-            try:
-                latitude, longitude = map(float, self.location.split(","))
-                return latitude, longitude
-            except ValueError:
+            coords = parse_location(self.location)
+            if coords is None:
                 logger.error(f"Invalid location format: {self.location}")
-                return None
+            return coords
         return None
 
 
@@ -109,7 +159,10 @@ class User(AbstractUser):
         blank=True
     )
     bio = models.TextField(blank=True)
-    profile_picture = models.OneToOneField(ProfilePicResource, null=True, blank=True, on_delete=models.SET_NULL)
+    profile_picture = models.OneToOneField(
+        MediaAsset, null=True, blank=True, on_delete=models.SET_NULL,
+        limit_choices_to={'owner_type': MediaAsset.PROFILE_PICTURE}
+    )
     last_active = models.DateTimeField(null=True, blank=True)
     is_active = models.BooleanField(default=True)
     is_verified = models.BooleanField(default=False)
@@ -144,45 +197,80 @@ class User(AbstractUser):
             return (timezone.now() - self.last_login).seconds < 900
         return False
 
+    def _active_roles(self) -> frozenset:
+        # Loaded once per user instance, i.e. once per authenticated request
+        roles = getattr(self, '_role_cache', None)
+        if roles is None:
+            roles = frozenset(
+                self.user_roles.filter(is_active=True)
+                .values_list('role__role_type', flat=True)
+            )
+            self._role_cache = roles
+        return roles
+
+    def clear_role_cache(self):
+        """Drop the cached role set after roles are assigned or deactivated"""
+        self.__dict__.pop('_role_cache', None)
+
     def get_roles(self) -> List[str]:
         # return [role.role_type for role in self.user_roles.all()]
-        return list(
-            self.user_roles.filter(is_active=True)
-            .select_related('role')
-            .values_list('role__role_type', flat=True)
-        )
+        return sorted(self._active_roles())
 
     def has_role(self, role_type: str) -> bool:
-        return self.user_roles.filter(role__role_type=role_type).exists()
+        return role_type in self._active_roles()
+
+    def has_any_role(self, *role_types: str) -> bool:
+        return not self._active_roles().isdisjoint(role_types)
 
     
     def delete(self, *args, **kwargs):
-        if self.profile_picture:
-            self.profile_picture.delete()
-        super().delete(*args, **kwargs)
+        from cloud_resource import media
 
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            media.discard([self.profile_picture_id])
+        return result
 
 
 
 
 
 
-# class UserLocation(LocationMixin):
-#     """Model to track user location history"""
-#     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name= 'user_locations')
-#     device_info = models.JSONField(
-#         default=dict,
-#         help_text="Information about the device that reported location"
-#     )
 
-#     class Meta:
-#         indexes = [
-#             models.Index(fields=['location_updated_at']),
-#         ]
-#         ordering = ['-location_updated_at']
+class UserLocationHistory(models.Model):
+    """Append-only track of user positions, downsampled as it ages (see accounts.history)"""
+    RAW = 0
+    MINUTE = 1
+    HOUR = 2
+    RESOLUTION_CHOICES = [
+        (RAW, 'Raw'),
+        (MINUTE, 'Minute'),
+        (HOUR, 'Hour'),
+    ]
+    RESOLUTION_NAMES = dict(RESOLUTION_CHOICES)
+
+    # The composite indexes below cover user lookups
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='location_history', db_index=False)
+    resolution = models.PositiveSmallIntegerField(choices=RESOLUTION_CHOICES, default=RAW)
+    recorded_at = models.DateTimeField(help_text="Time of the fix, or start of the bucket when downsampled")
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    accuracy = models.PositiveSmallIntegerField(
+        null=True,
+        blank=True,
+        help_text="Accuracy in whole meters; the worst in the bucket when downsampled"
+    )
+    samples = models.PositiveIntegerField(default=1, help_text="Raw fixes averaged into this row")
+
+    class Meta:
+        verbose_name_plural = 'user location history'
+        indexes = [
+            models.Index(fields=['user', 'resolution', 'recorded_at']),
+            models.Index(fields=['resolution', 'recorded_at']),
+        ]
 
-    # def latest_location(self):
-    #     return self.user.locations.order_by('-location_updated_at').first()
+    def __str__(self):
+        return f"{self.user_id} @ {self.recorded_at} ({self.get_resolution_display()})"
 
 
 class Role(models.Model):
@@ -232,5 +320,15 @@ class UserRole(models.Model):
         if self.role.role_type == 'SUPERADMIN' and not self.assigned_by.has_role('SUPERADMIN') and not self.user.is_superuser:
             raise ValidationError("Only superadmins can assign superadmin roles")
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.user.clear_role_cache()
+
+    def delete(self, *args, **kwargs):
+        user = self.user
+        result = super().delete(*args, **kwargs)
+        user.clear_role_cache()
+        return result
+
 
 
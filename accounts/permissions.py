@@ -25,8 +25,9 @@ class AdminPermission(BaseRolePermission):
     required_role = 'ADMIN'
     
     def has_permission(self, request, view):
-        return (super().has_permission(request, view) or 
-                request.user.has_role('SUPERADMIN'))
+        if not request.user or not request.user.is_authenticated:
+            return False
+        return request.user.has_any_role('ADMIN', 'SUPERADMIN')
     
 
 
@@ -34,7 +35,7 @@ class ResponderPermission(BaseRolePermission):
     required_role = 'RESPONDER'
     
     def has_object_permission(self, request, view, obj: Any) -> bool:
-        if request.user.has_role('ADMIN') or request.user.has_role('SUPERADMIN'):
+        if request.user.has_any_role('ADMIN', 'SUPERADMIN'):
             return True
         if hasattr(obj, 'responder'):
             return obj.responder.user == request.user
@@ -46,7 +47,7 @@ class VolunteerPermission(BaseRolePermission):
     required_role = 'VOLUNTEER'
     
     def has_object_permission(self, request, view, obj: Any) -> bool:
-        if request.user.has_role('ADMIN') or request.user.has_role('SUPERADMIN'):
+        if request.user.has_any_role('ADMIN', 'SUPERADMIN'):
             return True
         if hasattr(obj, 'volunteer'):
             return obj.volunteer.user == request.user
@@ -58,7 +59,7 @@ class ReporterPermission(BaseRolePermission):
     required_role = 'REPORTER'
     
     def has_object_permission(self, request, view, obj: Any) -> bool:
-        if request.user.has_role('ADMIN') or request.user.has_role('SUPERADMIN'):
+        if request.user.has_any_role('ADMIN', 'SUPERADMIN'):
             return True
         if hasattr(obj, 'reporter'):
             return obj.reporter.user == request.user
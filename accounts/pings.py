@@ -0,0 +1,231 @@
+"""
+High-rate location ping ingestion.
+
+Devices report GPS fixes every few seconds, far more often than anything
+reads them. Pings are buffered instead of written: the buffer keeps only the
+newest ping per location, and a periodic flush writes the survivors with a
+single bulk_update. Pings that would not change anything are dropped, i.e.
+fixes that are too inaccurate, older than the stored position, or within the
+accuracy radius of it while the stored position is still fresh. Pings are
+compared with the time the stored fix was taken, location_recorded_at, not
+with when it was written.
+
+The Redis buffer is shared by every web worker and flushed by the
+``flush_location_pings`` Celery task. The in-memory buffer flushes itself
+from the request path and is meant for tests and single-process servers.
+When Redis can not be reached a ping is written straight away instead.
+"""
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Dict, Optional
+from django.conf import settings
+from django.utils import timezone
+
+from . import history
+from .models import UserLocation
+from .spatial import haversine_km, geocell_key, location_index
+
+logger = logging.getLogger(__name__)
+
+
+# Fixes less accurate than this are not worth storing (UserLocation allows 0-100m)
+MAX_ACCURACY_METERS = 100
+
+# Movement below this, or below the fix's own accuracy, is treated as noise
+MIN_MOVE_METERS = 10
+
+# A stationary device still refreshes its timestamp this often
+REFRESH_INTERVAL = timedelta(minutes=5)
+
+# Pings recorded longer ago than this are dropped on arrival
+MAX_PING_AGE = timedelta(minutes=10)
+
+# Matches the flush-location-pings beat schedule
+FLUSH_INTERVAL_SECONDS = 5
+
+BUFFER_KEY = 'cddp:location-pings'
+
+UPDATE_FIELDS = [
+    'location', 'latitude', 'longitude', 'geocell', 'location_accuracy',
+    'location_updated_at', 'location_recorded_at',
+]
+
+
+class LocationPing:
+    __slots__ = ('location_id', 'latitude', 'longitude', 'accuracy', 'recorded_at')
+
+    def __init__(self, location_id, latitude, longitude, accuracy, recorded_at):
+        self.location_id = location_id
+        self.latitude = latitude
+        self.longitude = longitude
+        self.accuracy = accuracy
+        self.recorded_at = recorded_at
+
+    def to_json(self):
+        return json.dumps([
+            self.latitude, self.longitude, self.accuracy, self.recorded_at.timestamp()
+        ])
+
+    @classmethod
+    def from_json(cls, location_id, value):
+        latitude, longitude, accuracy, recorded_at = json.loads(value)
+        return cls(
+            int(location_id), latitude, longitude, accuracy,
+            datetime.fromtimestamp(recorded_at, tz=dt_timezone.utc)
+        )
+
+
+# Buffers
+
+class InMemoryPingBuffer:
+    def __init__(self, flush_interval=FLUSH_INTERVAL_SECONDS):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pings: Dict[int, LocationPing] = {}
+        self._last_flush = time.monotonic()
+
+    def add(self, ping):
+        with self._lock:
+            current = self._pings.get(ping.location_id)
+            if current is None or ping.recorded_at >= current.recorded_at:
+                self._pings[ping.location_id] = ping
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            flush()
+
+    def drain(self):
+        with self._lock:
+            pings, self._pings = self._pings, {}
+            self._last_flush = time.monotonic()
+        return list(pings.values())
+
+
+class RedisPingBuffer:
+    # Keep the newer of the buffered and incoming ping
+    _ADD_SCRIPT = """
+        local current = redis.call('HGET', KEYS[1], ARGV[1])
+        if current and cjson.decode(current)[4] > tonumber(ARGV[3]) then
+            return 0
+        end
+        redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+        return 1
+    """
+
+    def __init__(self, url):
+        import redis
+
+        self._redis = redis
+        self._client = redis.Redis.from_url(url, socket_connect_timeout=1, socket_timeout=1)
+        self._add = self._client.register_script(self._ADD_SCRIPT)
+
+    def add(self, ping):
+        try:
+            self._add(keys=[BUFFER_KEY], args=[ping.location_id, ping.to_json(), ping.recorded_at.timestamp()])
+        except self._redis.RedisError as e:
+            # Losing the buffer costs a write per ping, not the ping itself
+            logger.warning(f"Could not buffer location ping, writing it directly: {e}")
+            write([ping])
+
+    def drain(self):
+        # Move the hash aside atomically so pings arriving mid-flush start a new buffer
+        flushing = f'{BUFFER_KEY}:flushing:{time.time_ns()}'
+        try:
+            self._client.rename(BUFFER_KEY, flushing)
+        except self._redis.ResponseError:
+            return []  # Nothing buffered
+        pipeline = self._client.pipeline()
+        pipeline.hgetall(flushing)
+        pipeline.delete(flushing)
+        values, _ = pipeline.execute()
+        return [LocationPing.from_json(location_id, value) for location_id, value in values.items()]
+
+
+_buffers = {}
+
+
+def get_buffer():
+    key = (settings.LOCATION_PING_BUFFER, settings.LOCATION_PING_BUFFER_URL)
+    if key not in _buffers:
+        if settings.LOCATION_PING_BUFFER == 'memory':
+            _buffers[key] = InMemoryPingBuffer()
+        else:
+            _buffers[key] = RedisPingBuffer(settings.LOCATION_PING_BUFFER_URL)
+    return _buffers[key]
+
+
+# Ingestion
+
+def record_ping(location_id: int, latitude: float, longitude: float,
+                accuracy: Optional[float] = None, recorded_at: Optional[datetime] = None) -> bool:
+    """
+    Buffer a ping, returning False when it is dropped on arrival.
+    Future timestamps are clamped to now.
+    """
+    now = timezone.now()
+    recorded_at = min(recorded_at or now, now)
+    if now - recorded_at > MAX_PING_AGE:
+        return False
+    if accuracy is not None and accuracy > MAX_ACCURACY_METERS:
+        return False
+    get_buffer().add(LocationPing(location_id, latitude, longitude, accuracy, recorded_at))
+    return True
+
+
+def is_noop(ping, stored):
+    """True when writing the ping would not tell anyone anything new"""
+    if stored.latitude is None or stored.longitude is None:
+        return False
+    # Rows written before location_recorded_at existed only know their write time
+    stored_at = stored.location_recorded_at or stored.location_updated_at
+    if stored_at and ping.recorded_at <= stored_at:
+        return True
+    if stored_at and ping.recorded_at - stored_at >= REFRESH_INTERVAL:
+        return False
+
+    moved_meters = haversine_km(stored.latitude, stored.longitude, ping.latitude, ping.longitude) * 1000
+    threshold = max(MIN_MOVE_METERS, ping.accuracy or 0)
+    more_accurate = (
+        ping.accuracy is not None
+        and (stored.location_accuracy is None or ping.accuracy < stored.location_accuracy)
+    )
+    return moved_meters < threshold and not more_accurate
+
+
+def flush():
+    """Write the newest buffered ping of every location, returning the number of rows updated"""
+    return write(get_buffer().drain())
+
+
+def write(pings):
+    """Write the newest of the given pings of every location, returning the number of rows updated"""
+    pings = {ping.location_id: ping for ping in sorted(pings, key=lambda ping: ping.recorded_at)}
+    if not pings:
+        return 0
+
+    flushed_at = timezone.now()
+    changed = []
+    for location in UserLocation.objects.filter(pk__in=list(pings)).only(*UPDATE_FIELDS):
+        ping = pings[location.pk]
+        if is_noop(ping, location):
+            continue
+        location.location = f"{ping.latitude},{ping.longitude}"
+        location.latitude = ping.latitude
+        location.longitude = ping.longitude
+        location.geocell = geocell_key(ping.latitude, ping.longitude)
+        if ping.accuracy is not None:
+            location.location_accuracy = ping.accuracy
+        location.location_recorded_at = ping.recorded_at
+        # bulk_update skips auto_now; other workers' spatial indexes sync on this column
+        location.location_updated_at = flushed_at
+        changed.append(location)
+
+    UserLocation.objects.bulk_update(changed, UPDATE_FIELDS, batch_size=500)
+    for location in changed:
+        location_index.update(location.pk, location.latitude, location.longitude)
+    history.record_locations(changed)
+
+    logger.debug(f"Flushed {len(changed)} of {len(pings)} buffered location pings")
+    return len(changed)
@@ -2,7 +2,7 @@ from rest_framework import serializers
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
 from .models import (
-    User, Role, UserRole, UserLocation,
+    User, Role, UserRole, UserLocation, UserLocationHistory,
 )
 from volunteer.models import Volunteer
 from reporters.models import Reporter
@@ -12,9 +12,10 @@ from django.contrib.auth.password_validation import validate_password
 from django.utils.http import urlsafe_base64_decode
 from django.contrib.auth.tokens import default_token_generator
 from django.utils import timezone
-from cloud_resource.serializers import ProfilePicResourceSerializer
+from cloud_resource.serializers import MediaAssetSerializer
 from django.core.exceptions import ValidationError
 import logging
+import math
 
 logger = logging.getLogger(__name__)
 
@@ -29,14 +30,16 @@ class UserLocationSimpleSerializer(serializers.ModelSerializer):
 class UserLocationSerializer(serializers.ModelSerializer):
     user_email = serializers.SerializerMethodField()
     last_updated = serializers.SerializerMethodField()
+    latitude = serializers.FloatField(required=False, allow_null=True, min_value=-90, max_value=90)
+    longitude = serializers.FloatField(required=False, allow_null=True, min_value=-180, max_value=180)
 
     class Meta:
         model = UserLocation
         fields = [
-            'id', 'location_accuracy', 'location_updated_at',
+            'id', 'latitude', 'longitude', 'geocell', 'location_accuracy', 'location_updated_at',
             'address', 'device_info', 'user_email', 'last_updated'
         ]
-        read_only_fields = ['location_updated_at']
+        read_only_fields = ['location_updated_at', 'geocell']
         extra_kwargs = {
             'location_accuracy': {'required': False},
             'device_info': {'required': False},
@@ -57,9 +60,63 @@ class UserLocationSerializer(serializers.ModelSerializer):
 
     def validate(self, data):
         # Validate basic fields, no GIS-related checks
+        if 'latitude' in data or 'longitude' in data:
+            latitude, longitude = data.get('latitude'), data.get('longitude')
+            if (latitude is None) != (longitude is None):
+                raise serializers.ValidationError(
+                    "Both latitude and longitude must be provided together"
+                )
+            # The location string stays the source of truth; the numeric
+            # columns are derived from it when the model is saved
+            data['location'] = f"{latitude},{longitude}" if latitude is not None else None
         return data    
 
 
+class LocationPingSerializer(serializers.Serializer):
+    lat = serializers.FloatField(min_value=-90, max_value=90)
+    lng = serializers.FloatField(min_value=-180, max_value=180)
+    accuracy = serializers.FloatField(required=False, allow_null=True, min_value=0)
+    recorded_at = serializers.DateTimeField(required=False)
+
+
+class NearbySearchQuerySerializer(serializers.Serializer):
+    """Query parameters of the searches for volunteers and responders near a point"""
+    latitude = serializers.FloatField(required=False, min_value=-90, max_value=90)
+    longitude = serializers.FloatField(required=False, min_value=-180, max_value=180)
+    radius = serializers.FloatField(required=False)
+    limit = serializers.IntegerField(required=False, min_value=1)
+
+    def validate_radius(self, radius):
+        if not (math.isfinite(radius) and radius > 0):
+            raise serializers.ValidationError("Radius must be a positive number of kilometers")
+        return radius
+
+    def validate(self, data):
+        # NaN passes the range checks, since every comparison with it is false
+        for field in ('latitude', 'longitude'):
+            if field in data and math.isnan(data[field]):
+                raise serializers.ValidationError({field: "A valid number is required."})
+        if ('latitude' in data) != ('longitude' in data):
+            raise serializers.ValidationError("Both latitude and longitude must be provided together")
+        return data
+
+
+class LocationHistoryQuerySerializer(serializers.Serializer):
+    RESOLUTIONS = {'raw': UserLocationHistory.RAW, 'minute': UserLocationHistory.MINUTE, 'hour': UserLocationHistory.HOUR}
+
+    user = serializers.UUIDField(required=False)
+    start = serializers.DateTimeField()
+    end = serializers.DateTimeField()
+    resolution = serializers.ChoiceField(choices=list(RESOLUTIONS), required=False)
+
+    def validate(self, data):
+        if data['start'] >= data['end']:
+            raise serializers.ValidationError("start must be before end")
+        if 'resolution' in data:
+            data['resolution'] = self.RESOLUTIONS[data['resolution']]
+        return data
+
+
 class UserRoleSerializer(serializers.ModelSerializer):
     role_type = serializers.CharField(source='role.role_type', read_only=True)
     
@@ -83,7 +140,7 @@ class UserSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, required=True)
     roles = UserRoleSerializer(source='userrole_set', many=True, read_only=True)
     location = UserLocationSerializer(required=False)
-    profile_picture_data = ProfilePicResourceSerializer(required=False, read_only=True)
+    profile_picture_data = MediaAssetSerializer(required=False, read_only=True)
 
     class Meta:
         model = User
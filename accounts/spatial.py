@@ -0,0 +1,322 @@
+import heapq
+import logging
+import math
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from django.db.models import Q
+
+logger = logging.getLogger(__name__)
+
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.32
+
+# ~5.5km cells at the equator, narrower towards the poles
+CELL_SIZE_DEGREES = 0.05
+
+# How often a worker pulls location changes written by other processes
+SYNC_INTERVAL_SECONDS = 5.0
+
+# How often a worker drops locations other processes deleted or cleared, which
+# leave no newer location_updated_at behind for the sync to find
+RECONCILE_INTERVAL_SECONDS = 300.0
+
+# Candidate locations resolved to profiles per query
+PROFILE_BATCH_SIZE = 500
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Great-circle distance between two points in kilometers"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def parse_location(value: Optional[str]) -> Optional[Tuple[float, float]]:
+    """Parse a 'latitude,longitude' string, returning None if it is not valid"""
+    if not value:
+        return None
+    try:
+        latitude, longitude = map(float, value.split(","))
+    except ValueError:
+        return None
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    return latitude, longitude
+
+
+def cell_for(latitude: float, longitude: float) -> Tuple[int, int]:
+    return (
+        int(math.floor(latitude / CELL_SIZE_DEGREES)),
+        int(math.floor(longitude / CELL_SIZE_DEGREES)),
+    )
+
+
+def geocell_key(latitude: float, longitude: float) -> str:
+    """Coarse cell key stored alongside coordinates for indexed lookups"""
+    row, col = cell_for(latitude, longitude)
+    return f"{row}:{col}"
+
+
+def bounding_box(latitude: float, longitude: float, radius_km: float) -> Tuple[float, float, float, float]:
+    """Return (min_lat, max_lat, min_lng, max_lng) enclosing the radius around a point"""
+    d_lat = radius_km / KM_PER_DEGREE_LAT
+    cos_lat = math.cos(math.radians(latitude))
+    if cos_lat < 1e-6:
+        d_lng = 180.0
+    else:
+        d_lng = min(180.0, radius_km / (KM_PER_DEGREE_LAT * cos_lat))
+    return (
+        max(-90.0, latitude - d_lat),
+        min(90.0, latitude + d_lat),
+        longitude - d_lng,
+        longitude + d_lng,
+    )
+
+
+def bounding_box_q(latitude: float, longitude: float, radius_km: float, prefix: str = '') -> Q:
+    """
+    Q object prefiltering rows on indexed latitude/longitude columns, so the
+    exact distance check only runs on rows inside the bounding box.
+    """
+    min_lat, max_lat, min_lng, max_lng = bounding_box(latitude, longitude, radius_km)
+    q = Q(**{f'{prefix}latitude__range': (min_lat, max_lat)})
+
+    if max_lng - min_lng >= 360:
+        return q
+    if min_lng < -180:
+        lng_q = Q(**{f'{prefix}longitude__gte': min_lng + 360}) | Q(**{f'{prefix}longitude__lte': max_lng})
+    elif max_lng > 180:
+        lng_q = Q(**{f'{prefix}longitude__gte': min_lng}) | Q(**{f'{prefix}longitude__lte': max_lng - 360})
+    else:
+        lng_q = Q(**{f'{prefix}longitude__range': (min_lng, max_lng)})
+    return q & lng_q
+
+
+class GridSpatialIndex:
+    """
+    Grid-bucketed in-memory index of tracked user locations.
+
+    Points are keyed by UserLocation id and bucketed into fixed-size
+    lat/lng cells, so radius and k-nearest queries only inspect the
+    handful of cells around the query point instead of every row.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._cells: Dict[Tuple[int, int], Dict[int, Tuple[float, float]]] = {}
+        self._points: Dict[int, Tuple[float, float]] = {}
+        self._loaded = False
+        self._watermark = None
+        self._last_sync = 0.0
+        self._last_reconcile = 0.0
+
+    def __len__(self):
+        return len(self._points)
+
+    def update(self, location_id: int, latitude: float, longitude: float):
+        with self._lock:
+            self._discard(location_id)
+            self._points[location_id] = (latitude, longitude)
+            self._cells.setdefault(cell_for(latitude, longitude), {})[location_id] = (latitude, longitude)
+
+    def remove(self, location_id: int):
+        with self._lock:
+            self._discard(location_id)
+
+    def clear(self):
+        with self._lock:
+            self._cells.clear()
+            self._points.clear()
+            self._loaded = False
+            self._watermark = None
+            self._last_sync = 0.0
+            self._last_reconcile = 0.0
+
+    def _discard(self, location_id: int):
+        point = self._points.pop(location_id, None)
+        if point is None:
+            return
+        key = cell_for(*point)
+        bucket = self._cells.get(key)
+        if bucket is not None:
+            bucket.pop(location_id, None)
+            if not bucket:
+                del self._cells[key]
+
+    def _cells_in_box(self, latitude: float, longitude: float, radius_km: float):
+        min_lat, max_lat, min_lng, max_lng = bounding_box(latitude, longitude, radius_km)
+        (min_row, min_col), (max_row, max_col) = cell_for(min_lat, min_lng), cell_for(max_lat, max_lng)
+        span = (max_row - min_row + 1) * (max_col - min_col + 1)
+
+        # For very large radii walking the occupied cells is cheaper than the grid
+        if span > len(self._cells):
+            for (row, col), bucket in self._cells.items():
+                if min_row <= row <= max_row and self._col_in_range(col, min_col, max_col):
+                    yield bucket
+            return
+
+        cols_per_turn = int(round(360 / CELL_SIZE_DEGREES))
+        for row in range(min_row, max_row + 1):
+            for col in range(min_col, max_col + 1):
+                bucket = self._cells.get((row, self._wrap_col(col, cols_per_turn)))
+                if bucket:
+                    yield bucket
+
+    @staticmethod
+    def _wrap_col(col: int, cols_per_turn: int) -> int:
+        half = cols_per_turn // 2
+        return (col + half) % cols_per_turn - half
+
+    def _col_in_range(self, col: int, min_col: int, max_col: int) -> bool:
+        cols_per_turn = int(round(360 / CELL_SIZE_DEGREES))
+        if max_col - min_col + 1 >= cols_per_turn:
+            return True
+        return any(
+            min_col <= candidate <= max_col
+            for candidate in (col - cols_per_turn, col, col + cols_per_turn)
+        )
+
+    def within_radius(self, latitude: float, longitude: float, radius_km: float,
+                      limit: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Return [(location_id, distance_km)] within the radius, nearest first"""
+        with self._lock:
+            matches = []
+            for bucket in self._cells_in_box(latitude, longitude, radius_km):
+                for location_id, (lat, lng) in bucket.items():
+                    distance = haversine_km(latitude, longitude, lat, lng)
+                    if distance <= radius_km:
+                        matches.append((distance, location_id))
+
+        if limit is not None:
+            matches = heapq.nsmallest(limit, matches)
+        else:
+            matches.sort()
+        return [(location_id, distance) for distance, location_id in matches]
+
+    def nearest(self, latitude: float, longitude: float, k: int,
+                max_radius_km: float = 50.0) -> List[Tuple[int, float]]:
+        """Return up to k [(location_id, distance_km)] nearest the point, searching outwards"""
+        radius = CELL_SIZE_DEGREES * KM_PER_DEGREE_LAT
+        while True:
+            radius = min(radius, max_radius_km)
+            matches = self.within_radius(latitude, longitude, radius, limit=k)
+            if len(matches) >= k or radius >= max_radius_km:
+                return matches
+            radius *= 2
+
+    # Loading and synchronisation with the database
+
+    def ensure_loaded(self):
+        """Load the index on first use, pull rows changed by other workers and drop removed ones"""
+        if self._loaded and not self._sync_due() and not self._reconcile_due():
+            return
+        with self._lock:
+            if not self._loaded:
+                self._load(full=True)
+            elif self._sync_due():
+                self._load(full=False)
+            if self._reconcile_due():
+                self._reconcile()
+
+    def _sync_due(self) -> bool:
+        return time.monotonic() - self._last_sync >= SYNC_INTERVAL_SECONDS
+
+    def _reconcile_due(self) -> bool:
+        return time.monotonic() - self._last_reconcile >= RECONCILE_INTERVAL_SECONDS
+
+    def _load(self, full: bool):
+        from .models import UserLocation
+
+        queryset = UserLocation.objects.all()
+        if full or self._watermark is None:
+            queryset = queryset.filter(latitude__isnull=False, longitude__isnull=False)
+        else:
+            queryset = queryset.filter(location_updated_at__gt=self._watermark)
+
+        rows = queryset.order_by().values_list('id', 'latitude', 'longitude', 'location_updated_at')
+        watermark = self._watermark
+        count = 0
+        for location_id, latitude, longitude, updated_at in rows.iterator(chunk_size=2000):
+            if latitude is None or longitude is None:
+                self._discard(location_id)
+            else:
+                self.update(location_id, latitude, longitude)
+            if updated_at and (watermark is None or updated_at > watermark):
+                watermark = updated_at
+            count += 1
+
+        self._watermark = watermark
+        self._loaded = True
+        self._last_sync = time.monotonic()
+        if full:
+            self._last_reconcile = self._last_sync
+            logger.info(f"Spatial index loaded with {count} locations")
+
+    def _reconcile(self):
+        """Drop indexed locations that no longer exist or no longer have coordinates"""
+        from .models import UserLocation
+
+        located = set(
+            UserLocation.objects.filter(latitude__isnull=False, longitude__isnull=False)
+            .values_list('id', flat=True).iterator(chunk_size=2000)
+        )
+        stale = [location_id for location_id in self._points if location_id not in located]
+        for location_id in stale:
+            self._discard(location_id)
+        self._last_reconcile = time.monotonic()
+        if stale:
+            logger.info(f"Spatial index dropped {len(stale)} stale locations")
+
+
+location_index = GridSpatialIndex()
+
+
+def find_nearby_locations(latitude: float, longitude: float, radius_km: float,
+                          limit: Optional[int] = None) -> List[Tuple[int, float]]:
+    """Location ids within radius_km of the point, nearest first"""
+    location_index.ensure_loaded()
+    return location_index.within_radius(latitude, longitude, radius_km, limit=limit)
+
+
+def find_nearest_locations(latitude: float, longitude: float, k: int,
+                           max_radius_km: float = 50.0) -> List[Tuple[int, float]]:
+    """The k location ids closest to the point, nearest first"""
+    location_index.ensure_loaded()
+    return location_index.nearest(latitude, longitude, k, max_radius_km=max_radius_km)
+
+
+def nearby_profiles(queryset, latitude: float, longitude: float, radius_km: float,
+                    limit: Optional[int] = None):
+    """
+    Return [(profile, distance_km)] for a Volunteer/Responder queryset,
+    restricted to profiles whose user has a location within the radius.
+
+    The index only proposes candidates: distances are recomputed from the
+    coordinates loaded with each profile, so a location another worker moved,
+    cleared or deleted since the last sync is never returned.
+    """
+    matches = find_nearby_locations(latitude, longitude, radius_km)
+    results = []
+
+    # Matches are nearest first, so stop resolving profiles once the limit is met
+    for start in range(0, len(matches), PROFILE_BATCH_SIZE):
+        location_ids = [location_id for location_id, _ in matches[start:start + PROFILE_BATCH_SIZE]]
+        profiles = queryset.filter(
+            user__location_id__in=location_ids,
+            user__location__latitude__isnull=False,
+            user__location__longitude__isnull=False,
+        ).select_related('user__location')
+        batch = []
+        for profile in profiles:
+            location = profile.user.location
+            distance = haversine_km(latitude, longitude, location.latitude, location.longitude)
+            if distance <= radius_km:
+                batch.append((profile, distance))
+        results.extend(sorted(batch, key=lambda item: item[1]))
+        if limit is not None and len(results) >= limit:
+            return results[:limit]
+    return results
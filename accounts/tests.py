@@ -1,3 +1,287 @@
-from django.test import TestCase
+import importlib
+from datetime import timedelta
+from unittest import mock
+from django.apps import apps
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase
 
-# Create your tests here.
+from volunteer.models import Volunteer
+from . import history, pings, spatial
+from .models import Role, User, UserLocation, UserLocationHistory, UserRole
+
+
+@override_settings(LOCATION_PING_BUFFER='memory')
+class LocationPingTest(APITestCase):
+    """Pings are coalesced per location and written in one flush"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='pinger@example.com', password='password')
+        self.client.force_authenticate(self.user)
+        pings.get_buffer().drain()
+
+    def ping(self, lat, lng, **extra):
+        return self.client.post(
+            reverse('user_location-ping'), {'lat': lat, 'lng': lng, **extra}, format='json'
+        )
+
+    def test_newest_ping_wins(self):
+        for step in range(5):
+            response = self.ping(6.5 + step * 0.01, 3.3)
+            self.assertEqual(response.status_code, 202)
+            self.assertTrue(response.data['accepted'])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(pings.flush(), 1)
+        # Load, bulk update, history owners, history insert
+        self.assertEqual(len(queries), 4)
+
+        self.user.refresh_from_db()
+        self.assertAlmostEqual(self.user.location.latitude, 6.54)
+        self.assertEqual(self.user.location_history.count(), 1)
+        self.assertEqual(self.user.location.location, '6.54,3.3')
+
+    def test_drops_inaccurate_stale_and_unchanged_pings(self):
+        self.ping(6.5, 3.3)
+        pings.flush()
+
+        self.assertFalse(self.ping(7.0, 3.3, accuracy=500).data['accepted'])
+        stale = (timezone.now() - timedelta(hours=1)).isoformat()
+        self.assertFalse(self.ping(7.0, 3.3, recorded_at=stale).data['accepted'])
+
+        # A couple of metres of jitter is noise
+        self.assertTrue(self.ping(6.50001, 3.3).data['accepted'])
+        self.assertEqual(pings.flush(), 0)
+
+    def test_compares_pings_with_the_time_of_the_stored_fix(self):
+        now = timezone.now()
+        self.ping(6.5, 3.3, recorded_at=(now - timedelta(seconds=60)).isoformat())
+        pings.flush()
+
+        # Taken after the stored fix but before it was flushed
+        self.ping(6.6, 3.3, recorded_at=(now - timedelta(seconds=30)).isoformat())
+        self.assertEqual(pings.flush(), 1)
+        location = UserLocation.objects.get(pk=self.user.location_id)
+        self.assertEqual(location.location_recorded_at, now - timedelta(seconds=30))
+        self.assertEqual(
+            list(self.user.location_history.values_list('recorded_at', flat=True).order_by('recorded_at')),
+            [now - timedelta(seconds=60), now - timedelta(seconds=30)]
+        )
+
+        self.ping(6.7, 3.3, recorded_at=(now - timedelta(seconds=45)).isoformat())
+        self.assertEqual(pings.flush(), 0)
+
+    @override_settings(LOCATION_PING_BUFFER='redis', LOCATION_PING_BUFFER_URL='redis://127.0.0.1:1/0')
+    def test_writes_directly_when_redis_is_down(self):
+        with self.assertLogs('accounts.pings', 'WARNING'):
+            self.assertTrue(self.ping(6.5, 3.3).data['accepted'])
+            self.assertTrue(self.ping(6.6, 3.3).data['accepted'])
+
+        location = UserLocation.objects.get(pk=self.user.location_id)
+        self.assertAlmostEqual(location.latitude, 6.6)
+        self.assertEqual(self.user.location_history.count(), 2)
+
+
+class LocationHistoryTest(APITestCase):
+    """Tracks are recorded raw, downsampled as they age and pruned by resolution"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='tracked@example.com', password='password')
+        cls.other = User.objects.create_user(email='other@example.com', password='password')
+        cls.start = timezone.now().replace(second=0, microsecond=0) - timedelta(days=3)
+        # Six fixes 20 seconds apart span two minutes
+        history.record(
+            (cls.user.pk, cls.start + timedelta(seconds=20 * n), 6.5 + n * 0.001, 3.3, 5)
+            for n in range(6)
+        )
+
+    def test_downsample_and_prune(self):
+        self.assertEqual(history.downsample(history.MINUTE), 2)
+        first_minute = UserLocationHistory.objects.get(
+            resolution=history.MINUTE, recorded_at=self.start
+        )
+        self.assertEqual(first_minute.samples, 3)
+        self.assertAlmostEqual(first_minute.latitude, 6.501)
+
+        # Running again finds nothing new
+        self.assertEqual(history.downsample(history.MINUTE), 0)
+        self.assertEqual(history.downsample(history.HOUR), 1)
+
+        # Raw rows are older than the two day retention and already absorbed
+        self.assertEqual(history.prune(), 6)
+        _, points, _ = history.track(
+            self.user.pk, self.start, self.start + timedelta(hours=1), resolution=history.HOUR
+        )
+        self.assertEqual(len(points), 1)
+        self.assertAlmostEqual(points[0][1], 6.5025)
+
+    def test_track_endpoint(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(reverse('user_location-history'), {
+            'start': self.start.isoformat(),
+            'end': (self.start + timedelta(minutes=1)).isoformat(),
+            'resolution': 'raw',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['resolution'], 'raw')
+        self.assertEqual(len(response.data['points']), 4)
+
+        self.client.force_authenticate(self.other)
+        response = self.client.get(reverse('user_location-history'), {
+            'user': str(self.user.pk),
+            'start': self.start.isoformat(),
+            'end': (self.start + timedelta(minutes=1)).isoformat(),
+        })
+        self.assertEqual(response.status_code, 403)
+
+
+class GridSpatialIndexTest(TestCase):
+    """Radius and nearest searches only inspect nearby cells and see other workers' changes"""
+
+    def setUp(self):
+        spatial.location_index.clear()
+
+    def test_radius_and_nearest(self):
+        index = spatial.GridSpatialIndex()
+        index.update(1, 6.5, 3.3)
+        index.update(2, 6.51, 3.3)
+        index.update(3, 6.6, 3.3)
+        index.update(4, 7.5, 3.3)
+
+        self.assertEqual([location_id for location_id, _ in index.within_radius(6.5, 3.3, 5)], [1, 2])
+        distance = dict(index.within_radius(6.5, 3.3, 5))[2]
+        self.assertAlmostEqual(distance, spatial.haversine_km(6.5, 3.3, 6.51, 3.3))
+        self.assertEqual([location_id for location_id, _ in index.nearest(6.5, 3.3, k=3)], [1, 2, 3])
+        # The search widens no further than max_radius_km
+        self.assertEqual(len(index.nearest(6.5, 3.3, k=4, max_radius_km=20)), 3)
+
+        index.update(2, 7.51, 3.3)
+        index.remove(1)
+        self.assertEqual([location_id for location_id, _ in index.within_radius(6.5, 3.3, 15)], [3])
+        self.assertEqual(len(index), 3)
+
+    def test_wraps_across_the_antimeridian(self):
+        index = spatial.GridSpatialIndex()
+        index.update(1, 0, 179.99)
+        index.update(2, 0, -179.99)
+        self.assertEqual({location_id for location_id, _ in index.within_radius(0, 179.995, 5)}, {1, 2})
+
+    def locate(self, name, location):
+        user = User.objects.create_user(
+            email=f'{name}@example.com', password='password', location=UserLocation.objects.create(location=location)
+        )
+        return Volunteer.objects.create(user=user)
+
+    def nearby(self):
+        return [profile for profile, _ in spatial.nearby_profiles(Volunteer.objects.all(), 6.5, 3.3, 5)]
+
+    def test_changes_by_other_workers_are_not_returned(self):
+        near, moved, cleared, deleted = (
+            self.locate(name, location) for name, location in
+            (('near', '6.5,3.3'), ('moved', '6.51,3.3'), ('cleared', '6.52,3.3'), ('deleted', '6.5,3.33'))
+        )
+        self.assertEqual(self.nearby(), [near, moved, cleared, deleted])
+
+        # Written without the index, as another process would
+        UserLocation.objects.filter(pk=moved.user.location_id).update(location='8.0,3.3', latitude=8.0)
+        UserLocation.objects.filter(pk=cleared.user.location_id).update(location='', latitude=None, longitude=None)
+        UserLocation.objects.filter(pk=deleted.user.location_id).delete()
+        self.assertEqual(self.nearby(), [near])
+
+        # Rows that vanished or lost their coordinates leave the index on the next reconcile
+        with mock.patch.object(spatial, 'RECONCILE_INTERVAL_SECONDS', 0):
+            spatial.location_index.ensure_loaded()
+        self.assertEqual(len(spatial.location_index), 2)
+
+
+class LocationCoordinatesTest(APITestCase):
+    """Coordinates are parsed into indexed columns and radius queries prefilter on them"""
+
+    def locations(self, *values):
+        return [UserLocation.objects.create(location=value) for value in values]
+
+    def test_coordinates_follow_the_location_string(self):
+        location, = self.locations('6.5,3.3')
+        self.assertEqual((location.latitude, location.longitude), (6.5, 3.3))
+        self.assertEqual(location.geocell, spatial.geocell_key(6.5, 3.3))
+
+        location.location = '95,3.3'
+        location.save(update_fields=['location'])
+        location.refresh_from_db()
+        self.assertEqual((location.latitude, location.longitude, location.geocell), (None, None, None))
+
+    def test_backfill_migration(self):
+        valid, invalid, empty = self.locations('6.5,3.3', 'somewhere', '')
+        UserLocation.objects.update(latitude=None, longitude=None, geocell=None)
+
+        migration = importlib.import_module('accounts.migrations.0002_userlocation_coordinates')
+        migration.backfill_coordinates(apps, None)
+
+        rows = dict(UserLocation.objects.values_list('pk', 'geocell'))
+        self.assertEqual(rows, {valid.pk: spatial.geocell_key(6.5, 3.3), invalid.pk: None, empty.pk: None})
+        valid.refresh_from_db()
+        self.assertEqual((valid.latitude, valid.longitude), (6.5, 3.3))
+
+    def test_bounding_box_wraps_across_the_antimeridian(self):
+        east, west, _ = self.locations('0,179.9', '0,-179.9', '0,170')
+        inside = UserLocation.objects.filter(spatial.bounding_box_q(0, 179.95, 20))
+        self.assertEqual(set(inside), {east, west})
+
+        north, _ = self.locations('89.95,10', '80,10')
+        # Near the pole the box spans every longitude
+        self.assertEqual(list(UserLocation.objects.filter(spatial.bounding_box_q(89.99, -170, 10))), [north])
+
+    def test_radius_filter(self):
+        near, corner, _ = self.locations('6.5,3.3', '6.54,3.34', '7.5,3.3')
+        self.client.force_authenticate(User.objects.create_user(
+            email='staff@example.com', password='password', is_staff=True
+        ))
+        response = self.client.get(reverse('user_location-list'), {'latitude': 6.5, 'longitude': 3.3, 'radius': 5})
+        self.assertEqual(response.status_code, 200)
+        # The corner of the bounding box is outside the radius itself
+        self.assertEqual([row['id'] for row in response.data['results']], [near.pk])
+        self.assertEqual(self.client.get(
+            reverse('user_location-list'), {'latitude': 'north', 'longitude': 3.3, 'radius': 5}
+        ).status_code, 400)
+
+
+class RoleCacheTest(TestCase):
+    """Role checks load the active roles once per user instance"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_role = Role.objects.create(role_type='ADMIN', description='Admin')
+        cls.volunteer_role = Role.objects.create(role_type='VOLUNTEER', description='Volunteer')
+
+    def test_roles_are_loaded_once(self):
+        user = User.objects.create_user(email='cached@example.com', password='password')
+        UserRole.objects.create(user=user, role=self.volunteer_role)
+        UserRole.objects.create(user=user, role=self.admin_role, is_active=False)
+
+        user = User.objects.get(pk=user.pk)
+        with self.assertNumQueries(1):
+            self.assertTrue(user.has_role('VOLUNTEER'))
+            self.assertFalse(user.has_role('ADMIN'))
+            self.assertTrue(user.has_any_role('ADMIN', 'VOLUNTEER'))
+            self.assertFalse(user.has_any_role('ADMIN', 'RESPONDER'))
+            self.assertEqual(user.get_roles(), ['VOLUNTEER'])
+
+    def test_role_changes_clear_the_cache(self):
+        user = User.objects.create_user(email='promoted@example.com', password='password')
+        self.assertFalse(user.has_any_role('ADMIN'))
+
+        assignment = UserRole.objects.create(user=user, role=self.admin_role)
+        self.assertTrue(user.has_any_role('ADMIN'))
+
+        assignment.is_active = False
+        assignment.save()
+        self.assertFalse(user.has_role('ADMIN'))
+
+        assignment = UserRole.objects.create(user=user, role=self.volunteer_role)
+        self.assertEqual(user.get_roles(), ['VOLUNTEER'])
+        assignment.delete()
+        self.assertEqual(user.get_roles(), [])
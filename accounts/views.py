@@ -10,7 +10,7 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from django.db.models import Avg, Count, Q
 from .filters import UserRoleFilter, RoleFilter, UserFilter
 from rest_framework_simplejwt.tokens import RefreshToken
-from rest_framework.exceptions import APIException
+from rest_framework.exceptions import APIException, ValidationError
 from .utils import send_verification_email, send_password_reset_email
 from rest_framework.request import Request
 from django.contrib.auth.tokens import default_token_generator
@@ -24,9 +24,14 @@ from drf_spectacular.types import OpenApiTypes
 from .permissions import (
     AdminPermission, 
 )
+from .spatial import bounding_box_q, haversine_km, location_index
+from cddp.pagination import FeedPagination
+from . import pings
+from . import history as location_history
 from .models import (
 
     UserLocation,
+    UserLocationHistory,
     Role,
     UserRole
 )
@@ -36,6 +41,8 @@ from .serializers import (
     RoleSerializer,
     UserLocationSerializer,
     UserLocationSimpleSerializer,
+    LocationPingSerializer,
+    LocationHistoryQuerySerializer,
     PasswordResetRequestSerializer,
     PasswordResetConfirmSerializer,
     LoginSerializer,
@@ -81,6 +88,8 @@ class UserLocationViewSet(viewsets.ModelViewSet):
     search_fields = ['address']
     ordering_fields = ['location_updated_at', 'location_accuracy']
     ordering = ['-location_updated_at']
+    pagination_class = FeedPagination
+    cursor_field = 'location_updated_at'
 
     def get_queryset(self):
         """
@@ -104,11 +113,34 @@ class UserLocationViewSet(viewsets.ModelViewSet):
         if end_date:
             queryset = queryset.filter(location_updated_at__lte=end_date)
 
+        # Proximity filtering on the indexed coordinate columns
+        latitude = self.request.query_params.get('latitude')
+        longitude = self.request.query_params.get('longitude')
+        radius = self.request.query_params.get('radius')
+        if latitude and longitude and radius:
+            try:
+                latitude, longitude, radius = float(latitude), float(longitude), float(radius)
+            except ValueError:
+                raise ValidationError("latitude, longitude and radius must be numbers")
+            queryset = self._within_radius(queryset, latitude, longitude, radius)
+
         return queryset
 
+    @staticmethod
+    def _within_radius(queryset, latitude, longitude, radius_km):
+        """Bounding-box prefilter in SQL, then an exact distance check on the survivors"""
+        candidates = queryset.filter(bounding_box_q(latitude, longitude, radius_km))
+        matching_ids = [
+            location_id
+            for location_id, lat, lng in candidates.values_list('id', 'latitude', 'longitude')
+            if haversine_km(latitude, longitude, lat, lng) <= radius_km
+        ]
+        return queryset.filter(id__in=matching_ids)
+
     def perform_create(self, serializer):
         """Automatically associate the location with the current user"""
-        serializer.save()
+        instance = serializer.save()
+        location_history.record_locations([instance])
         logger.info(f"Location created for user {self.request.user}")
 
     def perform_update(self, serializer):
@@ -117,11 +149,78 @@ class UserLocationViewSet(viewsets.ModelViewSet):
         instance = serializer.save()
         
         if old_location.coordinates != instance.coordinates:
+            location_history.record_locations([instance])
             logger.info(
                 f"Location updated for user {self.request.user}. "
                 f"Old: {old_location.coordinates}, New: {instance.coordinates}"
             )
 
+    @extend_schema(request=LocationPingSerializer, responses={202: OpenApiTypes.OBJECT})
+    @action(detail=False, methods=['post'])
+    def ping(self, request):
+        """
+        Report the caller's current GPS fix at high frequency.
+        POST /api/locations/ping/
+
+        Pings are buffered and written in bulk every few seconds, keeping only
+        the newest per user; inaccurate, stale and unchanged fixes are dropped.
+        """
+        serializer = LocationPingSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        location_id = request.user.location_id
+        if location_id is None:
+            # First fix for this user: create the row the buffer will fill in
+            request.user.location = UserLocation.objects.create()
+            request.user.save(update_fields=['location'])
+            location_id = request.user.location_id
+
+        accepted = pings.record_ping(
+            location_id,
+            data['lat'],
+            data['lng'],
+            accuracy=data.get('accuracy'),
+            recorded_at=data.get('recorded_at')
+        )
+        return Response({"accepted": accepted}, status=status.HTTP_202_ACCEPTED)
+
+    @extend_schema(parameters=[LocationHistoryQuerySerializer], responses={200: OpenApiTypes.OBJECT})
+    @action(detail=False, methods=['get'])
+    def history(self, request):
+        """
+        Where a user was between two points in time, oldest first.
+        GET /api/locations/history/?user={id}&start=...&end=...&resolution=raw|minute|hour
+
+        Defaults to the caller. Without a resolution the finest one that is
+        still retained and fits in one response is used.
+        """
+        serializer = LocationHistoryQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+
+        user_id = params.get('user', request.user.pk)
+        if user_id != request.user.pk and not (
+            request.user.is_staff or request.user.has_any_role('ADMIN', 'SUPERADMIN')
+        ):
+            return Response(
+                {"detail": "You do not have permission to view this user's location history."},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        resolution, points, truncated = location_history.track(
+            user_id, params['start'], params['end'], resolution=params.get('resolution')
+        )
+        return Response({
+            'user': user_id,
+            'resolution': UserLocationHistory.RESOLUTION_NAMES[resolution].lower(),
+            'truncated': truncated,
+            'points': [
+                {'recorded_at': recorded_at, 'lat': latitude, 'lng': longitude, 'accuracy': accuracy}
+                for recorded_at, latitude, longitude, accuracy in points
+            ],
+        })
+
     @action(detail=True, methods=['post'])
     def quick_update(self, request, pk=None):
         """
@@ -183,33 +282,47 @@ class UserLocationViewSet(viewsets.ModelViewSet):
         updated = []
         errors = []
 
+        # One query for every row instead of a get() per item
+        existing = self.get_queryset().in_bulk(
+            [loc_data.get('id') for loc_data in locations if isinstance(loc_data, dict)]
+        )
+        changed, update_fields = [], {'location_updated_at'}
+        now = timezone.now()
         for loc_data in locations:
-            try:
-                location = UserLocation.objects.get(id=loc_data.get('id'))
-                serializer = self.get_serializer(
-                    location,
-                    data=loc_data,
-                    partial=True
-                )
-                
-                if serializer.is_valid():
-                    serializer.save()
-                    updated.append(serializer.data)
-                else:
-                    errors.append({
-                        'id': loc_data.get('id'),
-                        'errors': serializer.errors
-                    })
-            except UserLocation.DoesNotExist:
+            location = existing.get(loc_data.get('id')) if isinstance(loc_data, dict) else None
+            if location is None:
                 errors.append({
-                    'id': loc_data.get('id'),
+                    'id': loc_data.get('id') if isinstance(loc_data, dict) else None,
                     'errors': 'Location not found'
                 })
-            except Exception as e:
+                continue
+
+            serializer = self.get_serializer(location, data=loc_data, partial=True)
+            if not serializer.is_valid():
                 errors.append({
                     'id': loc_data.get('id'),
-                    'errors': str(e)
+                    'errors': serializer.errors
                 })
+                continue
+
+            for attr, value in serializer.validated_data.items():
+                setattr(location, attr, value)
+                update_fields.add(attr)
+            if 'location' in serializer.validated_data:
+                location.sync_coordinates()
+                update_fields.update(('latitude', 'longitude', 'geocell'))
+            # bulk_update does not apply auto_now
+            location.location_updated_at = now
+            changed.append(location)
+
+        UserLocation.objects.bulk_update(changed, sorted(update_fields), batch_size=500)
+        for location in changed:
+            if location.latitude is not None and location.longitude is not None:
+                location_index.update(location.pk, location.latitude, location.longitude)
+            else:
+                location_index.remove(location.pk)
+            updated.append(self.get_serializer(location).data)
+        location_history.record_locations(changed)
 
         return Response({
             'updated': updated,
@@ -327,7 +440,7 @@ class UserViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['post'])
     def assign_role(self, request, pk=None):
-        if not request.user.has_role('ADMIN') and not request.user.has_role('SUPERADMIN'):
+        if not request.user.has_any_role('ADMIN', 'SUPERADMIN'):
             return Response(
                 {'detail': 'Permission denied'},
                 status=status.HTTP_403_FORBIDDEN
@@ -341,6 +454,8 @@ class UserViewSet(viewsets.ModelViewSet):
         
         if role_serializer.is_valid():
             role_serializer.save(user=user, assigned_by=request.user)
+            if user.pk == request.user.pk:
+                request.user.clear_role_cache()
             return Response(role_serializer.data)
         return Response(
             role_serializer.errors,
@@ -357,6 +472,7 @@ class UserViewSet(viewsets.ModelViewSet):
             for attr, value in location_serializer.validated_data.items():
                 setattr(location, attr, value)
             location.save()
+            location_history.record_locations([location])
             return Response(UserLocationSerializer(location).data)
         return Response(
             location_serializer.errors,
@@ -366,7 +482,7 @@ class UserViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['post'])
     def deactivate(self, request, pk=None):
-        if not request.user.has_role('ADMIN') and not request.user.has_role('SUPERADMIN'):
+        if not request.user.has_any_role('ADMIN', 'SUPERADMIN'):
             return Response(
                 {'detail': 'Permission denied'},
                 status=status.HTTP_403_FORBIDDEN
@@ -463,7 +579,17 @@ class UserRoleViewSet(viewsets.ModelViewSet):
         return [AdminPermission()]
 
     def perform_create(self, serializer):
-        serializer.save(assigned_by=self.request.user)
+        user_role = serializer.save(assigned_by=self.request.user)
+        self._refresh_request_roles(user_role)
+
+    def perform_update(self, serializer):
+        user_role = serializer.save()
+        self._refresh_request_roles(user_role)
+
+    def _refresh_request_roles(self, user_role):
+        # request.user is a separate instance from user_role.user
+        if user_role.user_id == self.request.user.pk:
+            self.request.user.clear_role_cache()
 
     @extend_schema(
         summary="List all user roles",
@@ -541,6 +667,7 @@ class UserRoleViewSet(viewsets.ModelViewSet):
             serializer = self.get_serializer(data=assignment)
             if serializer.is_valid():
                 user_role = serializer.save(assigned_by=request.user)
+                self._refresh_request_roles(user_role)
                 created_roles.append(user_role)
             else:
                 return Response(
@@ -569,6 +696,7 @@ class UserRoleViewSet(viewsets.ModelViewSet):
         
         user_role.is_active = False
         user_role.save()
+        self._refresh_request_roles(user_role)
         return Response({'message': 'Role deactivated successfully'})
 
     @extend_schema(
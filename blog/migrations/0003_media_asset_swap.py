@@ -0,0 +1,30 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Separate from 0002_media_asset_links so PostgreSQL has checked the copied
+# references before the tables are altered
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0002_media_asset_links'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='blog',
+            name='resource',
+        ),
+        migrations.RenameField(
+            model_name='blog',
+            old_name='resource_asset',
+            new_name='resource',
+        ),
+        migrations.AlterField(
+            model_name='blog',
+            name='resource',
+            field=models.ForeignKey(blank=True, limit_choices_to={'owner_type': 'blogs-media'}, null=True, on_delete=django.db.models.deletion.SET_NULL, to='cloud_resource.mediaasset'),
+        ),
+    ]
@@ -1,7 +1,7 @@
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 from django.contrib.auth import get_user_model
-from cloud_resource.models import BlogResource
+from cloud_resource.models import MediaAsset
 # Create your models here.
 
 User = get_user_model()
@@ -21,15 +21,21 @@ class Blog(models.Model):
     content = models.TextField()
     category = models.ForeignKey(BlogCategory, on_delete=models.SET_NULL, null=True)
     created_at = models.DateTimeField(default=timezone.now)
-    resource = models.ForeignKey(BlogResource, on_delete=models.SET_NULL, null=True, blank=True )
+    resource = models.ForeignKey(
+        MediaAsset, on_delete=models.SET_NULL, null=True, blank=True,
+        limit_choices_to={'owner_type': MediaAsset.BLOG}
+    )
 
     def __str__(self):
         return self.title
     
     def delete(self, *args, **kwargs):
-        if self.resource:
-            self.resource.delete()
-        super().delete(*args, **kwargs)
+        from cloud_resource import media
+
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            media.discard([self.resource_id])
+        return result
     
 
     
@@ -1,6 +1,6 @@
 from rest_framework import serializers
 from .models import *
-from cloud_resource.serializers import BlogResourceSerializer
+from cloud_resource.serializers import MediaAssetSerializer
 
 class BlogCategorySerializer(serializers.ModelSerializer):
     class Meta:
@@ -11,7 +11,7 @@ class BlogCategorySerializer(serializers.ModelSerializer):
 
 class BlogSerializer(serializers.ModelSerializer):
     category = serializers.SlugRelatedField(slug_field='name', queryset=BlogCategory.objects.all())
-    resource = BlogResourceSerializer(read_only=True)
+    resource = MediaAssetSerializer(read_only=True)
     class Meta:
         model = Blog
         fields = ['id', 'title', 'author', 'content', 'category',
@@ -1,6 +1,7 @@
 # cddp/celery.py
 import os
 from celery import Celery
+from kombu import Queue
 from django.conf import settings
 
 # Set the default Django settings module for the 'celery' program.
@@ -21,34 +22,113 @@ app.conf.beat_schedule = {
         'task': 'cddp.tasks.check_overdue_tasks',
         'schedule': 300.0,  # every 5 minutes
     },
-    'test_stuff': {
-        'task': 'cddp.tasks.test_stuff',
-        'schedule': 300.0,  # every 5 minutes
-    },
     'send-task-reminders': {
         'task': 'cddp.tasks.send_task_reminders',
         'schedule': 3600.0,  # every hour
     },
+    'refresh-dashboard-rollups': {
+        'task': 'cddp.tasks.refresh_dashboard_rollups',
+        'schedule': 900.0,  # every 15 minutes
+    },
+    'flush-location-pings': {
+        'task': 'cddp.tasks.flush_location_pings',
+        'schedule': 5.0,  # every 5 seconds, see accounts.pings.FLUSH_INTERVAL_SECONDS
+        # A flush that waited longer than one interval is superseded by the next
+        'options': {'expires': 5},
+    },
+    'downsample-location-history': {
+        'task': 'cddp.tasks.downsample_location_history',
+        'schedule': 600.0,  # every 10 minutes
+    },
+    'prune-location-history': {
+        'task': 'cddp.tasks.prune_location_history',
+        'schedule': 86400.0,  # daily
+    },
+    'check-resource-reorder': {
+        'task': 'cddp.tasks.check_resource_reorder',
+        'schedule': 3600.0,  # every hour, alerts go out at most once a day
+    },
+    'expire-upload-sessions': {
+        'task': 'cddp.tasks.expire_upload_sessions',
+        'schedule': 3600.0,  # every hour
+    },
+    'purge-media-tombstones': {
+        'task': 'cddp.tasks.purge_media_tombstones',
+        'schedule': 300.0,  # every 5 minutes, picks up retries and deletes whose task was lost
+        'options': {'expires': 300},
+    },
+    'reconcile-media-orphans': {
+        'task': 'cddp.tasks.reconcile_media_orphans',
+        'schedule': 86400.0,  # daily
+    },
 
 }
 
-# Optional configuration
-# app.conf.update(
-#     worker_max_tasks_per_child=1000,
-#     worker_prefetch_multiplier=1,
-#     task_time_limit=3600,  # 1 hour
-#     task_soft_time_limit=3000,  # 50 minutes
-#     task_default_queue='default',
-#     task_queues={
-#         'default': {},
-#         'email': {
-#             'routing_key': 'email.#',
-#         },
-#         'high_priority': {
-#             'routing_key': 'high.#',
-#         },
-#     }
-# )
+# Queues and routing
+# Each queue is meant to be consumed by its own worker so a long bulk sweep
+# can never hold up incident alerts, e.g.
+#   celery -A cddp worker -Q critical --prefetch-multiplier=1 --concurrency=4
+#   celery -A cddp worker -Q notifications --prefetch-multiplier=4
+#   celery -A cddp worker -Q bulk,maintenance --prefetch-multiplier=1 --concurrency=2
+app.conf.update(
+    task_queues=(
+        Queue('critical', routing_key='critical'),
+        Queue('notifications', routing_key='notifications'),
+        Queue('bulk', routing_key='bulk'),
+        Queue('maintenance', routing_key='maintenance'),
+    ),
+    task_default_queue='notifications',
+    task_default_routing_key='notifications',
+    task_routes={
+        'cddp.tasks.send_responder_assignment_notification': {'queue': 'critical'},
+        'cddp.tasks.send_incident_status_notification': {'queue': 'critical'},
+        'cddp.tasks.check_overdue_tasks': {'queue': 'bulk'},
+        'cddp.tasks.send_task_reminders': {'queue': 'bulk'},
+        'cddp.tasks.check_resource_reorder': {'queue': 'bulk'},
+        'cddp.tasks.process_media_upload': {'queue': 'bulk'},
+        'cddp.tasks.purge_media_tombstones': {'queue': 'bulk'},
+        'cddp.tasks.refresh_dashboard_rollups': {'queue': 'maintenance'},
+        'cddp.tasks.flush_location_pings': {'queue': 'maintenance'},
+        'cddp.tasks.downsample_location_history': {'queue': 'maintenance'},
+        'cddp.tasks.prune_location_history': {'queue': 'maintenance'},
+        'cddp.tasks.expire_upload_sessions': {'queue': 'maintenance'},
+        'cddp.tasks.reconcile_media_orphans': {'queue': 'maintenance'},
+        'cddp.celery.debug_task': {'queue': 'maintenance'},
+        'cddp.tasks.*': {'queue': 'notifications'},
+    },
+    # Messages are only acknowledged once handled, so a crashed worker's
+    # alerts are redelivered instead of lost
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    worker_prefetch_multiplier=1,
+    task_default_priority=5,
+    broker_transport_options={
+        # Redis emulates priorities with one list per step; lower numbers are consumed first
+        'priority_steps': list(range(10)),
+        'sep': ':',
+        'queue_order_strategy': 'priority',
+        'visibility_timeout': 3600,
+    },
+    worker_max_tasks_per_child=1000,
+)
+
+
+# Redis consumes lower priority numbers first
+INCIDENT_TASK_PRIORITIES = {
+    'EMERGENCY': 0,
+    'CRITICAL': 1,
+    'HIGH': 3,
+    'MEDIUM': 5,
+    'LOW': 7,
+}
+
+
+def incident_task_options(incident_priority):
+    """apply_async() routing options for a task alerting about an incident of this priority"""
+    priority = INCIDENT_TASK_PRIORITIES.get(incident_priority, app.conf.task_default_priority)
+    if incident_priority in ('EMERGENCY', 'CRITICAL'):
+        return {'queue': 'critical', 'priority': priority}
+    return {'priority': priority}
 
 
 @app.task(bind=True)
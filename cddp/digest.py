@@ -0,0 +1,104 @@
+"""
+Batched notification digests.
+
+Notifications produced during one scheduler run are grouped per recipient
+into a single email. Each distinct item context is rendered once no matter
+how many recipients share it, and the finished messages are delivered over
+one pooled SMTP connection. Callers that record who was notified do so per
+delivered message, so a send failing half way only repeats the undelivered
+digests on the next run.
+"""
+import json
+import logging
+from collections import OrderedDict
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template.loader import render_to_string
+from django.utils.html import strip_tags
+from django.utils.safestring import mark_safe
+
+logger = logging.getLogger(__name__)
+
+
+class RenderCache:
+    """Render each (template, context) pair once per run"""
+
+    def __init__(self):
+        self._rendered = {}
+        self.renders = 0
+
+    def render(self, template_name, context):
+        key = (template_name, json.dumps(context, sort_keys=True, default=str))
+        html = self._rendered.get(key)
+        if html is None:
+            html = render_to_string(template_name, context)
+            self._rendered[key] = html
+            self.renders += 1
+        return html
+
+
+class NotificationDigest:
+    """
+    Collect notification items per recipient and send one email each.
+
+    subject may contain {count}, which is replaced by the recipient's item count.
+    """
+
+    def __init__(self, subject, intro, item_template='emails/task_digest_item.html',
+                 template='emails/task_digest.html'):
+        self.subject = subject
+        self.intro = intro
+        self.item_template = item_template
+        self.template = template
+        self.renderer = RenderCache()
+        self._recipients = OrderedDict()
+
+    def __len__(self):
+        return len(self._recipients)
+
+    def add(self, email, name, item_context):
+        if not email:
+            return
+        recipient = self._recipients.setdefault(email, {'name': name, 'items': []})
+        recipient['items'].append(self.renderer.render(self.item_template, item_context))
+
+    def build_messages(self):
+        """[(email, message)] with one message per recipient"""
+        messages = []
+        for email, recipient in self._recipients.items():
+            html_message = render_to_string(self.template, {
+                'recipient_name': recipient['name'],
+                'intro': self.intro,
+                'items': [mark_safe(item) for item in recipient['items']],
+            })
+            message = EmailMultiAlternatives(
+                subject=self.subject.format(count=len(recipient['items'])),
+                body=strip_tags(html_message),
+                from_email=settings.DEFAULT_FROM_EMAIL,
+                to=[email],
+            )
+            message.attach_alternative(html_message, 'text/html')
+            messages.append((email, message))
+        return messages
+
+    def send(self, connection=None, on_sent=None):
+        """
+        Send every digest over one connection, returning the number delivered.
+        on_sent(email) is called as soon as each recipient's digest is delivered.
+        """
+        messages = self.build_messages()
+        if not messages:
+            return 0
+
+        connection = connection or get_connection()
+        sent = 0
+        with connection:
+            for email, message in messages:
+                if connection.send_messages([message]):
+                    sent += 1
+                    if on_sent is not None:
+                        on_sent(email)
+        logger.info(
+            f"Sent {sent} digest emails ({self.renderer.renders} item renders) for '{self.subject}'"
+        )
+        return sent
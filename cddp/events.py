@@ -0,0 +1,247 @@
+"""
+Publish/subscribe bus for live incident events.
+
+Writes publish small deltas (status changes, timeline updates, assignments,
+resource allocations) once their transaction commits. Every ASGI worker
+subscribes to the shared Redis channel and streams the events each connected
+client may see as Server-Sent Events, so consoles and apps no longer have to
+poll the incident endpoints. The in-memory broker does the same within one
+process and is used by tests and single-process development servers.
+"""
+import asyncio
+import json
+import logging
+import threading
+import uuid
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+INCIDENT_CREATED = 'incident.created'
+INCIDENT_STATUS = 'incident.status'
+INCIDENT_UPDATE = 'incident.update'
+INCIDENT_ASSIGNMENT = 'incident.assignment'
+VOLUNTEER_ASSIGNMENT = 'incident.volunteer'
+RESOURCE_ALLOCATION = 'resource.allocation'
+
+CHANNEL = 'cddp:events:incidents'
+
+# Events queued for one slow subscriber before the oldest are dropped
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+
+# Building events
+
+def _audience(incident, unassigned=False):
+    """Who may see events about the incident, mirroring IncidentViewSet's role scoping"""
+    audience = {
+        'sensitive': incident.is_sensitive,
+        'professional': incident.category.requires_professional_responder,
+        'reporter': incident.reporter_id,
+        'responders': [],
+        'volunteers': [],
+    }
+    if not unassigned:
+        audience['responders'] = list(incident.incidentassignment_set.values_list('responder_id', flat=True))
+        audience['volunteers'] = list(incident.incidentvolunteer_set.values_list('volunteer_id', flat=True))
+    return audience
+
+
+def build_event(event_type, incident, data=None, unassigned=False):
+    """unassigned skips the assignment lookups for incidents that were just created"""
+    return {
+        'id': uuid.uuid4().hex,
+        'type': event_type,
+        'incident': str(incident.pk),
+        'occurred_at': timezone.now().isoformat(),
+        'data': data or {},
+        'audience': _audience(incident, unassigned),
+    }
+
+
+def publish(event_type, incident, data=None, unassigned=False):
+    """Publish an event about the incident once the current transaction commits"""
+    event = build_event(event_type, incident, data, unassigned)
+    transaction.on_commit(lambda: get_broker().publish([event]))
+    return event
+
+
+def publish_many(events):
+    events = list(events)
+    if events:
+        transaction.on_commit(lambda: get_broker().publish(events))
+
+
+# Brokers
+#
+# subscribe() returns an async context manager yielding an asyncio.Queue of
+# events. They are plain classes rather than generator-based managers so a
+# stream abandoned by a disconnected client is always torn down cleanly.
+
+class InMemoryBroker:
+    """Fan events out to subscribers of this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def publish(self, events):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for loop, queue in subscribers:
+            for event in events:
+                loop.call_soon_threadsafe(_offer, queue, event)
+
+    def subscribe(self):
+        return _InMemorySubscription(self)
+
+
+class _InMemorySubscription:
+    def __init__(self, broker):
+        self.broker = broker
+        self.subscriber = None
+
+    async def __aenter__(self):
+        self.subscriber = (asyncio.get_running_loop(), asyncio.Queue(SUBSCRIBER_QUEUE_SIZE))
+        with self.broker._lock:
+            self.broker._subscribers.add(self.subscriber)
+        return self.subscriber[1]
+
+    async def __aexit__(self, *exc_info):
+        with self.broker._lock:
+            self.broker._subscribers.discard(self.subscriber)
+
+
+class RedisBroker:
+    """Fan events out to every worker through Redis pub/sub"""
+
+    def __init__(self, url):
+        import redis
+
+        self.url = url
+        self._redis = redis
+        self._client = redis.Redis.from_url(url, socket_connect_timeout=1, socket_timeout=1)
+
+    def publish(self, events):
+        try:
+            pipeline = self._client.pipeline(transaction=False)
+            for event in events:
+                pipeline.publish(CHANNEL, json.dumps(event, cls=DjangoJSONEncoder))
+            pipeline.execute()
+        except self._redis.RedisError as e:
+            # Live events are best effort; the write itself already succeeded
+            logger.warning(f"Could not publish {len(events)} incident events: {e}")
+
+    def subscribe(self):
+        return _RedisSubscription(self.url)
+
+
+class _RedisSubscription:
+    def __init__(self, url):
+        self.url = url
+
+    async def __aenter__(self):
+        from redis import asyncio as aioredis
+
+        self.client = aioredis.Redis.from_url(self.url)
+        self.pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        await self.pubsub.subscribe(CHANNEL)
+        queue = asyncio.Queue(SUBSCRIBER_QUEUE_SIZE)
+        self.reader = asyncio.create_task(self._read(queue))
+        return queue
+
+    async def _read(self, queue):
+        async for message in self.pubsub.listen():
+            _offer(queue, json.loads(message['data']))
+
+    async def __aexit__(self, *exc_info):
+        self.reader.cancel()
+        try:
+            await self.pubsub.unsubscribe(CHANNEL)
+            await self.pubsub.aclose()
+            await self.client.aclose()
+        except Exception as e:
+            logger.warning(f"Error closing incident event subscription: {e}")
+
+
+def _offer(queue, event):
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(event)
+
+
+_brokers = {}
+
+
+def get_broker():
+    key = (settings.EVENT_BROKER, settings.EVENT_BROKER_URL)
+    if key not in _brokers:
+        if settings.EVENT_BROKER == 'memory':
+            _brokers[key] = InMemoryBroker()
+        else:
+            _brokers[key] = RedisBroker(settings.EVENT_BROKER_URL)
+    return _brokers[key]
+
+
+# Subscribing
+
+class EventScope:
+    """The incidents a user may follow, resolved once when the stream opens"""
+
+    def __init__(self, user):
+        self.sees_all = user.has_perm('incidents.view_all_incidents')
+        self.responder_id = self._profile_id(user, 'RESPONDER', 'responder')
+        self.reporter_id = self._profile_id(user, 'REPORTER', 'reporter')
+        self.volunteer_id = self._profile_id(user, 'VOLUNTEER', 'volunteer')
+        self.has_roles = any(
+            user.has_role(role) for role in ('RESPONDER', 'REPORTER', 'VOLUNTEER')
+        )
+        self.is_responder = user.has_role('RESPONDER')
+        self.is_volunteer = user.has_role('VOLUNTEER')
+
+    @staticmethod
+    def _profile_id(user, role, attribute):
+        if not user.has_role(role):
+            return None
+        profile = getattr(user, attribute, None)
+        return profile.pk if profile else None
+
+    def allows(self, event):
+        if self.sees_all:
+            return True
+
+        audience = event['audience']
+        if not self.has_roles:
+            return not audience['sensitive']
+        if self.is_responder and (audience['professional'] or self.responder_id in audience['responders']):
+            return True
+        if self.reporter_id is not None and audience['reporter'] == self.reporter_id:
+            return True
+        if self.is_volunteer and (not audience['sensitive'] or self.volunteer_id in audience['volunteers']):
+            return True
+        return False
+
+
+def format_sse(event):
+    data = {key: value for key, value in event.items() if key != 'audience'}
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+async def sse_stream(scope, broker=None, heartbeat=None):
+    """Yield the events the scope allows as Server-Sent Events, with keep-alive comments"""
+    broker = broker or get_broker()
+    heartbeat = heartbeat or settings.EVENT_STREAM_HEARTBEAT
+    async with broker.subscribe() as queue:
+        yield 'retry: 5000\n\n'
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'
+                continue
+            if scope.allows(event):
+                yield format_sse(event)
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.16 on 2026-10-18 10:24
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SweepWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('processed_until', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='NotificationLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recipient', models.EmailField(max_length=254)),
+                ('object_type', models.CharField(max_length=50)),
+                ('object_id', models.CharField(max_length=64)),
+                ('notification_type', models.CharField(choices=[('TASK_OVERDUE', 'Task Overdue'), ('TASK_REMINDER', 'Task Due Reminder')], max_length=30)),
+                ('window', models.CharField(help_text='What the notification was about, e.g. the due date it reported', max_length=64)),
+                ('sent_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['notification_type', 'object_type', 'object_id'], name='cddp_notifi_notific_38c805_idx'), models.Index(fields=['sent_at'], name='cddp_notifi_sent_at_932425_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='notificationlog',
+            constraint=models.UniqueConstraint(fields=('recipient', 'object_type', 'object_id', 'notification_type', 'window'), name='unique_notification_per_window'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 10:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cddp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notificationlog',
+            name='notification_type',
+            field=models.CharField(choices=[('TASK_OVERDUE', 'Task Overdue'), ('TASK_REMINDER', 'Task Due Reminder'), ('RESOURCE_REORDER', 'Resource Reorder')], max_length=30),
+        ),
+    ]
@@ -0,0 +1,54 @@
+from django.db import models
+from django.utils import timezone
+
+
+class NotificationLog(models.Model):
+    """Ledger of notifications already sent, so periodic sweeps never repeat one"""
+    TYPE_CHOICES = [
+        ('TASK_OVERDUE', 'Task Overdue'),
+        ('TASK_REMINDER', 'Task Due Reminder'),
+        ('RESOURCE_REORDER', 'Resource Reorder'),
+    ]
+
+    recipient = models.EmailField()
+    object_type = models.CharField(max_length=50)
+    object_id = models.CharField(max_length=64)
+    notification_type = models.CharField(max_length=30, choices=TYPE_CHOICES)
+    window = models.CharField(
+        max_length=64,
+        help_text="What the notification was about, e.g. the due date it reported"
+    )
+    sent_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipient', 'object_type', 'object_id', 'notification_type', 'window'],
+                name='unique_notification_per_window'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['notification_type', 'object_type', 'object_id']),
+            models.Index(fields=['sent_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.notification_type} {self.object_type}:{self.object_id} to {self.recipient}"
+
+
+class SweepWatermark(models.Model):
+    """Point in time up to which a periodic sweep has processed its rows"""
+    name = models.CharField(max_length=100, unique=True)
+    processed_until = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def get(cls, name):
+        return cls.objects.filter(name=name).values_list('processed_until', flat=True).first()
+
+    @classmethod
+    def advance(cls, name, processed_until):
+        cls.objects.update_or_create(name=name, defaults={'processed_until': processed_until})
+
+    def __str__(self):
+        return f"{self.name} @ {self.processed_until}"
@@ -1,30 +1,188 @@
-from rest_framework.pagination import PageNumberPagination
-from rest_framework.response import Response
-import math
-
-DEFAULT_PAGE = 1
-
-
-class CustomPagination(PageNumberPagination):
-    page_size_query_param = "page_size"
-
-    def get_paginated_response(self, data):
-        return Response(
-            {
-                "links": {
-                    "next": self.get_next_link(),
-                    "previous": self.get_previous_link(),
-                },
-                "total": self.page.paginator.count,
-                "total_pages": math.ceil(self.page.paginator.count / self.page_size),
-                "current_page": int(self.request.GET.get("page", DEFAULT_PAGE)),
-                "page_size": int(self.request.GET.get("page_size", self.page_size)),
-                "results": data,
-            }
-        )
-
-
-class StandardResultsSetPagination(PageNumberPagination):
-    page_size = 100
-    page_size_query_param = "page_size"
-    max_page_size = 1000
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from django.core.paginator import Paginator as DjangoPaginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+import json
+import math
+
+DEFAULT_PAGE = 1
+
+# Below this many rows an exact COUNT(*) is cheap enough to run anyway
+EXACT_COUNT_THRESHOLD = 1000
+
+
+def estimate_count(queryset):
+    """
+    Row count from the query planner's estimate on PostgreSQL, which costs a
+    plan instead of a scan. Small results and other backends are counted exactly.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    estimate = int(plan[0]['Plan']['Plan Rows'])
+    if estimate < EXACT_COUNT_THRESHOLD:
+        return queryset.count()
+    return estimate
+
+
+class EstimatedCountPaginator(DjangoPaginator):
+    @cached_property
+    def count(self):
+        return estimate_count(self.object_list)
+
+
+class CustomPagination(PageNumberPagination):
+    page_size_query_param = "page_size"
+
+    def get_paginated_response(self, data):
+        return Response(
+            {
+                "links": {
+                    "next": self.get_next_link(),
+                    "previous": self.get_previous_link(),
+                },
+                "total": self.page.paginator.count,
+                "total_pages": math.ceil(self.page.paginator.count / self.page.paginator.per_page),
+                "current_page": int(self.request.GET.get("page", DEFAULT_PAGE)),
+                # The size applied, which falls back to the default for invalid values
+                "page_size": self.page.paginator.per_page,
+                "results": data,
+            }
+        )
+
+
+class FeedPagination(CustomPagination):
+    """
+    CustomPagination with two opt-in modes for long, fast-moving feeds.
+
+    ?pagination=cursor switches to keyset pages ordered newest first on
+    (created_at, id). Each page is a range scan from the previous page's last
+    row, so deep pages cost the same as the first one and rows inserted while
+    a client scrolls never shift or repeat items. The next/previous links
+    carry the position in ?cursor=.
+
+    ?count=estimate reports the planner's row estimate as the total instead
+    of running COUNT(*). In cursor mode no total is computed unless asked for.
+
+    Views can key the cursor on another timestamp with ``cursor_field``.
+    Page sizes are limited as in CustomPagination, which does not cap them.
+    """
+    cursor_query_param = 'cursor'
+    mode_query_param = 'pagination'
+    count_query_param = 'count'
+    cursor_field = 'created_at'
+
+    @classmethod
+    def cursor_requested(cls, request):
+        return (
+            request.query_params.get(cls.mode_query_param) == 'cursor'
+            or cls.cursor_query_param in request.query_params
+        )
+
+    def estimate_requested(self, request):
+        return request.query_params.get(self.count_query_param) == 'estimate'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.use_cursor = self.cursor_requested(request)
+        self.use_estimate = self.estimate_requested(request)
+        if not self.use_cursor:
+            if self.use_estimate:
+                self.django_paginator_class = EstimatedCountPaginator
+            return super().paginate_queryset(queryset, request, view)
+
+        self.page_size = self.get_page_size(request)
+        self.field = getattr(view, 'cursor_field', self.cursor_field)
+        self.total = estimate_count(queryset) if self.use_estimate else None
+        return self._paginate_by_cursor(queryset, request)
+
+    # Cursor mode
+
+    def _encode_cursor(self, item, reverse):
+        position = {
+            'value': getattr(item, self.field).isoformat(),
+            'pk': str(item.pk),
+            'reverse': reverse,
+        }
+        cursor = urlsafe_b64encode(json.dumps(position).encode()).decode()
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def _decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(urlsafe_b64decode(encoded.encode()))
+            value = parse_datetime(position['value'])
+            if value is None:
+                raise ValueError
+            return value, position['pk'], bool(position.get('reverse'))
+        except (TypeError, ValueError, KeyError, UnicodeDecodeError):
+            raise NotFound('Invalid cursor')
+
+    def _paginate_by_cursor(self, queryset, request):
+        position = self._decode_cursor(request)
+        reverse = bool(position and position[2])
+        field = self.field
+
+        if position is not None:
+            value, pk, _ = position
+            if reverse:
+                queryset = queryset.filter(Q(**{f'{field}__gt': value}) | Q(**{field: value, 'pk__gt': pk}))
+            else:
+                queryset = queryset.filter(Q(**{f'{field}__lt': value}) | Q(**{field: value, 'pk__lt': pk}))
+
+        ordering = (field, 'pk') if reverse else (f'-{field}', '-pk')
+        rows = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        # Any cursor walking forwards left a newer page behind it
+        has_next = has_more if not reverse else bool(rows)
+        has_previous = has_more if reverse else position is not None
+
+        self.next_link = self._encode_cursor(rows[-1], reverse=False) if has_next else None
+        self.previous_link = self._encode_cursor(rows[0], reverse=True) if has_previous and rows else None
+        return rows
+
+    def get_paginated_response(self, data):
+        if not self.use_cursor:
+            response = super().get_paginated_response(data)
+            if self.use_estimate:
+                response.data['total_is_estimate'] = True
+            return response
+
+        payload = {
+            "links": {
+                "next": self.next_link,
+                "previous": self.previous_link,
+            },
+            "page_size": self.page_size,
+            "results": data,
+        }
+        if self.total is not None:
+            payload["total"] = self.total
+            payload["total_is_estimate"] = True
+        return Response(payload)
+
+
+class StandardResultsSetPagination(PageNumberPagination):
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = 1000
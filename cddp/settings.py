@@ -14,6 +14,7 @@ from pathlib import Path
 import dj_database_url
 from decouple import config
 import os
+import tempfile
 import cloudinary
 from datetime import timedelta
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -117,6 +118,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "cddp.wsgi.application"
+ASGI_APPLICATION = "cddp.asgi.application"
 
 
 # Database
@@ -152,6 +154,62 @@ DATABASES = {
 #     }
 # }
 
+# Cache Configuration
+CACHES = {
+    "default": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": config("REDIS_CACHE_URL", default="redis://localhost:6379/1"),
+        "KEY_PREFIX": "cddp",
+        "TIMEOUT": 300,
+        "OPTIONS": {
+            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            # A cache outage should slow requests down, not fail them
+            "IGNORE_EXCEPTIONS": True,
+            "SOCKET_CONNECT_TIMEOUT": 1,
+            "SOCKET_TIMEOUT": 1,
+        },
+    }
+}
+
+# Seconds dashboard responses are served from cache
+DASHBOARD_CACHE_TIMEOUT = config("DASHBOARD_CACHE_TIMEOUT", default=30, cast=int)
+
+# Largest batch accepted by POST /incident/bulk/
+INCIDENT_BULK_MAX_ITEMS = config("INCIDENT_BULK_MAX_ITEMS", default=1000, cast=int)
+
+# Live incident events: "redis" fans out across workers, "memory" stays in-process
+EVENT_BROKER = config("EVENT_BROKER", default="redis")
+EVENT_BROKER_URL = config("EVENT_BROKER_URL", default="redis://localhost:6379/2")
+# Seconds between keep-alive comments on idle event streams
+EVENT_STREAM_HEARTBEAT = config("EVENT_STREAM_HEARTBEAT", default=15, cast=int)
+
+# Location pings are buffered here and written in bulk: "redis" or "memory"
+LOCATION_PING_BUFFER = config("LOCATION_PING_BUFFER", default="redis")
+LOCATION_PING_BUFFER_URL = config("LOCATION_PING_BUFFER_URL", default="redis://localhost:6379/3")
+
+# Days location history is kept at raw, per-minute and per-hour resolution
+LOCATION_HISTORY_RAW_DAYS = config("LOCATION_HISTORY_RAW_DAYS", default=2, cast=int)
+LOCATION_HISTORY_MINUTE_DAYS = config("LOCATION_HISTORY_MINUTE_DAYS", default=30, cast=int)
+LOCATION_HISTORY_HOUR_DAYS = config("LOCATION_HISTORY_HOUR_DAYS", default=365, cast=int)
+
+# Days of demand history resource forecasts learn from, and days ahead they project
+RESOURCE_FORECAST_HISTORY_DAYS = config("RESOURCE_FORECAST_HISTORY_DAYS", default=90, cast=int)
+RESOURCE_FORECAST_HORIZON_DAYS = config("RESOURCE_FORECAST_HORIZON_DAYS", default=14, cast=int)
+
+# Media storage: "cloudinary", or "local" to keep files under MEDIA_LOCAL_ROOT for tests and development
+MEDIA_STORAGE_BACKEND = config("MEDIA_STORAGE_BACKEND", default="cloudinary")
+MEDIA_LOCAL_ROOT = config("MEDIA_LOCAL_ROOT", default=str(BASE_DIR / "media"))
+MEDIA_LOCAL_URL = config("MEDIA_LOCAL_URL", default="/media/")
+
+# Chunked and direct media uploads: largest file and chunk in bytes, and hours an unfinished upload is kept
+MEDIA_UPLOAD_MAX_SIZE = config("MEDIA_UPLOAD_MAX_SIZE", default=500 * 1024 * 1024, cast=int)
+MEDIA_UPLOAD_CHUNK_SIZE = config("MEDIA_UPLOAD_CHUNK_SIZE", default=5 * 1024 * 1024, cast=int)
+MEDIA_UPLOAD_EXPIRY_HOURS = config("MEDIA_UPLOAD_EXPIRY_HOURS", default=24, cast=int)
+# Where received chunks are assembled; web and Celery workers must share it
+MEDIA_UPLOAD_TEMP_DIR = config("MEDIA_UPLOAD_TEMP_DIR", default=os.path.join(tempfile.gettempdir(), "cddp-uploads"))
+# Days media may sit unattached, and stored files unreferenced, before the orphan sweep deletes them
+MEDIA_ORPHAN_GRACE_DAYS = config("MEDIA_ORPHAN_GRACE_DAYS", default=7, cast=int)
+
 # Celery Configuration
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
@@ -6,8 +6,15 @@ from django.utils.html import strip_tags
 from django.conf import settings
 from django.urls import reverse
 from django.utils import timezone
+from django.db.models import Q
 from datetime import timedelta
+from itertools import islice
+from cloud_resource.storage import StorageError
 from .email_templates import EmailTemplates
+from .digest import NotificationDigest
+
+# Tasks loaded per batch by the periodic notification sweeps
+SWEEP_CHUNK_SIZE = 500
 
 @shared_task(
     name='cddp.tasks.send_notification_email',
@@ -332,6 +339,78 @@ def send_overdue_reminder(resource_id):
     )
 
 
+def _task_digest_context(task):
+    return {
+        'task_title': task.title,
+        'task_priority': f"{EmailTemplates.get_priority_indicator(task.priority)} {task.get_priority_display()}",
+        'incident_title': task.incident.title,
+        'estimated_time': f"⏱️ {task.estimated_time} minutes" if task.estimated_time else "⏱️ Time not specified",
+        'due_date': f"📅 Due: {task.due_date.strftime('%Y-%m-%d %H:%M')}" if task.due_date else "No due date",
+        'skills_needed': [f"🔧 {skill.name}" for skill in task.required_skills.all()],
+    }
+
+
+def _send_task_digest(tasks, notification_type, subject, intro):
+    """
+    Group the volunteers of every task into one digest email per volunteer,
+    skipping anyone the NotificationLog says was already told about the
+    task's current due date.
+    """
+    from incident.models import IncidentVolunteer
+    from .models import NotificationLog
+
+    digest = NotificationDigest(subject=subject, intro=intro)
+    ledger = {}
+    user = 'incidentvolunteer__volunteer__user'
+
+    tasks = tasks.select_related('incident').prefetch_related('required_skills').order_by('pk')
+    for chunk in _chunked(tasks.iterator(chunk_size=SWEEP_CHUNK_SIZE), SWEEP_CHUNK_SIZE):
+        tasks_by_id = {str(task.id): task for task in chunk}
+        windows = {task_id: task.due_date.isoformat() for task_id, task in tasks_by_id.items()}
+        already_sent = set(
+            NotificationLog.objects.filter(
+                notification_type=notification_type,
+                object_type='task',
+                object_id__in=list(tasks_by_id)
+            ).values_list('recipient', 'object_id', 'window')
+        )
+        recipients = IncidentVolunteer.tasks.through.objects.filter(
+            task_id__in=[task.id for task in chunk]
+        ).values_list(
+            'task_id', f'{user}__email', f'{user}__first_name', f'{user}__last_name'
+        ).distinct()
+
+        contexts = {}
+        for task_id, email, first_name, last_name in recipients:
+            task_id = str(task_id)
+            if not email or (email, task_id, windows[task_id]) in already_sent:
+                continue
+            if task_id not in contexts:
+                contexts[task_id] = _task_digest_context(tasks_by_id[task_id])
+            digest.add(email, f"{first_name} {last_name}", contexts[task_id])
+            ledger.setdefault(email, []).append(NotificationLog(
+                recipient=email,
+                object_type='task',
+                object_id=task_id,
+                notification_type=notification_type,
+                window=windows[task_id]
+            ))
+
+    # Log each volunteer as their digest goes out, so a failed send only repeats the rest
+    return digest.send(on_sent=lambda email: NotificationLog.objects.bulk_create(
+        ledger[email], ignore_conflicts=True, batch_size=SWEEP_CHUNK_SIZE
+    ))
+
+
+def _chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
 @shared_task(
     name='cddp.tasks.check_overdue_tasks',
     retry_backoff=True,
@@ -339,80 +418,188 @@ def send_overdue_reminder(resource_id):
 )
 def check_overdue_tasks():
     from incident.models import Task
-    """Check for tasks that are overdue and send notifications if needed."""
-    overdue_tasks = Task.objects.filter(due_date__lt=timezone.now(), status__in=['PENDING', 'IN_PROGRESS'])
-    for task in overdue_tasks:
-        volunteers = task.get_volunteers()
-        if volunteers is not None:
-            try:
-                for volunteer in volunteers:
-                    context = {
-                    'volunteer_name': volunteer.user.full_name,
-                    'task_title': task.title,
-                    'task_priority': f"{EmailTemplates.get_priority_indicator(task.priority)} {task.get_priority_display()}",
-                    'incident_title': task.incident.title,
-                    'estimated_time': f"⏱️ {task.estimated_time} minutes" if task.estimated_time else "⏱️ Time not specified",
-                    'due_date': f"📅 Due: {task.due_date.strftime('%Y-%m-%d %H:%M')}" if task.due_date else "No due date",
-                    'skills_needed': [f"🔧 {skill.name}" for skill in task.required_skills.all()],
-                    }
-                    send_notification_email.delay(
-                        subject=f"🎯 Task Overdue Notification: {task.title}",
-                        template_name='task_overdue',
-                        context=context,
-                        recipient_list=[volunteer.user.email]
-                    )
-            except Task.DoesNotExist:
-                return None
+    from .models import SweepWatermark
+    """Send each volunteer one digest of their tasks that became overdue since the last sweep."""
+    now = timezone.now()
+    since = SweepWatermark.get('check_overdue_tasks')
+
+    overdue_tasks = Task.objects.filter(due_date__lt=now, status__in=['PENDING', 'IN_PROGRESS'])
+    if since:
+        overdue_tasks = overdue_tasks.filter(Q(due_date__gte=since) | Q(updated_at__gte=since))
+
+    sent = _send_task_digest(
+        overdue_tasks,
+        'TASK_OVERDUE',
+        subject="🎯 Task Overdue Notification: {count} task(s) need attention",
+        intro="The following tasks you are assigned to are past their due date."
+    )
+    SweepWatermark.advance('check_overdue_tasks', now)
+    return sent
+
+
+@shared_task
+def send_task_reminders():
+    from incident.models import Task
+    from .models import SweepWatermark
+    """Send each volunteer one digest of their tasks that came due within the next 24 hours since the last sweep."""
+    now = timezone.now()
+    since = SweepWatermark.get('send_task_reminders')
+
+    reminder_time = now + timedelta(hours=24)
+    tasks_due_soon = Task.objects.filter(due_date__lte=reminder_time, due_date__gt=now, status='PENDING')  #!!! Perhaps not PENDING?
+    if since:
+        tasks_due_soon = tasks_due_soon.filter(
+            Q(due_date__gt=since + timedelta(hours=24)) | Q(updated_at__gte=since)
+        )
+
+    sent = _send_task_digest(
+        tasks_due_soon,
+        'TASK_REMINDER',
+        subject="🎯 Upcoming Task Due Reminder: {count} task(s) due soon",
+        intro="The following tasks you are assigned to are due within the next 24 hours."
+    )
+    SweepWatermark.advance('send_task_reminders', now)
+    return sent
+
 
 @shared_task(
-    name='cddp.tasks.test_stuff',
+    name='cddp.tasks.refresh_dashboard_rollups',
     retry_backoff=True,
     max_retries=3
 )
-def test_stuff():
-    context = {
-    'volunteer_name': "volunteer Mcc",
-    'task_title': "Just Testing Bro",
-    'task_priority': "'LOW': '⚪',",
-    'estimated_time': "⏱️ Time not specified⏱️",
-    'due_date': "📅 Due: No due date",
-    'skills_needed': [f"🔧 No SKill"],
+def refresh_dashboard_rollups(full=False):
+    """
+    Rebuild dashboard rollup buckets touched since the last run, or all of
+    them along with the resource demand counters
+    """
+    from dashboard import rollups
+    from dashboard.cache import invalidate, TAG_INCIDENTS, TAG_RESOURCES
+    from incident import demand
+    if full:
+        demand.rebuild()
+    refreshed = rollups.rebuild_all() if full else rollups.refresh_recent()
+    if refreshed:
+        invalidate(TAG_INCIDENTS, TAG_RESOURCES)
+    return refreshed
+
+
+@shared_task(name='cddp.tasks.flush_location_pings')
+def flush_location_pings():
+    """Write the latest buffered location ping of every user in one bulk update"""
+    from accounts import pings
+    return pings.flush()
+
+
+@shared_task(name='cddp.tasks.downsample_location_history')
+def downsample_location_history():
+    """Roll raw location history up into per-minute and per-hour tracks"""
+    from accounts import history
+    return {
+        'minute': history.downsample(history.MINUTE),
+        'hour': history.downsample(history.HOUR),
     }
-    send_notification_email.delay(
-        subject=f"🎯 Task Test Notification",
-        template_name='task_overdue',
-        context=context,
-        recipient_list=["adebayoworkmail@gmail.com"]
+
+
+@shared_task(name='cddp.tasks.prune_location_history')
+def prune_location_history():
+    """Delete location history past the retention of its resolution"""
+    from accounts import history
+    return history.prune()
+
+
+@shared_task(
+    name='cddp.tasks.check_resource_reorder',
+    retry_backoff=True,
+    max_retries=3
+)
+def check_resource_reorder():
+    """Refresh resource forecasts and send managers one daily digest of the resources to reorder"""
+    from cddpresources import forecast
+    from cddpresources.models import Resource
+    from .models import NotificationLog
+
+    result = forecast.get_forecast(refresh=True)
+    alerts = {str(item['resource']): item for item in result['resources'] if item['needs_reorder']}
+    if not alerts:
+        return 0
+
+    window = timezone.localdate().isoformat()
+    already_sent = set(
+        NotificationLog.objects.filter(
+            notification_type='RESOURCE_REORDER',
+            object_type='resource',
+            object_id__in=list(alerts),
+            window=window
+        ).values_list('recipient', 'object_id')
+    )
+    contacts = Resource.objects.filter(pk__in=list(alerts)).values_list(
+        'pk', 'manager__email', 'manager__first_name', 'manager__last_name',
+        'owner__email', 'owner__first_name', 'owner__last_name',
     )
 
+    digest = NotificationDigest(
+        subject="📦 Reorder Alert: {count} resource(s) running low",
+        intro=f"These resources are expected to fall to their reorder point within {result['horizon_days']} days.",
+        item_template='emails/resource_reorder_item.html',
+        template='emails/resource_reorder_digest.html'
+    )
+    ledger = {}
+    for resource_id, *people in contacts:
+        resource_id = str(resource_id)
+        manager, owner = people[:3], people[3:]
+        # The manager, else the owner, else the platform admin
+        email, first_name, last_name = next(
+            (person for person in (manager, owner) if person[0]),
+            (settings.ADMIN_EMAIL, 'Resource', 'Team')
+        )
+        if (email, resource_id) in already_sent:
+            continue
+        digest.add(email, f"{first_name} {last_name}", {**alerts[resource_id], 'horizon_days': result['horizon_days']})
+        ledger.setdefault(email, []).append(NotificationLog(
+            recipient=email,
+            object_type='resource',
+            object_id=resource_id,
+            notification_type='RESOURCE_REORDER',
+            window=window
+        ))
+
+    # Log each manager as their digest goes out, so a failed send only repeats the rest
+    return digest.send(
+        on_sent=lambda email: NotificationLog.objects.bulk_create(ledger[email], ignore_conflicts=True)
+    )
 
-    
 
-@shared_task
-def send_task_reminders():
-    from incident.models import Task
-    """Send reminders for tasks that are approaching their due date within the next 24 hours."""
-    reminder_time = timezone.now() + timedelta(hours=24)
-    tasks_due_soon = Task.objects.filter(due_date__lte=reminder_time, due_date__gt=timezone.now(), status='PENDING')  #!!! Perhaps not PENDING?
-    for task in tasks_due_soon:
-        volunteers = task.get_volunteers()
-        if volunteers is not None:
-            try:
-                for volunteer in volunteers:
-                    context = {
-                    'volunteer_name': volunteer.user.full_name,
-                    'task_title': task.title,
-                    'task_priority': f"{EmailTemplates.get_priority_indicator(task.priority)} {task.get_priority_display()}",
-                    'incident_title': task.incident.title,
-                    'estimated_time': f"⏱️ {task.estimated_time} minutes" if task.estimated_time else "⏱️ Time not specified",
-                    'due_date': f"📅 Due: {task.due_date.strftime('%Y-%m-%d %H:%M')}" if task.due_date else "No due date",
-                    'skills_needed': [f"🔧 {skill.name}" for skill in task.required_skills.all()],
-                    }
-                    send_notification_email.delay(
-                        subject=f"🎯 Upcoming Task Due Reminder: {task.title}",
-                        template_name='task_overdue',
-                        context=context,
-                        recipient_list=[volunteer.user.email]
-                    )
-            except Task.DoesNotExist:
-                return None
+@shared_task(
+    bind=True,
+    name='cddp.tasks.process_media_upload',
+    autoretry_for=(StorageError,),
+    retry_backoff=True,
+    max_retries=3
+)
+def process_media_upload(self, session_id):
+    """Store a completed upload, detect its type, render a thumbnail and create its media row"""
+    from cloud_resource import uploads
+    # Storage outages are retried; the last attempt fails the session instead
+    session = uploads.process(session_id, retry=self.request.retries < self.max_retries)
+    return session.status if session else None
+
+
+@shared_task(name='cddp.tasks.expire_upload_sessions')
+def expire_upload_sessions():
+    """Expire media uploads left unfinished and delete their received chunks"""
+    from cloud_resource import uploads
+    return uploads.expire()
+
+
+@shared_task(name='cddp.tasks.purge_media_tombstones')
+def purge_media_tombstones():
+    """Bulk delete the stored files of deleted media; failures are retried with a backoff on later runs"""
+    from cloud_resource import media
+    return media.purge()
+
+
+@shared_task(name='cddp.tasks.reconcile_media_orphans')
+def reconcile_media_orphans():
+    """Delete media left without an owner and stored files no media refers to"""
+    from cloud_resource import media
+    return media.reconcile()
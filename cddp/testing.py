@@ -0,0 +1,38 @@
+"""
+Fixtures shared by the apps' tests.
+"""
+from accounts.models import User, Role, UserRole
+from incident.models import Incident, IncidentCategory
+from reporters.models import Reporter
+
+
+def create_user(email, role_type=None, **fields):
+    """A user with the password "password", optionally holding a role"""
+    user = User.objects.create_user(email=email, password='password', **fields)
+    if role_type:
+        role, _ = Role.objects.get_or_create(role_type=role_type, defaults={'description': role_type.title()})
+        UserRole.objects.create(user=user, role=role)
+    return user
+
+
+def create_admin(email='admin@example.com', **fields):
+    return create_user(email, 'ADMIN', **fields)
+
+
+def create_reporter(email='reporter@example.com', **fields):
+    return Reporter.objects.create(user=create_user(email, **fields))
+
+
+def create_category(**fields):
+    return IncidentCategory.objects.create(
+        **{'name': 'Flood', 'description': 'Flooding', 'severity_level': 3, **fields}
+    )
+
+
+def create_incident(category=None, reporter=None, **fields):
+    """An incident with a new Flood category and reporter unless given"""
+    return Incident.objects.create(
+        category=category or create_category(),
+        reporter=reporter or create_reporter(),
+        **{'title': 'Flood', 'description': 'Water rising', **fields}
+    )
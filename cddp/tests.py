@@ -0,0 +1,33 @@
+from django.test import SimpleTestCase
+
+from .celery import app, incident_task_options
+
+
+class TaskRoutingTest(SimpleTestCase):
+    """Tasks land on the queue of the worker meant for them"""
+
+    def queue(self, task, **options):
+        return app.amqp.router.route(options, task)['queue'].name
+
+    def test_tasks_are_routed_by_name(self):
+        self.assertEqual(self.queue('cddp.tasks.send_incident_status_notification'), 'critical')
+        self.assertEqual(self.queue('cddp.tasks.check_overdue_tasks'), 'bulk')
+        self.assertEqual(self.queue('cddp.tasks.process_media_upload'), 'bulk')
+        self.assertEqual(self.queue('cddp.tasks.flush_location_pings'), 'maintenance')
+        # Anything not listed is a notification
+        self.assertEqual(self.queue('cddp.tasks.send_notification_email'), 'notifications')
+
+    def test_every_periodic_task_has_a_route(self):
+        for entry in app.conf.beat_schedule.values():
+            self.assertIn(entry['task'], app.conf.task_routes)
+
+    def test_incident_task_options(self):
+        self.assertEqual(incident_task_options('EMERGENCY'), {'queue': 'critical', 'priority': 0})
+        self.assertEqual(incident_task_options('CRITICAL'), {'queue': 'critical', 'priority': 1})
+        self.assertEqual(incident_task_options('LOW'), {'priority': 7})
+        self.assertEqual(incident_task_options(None), {'priority': app.conf.task_default_priority})
+        # Options given to apply_async win over the task's route
+        self.assertEqual(
+            self.queue('cddp.tasks.send_notification_email', **incident_task_options('EMERGENCY')),
+            'critical'
+        )
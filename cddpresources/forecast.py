@@ -0,0 +1,217 @@
+"""
+Resource demand forecasting.
+
+Daily demand for every resource is built from incident resource requests
+and the requirements of events that have started, and daily supply from
+donations, as two (resources x days) NumPy matrices filled from three
+grouped queries. One matrix-vector product per matrix then gives every
+resource's demand and supply rate, weighted either exponentially so recent
+days count most (EWMA) or evenly over the last week (SMA).
+
+From those rates, the stock not yet allocated and the unmet requirements of
+events scheduled inside the horizon, each resource gets a projected stock
+level, days of cover and whether it should be reordered now. Forecasts are
+cached for FORECAST_CACHE_SECONDS; the ``check_resource_reorder`` Celery
+task recomputes them and emails reorder alerts to resource managers.
+"""
+import logging
+from datetime import datetime, time, timedelta
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from event.models import EventResourceRequirement, EventStatus
+from incident.models import IncidentResource
+from .models import Resource, ResourceDonation
+
+logger = logging.getLogger(__name__)
+
+
+EWMA = 'ewma'
+SMA = 'sma'
+METHODS = (EWMA, SMA)
+
+# Weight of the most recent day under exponential smoothing
+SMOOTHING = 0.3
+
+# Days averaged by the simple moving average
+SMA_WINDOW = 7
+
+FORECAST_CACHE_SECONDS = 900
+
+CACHE_KEY = 'cddpresources:forecast:{method}:{horizon}:{history}'
+
+
+# Time series
+
+def _grouped(queryset, date_field, quantity_field):
+    return (
+        queryset.annotate(day=TruncDate(date_field))
+        .values('resource_id', 'day')
+        .annotate(total=Sum(quantity_field))
+        .values_list('resource_id', 'day', 'total')
+        .order_by()
+    )
+
+
+def _fill(matrix, row, first_day, grouped):
+    """Add (resource_id, day, total) rows into a (resources x days) matrix"""
+    cells = [
+        (row[resource_id], (day - first_day).days, total)
+        for resource_id, day, total in grouped
+        if resource_id in row and 0 <= (day - first_day).days < matrix.shape[1]
+    ]
+    if cells:
+        rows, columns, totals = zip(*cells)
+        np.add.at(matrix, (list(rows), list(columns)), totals)
+
+
+def daily_series(resource_ids, history_days, today=None):
+    """
+    Units demanded and supplied per resource and day, as two
+    (len(resource_ids) x history_days) matrices running up to yesterday.
+    """
+    today = today or timezone.localdate()
+    first_day = today - timedelta(days=history_days)
+    start = timezone.make_aware(datetime.combine(first_day, time.min))
+    end = timezone.make_aware(datetime.combine(today, time.min))
+    row = {resource_id: i for i, resource_id in enumerate(resource_ids)}
+
+    demand = np.zeros((len(resource_ids), history_days))
+    _fill(demand, row, first_day, _grouped(
+        IncidentResource.objects.filter(requested_at__gte=start, requested_at__lt=end).exclude(status='CANCELLED'),
+        'requested_at', 'quantity_requested'
+    ))
+    _fill(demand, row, first_day, _grouped(
+        EventResourceRequirement.objects.filter(
+            event__start_date__gte=start, event__start_date__lt=end
+        ).exclude(event__status=EventStatus.CANCELLED),
+        'event__start_date', 'quantity_required'
+    ))
+
+    supply = np.zeros((len(resource_ids), history_days))
+    _fill(supply, row, first_day, _grouped(
+        ResourceDonation.objects.filter(donation_date__gte=start, donation_date__lt=end),
+        'donation_date', 'quantity'
+    ))
+    return demand, supply
+
+
+def daily_rates(matrix, method=EWMA, smoothing=SMOOTHING, window=SMA_WINDOW):
+    """Smoothed units per day for every row of a (resources x days) matrix, oldest day first"""
+    days = matrix.shape[1]
+    if method == SMA:
+        weights = np.zeros(days)
+        weights[-min(window, days):] = 1.0
+    else:
+        weights = smoothing * (1 - smoothing) ** np.arange(days - 1, -1, -1)
+    return matrix @ (weights / weights.sum())
+
+
+def scheduled_demand(resource_ids, horizon_days, now=None):
+    """Unmet requirements of events starting within the horizon, per resource"""
+    now = now or timezone.now()
+    row = {resource_id: i for i, resource_id in enumerate(resource_ids)}
+    scheduled = np.zeros(len(resource_ids))
+    requirements = (
+        EventResourceRequirement.objects
+        .filter(
+            event__start_date__gte=now,
+            event__start_date__lt=now + timedelta(days=horizon_days),
+            quantity_required__gt=F('quantity_fulfilled'),
+        )
+        .exclude(event__status=EventStatus.CANCELLED)
+        .values('resource_id')
+        .annotate(needed=Sum(F('quantity_required') - F('quantity_fulfilled')))
+        .values_list('resource_id', 'needed')
+        .order_by()
+    )
+    for resource_id, needed in requirements:
+        if resource_id in row:
+            scheduled[row[resource_id]] += needed
+    return scheduled
+
+
+# Forecasts
+
+def _rounded(values):
+    return [round(float(value), 2) for value in values]
+
+
+def forecast(method=EWMA, horizon_days=None, history_days=None, today=None):
+    """Projected demand, supply and stock of every resource over the horizon"""
+    horizon_days = horizon_days or settings.RESOURCE_FORECAST_HORIZON_DAYS
+    history_days = history_days or settings.RESOURCE_FORECAST_HISTORY_DAYS
+    resources = list(Resource.objects.order_by('pk').values_list(
+        'pk', 'name', 'unit', 'quantity_available', 'quantity_allocated', 'reorder_point', 'minimum_quantity'
+    ))
+    if not resources:
+        return []
+    resource_ids = [resource[0] for resource in resources]
+
+    demand, supply = daily_series(resource_ids, history_days, today)
+    demand_rate = daily_rates(demand, method)
+    supply_rate = daily_rates(supply, method)
+    scheduled = scheduled_demand(resource_ids, horizon_days)
+
+    free = np.maximum(
+        np.array([resource[3] for resource in resources], dtype=float)
+        - np.array([resource[4] for resource in resources], dtype=float),
+        0,
+    )
+    # The reorder point when one is set, the minimum quantity otherwise
+    threshold = np.array(
+        [resource[6] if resource[5] is None else resource[5] for resource in resources], dtype=float
+    )
+    projected_demand = demand_rate * horizon_days + scheduled
+    projected_stock = free + supply_rate * horizon_days - projected_demand
+    net_burn = demand_rate - supply_rate
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days_of_cover = np.where(net_burn > 0, free / net_burn, np.inf)
+    needs_reorder = (projected_stock <= threshold) & ((projected_demand > 0) | (threshold > 0))
+    reorder_quantity = np.where(needs_reorder, np.ceil(np.maximum(threshold - projected_stock, 0)), 0)
+
+    columns = zip(
+        resources, _rounded(demand_rate), _rounded(supply_rate), _rounded(scheduled),
+        _rounded(projected_demand), _rounded(projected_stock), days_of_cover.tolist(),
+        needs_reorder.tolist(), reorder_quantity.astype(int).tolist(),
+    )
+    return [
+        {
+            'resource': resource[0],
+            'name': resource[1],
+            'unit': resource[2],
+            'available_for_allocation': int(free[i]),
+            'daily_demand': daily_demand,
+            'daily_supply': daily_supply,
+            'scheduled_demand': scheduled_units,
+            'projected_demand': projected,
+            'projected_stock': stock,
+            'days_of_cover': None if cover == np.inf else round(cover, 1),
+            'needs_reorder': reorder,
+            'reorder_quantity': quantity,
+        }
+        for i, (resource, daily_demand, daily_supply, scheduled_units, projected, stock, cover, reorder, quantity)
+        in enumerate(columns)
+    ]
+
+
+def get_forecast(method=EWMA, horizon_days=None, history_days=None, refresh=False):
+    """The cached forecast, computed when missing, expired or refresh is set"""
+    horizon_days = horizon_days or settings.RESOURCE_FORECAST_HORIZON_DAYS
+    history_days = history_days or settings.RESOURCE_FORECAST_HISTORY_DAYS
+    key = CACHE_KEY.format(method=method, horizon=horizon_days, history=history_days)
+    result = None if refresh else cache.get(key)
+    if result is None:
+        result = {
+            'generated_at': timezone.now(),
+            'method': method,
+            'horizon_days': horizon_days,
+            'history_days': history_days,
+            'resources': forecast(method, horizon_days, history_days),
+        }
+        cache.set(key, result, FORECAST_CACHE_SECONDS)
+    return result
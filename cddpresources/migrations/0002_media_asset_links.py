@@ -0,0 +1,49 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+BATCH_SIZE = 1000
+
+
+def copy_links(model, old_name, new_name, assets):
+    old = model._meta.get_field(old_name)
+    new = model._meta.get_field(new_name)
+    links = old.remote_field.through.objects.values_list(
+        f'{old.m2m_field_name()}_id', f'{old.m2m_reverse_field_name()}_id'
+    )
+    batch = []
+    for owner_id, legacy_id in links.iterator(chunk_size=BATCH_SIZE):
+        batch.append(new.remote_field.through(**{
+            f'{new.m2m_field_name()}_id': owner_id,
+            f'{new.m2m_reverse_field_name()}_id': assets[legacy_id],
+        }))
+        if len(batch) >= BATCH_SIZE:
+            new.remote_field.through.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        new.remote_field.through.objects.bulk_create(batch)
+
+
+def relink_media(apps, schema_editor):
+    """Point at the MediaAsset each legacy csr-media row was copied to"""
+    MediaAsset = apps.get_model('cloud_resource', 'MediaAsset')
+    assets = dict(MediaAsset.objects.filter(owner_type='csr-media').values_list('legacy_id', 'pk'))
+    copy_links(apps.get_model('cddpresources', 'Resource'), 'media', 'media_assets', assets)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cloud_resource', '0003_media_asset'),
+        ('cddpresources', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resource',
+            name='media_assets',
+            field=models.ManyToManyField(blank=True, limit_choices_to={'owner_type': 'csr-media'}, related_name='+', to='cloud_resource.mediaasset'),
+        ),
+        migrations.RunPython(relink_media, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 # from django.contrib.gis.db import models as gis_models
 # from django.contrib.gis.geos import Point
 from django.core.validators import MinValueValidator, MaxValueValidator
@@ -6,7 +6,7 @@ from django.utils import timezone
 from typing import List, Dict, Any
 import uuid
 from accounts.models import User
-from cloud_resource.models import CSRResourceMedia
+from cloud_resource.models import MediaAsset
 
 
 class ResourceTag(models.Model):
@@ -42,7 +42,9 @@ class Resource(models.Model):
     reorder_point = models.IntegerField(null=True, blank=True, validators=[MinValueValidator(0)])
     quantity_available = models.IntegerField(default=0, validators=[MinValueValidator(0)])
     quantity_allocated = models.IntegerField(default=0, validators=[MinValueValidator(0)])
-    media = models.ManyToManyField(CSRResourceMedia, blank= True, related_name="resources_media")
+    media = models.ManyToManyField(
+        MediaAsset, blank= True, related_name="resources_media", limit_choices_to={'owner_type': MediaAsset.CSR}
+    )
     unit = models.CharField(max_length=50)
     expiry_date = models.DateField(null=True, blank=True)
     # location = gis_models.PointField(null=True, blank=True)
@@ -85,9 +87,13 @@ class Resource(models.Model):
         return self.reorder_point is not None and self.quantity_available <= self.reorder_point
     
     def delete(self, *args, **kwargs):
-        if self.media:
-            self.media.delete()
-        super().delete(*args, **kwargs)
+        from cloud_resource import media
+
+        with transaction.atomic():
+            asset_ids = list(self.media.values_list('pk', flat=True))
+            result = super().delete(*args, **kwargs)
+            media.discard(asset_ids)
+        return result
 
     def __str__(self):
         return f"{self.name} (Resource Type: {self.resource_type})"
@@ -1,6 +1,7 @@
 from rest_framework import serializers
 # from django.contrib.gis.geos import Point
 from .models import ResourceTag, ResourceType, Resource, ResourceDonation
+from . import forecast
 from accounts.models import User
 
 
@@ -60,3 +61,9 @@ class ResourceDonationSerializer(serializers.ModelSerializer):
             'id', 'resource', 'donor', 'quantity', 'donation_date',
             'monetary_value', 'is_anonymous', 'receipt_issued', 'notes'
         )
+
+
+class ResourceForecastQuerySerializer(serializers.Serializer):
+    method = serializers.ChoiceField(choices=forecast.METHODS, default=forecast.EWMA)
+    horizon = serializers.IntegerField(min_value=1, max_value=90, required=False)
+    needs_reorder = serializers.BooleanField(required=False)
@@ -1,3 +1,116 @@
-from django.test import TestCase
+from datetime import timedelta
+from smtplib import SMTPException
+from unittest import mock
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.core.cache import cache
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase
 
-# Create your tests here.
+from accounts.models import User
+from cddp.tasks import check_resource_reorder
+from cddp.testing import create_admin, create_incident
+from incident.models import IncidentResource
+from . import forecast
+from .models import Resource, ResourceType, ResourceDonation
+
+
+class ResourceForecastTest(APITestCase):
+    """Forecasts smooth daily demand per resource and drive reorder alerts"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.manager = User.objects.create_user(
+            email='stores@example.com', password='password', first_name='Sam', last_name='Stores'
+        )
+        incident = create_incident()
+        resource_type = ResourceType.objects.create(name='Supplies')
+        cls.sandbags = Resource.objects.create(
+            name='Sandbags', resource_type=resource_type, description='Sandbags', unit='bag',
+            quantity_available=20, reorder_point=5, manager=cls.manager
+        )
+        cls.blankets = Resource.objects.create(
+            name='Blankets', resource_type=resource_type, description='Blankets', unit='blanket',
+            quantity_available=10
+        )
+        # Two sandbags a day for the last ten days
+        now = timezone.now()
+        for days_ago in range(1, 11):
+            request = IncidentResource.objects.create(incident=incident, resource=cls.sandbags, quantity_requested=2)
+            IncidentResource.objects.filter(pk=request.pk).update(requested_at=now - timedelta(days=days_ago))
+        donation = ResourceDonation.objects.create(resource=cls.blankets, quantity=7)
+        ResourceDonation.objects.filter(pk=donation.pk).update(donation_date=now - timedelta(days=1))
+
+    def setUp(self):
+        cache.clear()
+
+    def test_projects_stock_and_reorders(self):
+        results = {item['resource']: item for item in forecast.forecast(forecast.SMA, horizon_days=14)}
+
+        sandbags = results[self.sandbags.pk]
+        self.assertEqual(sandbags['daily_demand'], 2.0)
+        self.assertEqual(sandbags['projected_stock'], -8.0)
+        self.assertEqual(sandbags['days_of_cover'], 10.0)
+        self.assertTrue(sandbags['needs_reorder'])
+        self.assertEqual(sandbags['reorder_quantity'], 13)
+
+        blankets = results[self.blankets.pk]
+        self.assertEqual(blankets['daily_demand'], 0.0)
+        self.assertEqual(blankets['daily_supply'], 1.0)
+        self.assertIsNone(blankets['days_of_cover'])
+        self.assertFalse(blankets['needs_reorder'])
+
+    def test_exponential_smoothing_favours_recent_days(self):
+        now = timezone.now()
+        request = IncidentResource.objects.filter(resource=self.sandbags).first()
+        IncidentResource.objects.filter(pk=request.pk).update(requested_at=now - timedelta(days=1), quantity_requested=20)
+
+        results = {item['resource']: item for item in forecast.forecast(forecast.EWMA, history_days=10)}
+        self.assertGreater(results[self.sandbags.pk]['daily_demand'], 3.8)
+
+    def test_dashboard_endpoint(self):
+        self.client.force_authenticate(User.objects.get(pk=self.admin.pk))
+        response = self.client.get(
+            reverse('incident-resorce-resource-forecast'), {'method': 'sma', 'needs_reorder': 'true'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['name'] for item in response.data['resources']], ['Sandbags'])
+        self.assertEqual(self.client.get(
+            reverse('incident-resorce-resource-forecast'), {'method': 'arima'}
+        ).status_code, 400)
+
+    def test_reorder_alerts_are_sent_once_a_day(self):
+        self.assertEqual(check_resource_reorder(), 1)
+        self.assertEqual(mail.outbox[0].to, ['stores@example.com'])
+        self.assertIn('Sandbags', mail.outbox[0].alternatives[0][0])
+
+        self.assertEqual(check_resource_reorder(), 0)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_reorder_alerts_are_logged_as_they_are_sent(self):
+        Resource.objects.create(
+            name='Pumps', resource_type=self.sandbags.resource_type, description='Pumps', unit='pump',
+            quantity_available=1, reorder_point=2,
+            manager=User.objects.create_user(email='pumps@example.com', password='password')
+        )
+        send_messages = locmem.EmailBackend.send_messages
+        sent = []
+
+        def fail_second(backend, messages):
+            if sent:
+                raise SMTPException('Connection lost')
+            sent.extend(messages)
+            return send_messages(backend, messages)
+
+        with mock.patch.object(locmem.EmailBackend, 'send_messages', fail_second):
+            with self.assertRaises(SMTPException):
+                check_resource_reorder()
+        self.assertEqual(len(mail.outbox), 1)
+
+        # Only the manager whose digest was lost is alerted again
+        self.assertEqual(check_resource_reorder(), 1)
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox), ['pumps@example.com', 'stores@example.com']
+        )
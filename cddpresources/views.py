@@ -1,4 +1,4 @@
-from rest_framework import viewsets, permissions
+from rest_framework import viewsets, permissions, status
 from django.db.models import Q
 from django_filters.rest_framework import DjangoFilterBackend
 from .models import ResourceTag, ResourceType, Resource, ResourceDonation
@@ -9,6 +9,8 @@ from .serializers import (
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from .filters import ResourceFilterSet, ResourceDonationFilterSet
+from incident import allocation
+from incident.allocation import AllocationError
 
 
 
@@ -61,14 +63,13 @@ class ResourceViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'])
     def allocate(self, request, pk=None):
         resource = self.get_object()
-        quantity = request.data.get('quantity', 0)
-        if quantity > resource.quantity_available_for_allocation:
-            return Response(
-                {'error': 'Requested quantity exceeds available quantity'},
-                status=status.HTTP_400_BAD_REQUEST
+        try:
+            allocation.allocate_stock(
+                resource.pk, allocation.parse_quantity(request.data.get('quantity', 0)),
+                request.user, request.data.get('notes', '')
             )
-        resource.quantity_allocated += quantity
-        resource.save()
+        except AllocationError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
         #send notification to resource manager about allocation
         return Response({'message': 'Resource allocated successfully'}, status=status.HTTP_200_OK)
@@ -77,14 +78,13 @@ class ResourceViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'])
     def return_allocated(self, request, pk=None):
         resource = self.get_object()
-        quantity = request.data.get('quantity', 0)
-        if quantity > resource.quantity_allocated:
-            return Response(
-                {'error': 'Requested return quantity exceeds allocated quantity'},
-                status=status.HTTP_400_BAD_REQUEST
+        try:
+            allocation.release_stock(
+                resource.pk, allocation.parse_quantity(request.data.get('quantity', 0)),
+                request.user, request.data.get('notes', '')
             )
-        resource.quantity_allocated -= quantity
-        resource.save()
+        except AllocationError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         # #send notification to resource manager about returned allocation
         return Response({'message': 'Allocated resources returned successfully'}, status=status.HTTP_200_OK)
     
@@ -0,0 +1,274 @@
+"""
+Media asset service.
+
+The one path media files take in and out of storage, whatever they are
+uploaded for: small files uploaded inside the request, chunked and direct
+uploads finished by a worker (see cloud_resource.uploads), replacing an
+asset's file and deleting assets.
+
+Stored files are never deleted inside the request. Deleting an asset, or
+replacing its file, writes a MediaTombstone for the old file in the same
+transaction, so a file can not be forgotten even if the worker never hears
+about it. ``purge_media_tombstones`` claims due tombstones, deletes their
+files with one bulk call per BULK_DELETE_LIMIT files and retries failures
+with an exponential backoff.
+
+``reconcile_media_orphans`` catches what slips past: assets whose owner was
+deleted without them, e.g. by a queryset delete, and files under the media
+folders that no asset or open upload refers to. Both are only touched once
+they are older than MEDIA_ORPHAN_GRACE_DAYS, as media is uploaded before it
+is attached.
+"""
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import storage
+from .models import MediaAsset, MediaTombstone, UploadSession
+
+logger = logging.getLogger(__name__)
+
+
+# Tombstones claimed and deleted together
+PURGE_BATCH_SIZE = storage.BULK_DELETE_LIMIT
+
+# Most tombstones one purge_media_tombstones run works through
+PURGE_MAX_PER_RUN = 5000
+
+# How long a claimed tombstone is left to its worker before others may retry it
+CLAIM_LEASE = timedelta(minutes=10)
+
+# Retry delays double from the first to the longest
+RETRY_DELAY = timedelta(minutes=1)
+MAX_RETRY_DELAY = timedelta(hours=6)
+
+# Failed attempts after which every further failure is logged as an error
+ALERT_AFTER_ATTEMPTS = 5
+
+# The relations that own media of each owner type; media of other types has no owner
+OWNER_RELATIONS = {
+    MediaAsset.PROFILE_PICTURE: ('user',),
+    MediaAsset.INCIDENT: ('incident_media', 'incidentupdate_media'),
+    MediaAsset.EVENT: ('events',),
+    MediaAsset.CSR: ('resources_media',),
+    MediaAsset.BLOG: ('blog',),
+}
+
+SWEEP_BATCH_SIZE = 500
+
+
+def _stored_fields(stored):
+    return {
+        'size': stored['bytes'],
+        'media_url': stored['url'],
+        'cloud_id': stored['public_id'],
+        'resource_type': stored['resource_type'],
+    }
+
+
+def _upload(file):
+    public_id = storage.new_public_id(storage.MEDIA_FOLDER, getattr(file, 'name', ''), storage.RAW)
+    return storage.get_backend().upload(file, public_id)
+
+
+def create(owner_type, stored, **fields):
+    """A MediaAsset for a file already in storage, as returned by the backend"""
+    return MediaAsset.objects.create(owner_type=owner_type, **_stored_fields(stored), **fields)
+
+
+def upload(file, owner_type, **fields):
+    """Store a file sent with the request and create its MediaAsset"""
+    return create(owner_type, _upload(file), **fields)
+
+
+@transaction.atomic
+def replace_file(asset, file):
+    """
+    Store a new file for the asset and save it; the old file, if any, is
+    deleted once the change commits
+    """
+    old = stored_file(asset)
+    for field, value in _stored_fields(_upload(file)).items():
+        setattr(asset, field, value)
+    asset.content_type = asset.thumbnail_url = ''
+    asset.save()
+    delete_files([old])
+    return asset
+
+
+def stored_file(asset):
+    """(public_id, resource_type) of the asset's file, None when it has none"""
+    return (asset.cloud_id, asset.resource_type) if asset.cloud_id else None
+
+
+# Deleting
+
+def delete_files(files):
+    """
+    Tombstone stored files in the current transaction and have them purged
+    once it commits
+    """
+    from cddp.tasks import purge_media_tombstones
+
+    tombstones = [
+        MediaTombstone(public_id=public_id, resource_type=resource_type)
+        for public_id, resource_type in {tuple(file) for file in files if file}
+    ]
+    if not tombstones:
+        return 0
+    MediaTombstone.objects.bulk_create(tombstones, ignore_conflicts=True)
+    transaction.on_commit(lambda: purge_media_tombstones.delay())
+    return len(tombstones)
+
+
+@transaction.atomic
+def delete(assets):
+    """Delete assets and tombstone their stored files, returning how many assets were deleted"""
+    assets = list(assets)
+    MediaAsset.objects.filter(pk__in=[asset.pk for asset in assets]).delete()
+    delete_files(stored_file(asset) for asset in assets)
+    return len(assets)
+
+
+def _unowned(queryset):
+    """The assets of the queryset that nothing owns any more"""
+    unowned = None
+    for owner_type, relations in OWNER_RELATIONS.items():
+        condition = queryset.filter(owner_type=owner_type, **{f'{relation}__isnull': True for relation in relations})
+        unowned = condition if unowned is None else unowned | condition
+    return unowned
+
+
+def discard(asset_ids):
+    """
+    Delete the given assets that nothing owns any more. Models call this
+    after deleting themselves, so media shared with another owner stays.
+    """
+    asset_ids = [asset_id for asset_id in asset_ids if asset_id is not None]
+    if not asset_ids:
+        return 0
+    return delete(_unowned(MediaAsset.objects.filter(pk__in=asset_ids)))
+
+
+# Purging
+
+def _claim(now):
+    """Lease a batch of due tombstones to this worker"""
+    with transaction.atomic():
+        batch = list(
+            MediaTombstone.objects.filter(next_attempt_at__lte=now)
+            .order_by('next_attempt_at')
+            .select_for_update(skip_locked=True)[:PURGE_BATCH_SIZE]
+        )
+        MediaTombstone.objects.filter(pk__in=[tombstone.pk for tombstone in batch]).update(
+            next_attempt_at=now + CLAIM_LEASE
+        )
+    return batch
+
+
+def retry_delay(attempts):
+    """How long to wait after the given number of failed attempts"""
+    return min(RETRY_DELAY * 2 ** max(attempts - 1, 0), MAX_RETRY_DELAY)
+
+
+def _failed(tombstone, error, now):
+    attempts = tombstone.attempts + 1
+    MediaTombstone.objects.filter(pk=tombstone.pk).update(
+        attempts=F('attempts') + 1,
+        next_attempt_at=now + retry_delay(attempts),
+        last_error=str(error)[:1000],
+    )
+    log = logger.error if attempts >= ALERT_AFTER_ATTEMPTS else logger.warning
+    log("Could not delete stored file %s after %d attempts: %s", tombstone, attempts, error)
+
+
+def _purge(batch, now):
+    backend = storage.get_backend()
+    by_type = {}
+    for tombstone in batch:
+        by_type.setdefault(tombstone.resource_type, []).append(tombstone)
+
+    deleted = []
+    for resource_type, tombstones in by_type.items():
+        try:
+            failures = backend.destroy_many([tombstone.public_id for tombstone in tombstones], resource_type)
+        except Exception as error:
+            failures = {tombstone.public_id: error for tombstone in tombstones}
+        for tombstone in tombstones:
+            if tombstone.public_id in failures:
+                _failed(tombstone, failures[tombstone.public_id], now)
+            else:
+                deleted.append(tombstone.pk)
+    MediaTombstone.objects.filter(pk__in=deleted).delete()
+    return len(deleted)
+
+
+def purge(now=None, limit=PURGE_MAX_PER_RUN):
+    """Delete the files of due tombstones, returning how many were deleted and how many failed"""
+    now = now or timezone.now()
+    deleted = attempted = 0
+    while attempted < limit:
+        batch = _claim(now)
+        if not batch:
+            break
+        attempted += len(batch)
+        deleted += _purge(batch, now)
+    return {'deleted': deleted, 'failed': attempted - deleted}
+
+
+# Reconciling
+
+def reconcile(now=None):
+    """
+    Delete assets their owners left behind and tombstone stored files that
+    nothing refers to, returning how many of each were found
+    """
+    now = now or timezone.now()
+    cutoff = now - timedelta(days=settings.MEDIA_ORPHAN_GRACE_DAYS)
+
+    orphaned_assets = 0
+    stale = _unowned(MediaAsset.objects.filter(created_at__lt=cutoff)).values_list('pk', flat=True)
+    while True:
+        batch = list(stale[:SWEEP_BATCH_SIZE])
+        if not batch:
+            break
+        orphaned_assets += delete(MediaAsset.objects.filter(pk__in=batch))
+
+    orphaned_files = 0
+    backend = storage.get_backend()
+    for resource_type in storage.RESOURCE_TYPES:
+        for folder in storage.FOLDERS:
+            batch = []
+            for public_id, uploaded_at in backend.list_files(folder, resource_type):
+                if uploaded_at < cutoff:
+                    batch.append(public_id)
+                if len(batch) >= SWEEP_BATCH_SIZE:
+                    orphaned_files += _tombstone_unreferenced(batch, resource_type)
+                    batch = []
+            if batch:
+                orphaned_files += _tombstone_unreferenced(batch, resource_type)
+    return {'assets': orphaned_assets, 'files': orphaned_files}
+
+
+@transaction.atomic
+def _tombstone_unreferenced(public_ids, resource_type):
+    referenced = set(
+        MediaAsset.objects.filter(cloud_id__in=public_ids, resource_type=resource_type)
+        .values_list('cloud_id', flat=True)
+    )
+    referenced.update(
+        UploadSession.objects.filter(
+            public_id__in=public_ids, status__in=UploadSession.OPEN_STATUSES
+        ).values_list('public_id', flat=True)
+    )
+    referenced.update(
+        MediaTombstone.objects.filter(public_id__in=public_ids, resource_type=resource_type)
+        .values_list('public_id', flat=True)
+    )
+    orphans = [public_id for public_id in public_ids if public_id not in referenced]
+    if orphans:
+        logger.info("Found %d stored %s files no media refers to", len(orphans), resource_type)
+    return delete_files((public_id, resource_type) for public_id in orphans)
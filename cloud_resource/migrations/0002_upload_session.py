@@ -0,0 +1,47 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:07
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('cloud_resource', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('target', models.CharField(choices=[('resources', 'Resources'), ('profile-pics', 'Profile pictures'), ('incident-media', 'Incident media'), ('event-media', 'Event media'), ('csr-media', 'CSR resource media'), ('blogs-media', 'Blog media')], max_length=20)),
+                ('title', models.CharField(max_length=50)),
+                ('type', models.CharField(blank=True, choices=[('AUDIO', 'AUDIO'), ('VIDEO', 'VIDEO'), ('IMAGE', 'IMAGE'), ('DOCUMENT', 'DOCUMENT'), ('OTHERS', 'OTHERS')], max_length=20)),
+                ('caption', models.CharField(blank=True, max_length=255)),
+                ('is_sensitive', models.BooleanField(default=False)),
+                ('filename', models.CharField(max_length=255)),
+                ('total_size', models.PositiveBigIntegerField()),
+                ('received_bytes', models.PositiveBigIntegerField(default=0)),
+                ('direct', models.BooleanField(default=False)),
+                ('public_id', models.CharField(max_length=255, unique=True)),
+                ('resource_type', models.CharField(default='raw', max_length=10)),
+                ('status', models.CharField(choices=[('UPLOADING', 'Uploading'), ('PROCESSING', 'Processing'), ('COMPLETE', 'Complete'), ('FAILED', 'Failed'), ('EXPIRED', 'Expired')], default='UPLOADING', max_length=20)),
+                ('content_type', models.CharField(blank=True, max_length=100)),
+                ('thumbnail_url', models.CharField(blank=True, max_length=255)),
+                ('media_id', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('expires_at', models.DateTimeField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'expires_at'], name='cloud_resou_status_f589ee_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,103 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+BATCH_SIZE = 1000
+
+# The per-owner models media was kept in until now, by owner type
+LEGACY_MODELS = (
+    ('resources', 'Resources'),
+    ('profile-pics', 'ProfilePicResource'),
+    ('incident-media', 'IncidentMediaResource'),
+    ('event-media', 'EventResources'),
+    ('csr-media', 'CSRResourceMedia'),
+    ('blogs-media', 'BlogResource'),
+)
+
+
+def copy_media(apps, schema_editor):
+    """
+    Copy every legacy media row into MediaAsset, remembering its old primary
+    key in legacy_id so the models attaching media can be relinked
+    """
+    MediaAsset = apps.get_model('cloud_resource', 'MediaAsset')
+    UploadSession = apps.get_model('cloud_resource', 'UploadSession')
+    uploaded = dict(UploadSession.objects.filter(status='COMPLETE').values_list('public_id', 'resource_type'))
+
+    for owner_type, model_name in LEGACY_MODELS:
+        Legacy = apps.get_model('cloud_resource', model_name)
+        batch = []
+        for row in Legacy.objects.order_by('pk').iterator(chunk_size=BATCH_SIZE):
+            batch.append(MediaAsset(
+                owner_type=owner_type,
+                legacy_id=row.pk,
+                title=row.title,
+                size=row.size,
+                type=row.type,
+                is_sensitive=getattr(row, 'is_sensitive', False),
+                caption=getattr(row, 'caption', ''),
+                media_url=row.media_url,
+                cloud_id=row.cloud_id,
+                # Files uploaded inside the request were all stored raw
+                resource_type=uploaded.get(row.cloud_id, 'raw'),
+                created_at=row.created_at,
+                updated_at=row.updated_at,
+            ))
+            if len(batch) >= BATCH_SIZE:
+                MediaAsset.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            MediaAsset.objects.bulk_create(batch)
+
+    # Finished uploads point at their asset instead of the legacy row
+    for session in UploadSession.objects.exclude(media_id=None).iterator(chunk_size=BATCH_SIZE):
+        session.media_id = MediaAsset.objects.filter(
+            owner_type=session.target, legacy_id=session.media_id
+        ).values_list('pk', flat=True).first()
+        session.save(update_fields=['media_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cloud_resource', '0002_upload_session'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaAsset',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('owner_type', models.CharField(choices=[('resources', 'Resources'), ('profile-pics', 'Profile pictures'), ('incident-media', 'Incident media'), ('event-media', 'Event media'), ('csr-media', 'CSR resource media'), ('blogs-media', 'Blog media')], default='resources', max_length=20)),
+                ('title', models.CharField(max_length=50, null=True)),
+                ('size', models.PositiveBigIntegerField(null=True)),
+                ('type', models.CharField(choices=[('AUDIO', 'AUDIO'), ('VIDEO', 'VIDEO'), ('IMAGE', 'IMAGE'), ('DOCUMENT', 'DOCUMENT'), ('OTHERS', 'OTHERS')], default='IMAGE', max_length=20)),
+                ('is_sensitive', models.BooleanField(default=False)),
+                ('caption', models.CharField(blank=True, max_length=255)),
+                ('media_url', models.CharField(blank=True, max_length=255, null=True)),
+                ('cloud_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('resource_type', models.CharField(default='raw', max_length=10)),
+                ('content_type', models.CharField(blank=True, max_length=100)),
+                ('thumbnail_url', models.CharField(blank=True, max_length=255)),
+                # Set by hand while copying so the legacy timestamps survive
+                ('created_at', models.DateTimeField(null=True)),
+                ('updated_at', models.DateTimeField(null=True)),
+                ('legacy_id', models.PositiveBigIntegerField(null=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.RunPython(copy_media, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='mediaasset',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='mediaasset',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, null=True),
+        ),
+    ]
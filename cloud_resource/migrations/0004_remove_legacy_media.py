@@ -0,0 +1,56 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cloud_resource', '0003_media_asset'),
+        ('accounts', '0005_media_asset_swap'),
+        ('blog', '0003_media_asset_swap'),
+        ('cddpresources', '0003_media_asset_swap'),
+        ('event', '0003_media_asset_swap'),
+        ('incident', '0008_media_asset_swap'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='BlogResource',
+        ),
+        migrations.DeleteModel(
+            name='CSRResourceMedia',
+        ),
+        migrations.DeleteModel(
+            name='EventResources',
+        ),
+        migrations.DeleteModel(
+            name='IncidentMediaResource',
+        ),
+        migrations.DeleteModel(
+            name='ProfilePicResource',
+        ),
+        migrations.DeleteModel(
+            name='Resources',
+        ),
+        migrations.RemoveField(
+            model_name='mediaasset',
+            name='legacy_id',
+        ),
+        migrations.RemoveField(
+            model_name='uploadsession',
+            name='content_type',
+        ),
+        migrations.RemoveField(
+            model_name='uploadsession',
+            name='thumbnail_url',
+        ),
+        migrations.AddIndex(
+            model_name='mediaasset',
+            index=models.Index(fields=['owner_type', '-created_at'], name='cloud_resou_owner_t_9d9518_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mediaasset',
+            index=models.Index(fields=['cloud_id'], name='cloud_resou_cloud_i_a678d3_idx'),
+        ),
+    ]
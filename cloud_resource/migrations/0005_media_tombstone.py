@@ -0,0 +1,34 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:17
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cloud_resource', '0004_remove_legacy_media'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('public_id', models.CharField(max_length=255)),
+                ('resource_type', models.CharField(default='raw', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['next_attempt_at'],
+                'indexes': [models.Index(fields=['next_attempt_at'], name='cloud_resou_next_at_d3c56d_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='mediatombstone',
+            constraint=models.UniqueConstraint(fields=('public_id', 'resource_type'), name='unique_media_tombstone'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cloud_resource', '0005_media_tombstone'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='uploadsession',
+            name='status',
+            field=models.CharField(choices=[('UPLOADING', 'Uploading'), ('PROCESSING', 'Processing'), ('STORING', 'Storing'), ('COMPLETE', 'Complete'), ('FAILED', 'Failed'), ('EXPIRED', 'Expired')], default='UPLOADING', max_length=20),
+        ),
+    ]
@@ -1,4 +1,7 @@
+import uuid
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
 # Create your models here.
 
@@ -14,103 +17,133 @@ RESOURCE_TYPES = (
 )
 
 
-class Resources(models.Model):
+class MediaAsset(models.Model):
+    """
+    Every uploaded media file, in one table whatever it was uploaded for.
+    owner_type says what that is; the models that attach media point here
+    and limit their choices to their own owner type.
+    """
+    RESOURCES = 'resources'
+    PROFILE_PICTURE = 'profile-pics'
+    INCIDENT = 'incident-media'
+    EVENT = 'event-media'
+    CSR = 'csr-media'
+    BLOG = 'blogs-media'
+    OWNER_TYPES = [
+        (RESOURCES, 'Resources'),
+        (PROFILE_PICTURE, 'Profile pictures'),
+        (INCIDENT, 'Incident media'),
+        (EVENT, 'Event media'),
+        (CSR, 'CSR resource media'),
+        (BLOG, 'Blog media'),
+    ]
+
+    owner_type = models.CharField(max_length=20, choices=OWNER_TYPES, default=RESOURCES)
     title = models.CharField(max_length=50, null=True)
-    size = models.IntegerField(null=True)
+    size = models.PositiveBigIntegerField(null=True)
     type = models.CharField(max_length=20, choices=RESOURCE_TYPES, default="IMAGE")
+    is_sensitive = models.BooleanField(default=False)
+    caption = models.CharField(max_length=255, blank=True)
     media_url = models.CharField(max_length=255, blank=True, null=True)
     cloud_id = models.CharField(max_length=255, blank=True, null=True)
+    # How the file is kept in storage, see cloud_resource.storage
+    resource_type = models.CharField(max_length=10, default='raw')
+    content_type = models.CharField(max_length=100, blank=True)
+    thumbnail_url = models.CharField(max_length=255, blank=True)
     created_at = models.DateTimeField(auto_now_add=True, null=True)
     updated_at = models.DateTimeField(auto_now=True, null=True)
 
     def __str__(self) -> str:
-        return self.title
-    
-    class Meta:
-        ordering = ["-created_at"]
+        return self.title or ''
 
-
-class EventResources(models.Model):
-    title = models.CharField(max_length=50, null=True)
-    size = models.IntegerField(null=True)
-    type = models.CharField(max_length=20, choices=RESOURCE_TYPES, default="IMAGE")
-    media_url = models.CharField(max_length=255, blank=True, null=True)
-    cloud_id = models.CharField(max_length=255, blank=True, null=True)
-    created_at = models.DateTimeField(auto_now_add=True, null=True)
-    updated_at = models.DateTimeField(auto_now=True, null=True)
-
-    def __str__(self) -> str:
-        return self.title
-    
     class Meta:
         ordering = ["-created_at"]
-
-
-class BlogResource(models.Model):
-    title = models.CharField(max_length=50, null=True)
-    size = models.IntegerField(null=True)
-    type = models.CharField(max_length=20, choices=RESOURCE_TYPES, default="IMAGE")
-    media_url = models.CharField(max_length=255, blank=True, null=True)
-    cloud_id = models.CharField(max_length=255, blank=True, null=True)
-    created_at = models.DateTimeField(auto_now_add=True, null=True)
-    updated_at = models.DateTimeField(auto_now=True, null=True)
+        indexes = [
+            models.Index(fields=['owner_type', '-created_at']),
+            models.Index(fields=['cloud_id']),
+        ]
+
+
+class UploadSession(models.Model):
+    """
+    A media upload made outside the request that creates it: either sent to
+    us in chunks that can be resumed, or signed for the client to send
+    straight to storage. Once complete, a Celery task stores and inspects
+    the file and creates its MediaAsset.
+    """
+    UPLOADING = 'UPLOADING'
+    PROCESSING = 'PROCESSING'
+    # Claimed by the worker storing it
+    STORING = 'STORING'
+    COMPLETE = 'COMPLETE'
+    FAILED = 'FAILED'
+    EXPIRED = 'EXPIRED'
+    STATUS_CHOICES = [
+        (UPLOADING, 'Uploading'),
+        (PROCESSING, 'Processing'),
+        (STORING, 'Storing'),
+        (COMPLETE, 'Complete'),
+        (FAILED, 'Failed'),
+        (EXPIRED, 'Expired'),
+    ]
+    # Sessions whose file may still be needed
+    OPEN_STATUSES = (UPLOADING, PROCESSING, STORING)
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='upload_sessions')
+    target = models.CharField(max_length=20, choices=MediaAsset.OWNER_TYPES)
+    title = models.CharField(max_length=50)
+    # Detected from the file when not given
+    type = models.CharField(max_length=20, choices=RESOURCE_TYPES, blank=True)
+    caption = models.CharField(max_length=255, blank=True)
+    is_sensitive = models.BooleanField(default=False)
+    filename = models.CharField(max_length=255)
+    total_size = models.PositiveBigIntegerField()
+    received_bytes = models.PositiveBigIntegerField(default=0)
+    direct = models.BooleanField(default=False)
+    public_id = models.CharField(max_length=255, unique=True)
+    resource_type = models.CharField(max_length=10, default='raw')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=UPLOADING)
+    # Primary key of the MediaAsset created once processed
+    media_id = models.PositiveBigIntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    expires_at = models.DateTimeField()
 
     def __str__(self) -> str:
-        return self.title
-    
-    class Meta:
-        ordering = ["-created_at"]
-
-
+        return f"{self.filename} ({self.status})"
 
-class CSRResourceMedia(models.Model):
-    title = models.CharField(max_length=50, null=True)
-    size = models.IntegerField(null=True)
-    type = models.CharField(max_length=20, choices=RESOURCE_TYPES, default="IMAGE")
-    media_url = models.CharField(max_length=255, blank=True, null=True)
-    cloud_id = models.CharField(max_length=255, blank=True, null=True)
-    created_at = models.DateTimeField(auto_now_add=True, null=True)
-    updated_at = models.DateTimeField(auto_now=True, null=True)
-
-    def __str__(self) -> str:
-        return self.title
-    
     class Meta:
         ordering = ["-created_at"]
-
-
-
-
-class ProfilePicResource(models.Model):
-    title = models.CharField(max_length=50, null=True)
-    size = models.IntegerField(null=True)
-    type = models.CharField(max_length=20, choices=RESOURCE_TYPES, default="IMAGE")
-    media_url = models.CharField(max_length=255, blank=True, null=True)
-    cloud_id = models.CharField(max_length=255, blank=True, null=True)
-    created_at = models.DateTimeField(auto_now_add=True, null=True)
-    updated_at = models.DateTimeField(auto_now=True, null=True)
+        indexes = [
+            models.Index(fields=['status', 'expires_at']),
+        ]
+
+
+
+class MediaTombstone(models.Model):
+    """
+    A stored file that no asset refers to any more, written in the same
+    transaction that dropped its asset. purge_media_tombstones deletes the
+    file from storage and then the tombstone; failed attempts are retried
+    from next_attempt_at with an exponential backoff.
+    """
+    public_id = models.CharField(max_length=255)
+    resource_type = models.CharField(max_length=10, default='raw')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self) -> str:
-        return self.title
-    
-    class Meta:
-        ordering = ["-created_at"]
-
-
-
-class IncidentMediaResource(models.Model):
-    title = models.CharField(max_length=50, null=True)
-    size = models.IntegerField(null=True)
-    type = models.CharField(max_length=20, choices=RESOURCE_TYPES, default="IMAGE")
-    is_sensitive = models.BooleanField(default=False)
-    caption = models.CharField(max_length=255, blank=True)
-    media_url = models.CharField(max_length=255, blank=True, null=True)
-    cloud_id = models.CharField(max_length=255, blank=True, null=True)
-    created_at = models.DateTimeField(auto_now_add=True, null=True)
-    updated_at = models.DateTimeField(auto_now=True, null=True)
+        return f"{self.resource_type}/{self.public_id}"
 
-    def __str__(self) -> str:
-        return self.title
-    
     class Meta:
-        ordering = ["-created_at"]
\ No newline at end of file
+        ordering = ["next_attempt_at"]
+        constraints = [
+            models.UniqueConstraint(fields=['public_id', 'resource_type'], name='unique_media_tombstone'),
+        ]
+        indexes = [
+            models.Index(fields=['next_attempt_at']),
+        ]
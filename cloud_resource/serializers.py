@@ -1,146 +1,37 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import Resources, ProfilePicResource, BlogResource, IncidentMediaResource, CSRResourceMedia, EventResources
-import cloudinary.uploader
+from .models import MediaAsset, UploadSession, RESOURCE_TYPES
 from rest_framework.validators import ValidationError
+from . import media
+from .storage import get_backend
 
 
 
-RESOURCE_TYPES = (
-    ("AUDIO", "AUDIO"),
-    ("VIDEO", "VIDEO"),
-    ("IMAGE", "IMAGE"),
-    ("DOCUMENT", "DOCUMENT"),
-    ("OTHERS", "OTHERS"),
-)
-
-
-
+# Larger files go through /uploads/ so they do not hold up a web worker
 MAXIMUM_SIZE_UPLOAD = 3 * 1024 * 1024 #3mb
 
 
-class BaseResourceSerializer(serializers.ModelSerializer):
-    file = serializers.FileField(required=True, write_only=True)
-    title = serializers.CharField(required=True)
-    type = serializers.ChoiceField(choices=(
-        ("AUDIO", "AUDIO"),
-        ("VIDEO", "VIDEO"),
-        ("IMAGE", "IMAGE"),
-        ("DOCUMENT", "DOCUMENT"),
-        ("OTHERS", "OTHERS"),
-    ), required=True)
-
-    class Meta:
-        fields = [
-            "id",
-            "title",
-            "file",
-            "type",
-            "size",
-            "media_url",
-            "cloud_id",
-        ]
-        read_only_fields = ["id", "media_url", "cloud_id", "size"]
-
-    def validate_file(self, value):
-        if value.size > MAXIMUM_SIZE_UPLOAD:
-            raise ValidationError("File size must not exceed 3MB")
-        return value
-
-    def upload_to_cloudinary(self, file):
-        return cloudinary.uploader.upload(file, resource_type='raw')
-
-    def create(self, validated_data):
-        file = validated_data.pop('file')
-        upload_result = self.upload_to_cloudinary(file)
-
-        # Create a new instance with the uploaded data
-        instance = self.Meta.model.objects.create(
-            media_url=upload_result["url"],
-            cloud_id=upload_result["public_id"],
-            size=upload_result["bytes"],
-            **validated_data,
-        )
-        return instance
-
-    def update(self, instance, validated_data):
-        file = validated_data.pop('file', None)
-        if file:
-            # Delete old Cloudinary resource
-            cloudinary.uploader.destroy(public_id=instance.cloud_id, resource_type='raw')
-
-            # Upload new file
-            upload_result = self.upload_to_cloudinary(file)
-            instance.media_url = upload_result["url"]
-            instance.cloud_id = upload_result["public_id"]
-            instance.size = upload_result["bytes"]
-
-        # Update other fields
-        instance.title = validated_data.get('title', instance.title)
-        instance.type = validated_data.get('type', instance.type)
-        instance.save()
-        return instance
-
-
-
-class CreateResourcesSerializer(BaseResourceSerializer):
-    class Meta(BaseResourceSerializer.Meta):
-        model = Resources
-
-class ResourcesSerializer(serializers.ModelSerializer):
+class MediaAssetSerializer(serializers.ModelSerializer):
     class Meta:
-        model = Resources
+        model = MediaAsset
         fields = "__all__"
 
 
-class CreateProfilePicResourceSerializer(BaseResourceSerializer):
-    class Meta(BaseResourceSerializer.Meta):
-        model = ProfilePicResource
-    
-class ProfilePicResourceSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = ProfilePicResource
-        fields = "__all__"
-
-
-class CreateBlogResourceSerializer(BaseResourceSerializer):
-    class Meta(BaseResourceSerializer.Meta):
-        model = BlogResource
-
-class BlogResourceSerializer(serializers.ModelSerializer):
-
-    class Meta:
-        model = BlogResource
-        fields = "__all__"
-
-
-
-
-
-
-
-
-class IncidentMediaResourceSerializer(serializers.ModelSerializer):
-
-    class Meta:
-        model = IncidentMediaResource
-        fields = "__all__"
-
-
-class CreateIncidentMediaResourceSerializer(serializers.ModelSerializer):
+class CreateMediaAssetSerializer(serializers.ModelSerializer):
+    """Uploads a small file inside the request; the view sets the owner type"""
     file = serializers.FileField(required=True, write_only=True)
     title = serializers.CharField(required=True)
     type = serializers.ChoiceField(RESOURCE_TYPES, required=True)
 
-
     class Meta:
-        model = IncidentMediaResource
+        model = MediaAsset
         fields = [
             "id",
             "title",
             "file",
             "type",
-            'is_sensitive',
-            'caption',
+            "is_sensitive",
+            "caption",
             "size",
             "media_url",
             "cloud_id",
@@ -149,131 +40,56 @@ class CreateIncidentMediaResourceSerializer(serializers.ModelSerializer):
 
     def validate_file(self, value):
         if value.size > MAXIMUM_SIZE_UPLOAD:
-            raise ValidationError("File size must not be more than 2MB")
+            raise ValidationError("File size must not exceed 3MB, use a chunked upload for larger files")
         return value
 
     def create(self, validated_data):
-        file = validated_data.pop('file')  # Extract 'file' from validated_data
-
-        # Upload the file to Cloudinary or your desired storage
-        upload_result = cloudinary.uploader.upload(file, resource_type='raw')
-
-        # Create a new Resources instance with the other fields
-        instance = IncidentMediaResource.objects.create(
-            media_url=upload_result["url"],
-            cloud_id=upload_result["public_id"],
-            size=upload_result["bytes"],
-            **validated_data,
-        )
-
-        return instance
+        file = validated_data.pop('file')
+        return media.upload(file, **validated_data)
 
     def update(self, instance, validated_data):
-        file = validated_data.pop('file', None)  # Extract 'file' from validated_data
-
+        file = validated_data.pop('file', None)
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
         if file:
-            # Delete the old file in Cloudinary
-            cloudinary.uploader.destroy(public_id=instance.cloud_id, resource_type='raw')
-
-            # Upload the new file to Cloudinary or your desired storage
-            upload_result = cloudinary.uploader.upload(file, resource_type='raw')
-
-            # Update the media_url and cloud_id with the new values
-            instance.media_url = upload_result["url"]
-            instance.cloud_id = upload_result["public_id"]
-            instance.size = upload_result["bytes"]
-
-        # Update other fields as needed
-        instance.title = validated_data.get('title', instance.title)
-        instance.type = validated_data.get('type', instance.type)
+            return media.replace_file(instance, file)
         instance.save()
         return instance
 
 
-
-
-class EventResourcesSerializer(serializers.ModelSerializer):
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """Opens a chunked or direct upload; read back to see its progress"""
+    total_size = serializers.IntegerField(min_value=1)
 
     class Meta:
-        model = EventResources
-        fields = "__all__"
-
-
-class CreateEventResourcesSerializer(serializers.ModelSerializer):
-    file = serializers.FileField(required=True, write_only=True)
-    title = serializers.CharField(required=True)
-    type = serializers.ChoiceField(RESOURCE_TYPES, required=True)
-
-
-    class Meta:
-        model = EventResources
+        model = UploadSession
         fields = [
             "id",
+            "target",
             "title",
-            "file",
             "type",
-            'is_sensitive',
-            'caption',
-            "size",
-            "media_url",
-            "cloud_id",
+            "caption",
+            "is_sensitive",
+            "filename",
+            "total_size",
+            "direct",
+            "received_bytes",
+            "status",
+            "media_id",
+            "error",
+            "created_at",
+            "expires_at",
+        ]
+        read_only_fields = [
+            "id", "received_bytes", "status", "media_id", "error", "created_at", "expires_at",
         ]
-        read_only_fields = ["id", "media_url", "cloud_id", "size"]
 
-    def validate_file(self, value):
-        if value.size > MAXIMUM_SIZE_UPLOAD:
-            raise ValidationError("File size must not be more than 2MB")
+    def validate_total_size(self, value):
+        if value > settings.MEDIA_UPLOAD_MAX_SIZE:
+            raise ValidationError(f"File size must not exceed {settings.MEDIA_UPLOAD_MAX_SIZE} bytes")
         return value
 
-    def create(self, validated_data):
-        file = validated_data.pop('file')  # Extract 'file' from validated_data
-
-        # Upload the file to Cloudinary or your desired storage
-        upload_result = cloudinary.uploader.upload(file, resource_type='raw')
-
-        # Create a new Resources instance with the other fields
-        instance = EventResources.objects.create(
-            media_url=upload_result["url"],
-            cloud_id=upload_result["public_id"],
-            size=upload_result["bytes"],
-            **validated_data,
-        )
-
-        return instance
-
-    def update(self, instance, validated_data):
-        file = validated_data.pop('file', None)  # Extract 'file' from validated_data
-
-        if file:
-            # Delete the old file in Cloudinary
-            cloudinary.uploader.destroy(public_id=instance.cloud_id, resource_type='raw')
-
-            # Upload the new file to Cloudinary or your desired storage
-            upload_result = cloudinary.uploader.upload(file, resource_type='raw')
-
-            # Update the media_url and cloud_id with the new values
-            instance.media_url = upload_result["url"]
-            instance.cloud_id = upload_result["public_id"]
-            instance.size = upload_result["bytes"]
-
-        # Update other fields as needed
-        instance.title = validated_data.get('title', instance.title)
-        instance.type = validated_data.get('type', instance.type)
-        instance.save()
-        return instance
-
-
-
-
-
-
-
-class CreateCSRResourceMediaSerializer(BaseResourceSerializer):
-    class Meta(BaseResourceSerializer.Meta):
-        model = CSRResourceMedia
-        
-
-class CSRResourceMediaSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = CSRResourceMedia
-        fields = "__all__"
+    def validate_direct(self, value):
+        if value and not get_backend().supports_direct_upload:
+            raise ValidationError("The storage backend does not accept direct uploads, use chunks")
+        return value
@@ -0,0 +1,286 @@
+"""
+Pluggable media storage.
+
+Media is stored through a backend chosen by MEDIA_STORAGE_BACKEND:
+"cloudinary" in production, or "local" to keep files on disk under
+MEDIA_LOCAL_ROOT, a stand-in for tests and development that needs no
+Cloudinary account. Both return uploads as a dict with url, public_id,
+bytes and resource_type, the keys the media serializers already read from
+Cloudinary's upload response.
+
+resource_type is Cloudinary's: "image", "video" (which covers audio) or
+"raw". Images and videos can be transformed, so only they get thumbnails.
+Files are stored under the folders in FOLDERS, which is where the orphan
+sweep in cloud_resource.media looks for files no asset refers to.
+"""
+import logging
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime, timezone as dt_timezone
+from urllib.parse import urljoin
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+
+logger = logging.getLogger(__name__)
+
+
+IMAGE = 'image'
+VIDEO = 'video'
+RAW = 'raw'
+RESOURCE_TYPES = (IMAGE, VIDEO, RAW)
+
+# Longest side of generated thumbnails, in pixels
+THUMBNAIL_SIZE = 320
+
+# Files above this are sent to Cloudinary in parts by upload_large
+CLOUDINARY_CHUNK_SIZE = 20 * 1024 * 1024
+
+# Seconds a signed direct upload stays valid (Cloudinary rejects older signatures after an hour)
+DIRECT_UPLOAD_SECONDS = 3600
+
+# Most public ids Cloudinary deletes in one Admin API call
+BULK_DELETE_LIMIT = 100
+
+# Files uploaded inside the request, and chunked or direct uploads
+MEDIA_FOLDER = 'media'
+UPLOADS_FOLDER = 'uploads'
+FOLDERS = (MEDIA_FOLDER, UPLOADS_FOLDER)
+
+# Results of a bulk delete that leave nothing behind
+DELETED = ('deleted', 'not_found')
+
+
+class StorageError(Exception):
+    """The backend could not store, find or delete a file"""
+
+
+class CloudinaryStorage:
+    supports_direct_upload = True
+
+    def upload(self, file, public_id=None, resource_type=RAW):
+        import cloudinary.exceptions
+        import cloudinary.uploader
+
+        options = {'resource_type': resource_type}
+        if public_id:
+            options['public_id'] = public_id
+        size = _size(file)
+        try:
+            if size is not None and size > CLOUDINARY_CHUNK_SIZE:
+                result = cloudinary.uploader.upload_large(file, chunk_size=CLOUDINARY_CHUNK_SIZE, **options)
+            else:
+                result = cloudinary.uploader.upload(file, **options)
+        except cloudinary.exceptions.Error as error:
+            raise StorageError(f"Cloudinary upload failed: {error}")
+        return _stored(result)
+
+    def destroy(self, public_id, resource_type=RAW):
+        import cloudinary.uploader
+
+        return cloudinary.uploader.destroy(public_id=public_id, resource_type=resource_type)
+
+    def destroy_many(self, public_ids, resource_type=RAW):
+        """
+        Delete up to BULK_DELETE_LIMIT files in one call, returning
+        {public_id: reason} for the ones Cloudinary did not delete
+        """
+        import cloudinary.api
+        import cloudinary.exceptions
+
+        try:
+            result = cloudinary.api.delete_resources(list(public_ids), resource_type=resource_type, type='upload')
+        except cloudinary.exceptions.Error as error:
+            raise StorageError(f"Cloudinary delete failed: {error}")
+        deleted = result.get('deleted', {})
+        return {
+            public_id: deleted.get(public_id, 'missing from the response')
+            for public_id in public_ids
+            if deleted.get(public_id) not in DELETED
+        }
+
+    def list_files(self, folder, resource_type=RAW):
+        """(public_id, uploaded_at) of every file stored under the folder"""
+        import cloudinary.api
+
+        cursor = None
+        while True:
+            page = cloudinary.api.resources(
+                type='upload', resource_type=resource_type, prefix=f'{folder}/', max_results=500,
+                **({'next_cursor': cursor} if cursor else {})
+            )
+            for resource in page.get('resources', []):
+                yield resource['public_id'], parse_datetime(resource['created_at'])
+            cursor = page.get('next_cursor')
+            if not cursor:
+                return
+
+    def stat(self, public_id, resource_type=RAW):
+        """The stored file, as upload() would have returned it"""
+        import cloudinary.api
+        import cloudinary.exceptions
+
+        try:
+            return _stored(cloudinary.api.resource(public_id, resource_type=resource_type))
+        except cloudinary.exceptions.NotFound:
+            raise StorageError(f"{public_id} was not uploaded")
+        except cloudinary.exceptions.Error as error:
+            raise StorageError(f"Cloudinary lookup of {public_id} failed: {error}")
+
+    def direct_upload(self, public_id, resource_type=RAW):
+        """
+        Signed parameters for the client to upload straight to Cloudinary,
+        bypassing our workers. The client POSTs the file with these fields
+        to the url; large files may be sent in parts with Content-Range and
+        X-Unique-Upload-Id headers under the same signature.
+        """
+        import cloudinary
+        import cloudinary.utils
+
+        params = {'public_id': public_id, 'timestamp': int(time.time())}
+        api_secret = cloudinary.config().api_secret
+        fields = dict(
+            params,
+            api_key=cloudinary.config().api_key,
+            signature=cloudinary.utils.api_sign_request(params, api_secret),
+        )
+        return {
+            'url': cloudinary.utils.cloudinary_api_url('upload', resource_type=resource_type),
+            'fields': fields,
+            'expires_at': params['timestamp'] + DIRECT_UPLOAD_SECONDS,
+        }
+
+    def thumbnail(self, public_id, resource_type):
+        """URL of a thumbnail Cloudinary renders on first request, None for raw files"""
+        import cloudinary.utils
+
+        if resource_type == RAW:
+            return None
+        url, _ = cloudinary.utils.cloudinary_url(
+            public_id, resource_type=resource_type, format='jpg', secure=True,
+            transformation=[{'width': THUMBNAIL_SIZE, 'height': THUMBNAIL_SIZE, 'crop': 'limit'}],
+        )
+        return url
+
+
+class LocalStorage:
+    """Files kept under root and served from base_url"""
+    supports_direct_upload = False
+
+    def __init__(self, root, base_url):
+        self.root = root
+        self.base_url = base_url if base_url.endswith('/') else base_url + '/'
+
+    def _path(self, public_id, resource_type):
+        path = os.path.normpath(os.path.join(self.root, resource_type, public_id))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise StorageError(f"Invalid public id {public_id}")
+        return path
+
+    def _stored(self, public_id, resource_type):
+        path = self._path(public_id, resource_type)
+        if not os.path.exists(path):
+            raise StorageError(f"{public_id} was not uploaded")
+        return {
+            'url': urljoin(self.base_url, f'{resource_type}/{public_id}'),
+            'public_id': public_id,
+            'bytes': os.path.getsize(path),
+            'resource_type': resource_type,
+        }
+
+    def upload(self, file, public_id=None, resource_type=RAW):
+        public_id = public_id or uuid.uuid4().hex + os.path.splitext(getattr(file, 'name', '') or '')[1]
+        path = self._path(public_id, resource_type)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if isinstance(file, (str, os.PathLike)):
+            shutil.copyfile(file, path)
+        else:
+            if hasattr(file, 'seek'):
+                file.seek(0)
+            with open(path, 'wb') as destination:
+                for chunk in file.chunks() if hasattr(file, 'chunks') else iter(lambda: file.read(65536), b''):
+                    destination.write(chunk)
+        return self._stored(public_id, resource_type)
+
+    def destroy(self, public_id, resource_type=RAW):
+        path = self._path(public_id, resource_type)
+        for stale in (path, path + '.thumb.jpg'):
+            if os.path.exists(stale):
+                os.remove(stale)
+        return {'result': 'ok'}
+
+    def destroy_many(self, public_ids, resource_type=RAW):
+        for public_id in public_ids:
+            self.destroy(public_id, resource_type)
+        return {}
+
+    def list_files(self, folder, resource_type=RAW):
+        base = os.path.join(self.root, resource_type)
+        for directory, _, names in os.walk(os.path.join(base, folder)):
+            for name in names:
+                if name.endswith('.thumb.jpg'):
+                    continue
+                path = os.path.join(directory, name)
+                public_id = os.path.relpath(path, base).replace(os.sep, '/')
+                yield public_id, datetime.fromtimestamp(os.path.getmtime(path), tz=dt_timezone.utc)
+
+    def stat(self, public_id, resource_type=RAW):
+        return self._stored(public_id, resource_type)
+
+    def direct_upload(self, public_id, resource_type=RAW):
+        raise StorageError("Local storage only accepts chunked uploads")
+
+    def thumbnail(self, public_id, resource_type):
+        """Render a JPEG thumbnail of an image when Pillow is installed"""
+        if resource_type != IMAGE:
+            return None
+        try:
+            from PIL import Image
+        except ImportError:
+            return None
+        path = self._path(public_id, resource_type)
+        try:
+            with Image.open(path) as image:
+                image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+                image.convert('RGB').save(path + '.thumb.jpg', 'JPEG')
+        except OSError:
+            logger.warning("Could not render a thumbnail of %s", public_id, exc_info=True)
+            return None
+        return urljoin(self.base_url, f'{resource_type}/{public_id}.thumb.jpg')
+
+
+def new_public_id(folder, filename, resource_type):
+    """A unique public id in the folder; raw files keep their extension, which they are served under"""
+    public_id = f'{folder}/{uuid.uuid4().hex}'
+    if resource_type == RAW:
+        public_id += os.path.splitext(filename or '')[1].lower()
+    return public_id
+
+
+def _size(file):
+    if isinstance(file, (str, os.PathLike)):
+        return os.path.getsize(file)
+    return getattr(file, 'size', None)
+
+
+def _stored(result):
+    return {
+        'url': result['url'],
+        'public_id': result['public_id'],
+        'bytes': result['bytes'],
+        'resource_type': result.get('resource_type', RAW),
+    }
+
+
+_backends = {}
+
+
+def get_backend():
+    key = (settings.MEDIA_STORAGE_BACKEND, settings.MEDIA_LOCAL_ROOT, settings.MEDIA_LOCAL_URL)
+    if key not in _backends:
+        if settings.MEDIA_STORAGE_BACKEND == 'local':
+            _backends[key] = LocalStorage(settings.MEDIA_LOCAL_ROOT, settings.MEDIA_LOCAL_URL)
+        else:
+            _backends[key] = CloudinaryStorage()
+    return _backends[key]
@@ -1,3 +1,264 @@
-from django.test import TestCase
+import io
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase
 
-# Create your tests here.
+from accounts.models import User
+from cddp.tasks import process_media_upload, purge_media_tombstones
+from cddpresources.models import Resource, ResourceType
+from . import media, storage, uploads
+from .models import MediaAsset, MediaTombstone, UploadSession
+
+
+MEDIA_ROOT = tempfile.mkdtemp(prefix='cddp-media-')
+
+
+@override_settings(
+    MEDIA_STORAGE_BACKEND='local', MEDIA_LOCAL_ROOT=os.path.join(MEDIA_ROOT, 'stored'),
+    MEDIA_UPLOAD_TEMP_DIR=os.path.join(MEDIA_ROOT, 'parts'), MEDIA_UPLOAD_CHUNK_SIZE=16,
+)
+class MediaTestCase(APITestCase):
+    """Media stored on local disk under a temporary directory"""
+    PNG = b'\x89PNG\r\n\x1a\n' + b'pixels' * 4
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='field@example.com', password='password')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+
+class MediaUploadTest(MediaTestCase):
+    """Chunked uploads resume at the last received byte and are stored by a worker"""
+
+    def start(self, **data):
+        response = self.client.post(reverse('cloud_resource:upload-list'), {
+            'target': 'incident-media', 'title': 'Flooded road', 'filename': 'road.png',
+            'total_size': len(self.PNG), **data,
+        }, format='json')
+        return response
+
+    def send(self, session_id, first, last):
+        return self.client.put(
+            reverse('cloud_resource:upload-chunk', args=[session_id]), self.PNG[first:last + 1],
+            content_type='application/octet-stream', HTTP_CONTENT_RANGE=f'bytes {first}-{last}/{len(self.PNG)}',
+        )
+
+    @mock.patch('cddp.tasks.process_media_upload.delay')
+    def test_chunked_upload(self, process):
+        session_id = self.start(caption='Main street').data['id']
+        self.assertEqual(self.send(session_id, 0, 15).status_code, 200)
+
+        # A retried chunk is refused with the offset to resume from
+        response = self.send(session_id, 0, 15)
+        self.assertEqual((response.status_code, response.data['received_bytes']), (409, 16))
+        complete = reverse('cloud_resource:upload-complete', args=[session_id])
+        self.assertEqual(self.client.post(complete).status_code, 400)
+
+        self.assertEqual(self.send(session_id, 16, len(self.PNG) - 1).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post(complete).status_code, 202)
+        process.assert_called_once_with(session_id)
+
+        self.assertEqual(process_media_upload(session_id), UploadSession.COMPLETE)
+        session = self.client.get(reverse('cloud_resource:upload-detail', args=[session_id])).data
+        self.assertEqual(session['status'], 'COMPLETE')
+        media = MediaAsset.objects.get(pk=session['media_id'])
+        self.assertEqual(
+            (media.owner_type, media.type, media.content_type, media.size, media.caption),
+            (MediaAsset.INCIDENT, 'IMAGE', 'image/png', len(self.PNG), 'Main street')
+        )
+        with open(os.path.join(MEDIA_ROOT, 'stored', 'image', media.cloud_id), 'rb') as stored:
+            self.assertEqual(stored.read(), self.PNG)
+        self.assertFalse(os.path.exists(uploads.temp_path(UploadSession(pk=session_id))))
+
+    def test_concurrent_attempts_at_a_chunk_apply_once(self):
+        session_id = self.start().data['id']
+        chunk = self.PNG[:16]
+
+        class Stream(io.BytesIO):
+            def read(stream, size=-1):
+                # Another attempt at the same chunk finishes while this one is being sent
+                if not UploadSession.objects.get(pk=session_id).received_bytes:
+                    uploads.receive_chunk(session_id, 0, len(chunk), io.BytesIO(chunk))
+                return super().read(size)
+
+        with self.assertRaises(uploads.OffsetMismatch) as mismatch:
+            uploads.receive_chunk(session_id, 0, len(chunk), Stream(chunk))
+        self.assertEqual(mismatch.exception.received_bytes, 16)
+        self.assertEqual(self.send(session_id, 16, len(self.PNG) - 1).status_code, 200)
+        with open(uploads.temp_path(UploadSession(pk=session_id)), 'rb') as part:
+            self.assertEqual(part.read(), self.PNG)
+
+    def uploaded(self):
+        session_id = self.start().data['id']
+        self.send(session_id, 0, 15)
+        self.send(session_id, 16, len(self.PNG) - 1)
+        with mock.patch('cddp.tasks.process_media_upload.delay'):
+            self.client.post(reverse('cloud_resource:upload-complete', args=[session_id]))
+        return session_id
+
+    def test_only_one_worker_stores_a_session(self):
+        session_id = self.uploaded()
+        UploadSession.objects.filter(pk=session_id).update(status=UploadSession.STORING)
+        self.assertIsNone(uploads.process(session_id))
+
+        UploadSession.objects.filter(pk=session_id).update(status=UploadSession.PROCESSING)
+        self.assertEqual(uploads.process(session_id).status, UploadSession.COMPLETE)
+        self.assertIsNone(uploads.process(session_id))
+        self.assertEqual(MediaAsset.objects.count(), 1)
+
+    def test_storage_errors_are_retried(self):
+        session_id = self.uploaded()
+        with mock.patch.object(storage.LocalStorage, 'upload', side_effect=storage.StorageError('Timed out')) as upload:
+            with self.assertRaises(storage.StorageError):
+                uploads.process(session_id, retry=True)
+            self.assertEqual(UploadSession.objects.get(pk=session_id).status, UploadSession.PROCESSING)
+
+            # The task gives up after its last retry and fails the session
+            result = process_media_upload.apply(args=[session_id])
+        self.assertEqual(result.get(), UploadSession.FAILED)
+        self.assertEqual(upload.call_count, 1 + process_media_upload.max_retries + 1)
+        self.assertEqual(UploadSession.objects.get(pk=session_id).error, 'Timed out')
+
+    def test_cloudinary_errors_become_storage_errors(self):
+        import cloudinary.exceptions
+
+        backend = storage.CloudinaryStorage()
+        failure = cloudinary.exceptions.Error('Server returned unexpected status code - 502')
+        with mock.patch('cloudinary.uploader.upload', side_effect=failure):
+            with self.assertRaises(storage.StorageError):
+                backend.upload(SimpleUploadedFile('photo.png', self.PNG), 'media/photo')
+        with mock.patch('cloudinary.api.resource', side_effect=failure):
+            with self.assertRaises(storage.StorageError):
+                backend.stat('media/photo')
+        with mock.patch('cloudinary.api.delete_resources', side_effect=failure):
+            with self.assertRaises(storage.StorageError):
+                backend.destroy_many(['media/photo'])
+
+    def test_sessions_are_private_and_expire(self):
+        self.assertEqual(self.start(direct=True).status_code, 400)
+        self.assertEqual(self.start(total_size=10 ** 12).status_code, 400)
+
+        session_id = self.start().data['id']
+        self.send(session_id, 0, 15)
+        self.client.force_authenticate(User.objects.create_user(email='other@example.com', password='password'))
+        self.assertEqual(self.send(session_id, 16, 20).status_code, 404)
+
+        self.assertEqual(uploads.expire(timezone.now() + timedelta(days=2)), 1)
+        session = UploadSession.objects.get(pk=session_id)
+        self.assertEqual(session.status, UploadSession.EXPIRED)
+        self.assertFalse(os.path.exists(uploads.temp_path(session)))
+
+
+class MediaAssetTest(MediaTestCase):
+    """Media of every owner type goes through one table and one service"""
+
+    @mock.patch('cddp.tasks.purge_media_tombstones.delay')
+    def test_media_assets_share_one_path(self, purge):
+        response = self.client.post(
+            reverse('cloud_resource:incidentmediaresource-list'),
+            {
+                'title': 'Bridge', 'type': 'IMAGE', 'caption': 'North side',
+                'file': SimpleUploadedFile('bridge.png', self.PNG),
+            },
+            format='multipart',
+        )
+        self.assertEqual(response.status_code, 201)
+        asset = MediaAsset.objects.get(pk=response.data['id'])
+        self.assertEqual(
+            (asset.owner_type, asset.caption, asset.size), (MediaAsset.INCIDENT, 'North side', len(self.PNG))
+        )
+
+        # Each owner type only sees its own assets
+        self.assertEqual(
+            self.client.get(reverse('cloud_resource:blogresource-detail', args=[asset.pk])).status_code, 404
+        )
+        listed = self.client.get(reverse('cloud_resource:incidentmediaresource-list')).data['results']
+        self.assertEqual([item['id'] for item in listed], [asset.pk])
+
+        # The stored file is tombstoned with the row and deleted by a worker
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(reverse('cloud_resource:incidentmediaresource-detail', args=[asset.pk]))
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(MediaAsset.objects.filter(pk=asset.pk).exists())
+        purge.assert_called_once_with()
+        self.assertTrue(MediaTombstone.objects.filter(public_id=asset.cloud_id, resource_type='raw').exists())
+        self.assertEqual(purge_media_tombstones(), {'deleted': 1, 'failed': 0})
+        self.assertFalse(MediaTombstone.objects.exists())
+        self.assertFalse(os.path.exists(os.path.join(MEDIA_ROOT, 'stored', 'raw', asset.cloud_id)))
+
+
+class MediaTombstoneTest(MediaTestCase):
+    """Stored files are deleted by a retrying worker and orphans are swept"""
+
+    @mock.patch('cddp.tasks.purge_media_tombstones.delay')
+    def test_owner_deletes_tombstone_media_and_failures_back_off(self, purge):
+        resource = Resource.objects.create(
+            name='Tents', resource_type=ResourceType.objects.create(name='Shelter'),
+            description='Tents', unit='tent', quantity_available=10,
+        )
+        kept, shared = (
+            media.upload(SimpleUploadedFile(f'{name}.png', self.PNG), MediaAsset.CSR) for name in ('kept', 'shared')
+        )
+        resource.media.add(kept, shared)
+        Resource.objects.create(
+            name='Blankets', resource_type=resource.resource_type,
+            description='Blankets', unit='blanket', quantity_available=10,
+        ).media.add(shared)
+
+        # Media another resource still shows is left alone
+        resource.delete()
+        self.assertEqual(list(MediaAsset.objects.values_list('pk', flat=True)), [shared.pk])
+        self.assertEqual(list(MediaTombstone.objects.values_list('public_id', flat=True)), [kept.cloud_id])
+
+        now = timezone.now()
+        with mock.patch.object(storage.LocalStorage, 'destroy_many', return_value={kept.cloud_id: 'rate limited'}):
+            self.assertEqual(media.purge(now), {'deleted': 0, 'failed': 1})
+        tombstone = MediaTombstone.objects.get()
+        self.assertEqual((tombstone.attempts, tombstone.last_error), (1, 'rate limited'))
+        self.assertEqual(tombstone.next_attempt_at, now + media.retry_delay(1))
+        # Not due again until the backoff has passed
+        self.assertEqual(media.purge(now), {'deleted': 0, 'failed': 0})
+        self.assertEqual(media.purge(tombstone.next_attempt_at), {'deleted': 1, 'failed': 0})
+
+    @mock.patch('cddp.tasks.purge_media_tombstones.delay')
+    def test_reconcile_sweeps_orphans_after_grace_period(self, purge):
+        # Files other tests left behind would be orphans too
+        shutil.rmtree(os.path.join(MEDIA_ROOT, 'stored'), ignore_errors=True)
+        attached = media.upload(SimpleUploadedFile('attached.png', self.PNG), MediaAsset.CSR)
+        Resource.objects.create(
+            name='Tents', resource_type=ResourceType.objects.create(name='Shelter'),
+            description='Tents', unit='tent', quantity_available=10,
+        ).media.add(attached)
+        unattached = media.upload(SimpleUploadedFile('unattached.png', self.PNG), MediaAsset.CSR)
+        stray = storage.get_backend().upload(
+            SimpleUploadedFile('stray.png', self.PNG), storage.new_public_id(storage.MEDIA_FOLDER, 'stray.png', 'raw')
+        )
+
+        # Nothing is touched while it may still be attached
+        self.assertEqual(media.reconcile(), {'assets': 0, 'files': 0})
+
+        later = timezone.now() + timedelta(days=settings.MEDIA_ORPHAN_GRACE_DAYS + 1)
+        self.assertEqual(media.reconcile(later), {'assets': 1, 'files': 1})
+        self.assertEqual(list(MediaAsset.objects.values_list('pk', flat=True)), [attached.pk])
+        self.assertEqual(
+            set(MediaTombstone.objects.values_list('public_id', flat=True)),
+            {unattached.cloud_id, stray['public_id']}
+        )
+        # Files already tombstoned are not found again
+        self.assertEqual(media.reconcile(later), {'assets': 0, 'files': 0})
@@ -0,0 +1,293 @@
+"""
+Chunked and direct media uploads.
+
+Uploading a whole file inside the request that creates its media row ties
+up a web worker for as long as the client takes to send it. Large files go
+through an UploadSession instead, in one of two ways:
+
+* chunked: the client PUTs the file in parts of at most
+  MEDIA_UPLOAD_CHUNK_SIZE, each with a Content-Range header. Parts are
+  appended to a file under MEDIA_UPLOAD_TEMP_DIR, which must be shared with
+  the Celery workers. A part that does not start where the last one ended is
+  refused with the offset to resume from, so an interrupted upload carries
+  on where it stopped.
+* direct: the client gets signed parameters and sends the file straight to
+  the storage backend, never touching our workers. Only backends that
+  support it (Cloudinary) offer this.
+
+Completing a session queues ``process_media_upload``, which moves the file
+to storage, detects its type, renders a thumbnail and creates a MediaAsset
+owned by the session's target. The task claims the session by moving it
+from PROCESSING to STORING in one conditional UPDATE, so a duplicated or
+redelivered task never stores the same upload twice. Sessions left
+unfinished past MEDIA_UPLOAD_EXPIRY_HOURS are expired by
+``expire_upload_sessions``.
+"""
+import logging
+import mimetypes
+import os
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import media, storage
+from .models import UploadSession
+
+logger = logging.getLogger(__name__)
+
+
+# Leading bytes of common formats as (offset, signature, content type); trusted over the filename
+SIGNATURES = (
+    (0, b'\xff\xd8\xff', 'image/jpeg'),
+    (0, b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (0, b'GIF87a', 'image/gif'),
+    (0, b'GIF89a', 'image/gif'),
+    (8, b'WEBP', 'image/webp'),
+    (8, b'WAVE', 'audio/wav'),
+    (8, b'AVI ', 'video/x-msvideo'),
+    (0, b'\x1aE\xdf\xa3', 'video/webm'),
+    (0, b'OggS', 'audio/ogg'),
+    (0, b'ID3', 'audio/mpeg'),
+    (0, b'fLaC', 'audio/flac'),
+    (0, b'%PDF', 'application/pdf'),
+)
+
+# ISO media files share the "ftyp" box; its brand tells them apart
+FTYP_BRANDS = {
+    b'qt  ': 'video/quicktime',
+    b'M4A ': 'audio/mp4',
+    b'heic': 'image/heic',
+    b'heix': 'image/heic',
+    b'mif1': 'image/heif',
+}
+
+DOCUMENT_TYPES = ('application/pdf', 'application/msword', 'application/vnd.', 'text/')
+
+COPY_BUFFER_SIZE = 64 * 1024
+
+
+class UploadError(ValueError):
+    """The session can not accept this chunk or be completed"""
+
+
+class OffsetMismatch(UploadError):
+    """The chunk does not start where the received bytes end"""
+
+    def __init__(self, received_bytes):
+        super().__init__(f"Expected the chunk starting at byte {received_bytes}")
+        self.received_bytes = received_bytes
+
+
+# Detection
+
+def detect(head, filename=''):
+    """Content type of a file from its first bytes, falling back to its name"""
+    if head[4:8] == b'ftyp':
+        return FTYP_BRANDS.get(head[8:12], 'video/mp4')
+    for offset, signature, content_type in SIGNATURES:
+        if head[offset:offset + len(signature)] == signature:
+            return content_type
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+
+def media_type(content_type):
+    """The RESOURCE_TYPES value for a content type"""
+    if content_type.startswith('image/'):
+        return 'IMAGE'
+    if content_type.startswith('video/'):
+        return 'VIDEO'
+    if content_type.startswith('audio/'):
+        return 'AUDIO'
+    if content_type.startswith(DOCUMENT_TYPES):
+        return 'DOCUMENT'
+    return 'OTHERS'
+
+
+def resource_type(type):
+    """The storage resource type media of this RESOURCE_TYPES value is kept as"""
+    if type == 'IMAGE':
+        return storage.IMAGE
+    if type in ('VIDEO', 'AUDIO'):
+        return storage.VIDEO
+    return storage.RAW
+
+
+def temp_path(session):
+    return os.path.join(settings.MEDIA_UPLOAD_TEMP_DIR, f'{session.pk}.part')
+
+
+# Sessions
+
+def start(user, target, title, filename, total_size, type='', caption='', is_sensitive=False, direct=False):
+    """
+    Open an upload session. The storage resource type is fixed up front for
+    direct uploads, from the declared type or else the filename.
+    """
+    kind = resource_type(type or media_type(mimetypes.guess_type(filename)[0] or ''))
+    public_id = storage.new_public_id(storage.UPLOADS_FOLDER, filename, kind)
+    return UploadSession.objects.create(
+        user=user, target=target, title=title, type=type, caption=caption, is_sensitive=is_sensitive,
+        filename=filename, total_size=total_size, direct=direct, public_id=public_id, resource_type=kind,
+        expires_at=timezone.now() + timedelta(hours=settings.MEDIA_UPLOAD_EXPIRY_HOURS),
+    )
+
+
+def _check_open(session):
+    if session.status != UploadSession.UPLOADING:
+        raise UploadError(f"Upload is {session.status.lower()}")
+    if session.expires_at <= timezone.now():
+        raise UploadError("Upload has expired")
+
+
+def receive_chunk(session_id, start, length, stream):
+    """
+    Write length bytes read from stream at offset start. No transaction is
+    held while the client sends the chunk; received_bytes only advances by
+    a conditional UPDATE from start, so of two attempts at the same chunk
+    one is applied and the other refused with the offset to resume from.
+    """
+    session = UploadSession.objects.get(pk=session_id)
+    _check_open(session)
+    if session.direct:
+        raise UploadError("Direct uploads are sent to storage, not to us")
+    if start != session.received_bytes:
+        raise OffsetMismatch(session.received_bytes)
+    if length <= 0 or length > settings.MEDIA_UPLOAD_CHUNK_SIZE:
+        raise UploadError(f"Chunks must be 1 to {settings.MEDIA_UPLOAD_CHUNK_SIZE} bytes")
+    if start + length > session.total_size:
+        raise UploadError(f"Chunk ends past the declared size of {session.total_size} bytes")
+
+    path = temp_path(session)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Opened without truncating, since another attempt may be writing the same file. Bytes an
+    # abandoned attempt left past received_bytes are overwritten by the chunks that follow.
+    with os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o644), 'r+b') as part:
+        part.seek(start)
+        remaining = length
+        while remaining:
+            data = stream.read(min(COPY_BUFFER_SIZE, remaining))
+            if not data:
+                break
+            part.write(data)
+            remaining -= len(data)
+    if remaining:
+        raise UploadError(f"Chunk ended {remaining} bytes short of its Content-Range")
+
+    advanced = UploadSession.objects.filter(
+        pk=session_id, status=UploadSession.UPLOADING, received_bytes=start
+    ).update(received_bytes=start + length, updated_at=timezone.now())
+    session.refresh_from_db()
+    if not advanced:
+        _check_open(session)
+        raise OffsetMismatch(session.received_bytes)
+    return session
+
+
+@transaction.atomic
+def complete(session_id):
+    """Hand a fully sent upload to process_media_upload; completing twice is harmless"""
+    from cddp.tasks import process_media_upload
+
+    session = UploadSession.objects.select_for_update().get(pk=session_id)
+    if session.status in (UploadSession.PROCESSING, UploadSession.STORING, UploadSession.COMPLETE):
+        return session
+    _check_open(session)
+    if not session.direct and session.received_bytes != session.total_size:
+        raise UploadError(f"Received {session.received_bytes} of {session.total_size} bytes")
+
+    session.status = UploadSession.PROCESSING
+    session.save(update_fields=['status', 'updated_at'])
+    transaction.on_commit(lambda: process_media_upload.delay(str(session.pk)))
+    return session
+
+
+# Processing
+
+def _fail(session, error):
+    logger.warning("Upload %s failed: %s", session.pk, error)
+    session.status = UploadSession.FAILED
+    session.error = str(error)
+    session.save(update_fields=['status', 'error', 'updated_at'])
+
+
+def _claim(session_id):
+    """Move the session from PROCESSING to STORING, so only one worker stores it"""
+    claimed = UploadSession.objects.filter(pk=session_id, status=UploadSession.PROCESSING).update(
+        status=UploadSession.STORING, updated_at=timezone.now()
+    )
+    return UploadSession.objects.get(pk=session_id) if claimed else None
+
+
+def process(session_id, retry=False):
+    """
+    Store a completed upload, detect its type and size, render a thumbnail
+    and create its MediaAsset. Returns the session, or None when it is not
+    waiting to be processed or another worker has claimed it.
+
+    With retry, a StorageError hands the session back to PROCESSING and is
+    raised for the task to try again; otherwise the session fails.
+    """
+    session = _claim(session_id)
+    if session is None:
+        return None
+    backend = storage.get_backend()
+    path = temp_path(session)
+
+    try:
+        if session.direct:
+            stored = backend.stat(session.public_id, session.resource_type)
+            content_type = mimetypes.guess_type(session.filename)[0] or 'application/octet-stream'
+            if stored['bytes'] > settings.MEDIA_UPLOAD_MAX_SIZE:
+                media.delete_files([(session.public_id, session.resource_type)])
+                raise UploadError(f"Uploads may not exceed {settings.MEDIA_UPLOAD_MAX_SIZE} bytes")
+        else:
+            with open(path, 'rb') as part:
+                content_type = detect(part.read(64), session.filename)
+            session.resource_type = resource_type(session.type or media_type(content_type))
+            stored = backend.upload(path, session.public_id, session.resource_type)
+    except storage.StorageError as error:
+        if not retry:
+            _fail(session, error)
+            return session
+        logger.warning("Upload %s could not be stored, retrying: %s", session.pk, error)
+        UploadSession.objects.filter(pk=session.pk, status=UploadSession.STORING).update(
+            status=UploadSession.PROCESSING, updated_at=timezone.now()
+        )
+        raise
+    except (UploadError, OSError) as error:
+        _fail(session, error)
+        return session
+
+    session.type = session.type or media_type(content_type)
+    asset = media.create(
+        session.target, stored,
+        title=session.title, type=session.type, caption=session.caption, is_sensitive=session.is_sensitive,
+        content_type=content_type,
+        thumbnail_url=backend.thumbnail(stored['public_id'], stored['resource_type']) or '',
+    )
+    session.media_id = asset.pk
+    session.status = UploadSession.COMPLETE
+    session.save()
+    if os.path.exists(path):
+        os.remove(path)
+    return session
+
+
+def expire(now=None):
+    """Expire unfinished sessions and delete their parts, returning how many were expired"""
+    now = now or timezone.now()
+    stale = UploadSession.objects.filter(status__in=UploadSession.OPEN_STATUSES, expires_at__lt=now)
+    expired = 0
+    for session in stale.iterator():
+        path = temp_path(session)
+        if os.path.exists(path):
+            os.remove(path)
+        if session.status in (UploadSession.PROCESSING, UploadSession.STORING):
+            # Its task was lost, kept failing or died while storing
+            _fail(session, "Processing did not finish")
+        else:
+            session.status = UploadSession.EXPIRED
+            session.save(update_fields=['status', 'updated_at'])
+        expired += 1
+    return expired
@@ -1,15 +1,17 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ResourcesViewSets, ProfilePicResourceViewSets, CSRResourceMediaViewSets, BlogResourceViewSets, IncidentMediaResourceViewSets
+from .views import ResourcesViewSets, ProfilePicResourceViewSets, CSRResourceMediaViewSets, BlogResourceViewSets, IncidentMediaResourceViewSets, UploadSessionViewSet
 
 app_name = 'cloud_resource'
 
 router = DefaultRouter()
-router.register('', ResourcesViewSets)
-router.register('profile-pics/', ProfilePicResourceViewSets)
-router.register('incident-media/', IncidentMediaResourceViewSets)
-router.register('csr-media-resource/', CSRResourceMediaViewSets )
-router.register('blogs-media/', BlogResourceViewSets)
+# Ahead of '', whose detail route would otherwise take uploads/
+router.register('uploads', UploadSessionViewSet, basename='upload')
+router.register('', ResourcesViewSets, basename='resources')
+router.register('profile-pics/', ProfilePicResourceViewSets, basename='profilepicresource')
+router.register('incident-media/', IncidentMediaResourceViewSets, basename='incidentmediaresource')
+router.register('csr-media-resource/', CSRResourceMediaViewSets, basename='csrresourcemedia')
+router.register('blogs-media/', BlogResourceViewSets, basename='blogresource')
 
 
 
@@ -1,201 +1,138 @@
-from django.shortcuts import render
-from .serializers import *
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from django.conf import settings
+from .serializers import MediaAssetSerializer, CreateMediaAssetSerializer, UploadSessionSerializer
+from rest_framework.permissions import IsAuthenticated
 from rest_framework import viewsets, status
-from .models import Resources, BlogResource, ProfilePicResource, IncidentMediaResource, CSRResourceMedia, EventResources
-import cloudinary
-from cloudinary.exceptions import Error as CloudinaryError
+from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.parsers import MultiPartParser
+from rest_framework.parsers import MultiPartParser, JSONParser
+import re
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema, OpenApiParameter
+from .models import MediaAsset, UploadSession
+from .storage import get_backend
+from . import media, uploads
 # Create your views here.
 
 
-class ResourcesViewSets(viewsets.ModelViewSet):
+class MediaAssetViewSet(viewsets.ModelViewSet):
+    """
+    Media assets of one owner type. Each subclass serves one owner type from
+    the shared MediaAsset table; deleting an asset queues its stored file for
+    deletion instead of calling storage inside the request.
+    """
     http_method_names = ["get", "patch", "post", "put", "delete"]
-    serializer_class = CreateResourcesSerializer
     permission_classes = [IsAuthenticated]
     parser_classes = [MultiPartParser]
+    queryset = MediaAsset.objects.all()
+    owner_type = MediaAsset.RESOURCES
 
-    queryset = Resources.objects.all()
+    def get_queryset(self):
+        return self.queryset.filter(owner_type=self.owner_type)
 
     def get_serializer_class(self):
         if self.action in ['update', 'create', 'partial_update']:
-            return CreateResourcesSerializer
-        return ResourcesSerializer
-    
-    def destroy(self, request, *args, **kwargs):
-        instance = self.get_object()
-        
-        # Attempt to delete the resource from Cloudinary
-        if instance.cloud_id:
-            try:
-                cloudinary.uploader.destroy(public_id=instance.cloud_id, resource_type='raw')
-                # print(f"Successfully deleted resource {instance.cloud_id} from Cloudinary")
-            except Exception as e:
-                pass
-                # print(f"Error deleting resource from Cloudinary: {e}")
-                # Optionally handle this error (e.g., log it, return a response, etc.)
-        
-        # Delete the instance from the database
-        self.perform_destroy(instance)
-        return Response(status=status.HTTP_204_NO_CONTENT)
-    
-
-
-class BlogResourceViewSets(viewsets.ModelViewSet):
-    http_method_names = ["get", "patch", "post", "put", "delete"]
-    serializer_class = CreateBlogResourceSerializer
-    permission_classes = [IsAuthenticated]
-    parser_classes = [MultiPartParser]
+            return CreateMediaAssetSerializer
+        return MediaAssetSerializer
 
-    queryset = BlogResource.objects.all()
+    def perform_create(self, serializer):
+        serializer.save(owner_type=self.owner_type)
 
-    def get_serializer_class(self):
-        if self.action in ['update', 'create', 'partial_update']:
-            return CreateBlogResourceSerializer
-        return BlogResourceSerializer
-    
-    def destroy(self, request, *args, **kwargs):
-        instance = self.get_object()
-        
-        # Attempt to delete the resource from Cloudinary
-        if instance.cloud_id:
-            try:
-                cloudinary.uploader.destroy(public_id=instance.cloud_id, resource_type='raw')
-                # print(f"Successfully deleted resource {instance.cloud_id} from Cloudinary")
-            except Exception as e:
-                pass
-                # print(f"Error deleting resource from Cloudinary: {e}")
-                # Optionally handle this error (e.g., log it, return a response, etc.)
-        
-        # Delete the instance from the database
-        self.perform_destroy(instance)
-        return Response(status=status.HTTP_204_NO_CONTENT)
-
-
-class ProfilePicResourceViewSets(viewsets.ModelViewSet):
-    http_method_names = ["get", "patch", "post", "put", "delete"]
-    serializer_class = CreateProfilePicResourceSerializer
-    permission_classes = [IsAuthenticated]
-    parser_classes = [MultiPartParser]
+    def perform_destroy(self, instance):
+        media.delete([instance])
 
-    queryset = ProfilePicResource.objects.all()
 
-    def get_serializer_class(self):
-        if self.action in ['update', 'create', 'partial_update']:
-            return CreateProfilePicResourceSerializer
-        return ProfilePicResourceSerializer
-    
-    def destroy(self, request, *args, **kwargs):
-        instance = self.get_object()
-        
-        # Attempt to delete the resource from Cloudinary
-        if instance.cloud_id:
-            try:
-                cloudinary.uploader.destroy(public_id=instance.cloud_id, resource_type='raw')
-                # print(f"Successfully deleted resource {instance.cloud_id} from Cloudinary")
-            except Exception as e:
-                pass
-                # print(f"Error deleting resource from Cloudinary: {e}")
-                # Optionally handle this error (e.g., log it, return a response, etc.)
-        
-        # Delete the instance from the database
-        self.perform_destroy(instance)
-        return Response(status=status.HTTP_204_NO_CONTENT)
-    
-
-
-
-class EventResourceViewSets(viewsets.ModelViewSet):
-    http_method_names = ["get", "patch", "post", "put", "delete"]
-    serializer_class = CreateEventResourcesSerializer
-    permission_classes = [IsAuthenticated]
-    parser_classes = [MultiPartParser]
+class ResourcesViewSets(MediaAssetViewSet):
+    owner_type = MediaAsset.RESOURCES
 
-    queryset = EventResources.objects.all()
 
-    def get_serializer_class(self):
-        if self.action in ['update', 'create', 'partial_update']:
-            return CreateEventResourcesSerializer
-        return EventResourcesSerializer
-    
-    def destroy(self, request, *args, **kwargs):
-        instance = self.get_object()
-        
-        # Attempt to delete the resource from Cloudinary
-        if instance.cloud_id:
-            try:
-                cloudinary.uploader.destroy(public_id=instance.cloud_id, resource_type='raw')
-                # print(f"Successfully deleted resource {instance.cloud_id} from Cloudinary")
-            except Exception as e:
-                pass
-                # print(f"Error deleting resource from Cloudinary: {e}")
-                # Optionally handle this error (e.g., log it, return a response, etc.)
-        
-        # Delete the instance from the database
-        self.perform_destroy(instance)
-        return Response(status=status.HTTP_204_NO_CONTENT)
-    
-
-class CSRResourceMediaViewSets(viewsets.ModelViewSet):
-    http_method_names = ["get", "patch", "post", "put", "delete"]
-    serializer_class = CreateCSRResourceMediaSerializer
-    permission_classes = [IsAuthenticated]
-    parser_classes = [MultiPartParser]
+class BlogResourceViewSets(MediaAssetViewSet):
+    owner_type = MediaAsset.BLOG
 
-    queryset = CSRResourceMedia.objects.all()
 
-    def get_serializer_class(self):
-        if self.action in ['update', 'create', 'partial_update']:
-            return CreateCSRResourceMediaSerializer
-        return CSRResourceMediaSerializer
-    
-    def destroy(self, request, *args, **kwargs):
-        instance = self.get_object()
-        
-        # Attempt to delete the resource from Cloudinary
-        if instance.cloud_id:
-            try:
-                cloudinary.uploader.destroy(public_id=instance.cloud_id, resource_type='raw')
-                # print(f"Successfully deleted resource {instance.cloud_id} from Cloudinary")
-            except Exception as e:
-                pass
-                # print(f"Error deleting resource from Cloudinary: {e}")
-                # Optionally handle this error (e.g., log it, return a response, etc.)
-        
-        # Delete the instance from the database
-        self.perform_destroy(instance)
-        return Response(status=status.HTTP_204_NO_CONTENT)
-    
-
-
-
-class IncidentMediaResourceViewSets(viewsets.ModelViewSet):
-    http_method_names = ["get", "patch", "post", "put", "delete"]
-    serializer_class = CreateIncidentMediaResourceSerializer
-    permission_classes = [IsAuthenticated]
-    parser_classes = [MultiPartParser]
+class ProfilePicResourceViewSets(MediaAssetViewSet):
+    owner_type = MediaAsset.PROFILE_PICTURE
 
-    queryset = IncidentMediaResource.objects.all()
 
-    def get_serializer_class(self):
-        if self.action in ['update', 'create', 'partial_update']:
-            return CreateIncidentMediaResourceSerializer
-        return IncidentMediaResourceSerializer
-    
-    def destroy(self, request, *args, **kwargs):
-        instance = self.get_object()
-        
-        # Attempt to delete the resource from Cloudinary
-        if instance.cloud_id:
-            try:
-                cloudinary.uploader.destroy(public_id=instance.cloud_id, resource_type='raw')
-                # print(f"Successfully deleted resource {instance.cloud_id} from Cloudinary")
-            except Exception as e:
-                pass
-                # print(f"Error deleting resource from Cloudinary: {e}")
-                # Optionally handle this error (e.g., log it, return a response, etc.)
-        
-        # Delete the instance from the database
-        self.perform_destroy(instance)
-        return Response(status=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
+class EventResourceViewSets(MediaAssetViewSet):
+    owner_type = MediaAsset.EVENT
+
+
+class CSRResourceMediaViewSets(MediaAssetViewSet):
+    owner_type = MediaAsset.CSR
+
+
+class IncidentMediaResourceViewSets(MediaAssetViewSet):
+    owner_type = MediaAsset.INCIDENT
+
+
+class UploadSessionViewSet(viewsets.GenericViewSet):
+    """
+    Chunked and direct media uploads, for files too large to send in one
+    request. POST opens a session; chunked uploads then PUT each part to
+    chunk/ with a Content-Range header, direct uploads send the file to the
+    returned direct_upload url. POST complete/ hands the file to a worker,
+    and GET shows its progress and, once done, the media_id created.
+    """
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAuthenticated]
+    parser_classes = [JSONParser]
+    queryset = UploadSession.objects.all()
+
+    def get_queryset(self):
+        return self.queryset.filter(user=self.request.user)
+
+    def create(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        session = uploads.start(request.user, **serializer.validated_data)
+        data = dict(self.get_serializer(session).data, chunk_size=settings.MEDIA_UPLOAD_CHUNK_SIZE)
+        if session.direct:
+            data['direct_upload'] = get_backend().direct_upload(session.public_id, session.resource_type)
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    def retrieve(self, request, pk=None):
+        return Response(self.get_serializer(self.get_object()).data)
+
+    @extend_schema(
+        request={'application/octet-stream': OpenApiTypes.BINARY},
+        parameters=[OpenApiParameter(
+            'Content-Range', OpenApiTypes.STR, OpenApiParameter.HEADER, required=True,
+            description="bytes <first>-<last>/<total>",
+        )],
+    )
+    @action(detail=True, methods=['put'])
+    def chunk(self, request, pk=None):
+        session = self.get_object()
+        match = re.fullmatch(r'bytes (\d+)-(\d+)/(\d+|\*)', request.headers.get('Content-Range', '').strip())
+        if not match:
+            return Response(
+                {"detail": "Content-Range header must read 'bytes <first>-<last>/<total>'"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        first, last = int(match.group(1)), int(match.group(2))
+        if last < first or int(request.headers.get('Content-Length') or 0) != last - first + 1:
+            return Response(
+                {"detail": "Content-Range does not match the length of the body"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            session = uploads.receive_chunk(session.pk, first, last - first + 1, request.stream)
+        except uploads.OffsetMismatch as error:
+            return Response(
+                {"detail": str(error), "received_bytes": error.received_bytes},
+                status=status.HTTP_409_CONFLICT
+            )
+        except uploads.UploadError as error:
+            return Response({"detail": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"received_bytes": session.received_bytes, "total_size": session.total_size})
+
+    @extend_schema(request=None)
+    @action(detail=True, methods=['post'])
+    def complete(self, request, pk=None):
+        session = self.get_object()
+        try:
+            session = uploads.complete(session.pk)
+        except uploads.UploadError as error:
+            return Response({"detail": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.get_serializer(session).data, status=status.HTTP_202_ACCEPTED)
@@ -0,0 +1,97 @@
+"""
+Short-lived response cache for dashboard actions.
+
+Cache keys combine the action, the caller's visibility scope, the query
+parameters and the current version of every tag the action depends on.
+Invalidating a tag bumps its version, so all entries built from the old
+version simply stop being read and expire on their own.
+"""
+import hashlib
+import logging
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+logger = logging.getLogger(__name__)
+
+
+TAG_INCIDENTS = 'incidents'
+TAG_RESOURCES = 'resources'
+TAG_EVENTS = 'events'
+
+# Tag versions outlive any cached response that refers to them
+TAG_VERSION_TIMEOUT = 60 * 60 * 24
+
+
+def _tag_key(tag):
+    return f'dashboard:tag:{tag}'
+
+
+def tag_versions(tags):
+    keys = {tag: _tag_key(tag) for tag in tags}
+    found = cache.get_many(list(keys.values()))
+    versions = {}
+    for tag, key in keys.items():
+        version = found.get(key)
+        if version is None:
+            version = 1
+            cache.add(key, version, TAG_VERSION_TIMEOUT)
+        versions[tag] = version
+    return versions
+
+
+def invalidate(*tags):
+    """Expire every cached dashboard response that depends on any of the tags"""
+    for tag in tags:
+        key = _tag_key(tag)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # No version stored yet, nothing cached against this tag
+            cache.set(key, 2, TAG_VERSION_TIMEOUT)
+
+
+def cache_key(action, scope, params, versions):
+    query = '&'.join(
+        f'{name}={",".join(sorted(params.getlist(name)))}' for name in sorted(params)
+    )
+    tags = ','.join(f'{tag}:{version}' for tag, version in sorted(versions.items()))
+    digest = hashlib.md5(f'{query}|{tags}'.encode()).hexdigest()
+    return f'dashboard:{action}:{scope}:{digest}'
+
+
+def global_scope(request):
+    return 'global'
+
+
+def user_scope(request):
+    return f'user:{request.user.pk}'
+
+
+def cached_action(*tags, scope=global_scope, timeout=None):
+    """
+    Cache a successful ViewSet action response for a few seconds.
+
+    scope(request) returns a string identifying who may share the entry,
+    e.g. 'global' for data that is the same for every dashboard user.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            key = cache_key(method.__name__, scope(request), request.query_params, tag_versions(tags))
+            data = cache.get(key)
+            if data is not None:
+                return Response(data)
+
+            response = method(self, request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                cache.set(
+                    key,
+                    response.data,
+                    timeout if timeout is not None else settings.DASHBOARD_CACHE_TIMEOUT
+                )
+            return response
+        return wrapper
+    return decorator
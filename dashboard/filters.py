@@ -1,5 +1,4 @@
 # from django.contrib.gis.measure import D
-from django.db.models import F, ExpressionWrapper, DurationField
 from django.utils import timezone
 from datetime import datetime, timedelta
 from django_filters import rest_framework as filters
@@ -7,6 +6,20 @@ from incident.models import Incident
 
 
 
+def date_range_bounds(value):
+    """Return the (start_date, end_date) covered by a date_range choice"""
+    today = datetime.now().date()
+    quarter_start = today.replace(day=1, month=(today.month - 1) // 3 * 3 + 1)
+    date_ranges = {
+        'today': (today, today + timedelta(days=1)),
+        'week': (today - timedelta(days=today.weekday()), today + timedelta(days=7)),
+        'month': (today.replace(day=1), (today.replace(day=1) + timedelta(days=32)).replace(day=1)),
+        'quarter': (quarter_start, (quarter_start + timedelta(days=92)).replace(day=1)),
+        'year': (today.replace(month=1, day=1),
+                today.replace(month=12, day=31))
+    }
+    return date_ranges.get(value, (None, None))
+
 
 class DashboardIncidentFilter(filters.FilterSet):
     date_range = filters.ChoiceFilter(
@@ -28,28 +41,13 @@ class DashboardIncidentFilter(filters.FilterSet):
     )
     
     def filter_by_date_range(self, queryset, name, value):
-        today = datetime.now().date()
-        date_ranges = {
-            'today': (today, today + timedelta(days=1)),
-            'week': (today - timedelta(days=today.weekday()), today + timedelta(days=7)),
-            'month': (today.replace(day=1), (today.replace(day=1) + timedelta(days=32)).replace(day=1)),
-            'quarter': (today.replace(day=1, month=(today.month - 1) // 3 * 3 + 1),
-                       today.replace(day=1, month=((today.month - 1) // 3 + 1) * 3 + 1)),
-            'year': (today.replace(month=1, day=1),
-                    today.replace(month=12, day=31))
-        }
-        start_date, end_date = date_ranges.get(value, (None, None))
+        start_date, end_date = date_range_bounds(value)
         if start_date and end_date:
             return queryset.filter(created_at__range=[start_date, end_date])
         return queryset
 
     def filter_by_response_time(self, queryset, name, value):
-        return queryset.annotate(
-            response_time=ExpressionWrapper(
-                F('first_response_at') - F('created_at'),
-                output_field=DurationField()
-            )
-        ).filter(response_time__gt=timedelta(minutes=value))
+        return queryset.filter(response_time_minutes__gt=value)
 
     # def filter_by_distance(self, queryset, name, value):
     #     user_location = self.request.user.get_location()
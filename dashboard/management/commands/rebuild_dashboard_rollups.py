@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from dashboard import rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild every dashboard rollup bucket from the incident, resource and "
+        "volunteer tables, e.g. after restoring a backup or a bulk import"
+    )
+
+    def handle(self, *args, **options):
+        refreshed = rollups.rebuild_all()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {refreshed} dashboard rollup buckets"))
@@ -0,0 +1,76 @@
+# Generated by Django 4.2.16 on 2026-10-18 10:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('incident', '0002_incident_response_timestamps'),
+        ('cddpresources', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VolunteerActivityRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('HOUR', 'Hour'), ('DAY', 'Day')], max_length=4)),
+                ('bucket_start', models.DateTimeField()),
+                ('assignment_count', models.IntegerField(default=0)),
+                ('volunteer_count', models.IntegerField(default=0)),
+                ('completed_count', models.IntegerField(default=0)),
+                ('hours_contributed', models.FloatField(default=0)),
+                ('refreshed_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('period', 'bucket_start')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ResourceUtilizationRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('HOUR', 'Hour'), ('DAY', 'Day')], max_length=4)),
+                ('bucket_start', models.DateTimeField()),
+                ('request_count', models.IntegerField(default=0)),
+                ('quantity_requested', models.BigIntegerField(default=0)),
+                ('quantity_allocated', models.BigIntegerField(default=0)),
+                ('refreshed_at', models.DateTimeField(auto_now=True)),
+                ('resource', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='cddpresources.resource')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period', 'bucket_start'], name='dashboard_r_period_b992e0_idx')],
+                'unique_together': {('period', 'bucket_start', 'resource')},
+            },
+        ),
+        migrations.CreateModel(
+            name='IncidentRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('HOUR', 'Hour'), ('DAY', 'Day')], max_length=4)),
+                ('bucket_start', models.DateTimeField()),
+                ('status', models.CharField(choices=[('REPORTED', 'Reported'), ('VERIFIED', 'Verified'), ('RESPONDING', 'Responding'), ('IN_PROGRESS', 'In Progress'), ('RESOLVED', 'Resolved'), ('CLOSED', 'Closed'), ('INVALID', 'Invalid')], max_length=20)),
+                ('priority', models.CharField(choices=[('LOW', 'Low'), ('MEDIUM', 'Medium'), ('HIGH', 'High'), ('CRITICAL', 'Critical'), ('EMERGENCY', 'Emergency')], max_length=20)),
+                ('incident_count', models.IntegerField(default=0)),
+                ('resolved_count', models.IntegerField(default=0)),
+                ('responded_count', models.IntegerField(default=0)),
+                ('response_minutes_total', models.BigIntegerField(default=0)),
+                ('response_minutes_max', models.IntegerField(blank=True, null=True)),
+                ('responses_under_1h', models.IntegerField(default=0)),
+                ('responses_1h_to_3h', models.IntegerField(default=0)),
+                ('responses_3h_to_6h', models.IntegerField(default=0)),
+                ('responses_6h_to_12h', models.IntegerField(default=0)),
+                ('responses_over_12h', models.IntegerField(default=0)),
+                ('refreshed_at', models.DateTimeField(auto_now=True)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='incident.incidentcategory')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period', 'bucket_start'], name='dashboard_i_period_12d758_idx')],
+                'unique_together': {('period', 'bucket_start', 'category', 'status', 'priority')},
+            },
+        ),
+    ]
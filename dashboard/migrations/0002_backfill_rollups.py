@@ -0,0 +1,23 @@
+from django.db import migrations
+
+
+def backfill_rollups(apps, schema_editor):
+    """
+    Fill the rollup tables from the incidents and requests that existed before
+    them. The bucket queries live in dashboard.rollups and use the current
+    models, which match the schema at this point in the migration graph.
+    """
+    from dashboard import rollups
+    rollups.rebuild_all()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0001_initial'),
+        ('incident', '0008_media_asset_swap'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,85 @@
 from django.db import models
+from incident.models import Incident, IncidentCategory
+from cddpresources.models import Resource
 
 # Create your models here.
+
+
+PERIOD_CHOICES = [
+    ('HOUR', 'Hour'),
+    ('DAY', 'Day'),
+]
+
+
+class IncidentRollup(models.Model):
+    """Incident counts and response-time histogram per period, category, status and priority"""
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    bucket_start = models.DateTimeField()
+    category = models.ForeignKey(IncidentCategory, on_delete=models.CASCADE, related_name='+')
+    status = models.CharField(max_length=20, choices=Incident.STATUS_CHOICES)
+    priority = models.CharField(max_length=20, choices=Incident.PRIORITY_CHOICES)
+
+    incident_count = models.IntegerField(default=0)
+    resolved_count = models.IntegerField(default=0)
+    responded_count = models.IntegerField(default=0)
+    response_minutes_total = models.BigIntegerField(default=0)
+    response_minutes_max = models.IntegerField(null=True, blank=True)
+
+    # Response-time histogram, counted over responded incidents
+    responses_under_1h = models.IntegerField(default=0)
+    responses_1h_to_3h = models.IntegerField(default=0)
+    responses_3h_to_6h = models.IntegerField(default=0)
+    responses_6h_to_12h = models.IntegerField(default=0)
+    responses_over_12h = models.IntegerField(default=0)
+
+    refreshed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['period', 'bucket_start', 'category', 'status', 'priority']
+        indexes = [
+            models.Index(fields=['period', 'bucket_start']),
+        ]
+
+    def __str__(self):
+        return f"{self.period} {self.bucket_start:%Y-%m-%d %H:%M} {self.category_id} {self.status}/{self.priority}"
+
+
+class ResourceUtilizationRollup(models.Model):
+    """Requested and allocated resource quantities per period and resource"""
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    bucket_start = models.DateTimeField()
+    resource = models.ForeignKey(Resource, on_delete=models.CASCADE, related_name='+')
+
+    request_count = models.IntegerField(default=0)
+    quantity_requested = models.BigIntegerField(default=0)
+    quantity_allocated = models.BigIntegerField(default=0)
+
+    refreshed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['period', 'bucket_start', 'resource']
+        indexes = [
+            models.Index(fields=['period', 'bucket_start']),
+        ]
+
+    def __str__(self):
+        return f"{self.period} {self.bucket_start:%Y-%m-%d %H:%M} {self.resource_id}"
+
+
+class VolunteerActivityRollup(models.Model):
+    """Volunteer assignments and contributed hours per period"""
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    bucket_start = models.DateTimeField()
+
+    assignment_count = models.IntegerField(default=0)
+    volunteer_count = models.IntegerField(default=0)
+    completed_count = models.IntegerField(default=0)
+    hours_contributed = models.FloatField(default=0)
+
+    refreshed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['period', 'bucket_start']
+
+    def __str__(self):
+        return f"{self.period} {self.bucket_start:%Y-%m-%d %H:%M}"
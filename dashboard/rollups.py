@@ -0,0 +1,302 @@
+"""
+Pre-aggregated dashboard rollups.
+
+Each rollup row summarises one hourly or daily bucket. Buckets are rebuilt
+from the source tables whenever a row inside them changes (post-save hooks)
+and periodically by the ``refresh_dashboard_rollups`` Celery task, which
+picks up bulk updates that bypass signals. Rebuilding a single bucket only
+touches the rows created inside it, so the cost does not grow with history.
+"""
+import logging
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Count, Sum, Max, Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from incident.aggregates import RESPONSE_TIME_BUCKETS, response_range_q
+from incident.models import Incident, IncidentResource, IncidentVolunteer
+from .models import IncidentRollup, ResourceUtilizationRollup, VolunteerActivityRollup
+
+logger = logging.getLogger(__name__)
+
+
+PERIODS = ('HOUR', 'DAY')
+
+# Changes older than this are picked up by the beat task from updated_at
+REFRESH_LOOKBACK = timedelta(hours=2)
+
+
+def bucket_bounds(period, moment):
+    """Return (start, end) of the bucket containing moment, in the current timezone"""
+    local = timezone.localtime(moment)
+    if period == 'HOUR':
+        start = local.replace(minute=0, second=0, microsecond=0)
+        return start, start + timedelta(hours=1)
+    start = local.replace(hour=0, minute=0, second=0, microsecond=0)
+    return start, start + timedelta(days=1)
+
+
+def _replace_rows(model, stale, rows):
+    with transaction.atomic():
+        stale.delete()
+        model.objects.bulk_create(rows, ignore_conflicts=True)
+
+
+# Rebuilding individual buckets
+
+def refresh_incident_bucket(period, moment, category_id):
+    start, end = bucket_bounds(period, moment)
+    aggregates = {
+        'incident_count': Count('id'),
+        'resolved_count': Count('resolved_at'),
+        'responded_count': Count('response_time_minutes'),
+        'response_minutes_total': Coalesce(Sum('response_time_minutes'), 0),
+        'response_minutes_max': Max('response_time_minutes'),
+    }
+    for label, lower, upper in RESPONSE_TIME_BUCKETS:
+        aggregates[f'responses_{label}'] = Count('id', filter=response_range_q(lower, upper))
+
+    grouped = Incident.objects.filter(
+        category_id=category_id,
+        created_at__gte=start,
+        created_at__lt=end
+    ).order_by().values('status', 'priority').annotate(**aggregates)
+
+    rows = [
+        IncidentRollup(period=period, bucket_start=start, category_id=category_id, **values)
+        for values in grouped
+    ]
+    stale = IncidentRollup.objects.filter(period=period, bucket_start=start, category_id=category_id)
+    _replace_rows(IncidentRollup, stale, rows)
+
+
+def refresh_resource_bucket(period, moment, resource_id):
+    start, end = bucket_bounds(period, moment)
+    totals = IncidentResource.objects.filter(
+        resource_id=resource_id,
+        requested_at__gte=start,
+        requested_at__lt=end
+    ).aggregate(
+        request_count=Count('id'),
+        quantity_requested=Coalesce(Sum('quantity_requested'), 0),
+        quantity_allocated=Coalesce(Sum('quantity_allocated'), 0),
+    )
+
+    rows = []
+    if totals['request_count']:
+        rows.append(ResourceUtilizationRollup(period=period, bucket_start=start, resource_id=resource_id, **totals))
+    stale = ResourceUtilizationRollup.objects.filter(period=period, bucket_start=start, resource_id=resource_id)
+    _replace_rows(ResourceUtilizationRollup, stale, rows)
+
+
+def refresh_volunteer_bucket(period, moment):
+    start, end = bucket_bounds(period, moment)
+    totals = IncidentVolunteer.objects.filter(
+        assigned_at__gte=start,
+        assigned_at__lt=end
+    ).aggregate(
+        assignment_count=Count('id'),
+        volunteer_count=Count('volunteer', distinct=True),
+        completed_count=Count('completed_at'),
+        hours_contributed=Coalesce(Sum('hours_contributed'), 0.0),
+    )
+
+    rows = []
+    if totals['assignment_count']:
+        rows.append(VolunteerActivityRollup(period=period, bucket_start=start, **totals))
+    stale = VolunteerActivityRollup.objects.filter(period=period, bucket_start=start)
+    _replace_rows(VolunteerActivityRollup, stale, rows)
+
+
+# Refreshing every bucket affected by a set of source rows
+
+def refresh_incident_buckets(keys):
+    """keys: iterable of (created_at, category_id)"""
+    buckets = {
+        (period, bucket_bounds(period, created_at)[0], category_id)
+        for created_at, category_id in keys
+        for period in PERIODS
+    }
+    for period, start, category_id in buckets:
+        refresh_incident_bucket(period, start, category_id)
+    return len(buckets)
+
+
+def refresh_resource_buckets(keys):
+    """keys: iterable of (requested_at, resource_id)"""
+    buckets = {
+        (period, bucket_bounds(period, requested_at)[0], resource_id)
+        for requested_at, resource_id in keys
+        for period in PERIODS
+    }
+    for period, start, resource_id in buckets:
+        refresh_resource_bucket(period, start, resource_id)
+    return len(buckets)
+
+
+def refresh_volunteer_buckets(moments):
+    buckets = {(period, bucket_bounds(period, moment)[0]) for moment in moments for period in PERIODS}
+    for period, start in buckets:
+        refresh_volunteer_bucket(period, start)
+    return len(buckets)
+
+
+def _rolled_up_categories(keys):
+    """
+    (bucket_start, category_id) of the rollups sharing a bucket with the
+    keys, so an incident moved to another category without signals is
+    dropped from the old category's buckets too
+    """
+    starts = {bucket_bounds(period, created_at)[0] for created_at, _ in keys for period in PERIODS}
+    if not starts:
+        return []
+    return list(
+        IncidentRollup.objects.filter(bucket_start__in=starts)
+        .order_by().values_list('bucket_start', 'category_id').distinct()
+    )
+
+
+def refresh_recent(lookback=REFRESH_LOOKBACK):
+    """Rebuild the buckets of every row created or changed within the lookback window"""
+    since = timezone.now() - lookback
+    changed = list(
+        Incident.objects.filter(updated_at__gte=since).values_list('created_at', 'category_id').distinct()
+    )
+    refreshed = refresh_incident_buckets(changed + _rolled_up_categories(changed))
+    refreshed += refresh_resource_buckets(
+        IncidentResource.objects.filter(
+            Q(requested_at__gte=since) | Q(allocated_at__gte=since) | Q(returned_at__gte=since)
+        ).values_list('requested_at', 'resource_id').distinct()
+    )
+    refreshed += refresh_volunteer_buckets(
+        IncidentVolunteer.objects.filter(
+            Q(assigned_at__gte=since) | Q(accepted_at__gte=since) | Q(completed_at__gte=since)
+        ).values_list('assigned_at', flat=True)
+    )
+    logger.info(f"Refreshed {refreshed} dashboard rollup buckets")
+    return refreshed
+
+
+def rebuild_all():
+    """Rebuild every bucket from scratch, e.g. after the rollup tables are first created"""
+    refreshed = refresh_incident_buckets(
+        Incident.objects.values_list('created_at', 'category_id').iterator()
+    )
+    refreshed += refresh_resource_buckets(
+        IncidentResource.objects.values_list('requested_at', 'resource_id').iterator()
+    )
+    refreshed += refresh_volunteer_buckets(
+        IncidentVolunteer.objects.values_list('assigned_at', flat=True).iterator()
+    )
+    logger.info(f"Rebuilt {refreshed} dashboard rollup buckets")
+    return refreshed
+
+
+# Reading rollups
+
+def incident_rollups(period='DAY', start=None, end=None, **filters):
+    queryset = IncidentRollup.objects.filter(period=period, **filters)
+    if start is not None:
+        queryset = queryset.filter(bucket_start__gte=start)
+    if end is not None:
+        queryset = queryset.filter(bucket_start__lt=end)
+    return queryset
+
+
+def _average(total, count):
+    return total / count if count else None
+
+
+def summarize_incidents(rollups):
+    """Totals, per-status/priority breakdowns and the response-time histogram"""
+    histogram_fields = {label: f'responses_{label}' for label, _, _ in RESPONSE_TIME_BUCKETS}
+    totals = rollups.aggregate(
+        incident_count=Coalesce(Sum('incident_count'), 0),
+        responded_count=Coalesce(Sum('responded_count'), 0),
+        response_minutes_total=Coalesce(Sum('response_minutes_total'), 0),
+        **{field: Coalesce(Sum(field), 0) for field in histogram_fields.values()}
+    )
+
+    def breakdown(field):
+        rows = rollups.order_by().values(field).annotate(
+            count=Sum('incident_count'),
+            responded=Sum('responded_count'),
+            minutes=Sum('response_minutes_total'),
+        ).order_by(field)
+        return [
+            {field: row[field], 'count': row['count'], 'avg_response_time': _average(row['minutes'], row['responded'])}
+            for row in rows
+        ]
+
+    return {
+        'total_incidents': totals['incident_count'],
+        'incidents_by_status': breakdown('status'),
+        'incidents_by_priority': breakdown('priority'),
+        'average_response_time': _average(totals['response_minutes_total'], totals['responded_count']),
+        'response_time_distribution': {
+            label: totals[field] for label, field in histogram_fields.items()
+        },
+    }
+
+
+def category_performance(rollups):
+    """Average response time and resolution rate per category"""
+    rows = rollups.order_by().values('category', 'category__name').annotate(
+        total=Sum('incident_count'),
+        resolved=Sum('resolved_count'),
+        responded=Sum('responded_count'),
+        minutes=Sum('response_minutes_total'),
+        max_response=Max('response_minutes_max'),
+    ).order_by('category__name')
+    return [
+        {
+            'category': row['category'],
+            'category_name': row['category__name'],
+            'total_incidents': row['total'],
+            'average_response_time': _average(row['minutes'], row['responded']),
+            'max_response_time': row['max_response'],
+            'resolution_rate': _average(row['resolved'] * 100.0, row['total']) or 0,
+        }
+        for row in rows
+    ]
+
+
+def resource_utilization(period='DAY', start=None):
+    queryset = ResourceUtilizationRollup.objects.filter(period=period)
+    if start is not None:
+        queryset = queryset.filter(bucket_start__gte=start)
+    rows = queryset.order_by().values('resource', 'resource__name').annotate(
+        requests=Sum('request_count'),
+        total_requested=Sum('quantity_requested'),
+        total_allocated=Sum('quantity_allocated'),
+    ).order_by('resource__name')
+    return [
+        {
+            'resource': row['resource'],
+            'resource__name': row['resource__name'],
+            'request_count': row['requests'],
+            'total_requested': row['total_requested'],
+            'total_allocated': row['total_allocated'],
+            'utilization_rate': _average(row['total_allocated'] * 100.0, row['total_requested']),
+        }
+        for row in rows
+    ]
+
+
+def volunteer_activity(period='DAY', start=None):
+    queryset = VolunteerActivityRollup.objects.filter(period=period)
+    if start is not None:
+        queryset = queryset.filter(bucket_start__gte=start)
+    totals = queryset.aggregate(
+        assignments=Coalesce(Sum('assignment_count'), 0),
+        completed=Coalesce(Sum('completed_count'), 0),
+        hours=Coalesce(Sum('hours_contributed'), 0.0),
+    )
+    return {
+        'total_assignments': totals['assignments'],
+        'completed_assignments': totals['completed'],
+        'completion_rate': _average(totals['completed'] * 100.0, totals['assignments']) or 0,
+        'total_hours': totals['hours'],
+        'average_hours_per_assignment': _average(totals['hours'], totals['assignments']),
+    }
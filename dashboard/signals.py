@@ -0,0 +1,70 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+
+from incident.models import Incident, IncidentResource, IncidentVolunteer
+from incident.signals import incidents_written, resources_written
+from cddpresources.models import Resource
+from event.models import Event
+from . import rollups
+from .cache import invalidate, TAG_INCIDENTS, TAG_RESOURCES, TAG_EVENTS
+
+
+# Buckets are rebuilt after commit so the rollup reads the committed rows
+# and a rolled-back write never touches the rollup tables. Cached dashboard
+# responses are invalidated once the rollups are up to date.
+
+@receiver(pre_save, sender=Incident)
+def remember_incident_category(sender, instance, raw=False, **kwargs):
+    # An incident moved to another category must also leave its old buckets
+    if raw or instance._state.adding:
+        return
+    instance._rollup_category_before = (
+        Incident.objects.filter(pk=instance.pk).values_list('category_id', flat=True).first()
+    )
+
+
+@receiver([post_save, post_delete], sender=Incident)
+def refresh_incident_rollups(sender, instance, **kwargs):
+    keys = {(instance.created_at, instance.category_id)}
+    previous_category = instance.__dict__.pop('_rollup_category_before', None)
+    if previous_category is not None:
+        keys.add((instance.created_at, previous_category))
+    transaction.on_commit(lambda: rollups.refresh_incident_buckets(keys))
+    transaction.on_commit(lambda: invalidate(TAG_INCIDENTS))
+
+
+@receiver([post_save, post_delete], sender=IncidentResource)
+def refresh_resource_rollups(sender, instance, **kwargs):
+    keys = [(instance.requested_at, instance.resource_id)]
+    transaction.on_commit(lambda: rollups.refresh_resource_buckets(keys))
+    transaction.on_commit(lambda: invalidate(TAG_RESOURCES))
+
+
+@receiver(incidents_written)
+def refresh_written_incident_rollups(sender, keys, **kwargs):
+    transaction.on_commit(lambda: rollups.refresh_incident_buckets(keys))
+    transaction.on_commit(lambda: invalidate(TAG_INCIDENTS))
+
+
+@receiver(resources_written)
+def refresh_written_resource_rollups(sender, keys, **kwargs):
+    if keys:
+        transaction.on_commit(lambda: rollups.refresh_resource_buckets(keys))
+    transaction.on_commit(lambda: invalidate(TAG_RESOURCES))
+
+
+@receiver([post_save, post_delete], sender=IncidentVolunteer)
+def refresh_volunteer_rollups(sender, instance, **kwargs):
+    moments = [instance.assigned_at]
+    transaction.on_commit(lambda: rollups.refresh_volunteer_buckets(moments))
+
+
+@receiver([post_save, post_delete], sender=Resource)
+def invalidate_resource_cache(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate(TAG_RESOURCES))
+
+
+@receiver([post_save, post_delete], sender=Event)
+def invalidate_event_cache(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate(TAG_EVENTS))
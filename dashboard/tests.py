@@ -1,3 +1,181 @@
-from django.test import TestCase
+import importlib
+from datetime import timedelta
+from django.apps import apps
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory, APITestCase, force_authenticate
+from rest_framework.views import APIView
 
-# Create your tests here.
+from cddp.testing import create_admin, create_category, create_incident, create_reporter, create_user
+from cddpresources.models import Resource, ResourceType
+from incident.models import Incident, IncidentResource
+from incident.signals import incidents_written
+from . import rollups
+from .cache import cached_action, invalidate, tag_versions, user_scope, TAG_EVENTS, TAG_INCIDENTS, TAG_RESOURCES
+from .models import IncidentRollup, ResourceUtilizationRollup
+
+
+class IncidentRollupTest(APITestCase):
+    """Rollup buckets follow incident changes, including moves between categories"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.reporter = create_reporter()
+        cls.flood = create_category()
+        cls.fire = create_category(name='Fire', description='Fire')
+
+    def setUp(self):
+        cache.clear()
+
+    def create(self, category, response_minutes=None, resolved=False):
+        with self.captureOnCommitCallbacks(execute=True):
+            incident = create_incident(category=category, reporter=self.reporter)
+            if response_minutes is not None:
+                incident.record_status_change(
+                    'RESPONDING', incident.created_at + timedelta(minutes=response_minutes)
+                )
+            if resolved:
+                incident.record_status_change('RESOLVED', incident.created_at + timedelta(hours=12))
+            incident.save()
+        return incident
+
+    def counts(self, period='DAY'):
+        rows = IncidentRollup.objects.filter(period=period).values_list('category__name', 'incident_count')
+        totals = {}
+        for name, count in rows:
+            totals[name] = totals.get(name, 0) + count
+        return totals
+
+    def test_rollups_summarise_incidents(self):
+        self.create(self.flood, response_minutes=30, resolved=True)
+        self.create(self.flood, response_minutes=90)
+        self.create(self.fire)
+        self.assertEqual(self.counts('HOUR'), {'Flood': 2, 'Fire': 1})
+
+        summary = rollups.summarize_incidents(rollups.incident_rollups('DAY'))
+        self.assertEqual(summary['total_incidents'], 3)
+        self.assertEqual(summary['average_response_time'], 60)
+        self.assertEqual(summary['response_time_distribution']['under_1h'], 1)
+        self.assertEqual(summary['response_time_distribution']['1h_to_3h'], 1)
+
+        self.client.force_authenticate(self.admin)
+        response = self.client.get(reverse('incident-resorce-performance-metrics'))
+        self.assertEqual(
+            [(row['category_name'], row['total_incidents'], row['resolution_rate'])
+             for row in response.data['resolution_rates']],
+            [('Fire', 1, 0), ('Flood', 2, 50.0)]
+        )
+
+    def test_moving_an_incident_leaves_its_old_category(self):
+        incident = self.create(self.flood)
+        with self.captureOnCommitCallbacks(execute=True):
+            incident.category = self.fire
+            incident.save()
+        self.assertEqual(self.counts('HOUR'), {'Fire': 1})
+        self.assertEqual(self.counts('DAY'), {'Fire': 1})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            incident.delete()
+        self.assertEqual(self.counts(), {})
+
+    def test_refresh_catches_moves_that_bypass_signals(self):
+        incident = self.create(self.flood)
+        Incident.objects.filter(pk=incident.pk).update(category=self.fire, updated_at=timezone.now())
+        self.assertEqual(self.counts(), {'Flood': 1})
+
+        rollups.refresh_recent()
+        self.assertEqual(self.counts(), {'Fire': 1})
+        self.assertEqual(self.counts('HOUR'), {'Fire': 1})
+
+    def test_bulk_writes_are_refreshed_through_incident_signals(self):
+        incident = self.create(self.flood)
+        Incident.objects.filter(pk=incident.pk).update(category=self.fire)
+        with self.captureOnCommitCallbacks(execute=True):
+            incidents_written.send(sender=Incident, keys={
+                (incident.created_at, self.flood.pk), (incident.created_at, self.fire.pk),
+            })
+        self.assertEqual(self.counts(), {'Fire': 1})
+
+    def test_migration_backfills_existing_incidents(self):
+        self.create(self.flood)
+        self.create(self.fire)
+        IncidentRollup.objects.all().delete()
+
+        migration = importlib.import_module('dashboard.migrations.0002_backfill_rollups')
+        migration.backfill_rollups(apps, None)
+        self.assertEqual(self.counts(), {'Flood': 1, 'Fire': 1})
+        self.assertEqual(self.counts('HOUR'), {'Flood': 1, 'Fire': 1})
+
+    def test_resource_buckets(self):
+        incident = self.create(self.flood)
+        resource = Resource.objects.create(
+            name='Sandbags', resource_type=ResourceType.objects.create(name='Supplies'),
+            description='Sandbags', unit='bag', quantity_available=10
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            for quantity in (3, 4):
+                IncidentResource.objects.create(incident=incident, resource=resource, quantity_requested=quantity)
+
+        rollup = ResourceUtilizationRollup.objects.get(period='DAY')
+        self.assertEqual((rollup.request_count, rollup.quantity_requested), (2, 7))
+        self.assertEqual(rollups.resource_utilization()[0]['total_requested'], 7)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CachedActionTest(TestCase):
+    """Cached responses are shared per scope and dropped when a tag they depend on changes"""
+
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+        self.status = 200
+
+        test = self
+
+        class Actions:
+            @cached_action(TAG_INCIDENTS, TAG_RESOURCES, scope=user_scope)
+            def summary(self, request):
+                test.calls += 1
+                return Response({'calls': test.calls}, status=test.status)
+
+        self.actions = Actions()
+        self.alice, self.bob = create_user('alice@example.com'), create_user('bob@example.com')
+
+    def get(self, user=None, **params):
+        request = APIRequestFactory().get('/summary/', params)
+        force_authenticate(request, user or self.alice)
+        return self.actions.summary(APIView().initialize_request(request))
+
+    def test_responses_are_cached_per_scope_and_query(self):
+        self.assertEqual(self.get().data, {'calls': 1})
+        self.assertEqual(self.get().data, {'calls': 1})
+        self.assertEqual(self.get(period='DAY').data, {'calls': 2})
+        self.assertEqual(self.get(self.bob).data, {'calls': 3})
+
+    def test_invalidating_a_tag_expires_its_responses(self):
+        self.get()
+        invalidate(TAG_EVENTS)
+        self.assertEqual(self.get().data, {'calls': 1})
+        invalidate(TAG_RESOURCES)
+        self.assertEqual(self.get().data, {'calls': 2})
+
+    def test_errors_are_not_cached(self):
+        self.status = 400
+        self.get()
+        self.status = 200
+        self.assertEqual(self.get().data, {'calls': 2})
+
+    def test_saving_a_resource_invalidates_its_tag(self):
+        before = tag_versions([TAG_RESOURCES, TAG_INCIDENTS])
+        with self.captureOnCommitCallbacks(execute=True):
+            Resource.objects.create(
+                name='Sandbags', resource_type=ResourceType.objects.create(name='Supplies'),
+                description='Sandbags', unit='bag', quantity_available=10
+            )
+        after = tag_versions([TAG_RESOURCES, TAG_INCIDENTS])
+        self.assertEqual(after[TAG_RESOURCES], before[TAG_RESOURCES] + 1)
+        self.assertEqual(after[TAG_INCIDENTS], before[TAG_INCIDENTS])
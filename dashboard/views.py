@@ -1,95 +1,204 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from django.db.models import Count, Avg, Sum, F, Q, Max, ExpressionWrapper, DurationField
+from django.db.models import Count, Avg, Sum, F, Q, Max, Case, When
+from django.db.models.functions import Coalesce
 from django.utils import timezone
-from datetime import datetime, timedelta
+from datetime import datetime, time, timedelta
 from accounts.permissions import AdminPermission, SuperAdminPermission
-from .filters import DashboardIncidentFilter
+from .filters import DashboardIncidentFilter, date_range_bounds
+from . import rollups
+from .cache import cached_action, user_scope, TAG_INCIDENTS, TAG_RESOURCES, TAG_EVENTS
+from incident import aggregates, demand
 from incident.models import Incident, IncidentResource
 from volunteer.models import Volunteer
 from cddpresources.models import Resource, ResourceDonation
 from event.models import Event, EventVolunteer
 from reporters.models import Reporter
-from cddpresources.serializers import ResourceSerializer, ResourceDonationSerializer
+from cddpresources import forecast
+from cddpresources.serializers import ResourceSerializer, ResourceDonationSerializer, ResourceForecastQuerySerializer
 from event.serializers import EventSerializer, EventVolunteerSerializer
+from drf_spectacular.utils import extend_schema
+from drf_spectacular.types import OpenApiTypes
 
 
+def incident_scope(request):
+    # Responders only see incidents they are assigned to
+    if request.user.has_role('RESPONDER'):
+        return user_scope(request)
+    return 'global'
+
+
+def resource_scope(request):
+    # Non-staff users only see events they take part in
+    if request.user.is_staff:
+        return 'staff'
+    return user_scope(request)
+
 
 class DashboardViewSet(viewsets.ViewSet):
     permission_classes = [AdminPermission|SuperAdminPermission]
     filterset_class = DashboardIncidentFilter
 
+    # Filters the rollups cannot answer; these fall back to live queries
+    LIVE_ONLY_FILTERS = ('response_time_gt', 'reporter_credibility', 'is_sensitive', 'location_within')
+
     @action(detail=False, methods=['get'])
+    @cached_action(TAG_INCIDENTS, TAG_RESOURCES, scope=incident_scope)
     def incident_overview(self, request):
-        incidents = Incident.objects.all()
-        if request.user.has_role('RESPONDER'):
-            incidents = incidents.filter(assigned_responders=request.user.responder)
+        filterset = self.filterset_class(request.GET, queryset=Incident.objects.all(), request=request)
+        if not filterset.is_valid():
+            return Response(filterset.errors, status=status.HTTP_400_BAD_REQUEST)
 
-        filtered_incidents = self.filterset_class(
-            request.GET,
-            queryset=incidents,
-            request=request
-        ).qs
+        if request.user.has_role('RESPONDER') or any(
+            request.GET.get(param) not in (None, '') for param in self.LIVE_ONLY_FILTERS
+        ):
+            return Response(self._live_incident_overview(request, filterset))
 
+        summary = rollups.summarize_incidents(self._filtered_rollups(filterset.form.cleaned_data))
         return Response({
-            'total_incidents': filtered_incidents.count(),
-            'incidents_by_status': self._get_incidents_by_status(filtered_incidents),
-            'incidents_by_priority': self._get_incidents_by_priority(filtered_incidents),
-            'response_metrics': self._get_response_metrics(filtered_incidents),
+            'total_incidents': summary['total_incidents'],
+            'incidents_by_status': summary['incidents_by_status'],
+            'incidents_by_priority': summary['incidents_by_priority'],
+            'response_metrics': {
+                'average_response_time': summary['average_response_time'],
+                'overdue_incidents': self._get_overdue_count(filterset.qs),
+                'response_time_distribution': summary['response_time_distribution'],
+            },
             'resource_utilization': self._get_resource_utilization(),
             'volunteer_metrics': self._get_volunteer_metrics(),
             'reporter_metrics': self._get_reporter_metrics()
         })
+
+    def _live_incident_overview(self, request, filterset):
+        incidents = filterset.qs
+        if request.user.has_role('RESPONDER'):
+            incidents = incidents.filter(assigned_responders=request.user.responder)
+
+        metrics = aggregates.incident_metrics(incidents)
+        return {
+            'total_incidents': metrics['total'],
+            'incidents_by_status': aggregates.breakdown(metrics, 'status'),
+            'incidents_by_priority': aggregates.breakdown(metrics, 'priority'),
+            'response_metrics': {
+                'average_response_time': metrics['average_response_time'],
+                'overdue_incidents': self._get_overdue_count(incidents),
+                'response_time_distribution': aggregates.response_time_distribution(metrics)
+            },
+            'resource_utilization': self._get_resource_utilization(),
+            'volunteer_metrics': self._get_volunteer_metrics(),
+            'reporter_metrics': self._get_reporter_metrics()
+        }
+
+    def _filtered_rollups(self, cleaned_data):
+        filters = {}
+        if cleaned_data.get('status'):
+            filters['status'] = cleaned_data['status']
+        if cleaned_data.get('priority'):
+            filters['priority'] = cleaned_data['priority']
+        if cleaned_data.get('category'):
+            filters['category'] = cleaned_data['category']
+        if cleaned_data.get('severity_level') is not None:
+            filters['category__severity_level'] = cleaned_data['severity_level']
+
+        start, end = date_range_bounds(cleaned_data.get('date_range'))
+        return rollups.incident_rollups(
+            'DAY',
+            start=self._as_datetime(start),
+            end=self._as_datetime(end),
+            **filters
+        )
+
+    @staticmethod
+    def _as_datetime(value):
+        if value is None:
+            return None
+        return timezone.make_aware(datetime.combine(value, time.min))
+
+    @action(detail=False, methods=['get'])
+    def incident_trend(self, request):
+        """Hourly incident counts for the last 24 hours"""
+        since = rollups.bucket_bounds('HOUR', timezone.now() - timedelta(hours=23))[0]
+        trend = rollups.incident_rollups('HOUR', start=since).order_by().values(
+            'bucket_start'
+        ).annotate(
+            count=Sum('incident_count'),
+            resolved=Sum('resolved_count'),
+        ).order_by('bucket_start')
+        return Response(list(trend))
     
     @action(detail=False, methods=['get'])
+    @cached_action(TAG_RESOURCES, TAG_EVENTS, scope=resource_scope)
     def resource_overview(self, request):
         user = request.user
 
-        resource_count = Resource.objects.count()
-        resource_value = Resource.objects.aggregate(total_value=Sum('cost_per_unit'))['total_value'] or 0
+        resources = Resource.objects.aggregate(
+            count=Count('id'),
+            total_value=Sum('cost_per_unit')
+        )
+        donations = ResourceDonation.objects.aggregate(
+            count=Count('id'),
+            total_value=Sum('monetary_value')
+        )
 
-        if user.is_staff:
-            event_count = Event.objects.count()
-            event_volunteers = EventVolunteer.objects.count()
-            event_hours = EventVolunteer.objects.aggregate(total_hours=Sum('hours_logged'))['total_hours'] or 0
-        else:
-            event_count = Event.objects.filter(
+        events = Event.objects.all()
+        event_volunteers = EventVolunteer.objects.all()
+        if not user.is_staff:
+            events = events.filter(
                 Q(organizer=user) | Q(coordinators__in=[user]) | Q(event_volunteers__volunteer__user=user)
-            ).distinct().count()
-            event_volunteers = EventVolunteer.objects.filter(volunteer__user=user).count()
-            event_hours = EventVolunteer.objects.filter(volunteer__user=user).aggregate(total_hours=Sum('hours_logged'))['total_hours'] or 0
-
-        donation_count = ResourceDonation.objects.count()
-        donation_value = ResourceDonation.objects.aggregate(total_value=Sum('monetary_value'))['total_value'] or 0
+            ).distinct()
+            event_volunteers = event_volunteers.filter(volunteer__user=user)
+        volunteering = event_volunteers.aggregate(
+            count=Count('id'),
+            total_hours=Sum('hours_logged')
+        )
 
         return Response({
-            'resource_count': resource_count,
-            'resource_value': resource_value,
-            'event_count': event_count,
-            'event_volunteers': event_volunteers,
-            'event_hours': event_hours,
-            'donation_count': donation_count,
-            'donation_value': donation_value
+            'resource_count': resources['count'],
+            'resource_value': resources['total_value'] or 0,
+            'event_count': events.count(),
+            'event_volunteers': volunteering['count'],
+            'event_hours': volunteering['total_hours'] or 0,
+            'donation_count': donations['count'],
+            'donation_value': donations['total_value'] or 0
         })
 
     @action(detail=False, methods=['get'])
     def performance_metrics(self, request):
+        categories = rollups.category_performance(rollups.incident_rollups('DAY'))
         return Response({
-            'average_response_times': self._get_average_response_times(),
-            'resolution_rates': self._get_resolution_rates(),
-            'resource_efficiency': self._get_resource_efficiency(),
-            'volunteer_effectiveness': self._get_volunteer_effectiveness(),
+            'average_response_times': [
+                {
+                    'category': row['category'],
+                    'category_name': row['category_name'],
+                    'average_response_time': row['average_response_time'],
+                    'max_response_time': row['max_response_time'],
+                }
+                for row in categories
+            ],
+            'resolution_rates': [
+                {
+                    'category': row['category'],
+                    'category_name': row['category_name'],
+                    'total_incidents': row['total_incidents'],
+                    'resolution_rate': row['resolution_rate'],
+                }
+                for row in categories
+            ],
+            'resource_efficiency': rollups.resource_utilization('DAY'),
+            'volunteer_effectiveness': rollups.volunteer_activity('DAY'),
             'reporter_reliability': self._get_reporter_reliability()
         })
     
     @action(detail=False, methods=['get'])
+    @cached_action(TAG_RESOURCES)
     def top_resources(self, request):
         top_resources = Resource.objects.order_by('-quantity_available')[:10]
         serializer = ResourceSerializer(top_resources, many=True)
         return Response(serializer.data)
 
     @action(detail=False, methods=['get'])
+    @cached_action(TAG_EVENTS)
     def upcoming_events(self, request):
         upcoming_events = Event.objects.filter(start_date__gt=timezone.now()).order_by('start_date')[:10]
         serializer = EventSerializer(upcoming_events, many=True)
@@ -119,6 +228,7 @@ class DashboardViewSet(viewsets.ViewSet):
         return Response(serializer.data)
 
     @action(detail=False, methods=['get'])
+    @cached_action(TAG_INCIDENTS, TAG_RESOURCES)
     def geographical_distribution(self, request):
         incidents = Incident.objects.all()
         return Response({
@@ -127,27 +237,28 @@ class DashboardViewSet(viewsets.ViewSet):
             'response_coverage': self._get_response_coverage_map()
         })
 
-    def _get_incidents_by_status(self, incidents):
-        return incidents.values('status').annotate(
-            count=Count('id'),
-            avg_response_time=Avg('response_time')
+    def _get_overdue_count(self, incidents):
+        # Only open incidents with an estimate can be overdue, so this stays small
+        now = timezone.now()
+        open_incidents = incidents.exclude(
+            status__in=aggregates.FINISHED_STATUSES
+        ).filter(
+            estimated_resolution_time__isnull=False
+        ).values_list('created_at', 'estimated_resolution_time')
+        return sum(
+            1 for created_at, minutes in open_incidents
+            if now > created_at + timedelta(minutes=minutes)
         )
 
-    def _get_response_metrics(self, incidents):
-        return {
-            'average_response_time': incidents.exclude(
-                status__in=['REPORTED', 'VERIFIED']
-            ).aggregate(Avg('response_time'))['response_time__avg'],
-            'overdue_incidents': incidents.filter(is_overdue=True).count(),
-            'response_time_distribution': self._get_response_time_distribution(incidents)
-        }
-
     def _get_resource_utilization(self):
-        return IncidentResource.objects.values(
-            'resource__name'
-        ).annotate(
-            total_allocated=Sum('quantity_allocated'),
-            utilization_rate=F('quantity_allocated') * 100.0 / F('quantity_requested')
+        return demand.utilization()
+
+    def _get_reporter_metrics(self):
+        return Reporter.objects.aggregate(
+            total_reporters=Count('id'),
+            average_credibility=Avg('credibility_score'),
+            total_reports=Sum('reports_submitted'),
+            verified_reports=Sum('reports_verified')
         )
 
     def _get_volunteer_metrics(self):
@@ -158,96 +269,93 @@ class DashboardViewSet(viewsets.ViewSet):
         )
 
     def _get_reporter_reliability(self):
-        return Reporter.objects.values(
+        return Reporter.objects.filter(
+            reports_submitted__gt=0
+        ).values(
             'credibility_score'
         ).annotate(
             report_count=Count('id'),
             verification_rate=F('reports_verified') * 100.0 / F('reports_submitted')
         ).order_by('-credibility_score')
 
-    def _get_response_time_distribution(self, incidents):
-        ranges = [
-            ('under_1h', timedelta(hours=1)),
-            ('1h_to_3h', timedelta(hours=3)),
-            ('3h_to_6h', timedelta(hours=6)),
-            ('6h_to_12h', timedelta(hours=12)),
-            ('over_12h', None)
-        ]
-        
-        distribution = {}
-        for label, threshold in ranges:
-            if threshold:
-                count = incidents.filter(response_time__lt=threshold.total_seconds()/60).count()
-            else:
-                count = incidents.filter(response_time__gte=ranges[-2][1].total_seconds()/60).count()
-            distribution[label] = count
-            
-        return distribution
-
     def _get_incident_clusters(self, incidents):
         return incidents.values(
             'location'
         ).annotate(
             incident_count=Count('id'),
-            avg_response_time=Avg('response_time'),
+            avg_response_time=Avg('response_time_minutes'),
             resolution_rate=Count(
                 'id',
                 filter=Q(status__in=['RESOLVED', 'CLOSED'])
             ) * 100.0 / Count('id')
         )
 
+    @extend_schema(parameters=[ResourceForecastQuerySerializer], responses={200: OpenApiTypes.OBJECT})
     @action(detail=False, methods=['get'])
+    @cached_action(TAG_INCIDENTS, TAG_RESOURCES)
     def resource_forecast(self, request):
-        """Predict resource needs based on historical data and current trends"""
-        current_month = timezone.now().month
-        historical_data = IncidentResource.objects.filter(
-            incident__created_at__month=current_month
-        ).values(
-            'resource__name'
-        ).annotate(
-            avg_monthly_usage=Avg('quantity_requested'),
-            peak_usage=Max('quantity_requested'),
-            typical_duration=Avg(
-                ExpressionWrapper(
-                    F('returned_at') - F('allocated_at'),
-                    output_field=DurationField()
-                )
-            )
-        )
-        
-        return Response(historical_data)
+        """
+        Projected demand and stock of every resource over the coming days,
+        from smoothed daily demand and scheduled event requirements.
+        ?method=ewma|sma&horizon={days}&needs_reorder=true
+        """
+        serializer = ResourceForecastQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+
+        result = forecast.get_forecast(params['method'], params.get('horizon'))
+        resources = result['resources']
+        if params.get('needs_reorder'):
+            resources = [resource for resource in resources if resource['needs_reorder']]
+        return Response({**result, 'resources': resources})
 
     @action(detail=False, methods=['get'])
     def system_health(self, request):
         """Monitor system performance and resource utilization metrics"""
         now = timezone.now()
         hour_ago = now - timedelta(hours=1)
+        last_hour = Q(created_at__gte=hour_ago)
+
+        incident_stats = Incident.objects.aggregate(
+            max_response=Max(Case(When(last_hour, then=F('response_time_minutes')))),
+            **aggregates.averages('response_time_minutes', avg_response=last_hour),
+            **aggregates.counts(
+                last_hour_total=last_hour,
+                last_hour_invalid=last_hour & Q(status='INVALID'),
+                active_incidents=~Q(status__in=aggregates.FINISHED_STATUSES),
+                pending_verifications=Q(status='REPORTED'),
+            )
+        )
         
         return Response({
             'response_times': {
-                'last_hour': Incident.objects.filter(
-                    created_at__gte=hour_ago
-                ).aggregate(
-                    avg_response=Avg('response_time'),
-                    max_response=Max('response_time')
-                ),
-                'error_rate': Incident.objects.filter(
-                    status='INVALID',
-                    created_at__gte=hour_ago
-                ).count() / Incident.objects.filter(
-                    created_at__gte=hour_ago
-                ).count() * 100
+                'last_hour': {
+                    'avg_response': incident_stats['avg_response'],
+                    'max_response': incident_stats['max_response'],
+                },
+                'error_rate': aggregates.percentage(
+                    incident_stats['last_hour_invalid'],
+                    incident_stats['last_hour_total']
+                )
             },
             'resource_availability': self._get_resource_availability(),
             'system_load': {
-                'active_incidents': Incident.objects.exclude(
-                    status__in=['RESOLVED', 'CLOSED', 'INVALID']
-                ).count(),
-                'pending_verifications': Incident.objects.filter(
-                    status='REPORTED'
-                ).count(),
+                'active_incidents': incident_stats['active_incidents'],
+                'pending_verifications': incident_stats['pending_verifications'],
                 'resource_requests': IncidentResource.objects.filter(
                     status='REQUESTED'
                 ).count()
             }
         })
+
+    def _get_resource_availability(self):
+        return Resource.objects.aggregate(
+            total_resources=Count('id'),
+            total_available=Coalesce(Sum('quantity_available'), 0),
+            total_allocated=Coalesce(Sum('quantity_allocated'), 0),
+            **aggregates.counts(
+                out_of_stock=Q(quantity_available=0),
+                below_minimum=Q(quantity_available__lt=F('minimum_quantity')),
+                at_reorder_point=Q(reorder_point__isnull=False, quantity_available__lte=F('reorder_point')),
+            )
+        )
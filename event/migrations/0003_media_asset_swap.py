@@ -0,0 +1,29 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+# Separate from 0002_media_asset_links so PostgreSQL has checked the copied
+# references before the tables are altered
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event', '0002_media_asset_links'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='event',
+            name='media',
+        ),
+        migrations.RenameField(
+            model_name='event',
+            old_name='media_assets',
+            new_name='media',
+        ),
+        migrations.AlterField(
+            model_name='event',
+            name='media',
+            field=models.ManyToManyField(blank=True, limit_choices_to={'owner_type': 'event-media'}, related_name='events', to='cloud_resource.mediaasset'),
+        ),
+    ]
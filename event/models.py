@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 
 # Create your models here.
 from django.db import models
@@ -11,7 +11,7 @@ from datetime import timedelta
 from django.core.exceptions import ValidationError
 from cddpresources.models import Resource
 from incident.models import Skill
-from cloud_resource.models import EventResources
+from cloud_resource.models import MediaAsset
 from volunteer.models import Volunteer
 User = get_user_model()
 
@@ -133,9 +133,10 @@ class Event(models.Model):
     skills_required = models.ManyToManyField(Skill,blank=True, related_name='event_skills',)
     equipment_provided = models.TextField(blank=True)
     media = models.ManyToManyField(
-        EventResources,
+        MediaAsset,
         blank=True,
-        related_name='events'
+        related_name='events',
+        limit_choices_to={'owner_type': MediaAsset.EVENT}
     )
 
     # Metadata
@@ -204,9 +205,13 @@ class Event(models.Model):
         return self.start_date <= now <= self.end_date
     
     def delete(self, *args, **kwargs):
-        if self.media:
-            self.media.delete()
-        super().delete(*args, **kwargs)
+        from cloud_resource import media
+
+        with transaction.atomic():
+            asset_ids = list(self.media.values_list('pk', flat=True))
+            result = super().delete(*args, **kwargs)
+            media.discard(asset_ids)
+        return result
 
     def get_resource_requirements(self):
         return self.eventresourcerequirement_set.all()
@@ -55,7 +55,7 @@ class IncidentAdmin(admin.ModelAdmin):
     search_fields = ('title', 'description', 'address')
     list_filter = ('status', 'priority', 'category')
     ordering = ('-created_at',)
-    readonly_fields = ('response_time', 'is_overdue')
+    readonly_fields = ('response_time', 'is_overdue', 'first_response_at', 'resolved_at')
     fieldsets = (
         (None, {
             'fields': ('title', 'description', 'category', 'reporter', 'status', 'priority')
@@ -66,6 +66,9 @@ class IncidentAdmin(admin.ModelAdmin):
         ('Verification', {
             'fields': ('verified_at', 'verified_by')
         }),
+        ('Response', {
+            'fields': ('first_response_at', 'resolved_at', 'response_time')
+        }),
         # Removed 'assigned_responders' and 'assigned_volunteers' from fieldsets
         ('Estimated Data', {
             'fields': ('estimated_resolution_time', 'estimated_people_affected')
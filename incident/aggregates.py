@@ -0,0 +1,101 @@
+"""
+Single-pass aggregation helpers for incident metrics.
+
+Every counter, average and histogram bucket a response needs from one table
+is expressed as a filtered aggregate, so it is computed by a single
+``aggregate()`` call instead of one ``count()`` per number. The incident
+statistics and the dashboard both build on these.
+"""
+from django.db.models import Avg, Case, Count, F, Max, Q, When
+
+from .models import Incident
+
+
+# Label, lower bound (inclusive) and upper bound (exclusive) in minutes
+RESPONSE_TIME_BUCKETS = [
+    ('under_1h', None, 60),
+    ('1h_to_3h', 60, 180),
+    ('3h_to_6h', 180, 360),
+    ('6h_to_12h', 360, 720),
+    ('over_12h', 720, None),
+]
+
+PENDING_STATUSES = ['REPORTED', 'VERIFIED']
+FINISHED_STATUSES = ['RESOLVED', 'CLOSED', 'INVALID']
+
+
+def response_range_q(lower, upper):
+    """Q matching incidents whose response time falls in [lower, upper) minutes"""
+    q = Q(response_time_minutes__isnull=False)
+    if lower is not None:
+        q &= Q(response_time_minutes__gte=lower)
+    if upper is not None:
+        q &= Q(response_time_minutes__lt=upper)
+    return q
+
+
+def counts(**conditions):
+    """{name: Count filtered by Q} for use in a single aggregate() call"""
+    return {name: Count('pk', filter=condition) for name, condition in conditions.items()}
+
+
+def averages(field, **conditions):
+    """{name: average of field over rows matching Q}, via Case/When"""
+    return {
+        name: Avg(Case(When(condition, then=F(field)), default=None))
+        for name, condition in conditions.items()
+    }
+
+
+def incident_metrics(queryset):
+    """
+    Compute totals, per-status and per-priority counts and average response
+    times, and the response-time histogram for an incident queryset in one query.
+    """
+    status_q = {value: Q(status=value) for value, _ in Incident.STATUS_CHOICES}
+    priority_q = {value: Q(priority=value) for value, _ in Incident.PRIORITY_CHOICES}
+
+    expressions = {
+        'total': Count('pk'),
+        'max_response_time': Max('response_time_minutes'),
+    }
+    expressions.update(averages(
+        'response_time_minutes',
+        average_response_time=~Q(status__in=PENDING_STATUSES),
+    ))
+    expressions.update(counts(**{f'status_{value}': q for value, q in status_q.items()}))
+    expressions.update(averages('response_time_minutes', **{
+        f'status_{value}_response': q for value, q in status_q.items()
+    }))
+    expressions.update(counts(**{f'priority_{value}': q for value, q in priority_q.items()}))
+    expressions.update(averages('response_time_minutes', **{
+        f'priority_{value}_response': q for value, q in priority_q.items()
+    }))
+    expressions.update(counts(**{
+        f'responses_{label}': response_range_q(lower, upper)
+        for label, lower, upper in RESPONSE_TIME_BUCKETS
+    }))
+
+    return queryset.order_by().aggregate(**expressions)
+
+
+def breakdown(metrics, field):
+    """[{field: value, count, avg_response_time}] for 'status' or 'priority', skipping empty groups"""
+    choices = Incident.STATUS_CHOICES if field == 'status' else Incident.PRIORITY_CHOICES
+    return [
+        {
+            field: value,
+            'count': metrics[f'{field}_{value}'],
+            'avg_response_time': metrics[f'{field}_{value}_response'],
+        }
+        for value, _ in choices
+        if metrics[f'{field}_{value}']
+    ]
+
+
+def response_time_distribution(metrics):
+    return {label: metrics[f'responses_{label}'] for label, _, _ in RESPONSE_TIME_BUCKETS}
+
+
+def percentage(part, whole):
+    return part * 100.0 / whole if whole else 0
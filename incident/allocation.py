@@ -0,0 +1,277 @@
+"""
+Race-free resource allocation.
+
+Stock and request counters are never read into Python, changed and saved
+back. Every change is a single conditional ``UPDATE ... SET n = n + q WHERE
+there is enough left``; when the condition fails no row is updated and the
+change is refused, so concurrent dispatchers can not over-allocate the same
+stock. Each change also appends a ResourceLedgerEntry, which keeps the full
+history of allocations and returns.
+
+Within a transaction the IncidentResource rows are locked first, in
+(resource, request) order, then the Resource rows they draw on and finally
+the ResourceDemand counters, so concurrent batches queue on the same rows
+instead of deadlocking.
+
+Updates bypass post_save, so the demand counters are adjusted here from the
+locked before and after state of each request, and resources_written is sent
+so the dashboard can refresh what the signals would have.
+"""
+import logging
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from cddpresources.models import Resource
+from . import demand
+from .signals import resources_written
+from .models import IncidentResource, ResourceLedgerEntry
+
+logger = logging.getLogger(__name__)
+
+
+class AllocationError(ValueError):
+    """The change would over-allocate stock or return more than was allocated"""
+
+
+def parse_quantity(value):
+    """Read a quantity from request data"""
+    try:
+        quantity = int(value)
+    except (TypeError, ValueError):
+        raise AllocationError("Quantity must be a positive whole number")
+    if quantity != value and str(quantity) != str(value).strip():
+        raise AllocationError("Quantity must be a positive whole number")
+    _check_quantity(quantity)
+    return quantity
+
+
+def _check_quantity(quantity):
+    if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity <= 0:
+        raise AllocationError("Quantity must be a positive whole number")
+
+
+def _lock_requests(request_ids):
+    """Lock the requests and return their current state, refusing unknown ones"""
+    before = demand.snapshots(request_ids, lock=True)
+    missing = set(request_ids) - set(before)
+    if missing:
+        raise AllocationError(f"Unknown resource requests: {sorted(missing)}")
+    return before
+
+
+def _refreshed(request_ids, before):
+    """
+    Re-read the updated requests, adjust the demand counters and refresh
+    what their post_save would have
+    """
+    requests = list(
+        IncidentResource.objects.filter(pk__in=request_ids)
+        .select_related('resource', 'incident', 'allocated_by', 'requested_by', 'return_verified_by')
+        .prefetch_related('ledger_entries__actor')
+    )
+    demand.record((before[request.pk], demand.snapshot(request)) for request in requests)
+    keys = [(request.requested_at, request.resource_id) for request in requests]
+    resources_written.send(sender=IncidentResource, keys=keys)
+    return sorted(requests, key=lambda request: request_ids.index(request.pk))
+
+
+# Stock
+
+def _reserve_stock(resource_id, quantity):
+    reserved = Resource.objects.filter(
+        pk=resource_id,
+        quantity_available__gte=F('quantity_allocated') + quantity,
+    ).update(quantity_allocated=F('quantity_allocated') + quantity)
+    if not reserved:
+        raise AllocationError(f"Not enough stock of resource {resource_id} to allocate {quantity}")
+
+
+def _release_stock(resource_id, quantity):
+    released = Resource.objects.filter(
+        pk=resource_id, quantity_allocated__gte=quantity
+    ).update(quantity_allocated=F('quantity_allocated') - quantity)
+    if not released:
+        raise AllocationError(f"Return of {quantity} exceeds the allocated stock of resource {resource_id}")
+
+
+@transaction.atomic
+def allocate_stock(resource_id, quantity, user, notes=''):
+    """Reserve stock directly on a resource, outside any incident request"""
+    _check_quantity(quantity)
+    _reserve_stock(resource_id, quantity)
+    ResourceLedgerEntry.objects.create(
+        resource_id=resource_id, kind=ResourceLedgerEntry.ALLOCATED,
+        quantity=quantity, actor=user, notes=notes,
+    )
+    resources_written.send(sender=Resource, keys=[])
+
+
+@transaction.atomic
+def release_stock(resource_id, quantity, user, notes=''):
+    """Give stock reserved with allocate_stock back to the resource"""
+    _check_quantity(quantity)
+    _release_stock(resource_id, quantity)
+    ResourceLedgerEntry.objects.create(
+        resource_id=resource_id, kind=ResourceLedgerEntry.RELEASED,
+        quantity=quantity, actor=user, notes=notes,
+    )
+    resources_written.send(sender=Resource, keys=[])
+
+
+# Incident requests
+
+def _allocate_one(request_id, resource_id, quantity, user, now, expected_return_date=None):
+    _check_quantity(quantity)
+    _reserve_stock(resource_id, quantity)
+
+    changes = {
+        'quantity_allocated': F('quantity_allocated') + quantity,
+        'status': Case(
+            When(quantity_requested__lte=F('quantity_allocated') + quantity, then=Value('FULLY_ALLOCATED')),
+            default=Value('PARTIALLY_ALLOCATED'),
+        ),
+        'allocated_at': now,
+        'allocated_by': user,
+    }
+    if expected_return_date:
+        changes['expected_return_date'] = expected_return_date
+    allocated = (
+        IncidentResource.objects
+        .filter(pk=request_id, quantity_requested__gte=F('quantity_allocated') + quantity)
+        .exclude(status='CANCELLED')
+        .update(**changes)
+    )
+    if not allocated:
+        raise AllocationError(f"Allocation of {quantity} exceeds the pending quantity of request {request_id}")
+
+    return ResourceLedgerEntry(
+        resource_id=resource_id, incident_resource_id=request_id,
+        kind=ResourceLedgerEntry.ALLOCATED, quantity=quantity, actor=user, created_at=now,
+    )
+
+
+def allocate(request_id, quantity, user, expected_return_date=None):
+    """Allocate stock to one incident request, returning the updated request"""
+    return allocate_many(
+        [{'request': request_id, 'quantity': quantity, 'expected_return_date': expected_return_date}],
+        user,
+    )[0]
+
+
+@transaction.atomic
+def allocate_many(items, user):
+    """
+    Allocate stock to many incident requests at once. items are dicts with
+    request, quantity and optionally expected_return_date.
+
+    All or nothing: if any item can not be allocated, none are and the
+    AllocationError names the item that failed.
+    """
+    if not items:
+        raise AllocationError("Nothing to allocate")
+    request_ids = [item['request'] for item in items]
+    if len(set(request_ids)) != len(request_ids):
+        raise AllocationError("Each request may only appear once per batch")
+    before = _lock_requests(request_ids)
+
+    now = timezone.now()
+    entries = [
+        _allocate_one(
+            item['request'], before[item['request']]['resource_id'], item['quantity'], user, now,
+            item.get('expected_return_date'),
+        )
+        for item in sorted(items, key=lambda item: (before[item['request']]['resource_id'], item['request']))
+    ]
+    ResourceLedgerEntry.objects.bulk_create(entries)
+    return _refreshed(request_ids, before)
+
+
+@transaction.atomic
+def submit_return(request_id, quantity, user, notes=''):
+    """Record that allocated stock is being returned; it is released once verified"""
+    _check_quantity(quantity)
+    before = _lock_requests([request_id])
+    resource_id = before[request_id]['resource_id']
+    submitted = IncidentResource.objects.filter(
+        pk=request_id, quantity_allocated__gte=quantity
+    ).update(return_status='SUBMITTED', return_notes=notes)
+    if not submitted:
+        raise AllocationError("Return quantity exceeds allocation")
+
+    ResourceLedgerEntry.objects.create(
+        resource_id=resource_id, incident_resource_id=request_id,
+        kind=ResourceLedgerEntry.RETURN_SUBMITTED, quantity=quantity, actor=user, notes=notes,
+    )
+    return _refreshed([request_id], before)[0]
+
+
+def _submitted_return(request_id):
+    """The quantity of the return awaiting verification, None when there is none"""
+    if not IncidentResource.objects.filter(pk=request_id, return_status='SUBMITTED').exists():
+        return None
+    return (
+        ResourceLedgerEntry.objects
+        .filter(incident_resource_id=request_id, kind=ResourceLedgerEntry.RETURN_SUBMITTED)
+        .order_by('-created_at', '-pk')
+        .values_list('quantity', flat=True)
+        .first()
+    )
+
+
+@transaction.atomic
+def verify_return(request_id, quantity, user, verified=True, notes=''):
+    """
+    Accept the submitted return, releasing its stock, or reject it. quantity
+    defaults to the quantity submitted and may not exceed it.
+    """
+    before = _lock_requests([request_id])
+    submitted = _submitted_return(request_id)
+    if submitted is None:
+        raise AllocationError("No return is awaiting verification")
+    if quantity is None:
+        quantity = submitted
+    _check_quantity(quantity)
+    if quantity > submitted:
+        raise AllocationError(f"Verified quantity exceeds the {submitted} submitted for return")
+    resource_id = before[request_id]['resource_id']
+    now = timezone.now()
+
+    if verified:
+        _release_stock(resource_id, quantity)
+        returned = IncidentResource.objects.filter(
+            pk=request_id, quantity_allocated__gte=quantity
+        ).update(
+            quantity_allocated=F('quantity_allocated') - quantity,
+            status=Case(
+                When(quantity_allocated=quantity, then=Value('RETURNED')),
+                default=Value('PARTIALLY_ALLOCATED'),
+            ),
+            return_status='VERIFIED',
+            return_notes=notes,
+            returned_at=now,
+            return_verified_by=user,
+            return_verified_at=now,
+        )
+        if not returned:
+            raise AllocationError("Return quantity exceeds allocation")
+        kind = ResourceLedgerEntry.RETURN_VERIFIED
+    else:
+        IncidentResource.objects.filter(pk=request_id).update(return_status='REJECTED', return_notes=notes)
+        kind = ResourceLedgerEntry.RETURN_REJECTED
+
+    ResourceLedgerEntry.objects.create(
+        resource_id=resource_id, incident_resource_id=request_id,
+        kind=kind, quantity=quantity, actor=user, notes=notes, created_at=now,
+    )
+    return _refreshed([request_id], before)[0]
+
+
+@transaction.atomic
+def cancel(request_id):
+    """Cancel a request that has nothing allocated yet, returning the updated request"""
+    before = _lock_requests([request_id])
+    cancelled = IncidentResource.objects.filter(pk=request_id, quantity_allocated=0).update(status='CANCELLED')
+    if not cancelled:
+        raise AllocationError("Cannot cancel request with allocated resources")
+    return _refreshed([request_id], before)[0]
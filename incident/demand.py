@@ -0,0 +1,176 @@
+"""
+Maintained resource demand counters.
+
+ResourceDemand holds one row per (resource, priority) with the number of
+open requests, how many still wait for a first allocation, and the
+quantities requested and allocated. Every write to IncidentResource applies
+the difference between the request's contribution before and after the
+write, inside the same transaction, so shortage and utilization reads touch
+a handful of counter rows instead of grouping the whole request history.
+
+Counters for every priority are created with their resource, so changes
+are plain updates. Model saves and deletes are covered by incident.signals,
+allocations and returns by incident.allocation, and bulk inserts call
+record() themselves. ``rebuild()`` recomputes every counter from scratch.
+"""
+import logging
+from collections import defaultdict
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+
+from cddpresources.models import Resource
+from .models import Incident, IncidentResource, ResourceDemand
+
+logger = logging.getLogger(__name__)
+
+
+# Requests in these states no longer count as demand
+CLOSED_STATUSES = ('CANCELLED', 'RETURNED', 'CONSUMED')
+
+URGENT_PRIORITIES = ('HIGH', 'CRITICAL', 'EMERGENCY')
+
+SNAPSHOT_FIELDS = ('pk', 'resource_id', 'priority', 'status', 'quantity_requested', 'quantity_allocated')
+
+COUNTERS = ('request_count', 'pending_count', 'quantity_requested', 'quantity_allocated')
+
+
+def snapshot(request):
+    """The fields of an IncidentResource the counters depend on"""
+    return {
+        'resource_id': request.resource_id,
+        'priority': request.priority,
+        'status': request.status,
+        'quantity_requested': request.quantity_requested,
+        'quantity_allocated': request.quantity_allocated,
+    }
+
+
+def snapshots(request_ids, lock=False):
+    """{pk: snapshot} read from the database, optionally locking the rows"""
+    queryset = IncidentResource.objects.filter(pk__in=request_ids)
+    if lock:
+        queryset = queryset.select_for_update().order_by('resource_id', 'pk')
+    return {row.pop('pk'): row for row in queryset.values(*SNAPSHOT_FIELDS)}
+
+
+def _contribution(state):
+    if state is None or state['status'] in CLOSED_STATUSES:
+        return (0, 0, 0, 0)
+    return (
+        1,
+        1 if state['status'] == 'REQUESTED' else 0,
+        state['quantity_requested'],
+        state['quantity_allocated'],
+    )
+
+
+def record(changes):
+    """
+    Apply (before, after) snapshot pairs to the counters; None stands for a
+    request that did not exist before or no longer exists after.
+    """
+    deltas = defaultdict(lambda: [0, 0, 0, 0])
+    for before, after in changes:
+        for state, sign in ((before, -1), (after, 1)):
+            if state is None:
+                continue
+            delta = deltas[(state['resource_id'], state['priority'])]
+            for i, value in enumerate(_contribution(state)):
+                delta[i] += sign * value
+
+    # Sorted so concurrent writers lock counter rows in the same order
+    for (resource_id, priority), delta in sorted(deltas.items()):
+        if any(delta):
+            _apply(resource_id, priority, dict(zip(COUNTERS, delta)))
+
+
+def create_counters(resource_ids):
+    """Empty counters for every priority, so later changes are plain updates"""
+    ResourceDemand.objects.bulk_create(
+        [
+            ResourceDemand(resource_id=resource_id, priority=priority)
+            for resource_id in resource_ids
+            for priority, _ in Incident.PRIORITY_CHOICES
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def _apply(resource_id, priority, delta):
+    changes = {field: F(field) + value for field, value in delta.items()}
+    if ResourceDemand.objects.filter(resource_id=resource_id, priority=priority).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            ResourceDemand.objects.create(resource_id=resource_id, priority=priority, **delta)
+    except IntegrityError:
+        # Created by a concurrent writer since the update above
+        ResourceDemand.objects.filter(resource_id=resource_id, priority=priority).update(**changes)
+
+
+@transaction.atomic
+def rebuild():
+    """Recompute every counter from IncidentResource, returning the number of rows written"""
+    rows = (
+        IncidentResource.objects.exclude(status__in=CLOSED_STATUSES)
+        .values('resource_id', 'priority')
+        .annotate(
+            requests=Count('id'),
+            pending=Count('id', filter=Q(status='REQUESTED')),
+            requested=Sum('quantity_requested'),
+            allocated=Sum('quantity_allocated'),
+        )
+        .order_by()
+    )
+    ResourceDemand.objects.all().delete()
+    create_counters(Resource.objects.values_list('pk', flat=True))
+    counters = ResourceDemand.objects.bulk_create([
+        ResourceDemand(
+            resource_id=row['resource_id'],
+            priority=row['priority'],
+            request_count=row['requests'],
+            pending_count=row['pending'],
+            quantity_requested=row['requested'],
+            quantity_allocated=row['allocated'],
+        )
+        for row in rows
+    ], update_conflicts=True, unique_fields=['resource', 'priority'], update_fields=COUNTERS)
+    return len(counters)
+
+
+# Reading
+
+def shortages():
+    """Resources whose open requests are not fully allocated, per priority"""
+    return (
+        ResourceDemand.objects
+        .filter(quantity_requested__gt=F('quantity_allocated'))
+        .order_by('resource__name', 'priority')
+    )
+
+
+def utilization():
+    """Open demand per resource summed over priorities"""
+    rows = (
+        ResourceDemand.objects.values('resource', 'resource__name')
+        .annotate(
+            requests=Sum('request_count'),
+            urgent=Sum('request_count', filter=Q(priority__in=URGENT_PRIORITIES)),
+            requested=Sum('quantity_requested'),
+            allocated=Sum('quantity_allocated'),
+        )
+        .filter(requests__gt=0)
+        .order_by('resource__name')
+    )
+    return [
+        {
+            'resource': row['resource'],
+            'resource__name': row['resource__name'],
+            'request_count': row['requests'],
+            'urgent_requests': row['urgent'] or 0,
+            'total_requested': row['requested'],
+            'total_allocated': row['allocated'],
+            'utilization_rate': row['allocated'] * 100.0 / row['requested'] if row['requested'] else None,
+        }
+        for row in rows
+    ]
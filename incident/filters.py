@@ -1,5 +1,5 @@
 import django_filters
-from django.db.models import Q, F, ExpressionWrapper, FloatField
+from django.db.models import Q, F, ExpressionWrapper, FloatField, Exists, OuterRef
 # from django.contrib.gis.measure import D
 # from django.contrib.gis.db.models.functions import Distance
 from .models import (
@@ -8,6 +8,7 @@ from .models import (
 )
 from django.utils import timezone
 from accounts.models import User
+from volunteer.models import VolunteerSkill
 
 
 class TaskFilter(django_filters.FilterSet):
@@ -138,9 +139,11 @@ class IncidentVolunteerFilter(django_filters.FilterSet):
     def filter_skill_match(self, queryset, name, value):
         if not value:
             return queryset
-        return queryset.filter(
-            incident__required_skills__in=F('volunteer__skills')
-        ).distinct()
+        # Volunteer holds at least one skill the incident requires
+        return queryset.filter(Exists(VolunteerSkill.objects.filter(
+            volunteer=OuterRef('volunteer'),
+            skill__incident_skills=OuterRef('incident')
+        )))
 
     def filter_availability(self, queryset, name, value):
         if not value:
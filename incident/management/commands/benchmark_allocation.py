@@ -0,0 +1,174 @@
+import random
+import statistics
+import threading
+import time
+import uuid
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection
+from django.db.models import Sum
+
+from accounts.models import User
+from cddpresources.models import Resource, ResourceType
+from reporters.models import Reporter
+from incident import allocation, demand
+from incident.allocation import AllocationError
+from incident.models import Incident, IncidentCategory, IncidentResource, ResourceDemand, ResourceLedgerEntry
+
+
+class Command(BaseCommand):
+    help = (
+        "Run concurrent dispatchers against one resource and report allocation "
+        "throughput, latency and whether any stock was over-allocated"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help="Concurrent dispatchers")
+        parser.add_argument('--attempts', type=int, default=50, help="Allocations each dispatcher attempts")
+        parser.add_argument('--batch', type=int, default=1, help="Requests allocated per transaction")
+        parser.add_argument('--requests', type=int, default=20, help="Incident requests competing for the stock")
+        parser.add_argument('--stock', type=int, help="Units in stock, defaults to half of what is attempted")
+        parser.add_argument('--keep', action='store_true', help="Keep the benchmark rows afterwards")
+
+    def handle(self, *args, **options):
+        if options['batch'] > options['requests']:
+            raise CommandError("--batch can not exceed --requests")
+        if connection.vendor == 'sqlite':
+            self.stderr.write(self.style.WARNING(
+                "SQLite serialises writers; expect 'database is locked' errors and no row-level contention"
+            ))
+
+        attempted_units = options['threads'] * options['attempts'] * options['batch']
+        stock = options['stock'] if options['stock'] is not None else attempted_units // 2
+        fixtures = self.create_fixtures(stock, options['requests'], attempted_units)
+        try:
+            results = self.run(fixtures, options)
+            self.report(results, options)
+            self.check_invariants(fixtures)
+        finally:
+            if not options['keep']:
+                self.delete_fixtures(fixtures)
+
+    def create_fixtures(self, stock, request_count, attempted_units):
+        tag = uuid.uuid4().hex[:8]
+        user = User.objects.create_user(email=f'allocation-benchmark-{tag}@example.com', password=None)
+        category = IncidentCategory.objects.create(
+            name=f'Allocation benchmark {tag}', description='Benchmark', severity_level=1
+        )
+        incident = Incident.objects.create(
+            title=f'Allocation benchmark {tag}', description='Benchmark',
+            category=category, reporter=Reporter.objects.create(user=user),
+        )
+        resource_type = ResourceType.objects.create(name=f'Allocation benchmark {tag}')
+        resource = Resource.objects.create(
+            name=f'Allocation benchmark {tag}', resource_type=resource_type,
+            description='Benchmark', unit='unit', quantity_available=stock,
+        )
+        per_request = max(1, attempted_units // request_count)
+        requests = IncidentResource.objects.bulk_create([
+            IncidentResource(incident=incident, resource=resource, quantity_requested=per_request, requested_by=user)
+            for _ in range(request_count)
+        ])
+        demand.record((None, demand.snapshot(request)) for request in requests)
+        return {
+            'user': user, 'category': category, 'incident': incident,
+            'resource_type': resource_type, 'resource': resource,
+            'requests': [request.pk for request in requests],
+        }
+
+    def run(self, fixtures, options):
+        results = {'allocated': 0, 'refused': 0, 'errors': 0, 'latencies': []}
+        lock = threading.Lock()
+        barrier = threading.Barrier(options['threads'])
+
+        def dispatcher():
+            allocated = refused = errors = 0
+            latencies = []
+            try:
+                barrier.wait()
+                for _ in range(options['attempts']):
+                    items = [
+                        {'request': request_id, 'quantity': 1}
+                        for request_id in random.sample(fixtures['requests'], options['batch'])
+                    ]
+                    started = time.perf_counter()
+                    try:
+                        allocation.allocate_many(items, fixtures['user'])
+                        allocated += len(items)
+                    except AllocationError:
+                        refused += 1
+                    except DatabaseError:
+                        errors += 1
+                    latencies.append(time.perf_counter() - started)
+            finally:
+                connection.close()
+            with lock:
+                results['allocated'] += allocated
+                results['refused'] += refused
+                results['errors'] += errors
+                results['latencies'] += latencies
+
+        threads = [threading.Thread(target=dispatcher) for _ in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        results['elapsed'] = time.perf_counter() - started
+        return results
+
+    def report(self, results, options):
+        latencies = sorted(results['latencies'])
+        transactions = len(latencies)
+        self.stdout.write(
+            f"{options['threads']} dispatchers x {options['attempts']} transactions of "
+            f"{options['batch']} in {results['elapsed']:.2f}s "
+            f"({transactions / results['elapsed']:.0f} transactions/s)"
+        )
+        self.stdout.write(
+            f"Units allocated: {results['allocated']}, refused transactions: {results['refused']}, "
+            f"database errors: {results['errors']}"
+        )
+        if latencies:
+            self.stdout.write(
+                f"Latency ms: median {statistics.median(latencies) * 1000:.1f}, "
+                f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f}, "
+                f"max {latencies[-1] * 1000:.1f}"
+            )
+
+    def check_invariants(self, fixtures):
+        resource = Resource.objects.get(pk=fixtures['resource'].pk)
+        requests = IncidentResource.objects.filter(pk__in=fixtures['requests'])
+        allocated_to_requests = requests.aggregate(total=Sum('quantity_allocated'))['total'] or 0
+        ledger = ResourceLedgerEntry.objects.filter(
+            resource=resource, kind=ResourceLedgerEntry.ALLOCATED
+        ).aggregate(total=Sum('quantity'))['total'] or 0
+        counted = ResourceDemand.objects.filter(resource=resource).aggregate(
+            total=Sum('quantity_allocated')
+        )['total'] or 0
+
+        problems = []
+        if resource.quantity_allocated > resource.quantity_available:
+            problems.append(f"{resource.quantity_allocated} allocated out of {resource.quantity_available} in stock")
+        if resource.quantity_allocated != allocated_to_requests:
+            problems.append(f"stock shows {resource.quantity_allocated} allocated, requests {allocated_to_requests}")
+        if ledger != allocated_to_requests:
+            problems.append(f"ledger shows {ledger} allocated, requests {allocated_to_requests}")
+        if counted != allocated_to_requests:
+            problems.append(f"demand counters show {counted} allocated, requests {allocated_to_requests}")
+        over_requested = [
+            request.pk for request in requests if request.quantity_allocated > request.quantity_requested
+        ]
+        if over_requested:
+            problems.append(f"requests allocated beyond their quantity: {over_requested}")
+        if problems:
+            raise CommandError("Allocation invariants broken: " + "; ".join(problems))
+        self.stdout.write(self.style.SUCCESS(
+            f"Invariants hold: {resource.quantity_allocated} of {resource.quantity_available} units allocated"
+        ))
+
+    def delete_fixtures(self, fixtures):
+        fixtures['incident'].delete()
+        fixtures['resource'].delete()
+        fixtures['resource_type'].delete()
+        fixtures['category'].delete()
+        fixtures['user'].delete()
@@ -0,0 +1,71 @@
+# Generated by Django 4.2.16 on 2026-10-18 10:15
+
+from django.db import migrations, models
+from django.db.models import Max, Min, Q
+
+
+BATCH_SIZE = 1000
+
+
+def backfill_response_timestamps(apps, schema_editor):
+    Incident = apps.get_model('incident', 'Incident')
+    IncidentUpdate = apps.get_model('incident', 'IncidentUpdate')
+
+    history = IncidentUpdate.objects.order_by().values('incident_id').annotate(
+        first_response=Min('created_at', filter=Q(status_changed_to__in=['RESPONDING', 'IN_PROGRESS'])),
+        last_resolved=Max('created_at', filter=Q(status_changed_to='RESOLVED')),
+        first_closed=Min('created_at', filter=Q(status_changed_to='CLOSED')),
+    )
+    timestamps = {
+        row['incident_id']: (row['first_response'], row['last_resolved'] or row['first_closed'])
+        for row in history
+    }
+
+    batch = []
+    for incident in Incident.objects.filter(id__in=list(timestamps)).iterator(chunk_size=BATCH_SIZE):
+        first_response, resolved = timestamps[incident.id]
+        if first_response:
+            incident.first_response_at = first_response
+            incident.response_time_minutes = int((first_response - incident.created_at).total_seconds() / 60)
+        if resolved and incident.status in ('RESOLVED', 'CLOSED'):
+            incident.resolved_at = resolved
+        batch.append(incident)
+        if len(batch) >= BATCH_SIZE:
+            Incident.objects.bulk_update(batch, ['first_response_at', 'response_time_minutes', 'resolved_at'])
+            batch = []
+    if batch:
+        Incident.objects.bulk_update(batch, ['first_response_at', 'response_time_minutes', 'resolved_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('incident', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='incident',
+            name='first_response_at',
+            field=models.DateTimeField(blank=True, help_text='When the incident first moved to Responding or In Progress', null=True),
+        ),
+        migrations.AddField(
+            model_name='incident',
+            name='resolved_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='incident',
+            name='response_time_minutes',
+            field=models.IntegerField(blank=True, help_text='Minutes from report to first response', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='incident',
+            index=models.Index(fields=['category', 'response_time_minutes'], name='incident_in_categor_9bfd4e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incident',
+            index=models.Index(fields=['resolved_at'], name='incident_in_resolve_e48b53_idx'),
+        ),
+        migrations.RunPython(backfill_response_timestamps, migrations.RunPython.noop),
+    ]
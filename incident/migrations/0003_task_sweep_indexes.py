@@ -0,0 +1,21 @@
+# Generated by Django 4.2.16 on 2026-10-18 10:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('incident', '0002_incident_response_timestamps'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['status', 'due_date'], name='incident_ta_status_729953_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['updated_at'], name='incident_ta_updated_13edd2_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.16 on 2026-10-18 10:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('incident', '0003_task_sweep_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='incidentupdate',
+            index=models.Index(fields=['incident', 'created_at'], name='incident_in_inciden_13a3ed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['created_at', 'id'], name='incident_ta_created_058b79_idx'),
+        ),
+    ]
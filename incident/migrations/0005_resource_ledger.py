@@ -0,0 +1,114 @@
+# Generated by Django 4.2.16 on 2026-10-18 10:50
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F, Q, Sum
+import django.db.models.deletion
+import django.utils.timezone
+from django.utils.dateparse import parse_datetime
+
+
+BATCH_SIZE = 1000
+
+
+def seed_ledger(apps, schema_editor):
+    """
+    Open the ledger with each request's current allocation and carry over the
+    partial returns recorded in the old JSON list.
+    """
+    IncidentResource = apps.get_model('incident', 'IncidentResource')
+    ResourceLedgerEntry = apps.get_model('incident', 'ResourceLedgerEntry')
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    user_ids = {str(pk) for pk in User.objects.values_list('pk', flat=True)}
+
+    entries = []
+    requests = IncidentResource.objects.filter(Q(quantity_allocated__gt=0) | ~Q(partial_returns=[]))
+    for request in requests.iterator(chunk_size=BATCH_SIZE):
+        if request.quantity_allocated > 0:
+            entries.append(ResourceLedgerEntry(
+                resource_id=request.resource_id,
+                incident_resource_id=request.pk,
+                kind='ALLOCATED',
+                quantity=request.quantity_allocated,
+                actor_id=request.allocated_by_id,
+                notes='Opening balance',
+                created_at=request.allocated_at or request.requested_at,
+            ))
+        for partial in request.partial_returns or []:
+            submitted_by = str(partial.get('submitted_by'))
+            entries.append(ResourceLedgerEntry(
+                resource_id=request.resource_id,
+                incident_resource_id=request.pk,
+                kind='RETURN_SUBMITTED',
+                quantity=partial.get('quantity') or 0,
+                actor_id=submitted_by if submitted_by in user_ids else None,
+                created_at=parse_datetime(partial.get('date') or '') or request.requested_at,
+            ))
+        if len(entries) >= BATCH_SIZE:
+            ResourceLedgerEntry.objects.bulk_create(entries)
+            entries = []
+    ResourceLedgerEntry.objects.bulk_create(entries)
+
+
+def _outstanding_allocations(apps):
+    IncidentResource = apps.get_model('incident', 'IncidentResource')
+    return (
+        IncidentResource.objects.filter(quantity_allocated__gt=0)
+        .order_by().values('resource_id').annotate(total=Sum('quantity_allocated'))
+    )
+
+
+def reserve_allocated_stock(apps, schema_editor):
+    """
+    Incident allocations now reserve stock on their resource and release it
+    when returned, so add what requests still hold to quantity_allocated.
+    """
+    Resource = apps.get_model('cddpresources', 'Resource')
+    for row in _outstanding_allocations(apps):
+        Resource.objects.filter(pk=row['resource_id']).update(
+            quantity_allocated=F('quantity_allocated') + row['total']
+        )
+
+
+def release_allocated_stock(apps, schema_editor):
+    Resource = apps.get_model('cddpresources', 'Resource')
+    for row in _outstanding_allocations(apps):
+        Resource.objects.filter(pk=row['resource_id']).update(
+            quantity_allocated=F('quantity_allocated') - row['total']
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cddpresources', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('incident', '0004_feed_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResourceLedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('ALLOCATED', 'Allocated'), ('RETURN_SUBMITTED', 'Return Submitted'), ('RETURN_VERIFIED', 'Return Verified'), ('RETURN_REJECTED', 'Return Rejected'), ('RELEASED', 'Released')], max_length=20)),
+                ('quantity', models.PositiveIntegerField()),
+                ('notes', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('actor', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('incident_resource', models.ForeignKey(blank=True, help_text='Empty for stock allocated directly on the resource', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='incident.incidentresource')),
+                ('resource', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='cddpresources.resource')),
+            ],
+            options={
+                'verbose_name_plural': 'resource ledger entries',
+                'ordering': ['created_at', 'id'],
+                'indexes': [models.Index(fields=['incident_resource', 'created_at'], name='incident_re_inciden_b64fd3_idx'), models.Index(fields=['resource', 'created_at'], name='incident_re_resourc_ca2477_idx')],
+            },
+        ),
+        migrations.RunPython(seed_ledger, migrations.RunPython.noop),
+        migrations.RunPython(reserve_allocated_stock, release_allocated_stock),
+        migrations.RemoveField(
+            model_name='incidentresource',
+            name='partial_returns',
+        ),
+    ]
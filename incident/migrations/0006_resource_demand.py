@@ -0,0 +1,70 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:00
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+import django.db.models.deletion
+
+
+PRIORITIES = ['LOW', 'MEDIUM', 'HIGH', 'CRITICAL', 'EMERGENCY']
+
+
+def count_open_demand(apps, schema_editor):
+    """One counter per resource and priority, filled from the open requests"""
+    Resource = apps.get_model('cddpresources', 'Resource')
+    IncidentResource = apps.get_model('incident', 'IncidentResource')
+    ResourceDemand = apps.get_model('incident', 'ResourceDemand')
+    totals = {
+        (row['resource_id'], row['priority']): row
+        for row in IncidentResource.objects.exclude(status__in=['CANCELLED', 'RETURNED', 'CONSUMED'])
+        .values('resource_id', 'priority')
+        .annotate(
+            requests=Count('id'),
+            pending=Count('id', filter=Q(status='REQUESTED')),
+            requested=Sum('quantity_requested'),
+            allocated=Sum('quantity_allocated'),
+        )
+        .order_by()
+    }
+    empty = {'requests': 0, 'pending': 0, 'requested': 0, 'allocated': 0}
+    counters = []
+    for resource_id in Resource.objects.values_list('pk', flat=True).iterator():
+        for priority in PRIORITIES:
+            row = totals.get((resource_id, priority), empty)
+            counters.append(ResourceDemand(
+                resource_id=resource_id,
+                priority=priority,
+                request_count=row['requests'],
+                pending_count=row['pending'],
+                quantity_requested=row['requested'],
+                quantity_allocated=row['allocated'],
+            ))
+    ResourceDemand.objects.bulk_create(counters, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cddpresources', '0001_initial'),
+        ('incident', '0005_resource_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResourceDemand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('priority', models.CharField(choices=[('LOW', 'Low'), ('MEDIUM', 'Medium'), ('HIGH', 'High'), ('CRITICAL', 'Critical'), ('EMERGENCY', 'Emergency')], max_length=20)),
+                ('request_count', models.IntegerField(default=0)),
+                ('pending_count', models.IntegerField(default=0, help_text='Requests nothing has been allocated to yet')),
+                ('quantity_requested', models.BigIntegerField(default=0)),
+                ('quantity_allocated', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('resource', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='demand', to='cddpresources.resource')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='resourcedemand',
+            constraint=models.UniqueConstraint(fields=('resource', 'priority'), name='unique_resource_demand_priority'),
+        ),
+        migrations.RunPython(count_open_demand, migrations.RunPython.noop),
+    ]
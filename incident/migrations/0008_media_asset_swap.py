@@ -0,0 +1,43 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+# Separate from 0007_media_asset_links so PostgreSQL has checked the copied
+# references before the tables are altered
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('incident', '0007_media_asset_links'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='incident',
+            name='media_resource',
+        ),
+        migrations.RenameField(
+            model_name='incident',
+            old_name='media_resource_assets',
+            new_name='media_resource',
+        ),
+        migrations.AlterField(
+            model_name='incident',
+            name='media_resource',
+            field=models.ManyToManyField(limit_choices_to={'owner_type': 'incident-media'}, related_name='incident_media', to='cloud_resource.mediaasset'),
+        ),
+        migrations.RemoveField(
+            model_name='incidentupdate',
+            name='media_resource',
+        ),
+        migrations.RenameField(
+            model_name='incidentupdate',
+            old_name='media_resource_assets',
+            new_name='media_resource',
+        ),
+        migrations.AlterField(
+            model_name='incidentupdate',
+            name='media_resource',
+            field=models.ManyToManyField(limit_choices_to={'owner_type': 'incident-media'}, related_name='incidentupdate_media', to='cloud_resource.mediaasset'),
+        ),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 # from django.contrib.gis.db import models as gis_models
 # from django.contrib.gis.geos import Point
 from django.core.validators import MinValueValidator, MaxValueValidator
@@ -6,7 +6,7 @@ from django.utils import timezone
 from typing import List, Dict, Any
 import uuid
 from django.contrib.auth import get_user_model
-from cloud_resource.models import IncidentMediaResource
+from cloud_resource.models import MediaAsset
 from cddpresources.models import Resource
 from responders.models import Responder
 from volunteer.models import Skill, Volunteer
@@ -118,7 +118,9 @@ class Incident(models.Model):
     )
     estimated_people_affected = models.IntegerField(null=True, blank=True)
     media_files = models.JSONField(default=list)  # URLs to images/videos
-    media_resource = models.ManyToManyField(IncidentMediaResource, related_name="incident_media")  # uploaded media resources
+    media_resource = models.ManyToManyField(
+        MediaAsset, related_name="incident_media", limit_choices_to={'owner_type': MediaAsset.INCIDENT}
+    )  # uploaded media resources
     tags = models.JSONField(default=list)
     required_skills = models.ManyToManyField(Skill, related_name="incident_skills")
     required_resources = models.ManyToManyField(
@@ -126,11 +128,28 @@ class Incident(models.Model):
         through='IncidentResource',
         related_name='incidents_needed'
     )
+    first_response_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="When the incident first moved to Responding or In Progress"
+    )
+    resolved_at = models.DateTimeField(null=True, blank=True)
+    response_time_minutes = models.IntegerField(
+        null=True,
+        blank=True,
+        help_text="Minutes from report to first response"
+    )
+
+    RESPONSE_STATUSES = ('RESPONDING', 'IN_PROGRESS')
+    RESOLVED_STATUSES = ('RESOLVED', 'CLOSED')
+
     class Meta:
         indexes = [
             models.Index(fields=['status', 'priority']),
             models.Index(fields=['created_at']),
             models.Index(fields=['category', 'status']),
+            models.Index(fields=['category', 'response_time_minutes']),
+            models.Index(fields=['resolved_at']),
         ]
 
     @property
@@ -138,12 +157,26 @@ class Incident(models.Model):
         """Returns response time in minutes"""
         if self.status in ['REPORTED', 'VERIFIED']:
             return 0
-        first_response = self.incident_timeline.filter(
-            status_changed_to__in=['RESPONDING', 'IN_PROGRESS']
-        ).first()
-        if first_response:
-            return int((first_response.created_at - self.created_at).total_seconds() / 60)
-        return 0
+        return self.response_time_minutes or 0
+
+    def record_status_change(self, new_status: str, changed_at=None):
+        """
+        Set the status and keep the response/resolution timestamps in step.
+        The caller is responsible for saving the incident.
+        """
+        changed_at = changed_at or timezone.now()
+        self.status = new_status
+
+        if new_status in self.RESPONSE_STATUSES and self.first_response_at is None:
+            self.first_response_at = changed_at
+            self.response_time_minutes = int((changed_at - self.created_at).total_seconds() / 60)
+
+        if new_status in self.RESOLVED_STATUSES:
+            if self.resolved_at is None:
+                self.resolved_at = changed_at
+        elif new_status in self.RESPONSE_STATUSES:
+            # Reopened incidents are no longer resolved
+            self.resolved_at = None
 
     @property
     def is_overdue(self) -> bool:
@@ -193,11 +226,16 @@ class IncidentUpdate(models.Model):
     )
 
     media_files = models.JSONField(default=list)  # URLs to images/videos
-    media_resource = models.ManyToManyField(IncidentMediaResource, related_name="incidentupdate_media")  # uploaded media resources
+    media_resource = models.ManyToManyField(
+        MediaAsset, related_name="incidentupdate_media", limit_choices_to={'owner_type': MediaAsset.INCIDENT}
+    )  # uploaded media resources
     
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['incident', 'created_at']),
+        ]
 
     def __str__(self):
         return f"{self.incident.title} (Updated By: {self.user.full_name})"
@@ -242,6 +280,13 @@ class Task(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'due_date']),
+            models.Index(fields=['updated_at']),
+            models.Index(fields=['created_at', 'id']),
+        ]
+
     @property
     def is_overdue(self) -> bool:
         if not self.due_date:
@@ -369,10 +414,6 @@ class IncidentResource(models.Model):
     )
     return_verified_at = models.DateTimeField(null=True, blank=True)
     return_notes = models.TextField(blank=True)
-    partial_returns = models.JSONField(
-        default=list,
-        help_text="Track history of partial returns [{quantity: int, date: datetime, verified_by: int}]"
-    )
     notes = models.TextField(blank=True)
     priority = models.CharField(
         max_length=20,
@@ -394,6 +435,12 @@ class IncidentResource(models.Model):
     def __str__(self):
         return f"{self.resource.name} (Incident: {self.incident.title})"
 
+    def save(self, *args, **kwargs):
+        # The demand signals lock the row before the save and adjust the
+        # counters after it, so the whole save runs in one transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     @property
     def pending_quantity(self):
         """Returns quantity still pending allocation"""
@@ -412,12 +459,80 @@ class IncidentResource(models.Model):
         return (self.quantity_allocated / self.quantity_requested) * 100
     
     def update_status(self):
-        """Update status based on current allocation"""
+        """Update status based on current allocation; the caller saves"""
         if self.quantity_allocated == 0:
             self.status = 'REQUESTED'
         elif self.quantity_allocated < self.quantity_requested:
             self.status = 'PARTIALLY_ALLOCATED'
         else:
             self.status = 'FULLY_ALLOCATED'
-        self.save()
 
+
+class ResourceLedgerEntry(models.Model):
+    """Append-only record of every change to allocated stock, see incident.allocation"""
+    ALLOCATED = 'ALLOCATED'
+    RETURN_SUBMITTED = 'RETURN_SUBMITTED'
+    RETURN_VERIFIED = 'RETURN_VERIFIED'
+    RETURN_REJECTED = 'RETURN_REJECTED'
+    RELEASED = 'RELEASED'
+    KIND_CHOICES = [
+        (ALLOCATED, 'Allocated'),
+        (RETURN_SUBMITTED, 'Return Submitted'),
+        (RETURN_VERIFIED, 'Return Verified'),
+        (RETURN_REJECTED, 'Return Rejected'),
+        (RELEASED, 'Released'),
+    ]
+
+    resource = models.ForeignKey(Resource, on_delete=models.CASCADE, related_name='ledger_entries')
+    incident_resource = models.ForeignKey(
+        IncidentResource,
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name='ledger_entries',
+        help_text="Empty for stock allocated directly on the resource"
+    )
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    quantity = models.PositiveIntegerField()
+    actor = models.ForeignKey(User, null=True, on_delete=models.SET_NULL, related_name='+')
+    notes = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name_plural = 'resource ledger entries'
+        ordering = ['created_at', 'id']
+        indexes = [
+            models.Index(fields=['incident_resource', 'created_at']),
+            models.Index(fields=['resource', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.quantity} x {self.resource_id}"
+
+
+
+class ResourceDemand(models.Model):
+    """
+    Open demand per resource and priority, kept in step with IncidentResource
+    by incident.demand in the same transaction as every change.
+    Cancelled, returned and consumed requests no longer count.
+    """
+    resource = models.ForeignKey(Resource, on_delete=models.CASCADE, related_name='demand')
+    priority = models.CharField(max_length=20, choices=Incident.PRIORITY_CHOICES)
+    request_count = models.IntegerField(default=0)
+    pending_count = models.IntegerField(default=0, help_text="Requests nothing has been allocated to yet")
+    quantity_requested = models.BigIntegerField(default=0)
+    quantity_allocated = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['resource', 'priority'], name='unique_resource_demand_priority'),
+        ]
+
+    def __str__(self):
+        return f"{self.resource_id}/{self.priority}: {self.quantity_allocated} of {self.quantity_requested}"
+
+    @property
+    def shortage(self):
+        return self.quantity_requested - self.quantity_allocated
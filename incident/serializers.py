@@ -1,14 +1,20 @@
 from rest_framework import serializers
 from .models import (
     Task, IncidentAssignment, IncidentVolunteer, IncidentUpdate,
-    IncidentResource, Incident, IncidentCategory
+    IncidentResource, Incident, IncidentCategory, ResourceLedgerEntry
 )
 from django.utils import timezone
 from django.db import transaction
+from django.core.exceptions import ValidationError as DjangoValidationError
 # from django.contrib.gis.geos import Point
 from datetime import timedelta
 from cddp.tasks import send_notification_email
+from cddp.celery import incident_task_options
+from cddp import events
+from . import demand
+from .signals import incidents_written, resources_written
 from accounts.models import User
+from cddpresources.models import Resource
 from cddp.email_templates import EmailTemplates
 from drf_spectacular.utils import extend_schema_field, OpenApiTypes
 
@@ -211,6 +217,22 @@ class IncidentCategorySerializer(serializers.ModelSerializer):
 
 
 
+def _staff_emails():
+    return list(User.objects.filter(is_staff=True).values_list('email', flat=True))
+
+
+def _resource_requests(incident, required_resources, requested_by=None):
+    return [
+        IncidentResource(
+            incident=incident,
+            resource=resource['resource'],
+            quantity_requested=resource['quantity'],
+            requested_by=requested_by
+        )
+        for resource in required_resources
+    ]
+
+
 class IncidentSerializer(serializers.ModelSerializer):
     # location = IncidentLocationSerializer()
     category_details = serializers.SerializerMethodField()
@@ -224,7 +246,8 @@ class IncidentSerializer(serializers.ModelSerializer):
         model = Incident
         fields = '__all__'
         read_only_fields = ('id', 'created_at', 'updated_at', 'verified_at', 
-                          'verified_by', 'response_time', 'is_overdue')
+                          'verified_by', 'response_time', 'is_overdue',
+                          'first_response_at', 'resolved_at', 'response_time_minutes')
         
     def get_category_details(self, obj):
         return {
@@ -235,9 +258,13 @@ class IncidentSerializer(serializers.ModelSerializer):
         }
 
     def get_assigned_responders_count(self, obj):
+        if hasattr(obj, 'responders_count'):
+            return obj.responders_count
         return obj.assigned_responders.count()
 
     def get_assigned_volunteers_count(self, obj):
+        if hasattr(obj, 'volunteers_count'):
+            return obj.volunteers_count
         return obj.assigned_volunteers.count()
 
     def get_media_resources(self, obj):
@@ -251,40 +278,40 @@ class IncidentSerializer(serializers.ModelSerializer):
 
     @transaction.atomic
     def create(self, validated_data):
-        location_data = validated_data.pop('location')
         required_skills = validated_data.pop('required_skills', [])
         required_resources = validated_data.pop('required_resources', [])
         
-        incident = Incident.objects.create(
-            location=location_data,
-            **validated_data
-        )
+        incident = Incident.objects.create(**validated_data)
 
         if required_skills:
             incident.required_skills.set(required_skills)
         
         if required_resources:
-            for resource in required_resources:
-                IncidentResource.objects.create(
-                    incident=incident,
-                    resource=resource['resource'],
-                    quantity_requested=resource['quantity']
-                )
+            requests = IncidentResource.objects.bulk_create(
+                _resource_requests(incident, required_resources)
+            )
+            demand.record((None, demand.snapshot(request)) for request in requests)
 
         if incident.category.requires_verification:
-            send_notification_email.delay(
-                subject="🔔 New Incident Requires Verification",
-                template_name='incident_verification_required',
-                context={'incident': incident},
-                recipient_list=[admin.email for admin in User.objects.filter(is_staff=True)]
+            send_notification_email.apply_async(
+                kwargs=dict(
+                    subject="🔔 New Incident Requires Verification",
+                    template_name='incident_verification_required',
+                    context={'incident': incident},
+                    recipient_list=_staff_emails()
+                ),
+                **incident_task_options(incident.priority)
             )
 
         if incident.category.auto_notify_authorities:
-            send_notification_email.delay(
-                subject="🚨 New Emergency Incident Reported",
-                template_name='incident_authority_notification',
-                context={'incident': incident},
-                recipient_list=[authority.email for authority in incident.category.authorities.all()] #!!!!!! needs update
+            send_notification_email.apply_async(
+                kwargs=dict(
+                    subject="🚨 New Emergency Incident Reported",
+                    template_name='incident_authority_notification',
+                    context={'incident': incident},
+                    recipient_list=[authority.email for authority in incident.category.authorities.all()] #!!!!!! needs update
+                ),
+                **incident_task_options(incident.priority)
             )
 
         return incident
@@ -312,6 +339,185 @@ class IncidentSerializer(serializers.ModelSerializer):
 
 
 
+class PrefetchedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Primary key field that resolves against instances loaded up front in
+    context['prefetched'][model], so validating a batch of items does not
+    run a query per related object.
+    """
+
+    def to_internal_value(self, data):
+        model = self.get_queryset().model
+        prefetched = self.context.get('prefetched', {}).get(model)
+        if prefetched is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = model._meta.pk.to_python(data)
+        except DjangoValidationError:
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if pk not in prefetched:
+            self.fail('does_not_exist', pk_value=data)
+        return prefetched[pk]
+
+
+class RequiredResourceSerializer(serializers.Serializer):
+    resource = PrefetchedPrimaryKeyRelatedField(queryset=Resource.objects.all())
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class IncidentBulkItemSerializer(IncidentSerializer):
+    """One incident of a bulk ingestion batch"""
+    serializer_related_field = PrefetchedPrimaryKeyRelatedField
+    required_resources = RequiredResourceSerializer(many=True, required=False, write_only=True)
+
+    # Related fields resolved in one query per model for the whole batch
+    SINGLE_RELATIONS = ('category', 'reporter')
+    MANY_RELATIONS = ('required_skills', 'media_resource')
+
+    # Incidents listed in the verification email, the rest are only counted
+    NOTIFICATION_LIST_LIMIT = 50
+
+    BATCH_SIZE = 500
+
+    class Meta(IncidentSerializer.Meta):
+        # Gateway reports usually arrive without media or skill assessments
+        extra_kwargs = {
+            'media_resource': {'required': False, 'allow_empty': True},
+            'required_skills': {'required': False, 'allow_empty': True},
+        }
+
+    @classmethod
+    def prefetch_related_objects(cls, items):
+        """{model: {pk: instance}} for every related object referenced by the batch"""
+        referenced = {}
+
+        def collect(model, value):
+            try:
+                referenced.setdefault(model, set()).add(model._meta.pk.to_python(value))
+            except (DjangoValidationError, TypeError):
+                pass  # Reported as a field error during validation
+
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            for name in cls.SINGLE_RELATIONS:
+                if item.get(name) is not None:
+                    collect(Incident._meta.get_field(name).related_model, item[name])
+            for name in cls.MANY_RELATIONS:
+                values = item.get(name)
+                if isinstance(values, list):
+                    for value in values:
+                        collect(Incident._meta.get_field(name).related_model, value)
+            resources = item.get('required_resources')
+            if isinstance(resources, list):
+                for resource in resources:
+                    if isinstance(resource, dict) and resource.get('resource') is not None:
+                        collect(Resource, resource['resource'])
+
+        # Related fields may limit their choices, e.g. media to assets uploaded for incidents
+        limits = {
+            Incident._meta.get_field(name).related_model: Incident._meta.get_field(name).get_limit_choices_to()
+            for name in cls.MANY_RELATIONS
+        }
+        return {
+            model: model.objects.complex_filter(limits.get(model) or {}).in_bulk(list(pks))
+            for model, pks in referenced.items()
+        }
+
+    @classmethod
+    @transaction.atomic
+    def bulk_create(cls, validated_items, requested_by=None):
+        """
+        Insert every incident, skill link and resource request of the batch with
+        one bulk INSERT per table. bulk_create bypasses the post-save signals, so
+        incidents_written and resources_written are sent for the whole batch.
+        """
+        skills_field = Incident._meta.get_field('required_skills')
+        media_field = Incident._meta.get_field('media_resource')
+
+        incidents, skill_links, media_links, resource_requests = [], [], [], []
+        for data in validated_items:
+            data = dict(data)
+            required_skills = data.pop('required_skills', [])
+            media_resources = data.pop('media_resource', [])
+            required_resources = data.pop('required_resources', [])
+
+            incident = Incident(**data)
+            incidents.append(incident)
+            skill_links.extend(
+                skills_field.remote_field.through(**{
+                    skills_field.m2m_field_name(): incident,
+                    skills_field.m2m_reverse_field_name(): skill
+                })
+                for skill in required_skills
+            )
+            media_links.extend(
+                media_field.remote_field.through(**{
+                    media_field.m2m_field_name(): incident,
+                    media_field.m2m_reverse_field_name(): media
+                })
+                for media in media_resources
+            )
+            resource_requests.extend(_resource_requests(incident, required_resources, requested_by))
+
+        Incident.objects.bulk_create(incidents, batch_size=cls.BATCH_SIZE)
+        skills_field.remote_field.through.objects.bulk_create(skill_links, batch_size=cls.BATCH_SIZE)
+        media_field.remote_field.through.objects.bulk_create(media_links, batch_size=cls.BATCH_SIZE)
+        IncidentResource.objects.bulk_create(resource_requests, batch_size=cls.BATCH_SIZE)
+        demand.record((None, demand.snapshot(request)) for request in resource_requests)
+
+        incident_keys = {(incident.created_at, incident.category_id) for incident in incidents}
+        resource_keys = {(request.requested_at, request.resource_id) for request in resource_requests}
+        incidents_written.send(sender=Incident, keys=incident_keys)
+        resources_written.send(sender=IncidentResource, keys=resource_keys)
+        transaction.on_commit(lambda: cls.notify_verification_required(incidents))
+        events.publish_many(
+            events.build_event(events.INCIDENT_CREATED, incident, {
+                'title': incident.title,
+                'status': incident.status,
+                'priority': incident.priority,
+                'category': incident.category_id,
+            }, unassigned=True)
+            for incident in incidents
+        )
+
+        return incidents
+
+    @classmethod
+    def notify_verification_required(cls, incidents):
+        """Send staff one email for every incident of the batch that needs verification"""
+        pending = [incident for incident in incidents if incident.category.requires_verification]
+        if not pending:
+            return
+
+        priority_order = [value for value, _ in reversed(Incident.PRIORITY_CHOICES)]
+        pending.sort(key=lambda incident: priority_order.index(incident.priority))
+        send_notification_email.apply_async(
+            kwargs=dict(
+                subject=f"🔔 {len(pending)} New Incidents Require Verification",
+                template_name='incident_bulk_verification_required',
+                context={
+                    'count': len(pending),
+                    'incidents': [
+                        {
+                            'id': str(incident.id),
+                            'title': incident.title,
+                            'priority': incident.get_priority_display(),
+                            'category': incident.category.name,
+                            'address': incident.address,
+                        }
+                        for incident in pending[:cls.NOTIFICATION_LIST_LIMIT]
+                    ],
+                    'remaining': max(len(pending) - cls.NOTIFICATION_LIST_LIMIT, 0),
+                },
+                recipient_list=_staff_emails()
+            ),
+            **incident_task_options(pending[0].priority)
+        )
+
+
 class IncidentUpdateSerializer(serializers.ModelSerializer):
     user_details = serializers.SerializerMethodField()
     media_resources = serializers.SerializerMethodField()
@@ -345,8 +551,12 @@ class IncidentUpdateSerializer(serializers.ModelSerializer):
         update = super().create(validated_data)
         
         if update.status_changed_to:
-            incident.status = update.status_changed_to
+            incident.record_status_change(update.status_changed_to, update.created_at)
             incident.save()
+            events.publish(events.INCIDENT_STATUS, incident, {
+                'previous_status': previous_status,
+                'status': update.status_changed_to,
+            })
             
             # Send notifications based on status change
             if update.status_changed_to == 'VERIFIED':
@@ -386,6 +596,15 @@ class IncidentUpdateSerializer(serializers.ModelSerializer):
 
 
 
+class ResourceLedgerEntrySerializer(serializers.ModelSerializer):
+    actor_name = serializers.CharField(source='actor.get_full_name', read_only=True)
+
+    class Meta:
+        model = ResourceLedgerEntry
+        fields = ['id', 'kind', 'quantity', 'actor', 'actor_name', 'notes', 'created_at']
+        read_only_fields = fields
+
+
 class IncidentResourceSerializer(serializers.ModelSerializer):
     pending_quantity = serializers.IntegerField(read_only=True)
     allocation_percentage = serializers.FloatField(read_only=True)
@@ -395,6 +614,7 @@ class IncidentResourceSerializer(serializers.ModelSerializer):
     requested_by_name = serializers.CharField(source='requested_by.get_full_name', read_only=True)
     allocated_by_name = serializers.CharField(source='allocated_by.get_full_name', read_only=True)
     return_verified_by_name = serializers.CharField(source='return_verified_by.get_full_name', read_only=True)
+    ledger = ResourceLedgerEntrySerializer(source='ledger_entries', many=True, read_only=True)
 
     class Meta:
         model = IncidentResource
@@ -404,9 +624,27 @@ class IncidentResourceSerializer(serializers.ModelSerializer):
             'allocation_percentage', 'is_fully_allocated', 'status', 'notes',
             'requested_at', 'allocated_at', 'returned_at', 'priority', 'return_status',
             'requested_by', 'requested_by_name', 'allocated_by', 'return_verified_by',
-            'allocated_by_name', 'expected_return_date','return_verified_at','partial_returns',
+            'allocated_by_name', 'expected_return_date','return_verified_at','ledger',
         ]
         read_only_fields = [
             'requested_at', 'allocated_at', 'returned_at',
-            'requested_by', 'allocated_by'
-        ]
\ No newline at end of file
+            'requested_by', 'allocated_by', 'quantity_allocated', 'status',
+            'return_status', 'return_verified_by', 'return_verified_at',
+        ]
+
+
+class ResourceAllocationItemSerializer(serializers.Serializer):
+    request = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+    expected_return_date = serializers.DateTimeField(required=False, allow_null=True)
+
+
+class ResourceAllocationBatchSerializer(serializers.Serializer):
+    allocations = ResourceAllocationItemSerializer(many=True, allow_empty=False)
+
+    MAX_ITEMS = 500
+
+    def validate_allocations(self, allocations):
+        if len(allocations) > self.MAX_ITEMS:
+            raise serializers.ValidationError(f"At most {self.MAX_ITEMS} allocations per batch")
+        return allocations
\ No newline at end of file
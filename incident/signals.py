@@ -0,0 +1,102 @@
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import Signal, receiver
+
+from cddp import events
+from cddpresources.models import Resource
+from . import demand
+from .models import Incident, IncidentAssignment, IncidentResource, IncidentUpdate, IncidentVolunteer
+
+
+# Sent for writes that bypass post_save, so other apps can refresh what they
+# derive from incidents. ``keys`` holds the (created_at, category_id) of
+# each incident written.
+incidents_written = Signal()
+
+# As above for resource requests and stock, with the (requested_at,
+# resource_id) of each request changed; empty when only stock changed.
+resources_written = Signal()
+
+
+# Status changes and allocations are published by the views that make them,
+# since a post_save cannot tell what changed.
+
+@receiver(post_save, sender=Incident)
+def publish_incident_created(sender, instance, created, **kwargs):
+    if created:
+        events.publish(events.INCIDENT_CREATED, instance, {
+            'title': instance.title,
+            'status': instance.status,
+            'priority': instance.priority,
+            'category': instance.category_id,
+        }, unassigned=True)
+
+
+@receiver(post_save, sender=IncidentUpdate)
+def publish_incident_update(sender, instance, created, **kwargs):
+    if created:
+        events.publish(events.INCIDENT_UPDATE, instance.incident, {
+            'update': instance.pk,
+            'user': instance.user_id,
+            'content': instance.content,
+            'status_changed_to': instance.status_changed_to,
+        })
+
+
+@receiver(post_save, sender=IncidentAssignment)
+def publish_responder_assignment(sender, instance, created, **kwargs):
+    if created:
+        events.publish(events.INCIDENT_ASSIGNMENT, instance.incident, {
+            'responder': instance.responder_id,
+            'role': instance.role,
+        })
+
+
+@receiver(post_save, sender=IncidentVolunteer)
+def publish_volunteer_assignment(sender, instance, created, **kwargs):
+    if created:
+        events.publish(events.VOLUNTEER_ASSIGNMENT, instance.incident, {
+            'volunteer': instance.volunteer_id,
+        })
+
+
+# Demand counters follow every saved or deleted request. The state before a
+# save is read in pre_save since the instance only knows its new values, and
+# the row stays locked until IncidentResource.save() commits, the way
+# allocation locks the requests it changes.
+
+@receiver(pre_save, sender=IncidentResource)
+def remember_demand(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    instance._demand_before = (
+        None if instance._state.adding
+        else demand.snapshots([instance.pk], lock=True).get(instance.pk)
+    )
+
+
+@receiver(post_save, sender=IncidentResource)
+def record_demand(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    demand.record([(instance.__dict__.pop('_demand_before', None), demand.snapshot(instance))])
+
+
+@receiver(post_delete, sender=IncidentResource)
+def forget_demand(sender, instance, origin=None, **kwargs):
+    # Deleting the resource deletes its counters too
+    if _deletes_resource(origin):
+        return
+    demand.record([(demand.snapshot(instance), None)])
+
+
+def _deletes_resource(origin):
+    if isinstance(origin, QuerySet):
+        return origin.model is Resource
+    return isinstance(origin, Resource)
+
+
+@receiver(post_save, sender=Resource)
+def create_demand_counters(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        demand.create_counters([instance.pk])
@@ -0,0 +1,93 @@
+"""
+Live incident event stream.
+
+Served as Server-Sent Events from an async view, so under an ASGI server one
+worker holds many open streams without tying up a thread per client.
+
+Browser EventSource can not set an Authorization header, and an access token
+in the query string would end up in server and proxy logs. Browsers instead
+POST for a ticket with their JWT and open the stream with ?ticket=. A ticket
+expires after TICKET_TTL_SECONDS and only opens one stream, so a logged URL
+is useless.
+"""
+import secrets
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.http import JsonResponse, StreamingHttpResponse
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, AuthenticationFailed
+
+from cddp import events
+
+# Long enough for the client to open the stream right after asking
+TICKET_TTL_SECONDS = 30
+
+
+def _ticket_key(ticket):
+    return f'incident-events:ticket:{ticket}'
+
+
+def issue_ticket(user):
+    """A random single-use ticket opening one event stream as the user"""
+    ticket = secrets.token_urlsafe(32)
+    cache.set(_ticket_key(ticket), user.pk, TICKET_TTL_SECONDS)
+    return ticket
+
+
+def redeem_ticket(ticket):
+    """The active user the ticket was issued to, None if it expired or was used"""
+    key = _ticket_key(ticket)
+    user_id = cache.get(key)
+    # Of two requests racing with the same ticket only one deletes it
+    if user_id is None or not cache.delete(key):
+        return None
+    return get_user_model().objects.filter(pk=user_id, is_active=True).first()
+
+
+def _authenticate(request):
+    """JWT from the Authorization header, or a ticket from the ticket query parameter"""
+    if request.GET.get('ticket'):
+        return redeem_ticket(request.GET['ticket'])
+    try:
+        result = JWTAuthentication().authenticate(request)
+    except (InvalidToken, AuthenticationFailed):
+        return None
+    return result[0] if result else None
+
+
+def _scope_for(request):
+    user = _authenticate(request)
+    return events.EventScope(user) if user is not None else None
+
+
+async def incident_events(request):
+    """Stream status changes, timeline updates, assignments and allocations visible to the user"""
+    if request.method != 'GET':
+        return JsonResponse({"detail": f'Method "{request.method}" not allowed.'}, status=405)
+
+    scope = await sync_to_async(_scope_for)(request)
+    if scope is None:
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+
+    response = StreamingHttpResponse(events.sse_stream(scope), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+class IncidentEventTicketView(APIView):
+    """Issue a ticket for opening the incident event stream from a browser"""
+
+    @extend_schema(request=None, responses={201: OpenApiTypes.OBJECT})
+    def post(self, request):
+        return Response(
+            {"ticket": issue_ticket(request.user), "expires_in": TICKET_TTL_SECONDS},
+            status=status.HTTP_201_CREATED
+        )
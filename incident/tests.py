@@ -1,3 +1,804 @@
-from django.test import TestCase
+import asyncio
+import csv
+import importlib
+import json
+from datetime import date, timedelta
+from smtplib import SMTPException
+from unittest import mock
+from django.apps import apps
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.db import connection
+from django.utils import timezone
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient, APITestCase
+from rest_framework_simplejwt.tokens import RefreshToken
 
-# Create your tests here.
+from accounts.models import User
+from reporters.models import Reporter
+from responders.models import Responder
+from volunteer.models import Volunteer, Skill
+from cddpresources.models import Resource, ResourceType
+from cloud_resource.models import MediaAsset
+from cddp import events
+from cddp.tasks import check_overdue_tasks
+from cddp.testing import create_admin, create_category, create_incident, create_reporter, create_user
+from . import aggregates, demand
+from .serializers import IncidentUpdateSerializer
+from .models import (
+    Incident, IncidentAssignment, IncidentVolunteer, IncidentUpdate, IncidentResource, Task,
+    ResourceDemand, ResourceLedgerEntry
+)
+
+
+class IncidentListQueryCountTest(APITestCase):
+    """The incident list must not issue extra queries per incident"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin(first_name='Ada', last_name='Admin')
+        cls.reporter = create_reporter(first_name='Rita', last_name='Reporter')
+        cls.category = create_category()
+        cls.counter = 0
+
+    def create_incidents(self, count):
+        for _ in range(count):
+            IncidentListQueryCountTest.counter += 1
+            n = IncidentListQueryCountTest.counter
+            incident = create_incident(
+                title=f'Incident {n}', category=self.category, reporter=self.reporter, status='RESPONDING'
+            )
+            responder = Responder.objects.create(
+                user=User.objects.create_user(email=f'responder{n}@example.com', password='password'),
+                organization='Red Cross',
+                certification_expiry=date.today() + timedelta(days=365),
+            )
+            volunteer = Volunteer.objects.create(
+                user=User.objects.create_user(email=f'volunteer{n}@example.com', password='password')
+            )
+            IncidentAssignment.objects.create(incident=incident, responder=responder, role='PRIMARY')
+            IncidentVolunteer.objects.create(incident=incident, volunteer=volunteer)
+            IncidentUpdate.objects.create(
+                incident=incident, user=self.admin, content='On site', status_changed_to='RESPONDING'
+            )
+
+    def count_list_queries(self):
+        # Authenticate with a fresh instance so the role cache starts empty
+        self.client.force_authenticate(User.objects.get(pk=self.admin.pk))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('incident-list'))
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def test_query_count_is_constant(self):
+        self.create_incidents(2)
+        few_queries, _ = self.count_list_queries()
+
+        self.create_incidents(6)
+        many_queries, response = self.count_list_queries()
+
+        self.assertEqual(few_queries, many_queries)
+        self.assertEqual(response.data['total'], 8)
+
+    def test_annotated_values(self):
+        self.create_incidents(1)
+        _, response = self.count_list_queries()
+
+        incident = response.data['results'][0]
+        self.assertEqual(incident['assigned_responders_count'], 1)
+        self.assertEqual(incident['assigned_volunteers_count'], 1)
+        self.assertEqual(incident['response_time'], 0)
+
+
+class OverdueTaskDigestTest(APITestCase):
+    """Overdue task notifications are batched into one email per volunteer"""
+
+    @classmethod
+    def setUpTestData(cls):
+        creator = User.objects.create_user(email='creator@example.com', password='password')
+        incident = create_incident(
+            title='Warehouse fire',
+            description='Smoke',
+            category=create_category(name='Fire', description='Fire', severity_level=4),
+            reporter=Reporter.objects.create(user=creator),
+        )
+        cls.tasks = [
+            Task.objects.create(
+                title=f'Task {n}',
+                description='Help out',
+                incident=incident,
+                created_by=creator,
+                due_date=timezone.now() - timedelta(hours=1),
+            )
+            for n in range(3)
+        ]
+        for n in range(4):
+            volunteer = Volunteer.objects.create(
+                user=User.objects.create_user(
+                    email=f'volunteer{n}@example.com', password='password', first_name='Vol', last_name=str(n)
+                )
+            )
+            assignment = IncidentVolunteer.objects.create(incident=incident, volunteer=volunteer)
+            assignment.tasks.set(cls.tasks)
+
+    def test_one_digest_per_volunteer(self):
+        sent = check_overdue_tasks()
+
+        self.assertEqual(sent, 4)
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox),
+            [f'volunteer{n}@example.com' for n in range(4)]
+        )
+        for message in mail.outbox:
+            html = message.alternatives[0][0]
+            for task in self.tasks:
+                self.assertIn(task.title, html)
+
+    def test_repeated_sweeps_do_not_resend(self):
+        check_overdue_tasks()
+        mail.outbox = []
+
+        self.assertEqual(check_overdue_tasks(), 0)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_failed_sends_are_retried_next_sweep(self):
+        send_messages = locmem.EmailBackend.send_messages
+
+        def fail_after_two(backend, messages):
+            if len(mail.outbox) >= 2:
+                raise SMTPException('Connection lost')
+            return send_messages(backend, messages)
+
+        with mock.patch.object(locmem.EmailBackend, 'send_messages', fail_after_two):
+            with self.assertRaises(SMTPException):
+                check_overdue_tasks()
+        delivered = {message.to[0] for message in mail.outbox}
+        mail.outbox = []
+
+        self.assertEqual(check_overdue_tasks(), 2)
+        self.assertFalse(delivered & {message.to[0] for message in mail.outbox})
+
+    def test_new_due_date_is_notified_again(self):
+        check_overdue_tasks()
+        mail.outbox = []
+
+        task = self.tasks[0]
+        task.due_date = timezone.now() - timedelta(minutes=5)
+        task.save()
+
+        self.assertEqual(check_overdue_tasks(), 4)
+        for message in mail.outbox:
+            html = message.alternatives[0][0]
+            self.assertIn(task.title, html)
+            self.assertNotIn(self.tasks[1].title, html)
+
+    def test_no_email_when_nothing_is_overdue(self):
+        Task.objects.update(due_date=timezone.now() + timedelta(days=2))
+
+        self.assertEqual(check_overdue_tasks(), 0)
+        self.assertEqual(len(mail.outbox), 0)
+
+
+@override_settings(EVENT_BROKER='memory')
+class IncidentStatusTimestampTest(TestCase):
+    """Status changes stamp the first response and resolution once"""
+
+    def setUp(self):
+        self.incident = create_incident()
+        self.created = self.incident.created_at
+
+    def test_first_response_and_resolution(self):
+        self.incident.record_status_change('VERIFIED', self.created + timedelta(minutes=5))
+        self.assertIsNone(self.incident.first_response_at)
+
+        self.incident.record_status_change('RESPONDING', self.created + timedelta(minutes=42))
+        self.incident.record_status_change('IN_PROGRESS', self.created + timedelta(minutes=50))
+        self.assertEqual(self.incident.first_response_at, self.created + timedelta(minutes=42))
+        self.assertEqual(self.incident.response_time_minutes, 42)
+
+        resolved = self.created + timedelta(hours=3)
+        self.incident.record_status_change('RESOLVED', resolved)
+        self.incident.record_status_change('CLOSED', resolved + timedelta(hours=1))
+        self.assertEqual((self.incident.status, self.incident.resolved_at), ('CLOSED', resolved))
+
+    def test_reopening_clears_the_resolution(self):
+        self.incident.record_status_change('RESOLVED', self.created + timedelta(hours=1))
+        self.incident.record_status_change('RESPONDING', self.created + timedelta(hours=2))
+        self.assertIsNone(self.incident.resolved_at)
+        # Responding after a resolution still counts as the first response
+        self.assertEqual(self.incident.response_time_minutes, 120)
+
+    def test_status_updates_are_recorded(self):
+        Incident.objects.filter(pk=self.incident.pk).update(status='VERIFIED')
+        serializer = IncidentUpdateSerializer(data={
+            'incident': str(self.incident.pk), 'user': str(self.incident.reporter.user.pk),
+            'content': 'Crew on site', 'status_changed_to': 'RESPONDING',
+            'media_resource': [MediaAsset.objects.create(owner_type=MediaAsset.INCIDENT, title='Crew').pk],
+        })
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        update = serializer.save()
+
+        self.incident.refresh_from_db()
+        self.assertEqual((self.incident.status, self.incident.first_response_at), ('RESPONDING', update.created_at))
+        self.assertIsNotNone(self.incident.response_time_minutes)
+
+
+@override_settings(EVENT_BROKER='memory')
+class IncidentAggregatesTest(TestCase):
+    """Incident metrics are computed in one query and grouped by status and priority"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category, reporter = create_category(), create_reporter()
+        for status, priority, minutes in [
+            ('REPORTED', 'HIGH', None),
+            ('RESPONDING', 'HIGH', 30),
+            ('RESOLVED', 'LOW', 200),
+            ('CLOSED', 'LOW', 800),
+        ]:
+            incident = create_incident(category=category, reporter=reporter, priority=priority)
+            Incident.objects.filter(pk=incident.pk).update(status=status, response_time_minutes=minutes)
+
+    def test_incident_metrics(self):
+        with self.assertNumQueries(1):
+            metrics = aggregates.incident_metrics(Incident.objects.all())
+        self.assertEqual((metrics['total'], metrics['max_response_time']), (4, 800))
+        self.assertAlmostEqual(metrics['average_response_time'], (30 + 200 + 800) / 3)
+        self.assertEqual(aggregates.response_time_distribution(metrics), {
+            'under_1h': 1, '1h_to_3h': 0, '3h_to_6h': 1, '6h_to_12h': 0, 'over_12h': 1,
+        })
+
+    def test_breakdown_skips_empty_groups(self):
+        metrics = aggregates.incident_metrics(Incident.objects.all())
+        self.assertEqual(aggregates.breakdown(metrics, 'priority'), [
+            {'priority': 'LOW', 'count': 2, 'avg_response_time': 500},
+            {'priority': 'HIGH', 'count': 2, 'avg_response_time': 30},
+        ])
+        self.assertEqual(
+            [(row['status'], row['count']) for row in aggregates.breakdown(metrics, 'status')],
+            [('REPORTED', 1), ('RESPONDING', 1), ('RESOLVED', 1), ('CLOSED', 1)]
+        )
+
+    def test_percentage(self):
+        self.assertEqual(aggregates.percentage(1, 4), 25.0)
+        self.assertEqual(aggregates.percentage(3, 0), 0)
+
+
+@override_settings(EVENT_BROKER='memory')
+class BulkIncidentCreateTest(APITestCase):
+    """A batch of incidents is validated per item and inserted in bulk"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin(is_staff=True)
+        cls.reporter = create_reporter()
+        cls.category = create_category(severity_level=4, requires_verification=True)
+        cls.skill = Skill.objects.create(name='First aid', description='First aid')
+        cls.resource = Resource.objects.create(
+            name='Sandbags',
+            resource_type=ResourceType.objects.create(name='Supplies'),
+            description='Sandbags',
+            unit='bag',
+        )
+
+    def item(self, n, **overrides):
+        item = {
+            'title': f'Flooded street {n}',
+            'description': 'Water rising',
+            'category': self.category.pk,
+            'reporter': self.reporter.pk,
+            'required_skills': [self.skill.pk],
+            'required_resources': [{'resource': self.resource.pk, 'quantity': 10}],
+        }
+        item.update(overrides)
+        return item
+
+    def post(self, items):
+        self.client.force_authenticate(User.objects.get(pk=self.admin.pk))
+        with mock.patch('incident.serializers.send_notification_email.apply_async') as notify:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(reverse('incident-bulk'), items, format='json')
+        return response, notify
+
+    def test_partial_batch_reports_item_errors(self):
+        response, notify = self.post([
+            self.item(1),
+            self.item(2, category=9999),
+            self.item(3, required_resources=[{'resource': self.resource.pk, 'quantity': 0}]),
+            self.item(4, required_skills=[]),
+        ])
+
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([created['index'] for created in response.data['created']], [0, 3])
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 2])
+        self.assertIn('category', response.data['errors'][0]['errors'])
+
+        self.assertEqual(Incident.objects.count(), 2)
+        incident = Incident.objects.get(title='Flooded street 1')
+        self.assertEqual(incident.priority, 'HIGH')
+        self.assertEqual(list(incident.required_skills.all()), [self.skill])
+        request = IncidentResource.objects.get(incident=incident)
+        self.assertEqual(request.quantity_requested, 10)
+        self.assertEqual(request.requested_by, self.admin)
+
+        notify.assert_called_once()
+        self.assertEqual(notify.call_args.kwargs['kwargs']['context']['count'], 2)
+        # High priority alerts jump the notifications queue
+        self.assertEqual(notify.call_args.kwargs['priority'], 3)
+        self.assertEqual(notify.call_args.kwargs['kwargs']['recipient_list'], ['admin@example.com'])
+
+    def test_query_count_does_not_grow_with_batch(self):
+        def count_queries(items):
+            self.client.force_authenticate(User.objects.get(pk=self.admin.pk))
+            with mock.patch('incident.serializers.send_notification_email.apply_async'):
+                with CaptureQueriesContext(connection) as queries:
+                    self.client.post(reverse('incident-bulk'), items, format='json')
+            return len(queries)
+
+        few = count_queries([self.item(n) for n in range(2)])
+        many = count_queries([self.item(n) for n in range(20)])
+
+        self.assertEqual(few, many)
+        self.assertEqual(Incident.objects.count(), 22)
+
+    def test_rejects_invalid_batches(self):
+        response, notify = self.post({'title': 'Not a list'})
+        self.assertEqual(response.status_code, 400)
+
+        response, notify = self.post([self.item(1, reporter=None)])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Incident.objects.count(), 0)
+        notify.assert_not_called()
+
+
+class IncidentExportTest(APITestCase):
+    """Exports stream every matching row without pagination"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        reporter = create_reporter()
+        category = create_category()
+        for n in range(15):
+            create_incident(
+                title=f'Incident {n}',
+                description='Water rising',
+                category=category,
+                reporter=reporter,
+                status='RESOLVED' if n % 3 == 0 else 'REPORTED',
+            )
+
+    def export(self, **params):
+        self.client.force_authenticate(User.objects.get(pk=self.admin.pk))
+        response = self.client.get(reverse('incident-export'), params)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_ndjson_applies_filters(self):
+        response, body = self.export(status='RESOLVED')
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(len(rows), 5)
+        self.assertTrue(all(row['status'] == 'RESOLVED' for row in rows))
+        self.assertEqual(rows[0]['category_name'], 'Flood')
+
+    def test_csv_includes_every_row(self):
+        response, body = self.export(export_format='csv')
+
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(body.splitlines()))
+        self.assertEqual(len(rows), 15)
+        self.assertIn('response_time_minutes', rows[0])
+
+    def test_unknown_format_is_rejected(self):
+        self.client.force_authenticate(User.objects.get(pk=self.admin.pk))
+        response = self.client.get(reverse('incident-export'), {'export_format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+
+class IncidentCursorPaginationTest(APITestCase):
+    """Cursor pages walk the feed on (created_at, id) without gaps or repeats"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.reporter = create_reporter()
+        cls.category = create_category()
+        for n in range(25):
+            cls.create_incident(n)
+        # Several incidents sharing a timestamp must still page deterministically
+        tied = Incident.objects.order_by('created_at').values_list('pk', flat=True)[5:12]
+        Incident.objects.filter(pk__in=list(tied)).update(created_at=timezone.now() - timedelta(hours=1))
+
+    @classmethod
+    def create_incident(cls, n):
+        return create_incident(title=f'Incident {n}', category=cls.category, reporter=cls.reporter)
+
+    def get(self, url, params=None):
+        self.client.force_authenticate(User.objects.get(pk=self.admin.pk))
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_walks_every_incident_once(self):
+        expected = list(Incident.objects.order_by('-created_at', '-pk').values_list('pk', flat=True))
+
+        page = self.get(reverse('incident-list'), {'pagination': 'cursor', 'page_size': 10})
+        self.assertNotIn('total', page)
+        self.assertIsNone(page['links']['previous'])
+        seen = [row['id'] for row in page['results']]
+
+        # New reports arriving mid-scroll do not shift the following pages
+        self.create_incident(99)
+        while page['links']['next']:
+            page = self.get(page['links']['next'])
+            seen.extend(row['id'] for row in page['results'])
+
+        self.assertEqual([str(pk) for pk in expected], [str(pk) for pk in seen])
+
+    def test_previous_link_returns_the_earlier_page(self):
+        first = self.get(reverse('incident-list'), {'pagination': 'cursor', 'page_size': 10})
+        second = self.get(first['links']['next'])
+        back = self.get(second['links']['previous'])
+
+        self.assertEqual(
+            [row['id'] for row in back['results']],
+            [row['id'] for row in first['results']]
+        )
+
+    def test_estimated_total(self):
+        page = self.get(reverse('incident-list'), {'count': 'estimate'})
+
+        self.assertEqual(page['total'], 25)
+        self.assertTrue(page['total_is_estimate'])
+
+    def test_reports_the_page_size_applied(self):
+        page = self.get(reverse('incident-list'), {'page_size': 20})
+        self.assertEqual((page['page_size'], page['total_pages'], len(page['results'])), (20, 2, 20))
+
+        page = self.get(reverse('incident-list'), {'page_size': 'all'})
+        self.assertEqual((page['page_size'], page['total_pages'], len(page['results'])), (10, 3, 10))
+
+        page = self.get(reverse('incident-list'), {'pagination': 'cursor', 'page_size': 20})
+        self.assertEqual((page['page_size'], len(page['results'])), (20, 20))
+
+    def test_invalid_cursor(self):
+        self.client.force_authenticate(User.objects.get(pk=self.admin.pk))
+        response = self.client.get(reverse('incident-list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(EVENT_BROKER='memory')
+class IncidentEventStreamTest(TestCase):
+    """Committed changes reach the subscribers allowed to see the incident"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reporters = [
+            Reporter.objects.create(user=create_user(f'reporter{n}@example.com', 'REPORTER')) for n in range(2)
+        ]
+        category = create_category()
+        cls.incidents = [
+            create_incident(title=f'Incident {n}', category=category, reporter=reporter, is_sensitive=True)
+            for n, reporter in enumerate(cls.reporters)
+        ]
+
+    def test_publishes_after_commit(self):
+        with mock.patch('cddp.events.get_broker') as get_broker:
+            with self.captureOnCommitCallbacks(execute=True):
+                IncidentUpdate.objects.create(
+                    incident=self.incidents[0], user=self.reporters[0].user, content='Road closed'
+                )
+                get_broker.assert_not_called()
+
+        (published,), _ = get_broker.return_value.publish.call_args
+        self.assertEqual(published[0]['type'], events.INCIDENT_UPDATE)
+        self.assertEqual(published[0]['data']['content'], 'Road closed')
+
+    def test_stream_is_scoped_to_the_user(self):
+        scope = events.EventScope(User.objects.get(pk=self.reporters[0].user.pk))
+        own, other = (
+            events.build_event(events.INCIDENT_STATUS, incident, {'status': 'VERIFIED'})
+            for incident in self.incidents
+        )
+        broker = events.InMemoryBroker()
+
+        async def read():
+            stream = events.sse_stream(scope, broker=broker, heartbeat=0.05)
+            chunks = [await stream.__anext__()]
+            broker.publish([other, own])
+            chunks.append(await stream.__anext__())
+            chunks.append(await stream.__anext__())
+            await stream.aclose()
+            return chunks
+
+        retry, event, keep_alive = asyncio.run(read())
+
+        self.assertTrue(retry.startswith('retry:'))
+        self.assertIn(f'id: {own["id"]}', event)
+        self.assertIn('event: incident.status', event)
+        self.assertNotIn('audience', event)
+        self.assertEqual(keep_alive, ': keep-alive\n\n')
+
+    def test_stream_requires_authentication(self):
+        response = self.client.get(reverse('incident-events'))
+        self.assertEqual(response.status_code, 401)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_stream_tickets_are_single_use(self):
+        self.assertEqual(self.client.post(reverse('incident-events-ticket')).status_code, 401)
+
+        client = APIClient()
+        client.force_authenticate(User.objects.get(pk=self.reporters[0].user.pk))
+        response = client.post(reverse('incident-events-ticket'))
+        self.assertEqual(response.status_code, 201)
+        ticket = response.data['ticket']
+
+        with mock.patch('incident.streams.events.sse_stream', return_value=iter([': keep-alive\n\n'])):
+            response = self.client.get(reverse('incident-events'), {'ticket': ticket})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            # A ticket read back from a log opens nothing
+            response = self.client.get(reverse('incident-events'), {'ticket': ticket})
+            self.assertEqual(response.status_code, 401)
+
+    def test_stream_ignores_access_tokens_in_the_query(self):
+        token = RefreshToken.for_user(self.reporters[0].user).access_token
+        response = self.client.get(reverse('incident-events'), {'access_token': str(token)})
+        self.assertEqual(response.status_code, 401)
+
+
+@mock.patch('incident.views.send_return_verification_notification.delay')
+@mock.patch('incident.views.send_return_submission_notification.delay')
+@mock.patch('incident.views.send_allocation_notification.delay')
+class ResourceAllocationTest(APITestCase):
+    """Allocations are conditional updates recorded in the ledger"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        incident = create_incident()
+        resource_type = ResourceType.objects.create(name='Supplies')
+        cls.sandbags = Resource.objects.create(
+            name='Sandbags', resource_type=resource_type, description='Sandbags', unit='bag', quantity_available=10
+        )
+        cls.pumps = Resource.objects.create(
+            name='Pumps', resource_type=resource_type, description='Pumps', unit='pump', quantity_available=2
+        )
+        cls.sandbag_request = IncidentResource.objects.create(
+            incident=incident, resource=cls.sandbags, quantity_requested=8
+        )
+        cls.pump_request = IncidentResource.objects.create(
+            incident=incident, resource=cls.pumps, quantity_requested=3
+        )
+
+    def setUp(self):
+        self.client.force_authenticate(User.objects.get(pk=self.admin.pk))
+
+    def post(self, name, data, request=None):
+        args = [request.pk] if request else []
+        return self.client.post(reverse(f'resource-{name}', args=args), data, format='json')
+
+    def test_allocation_is_bounded_and_recorded(self, *notifications):
+        response = self.post('allocate', {'quantity': 5}, self.sandbag_request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'PARTIALLY_ALLOCATED')
+
+        self.assertEqual(self.post('allocate', {'quantity': 4}, self.sandbag_request).status_code, 400)
+        self.assertEqual(self.post('allocate', {'quantity': 'lots'}, self.sandbag_request).status_code, 400)
+        response = self.post('allocate', {'quantity': 3}, self.sandbag_request)
+        self.assertEqual(response.data['status'], 'FULLY_ALLOCATED')
+        self.assertEqual([entry['quantity'] for entry in response.data['ledger']], [5, 3])
+
+        self.sandbags.refresh_from_db()
+        self.assertEqual(self.sandbags.quantity_allocated, 8)
+
+    def test_expected_return_date_is_validated(self, *notifications):
+        response = self.post('allocate', {'quantity': 1, 'expected_return_date': 'next week'}, self.sandbag_request)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('expected_return_date', response.data)
+
+        response = self.post(
+            'allocate', {'quantity': 1, 'expected_return_date': '2030-01-31T12:00:00Z'}, self.sandbag_request
+        )
+        self.assertEqual(response.status_code, 200)
+        self.sandbag_request.refresh_from_db()
+        self.assertEqual(self.sandbag_request.expected_return_date.date(), date(2030, 1, 31))
+
+    def test_stock_limits_allocation(self, *notifications):
+        self.assertEqual(self.post('allocate', {'quantity': 3}, self.pump_request).status_code, 400)
+        self.pump_request.refresh_from_db()
+        self.assertEqual(self.pump_request.quantity_allocated, 0)
+
+    def test_batch_is_all_or_nothing(self, *notifications):
+        response = self.post('allocate-batch', {'allocations': [
+            {'request': self.sandbag_request.pk, 'quantity': 4},
+            {'request': self.pump_request.pk, 'quantity': 3},
+        ]})
+        self.assertEqual(response.status_code, 400)
+        self.sandbags.refresh_from_db()
+        self.assertEqual(self.sandbags.quantity_allocated, 0)
+        self.assertFalse(ResourceLedgerEntry.objects.exists())
+
+        response = self.post('allocate-batch', {'allocations': [
+            {'request': self.sandbag_request.pk, 'quantity': 4},
+            {'request': self.pump_request.pk, 'quantity': 2},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([request['quantity_allocated'] for request in response.data], [4, 2])
+        self.assertEqual(ResourceLedgerEntry.objects.filter(kind=ResourceLedgerEntry.ALLOCATED).count(), 2)
+
+    def test_returns_release_stock_once_verified(self, *notifications):
+        self.post('allocate', {'quantity': 8}, self.sandbag_request)
+        self.assertEqual(self.post('submit-return', {'quantity': 9}, self.sandbag_request).status_code, 400)
+
+        response = self.post('submit-return', {'quantity': 3}, self.sandbag_request)
+        self.assertEqual(response.data['return_status'], 'SUBMITTED')
+        self.sandbags.refresh_from_db()
+        self.assertEqual(self.sandbags.quantity_allocated, 8)
+
+        response = self.post('verify-return', {'quantity': 3}, self.sandbag_request)
+        self.assertEqual(response.data['status'], 'PARTIALLY_ALLOCATED')
+        self.assertEqual(response.data['quantity_allocated'], 5)
+        self.assertEqual(
+            [entry['kind'] for entry in response.data['ledger']],
+            ['ALLOCATED', 'RETURN_SUBMITTED', 'RETURN_VERIFIED']
+        )
+        self.sandbags.refresh_from_db()
+        self.assertEqual(self.sandbags.quantity_allocated, 5)
+
+        # Only a submitted return can be verified, and only up to what was submitted
+        self.assertEqual(self.post('verify-return', {'quantity': 5}, self.sandbag_request).status_code, 400)
+        self.post('submit-return', {'quantity': 5}, self.sandbag_request)
+        self.assertEqual(self.post('verify-return', {'quantity': 6}, self.sandbag_request).status_code, 400)
+        response = self.post('verify-return', {}, self.sandbag_request)
+        self.assertEqual((response.data['status'], response.data['quantity_allocated']), ('RETURNED', 0))
+        self.assertEqual(self.post('cancel', {}, self.pump_request).data['status'], 'CANCELLED')
+        self.assertEqual(self.post('allocate', {'quantity': 1}, self.pump_request).status_code, 400)
+
+
+    def test_ledger_migration_reserves_allocated_stock(self, *notifications):
+        IncidentResource.objects.filter(pk=self.sandbag_request.pk).update(quantity_allocated=4)
+        Resource.objects.filter(pk=self.sandbags.pk).update(quantity_allocated=2)
+
+        migration = importlib.import_module('incident.migrations.0005_resource_ledger')
+        migration.reserve_allocated_stock(apps, None)
+        self.sandbags.refresh_from_db()
+        self.assertEqual(self.sandbags.quantity_allocated, 6)
+
+
+@mock.patch('incident.views.send_return_verification_notification.delay')
+@mock.patch('incident.views.send_return_submission_notification.delay')
+@mock.patch('incident.views.send_allocation_notification.delay')
+class ResourceDemandCounterTest(APITestCase):
+    """Demand counters follow every request change and match a full recount"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.incident = create_incident()
+        cls.sandbags = Resource.objects.create(
+            name='Sandbags', resource_type=ResourceType.objects.create(name='Supplies'),
+            description='Sandbags', unit='bag', quantity_available=100
+        )
+
+    def setUp(self):
+        self.client.force_authenticate(User.objects.get(pk=self.admin.pk))
+
+    def counters(self):
+        return {
+            counter.priority: (
+                counter.request_count, counter.pending_count, counter.quantity_requested, counter.quantity_allocated
+            )
+            for counter in ResourceDemand.objects.filter(request_count__gt=0)
+        }
+
+    def request(self, quantity, priority='MEDIUM'):
+        response = self.client.post(reverse('resource-list'), {
+            'incident': str(self.incident.pk), 'resource': self.sandbags.pk,
+            'quantity_requested': quantity, 'priority': priority,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return IncidentResource.objects.get(pk=response.data['id'])
+
+    def action(self, name, request, data=None):
+        return self.client.post(reverse(f'resource-{name}', args=[request.pk]), data or {}, format='json')
+
+    def test_counters_follow_requests(self, *notifications):
+        urgent = self.request(10, 'CRITICAL')
+        routine = self.request(4)
+        cancelled = self.request(3)
+        self.assertEqual(self.counters(), {'CRITICAL': (1, 1, 10, 0), 'MEDIUM': (2, 2, 7, 0)})
+
+        self.action('allocate', urgent, {'quantity': 6})
+        self.action('allocate', routine, {'quantity': 4})
+        self.action('cancel', cancelled)
+        self.assertEqual(self.counters(), {'CRITICAL': (1, 0, 10, 6), 'MEDIUM': (1, 0, 4, 4)})
+
+        response = self.client.get(reverse('resource-resource-needs'))
+        self.assertEqual(response.data, [{
+            'resource__name': 'Sandbags', 'resource__id': self.sandbags.pk, 'priority': 'CRITICAL',
+            'total_requested': 10, 'total_allocated': 6, 'pending_requests': 0, 'shortage': 4,
+            'urgent_requests': 1,
+        }])
+
+        self.action('submit-return', routine, {'quantity': 4})
+        self.action('verify-return', routine)
+        self.client.patch(reverse('resource-detail', args=[urgent.pk]), {'quantity_requested': 8}, format='json')
+        self.assertEqual(self.counters(), {'CRITICAL': (1, 0, 8, 6)})
+
+        urgent.delete()
+        self.assertEqual(self.counters(), {})
+
+    def test_deleting_a_resource_deletes_its_counters(self, *notifications):
+        self.request(4)
+        self.sandbags.delete()
+        self.assertFalse(ResourceDemand.objects.filter(resource_id=self.sandbags.pk).exists())
+        self.assertFalse(IncidentResource.objects.exists())
+
+        pumps = Resource.objects.create(
+            name='Pumps', resource_type=self.sandbags.resource_type, description='Pumps', unit='pump'
+        )
+        IncidentResource.objects.create(incident=self.incident, resource=pumps, quantity_requested=2)
+        Resource.objects.filter(pk=pumps.pk).delete()
+        self.assertFalse(ResourceDemand.objects.exists())
+
+    def test_saves_lock_the_request_they_count(self, *notifications):
+        request = self.request(4)
+        outer = len(connection.savepoint_ids)
+        locks = []
+        snapshots = demand.snapshots
+
+        def spy(request_ids, lock=False):
+            locks.append((lock, len(connection.savepoint_ids) > outer))
+            return snapshots(request_ids, lock)
+
+        with mock.patch('incident.demand.snapshots', spy):
+            request.quantity_requested = 6
+            request.save()
+        self.assertEqual(locks, [(True, True)])
+        self.assertEqual(self.counters(), {'MEDIUM': (1, 1, 6, 0)})
+
+    def test_counters_match_a_recount(self, *notifications):
+        requests = [self.request(quantity, priority) for quantity, priority in ((5, 'HIGH'), (7, 'LOW'), (2, 'LOW'))]
+        self.client.post(reverse('resource-allocate-batch'), {'allocations': [
+            {'request': requests[0].pk, 'quantity': 5}, {'request': requests[1].pk, 'quantity': 3},
+        ]}, format='json')
+        self.action('cancel', requests[2])
+
+        maintained = self.counters()
+        demand.rebuild()
+        self.assertEqual(self.counters(), maintained)
+
+
+class NearestVolunteersTest(APITestCase):
+    """Searches around an incident reject malformed query parameters"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.incident = create_incident()
+
+    def setUp(self):
+        self.client.force_authenticate(self.admin)
+
+    def test_rejects_invalid_queries(self):
+        url = reverse('incident-nearest-volunteers', args=[self.incident.pk])
+        for params in (
+            {'limit': 0},
+            {'radius': -1},
+            {'latitude': 'nan', 'longitude': 3.3},
+            {'latitude': 6.5, 'longitude': 'inf'},
+            {'latitude': 6.5, 'longitude': 181},
+            {'longitude': 3.3},
+        ):
+            self.assertEqual(self.client.get(url, params).status_code, 400, params)
+
+    def test_searches_around_the_given_point(self):
+        url = reverse('incident-nearest-volunteers', args=[self.incident.pk])
+        response = self.client.get(url, {'latitude': 6.5, 'longitude': 3.3, 'limit': 5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['volunteers'], [])
@@ -1,6 +1,8 @@
+from django.urls import path
 from rest_framework.routers import DefaultRouter
 from .views import( ResourceManagementViewSet, IncidentCategoryViewSet,
                     TaskViewSet, IncidentViewSet)
+from .streams import incident_events, IncidentEventTicketView
 
 router = DefaultRouter()
 router.register(r'resources', ResourceManagementViewSet, basename='resource')
@@ -11,5 +13,6 @@ router.register(r'tasks', TaskViewSet, basename='tasks')
 
 
 urlpatterns = [
-
+    path('events/', incident_events, name='incident-events'),
+    path('events/ticket/', IncidentEventTicketView.as_view(), name='incident-events-ticket'),
 ] + router.urls
@@ -5,14 +5,17 @@ from .models import ( Incident, IncidentAssignment,
 from .filters import TaskFilter, IncidentVolunteerFilter, IncidentAssignmentFilter, IncidentFilter, IncidentResourceFilter
 from .serializers import (TaskSerializer, IncidentSerializer, IncidentResourceSerializer,
                           IncidentAssignmentSerializer, IncidentUpdateSerializer,
-                         IncidentCategorySerializer)
-from rest_framework import viewsets, filters, status
+                         IncidentCategorySerializer, IncidentBulkItemSerializer,
+                         ResourceAllocationBatchSerializer)
+from rest_framework import viewsets, filters, serializers, status
 from django_filters.rest_framework import DjangoFilterBackend
 from accounts.permissions import AdminPermission, ResponderPermission, VolunteerPermission, ReporterPermission
-from django.db.models import Q
+from django.db.models import Q, F, Exists, OuterRef, Subquery, Count, IntegerField
+from django.db.models.functions import Coalesce
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from volunteer.models import Volunteer
+from volunteer import matching
 from django.utils import timezone
 from django.db import transaction
 from django.core.mail import send_mail
@@ -22,14 +25,92 @@ from cddp.tasks import(send_return_submission_notification, send_return_verifica
                        send_overdue_reminder, send_allocation_notification, send_task_completion_notification,
                        send_task_assignment_notification, send_incident_status_notification,
                        send_responder_assignment_notification)
+from cddp.celery import incident_task_options
+from cddp import events
+from . import allocation, demand
+from .allocation import AllocationError
 from django.urls import reverse
 from responders.models import Responder
+from accounts.serializers import NearbySearchQuerySerializer
+from accounts.spatial import nearby_profiles
+from . import aggregates
+from cddp.exports import export_response, EXPORT_FORMAT_PARAMETER
+from cddp.pagination import FeedPagination
 # from django.contrib.gis.measure import D
 from drf_spectacular.utils import extend_schema, OpenApiParameter
 from drf_spectacular.types import OpenApiTypes
 
 
 
+def _count_subquery(through_model):
+    """Correlated COUNT over an incident through table, 0 when there are no rows"""
+    counts = through_model.objects.filter(
+        incident=OuterRef('pk')
+    ).order_by().values('incident').annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+MATCH_PARAMETERS = [
+    OpenApiParameter(name='latitude', type=OpenApiTypes.FLOAT, location=OpenApiParameter.QUERY,
+                     description="Latitude of the work site (default: reporter's location)", required=False),
+    OpenApiParameter(name='longitude', type=OpenApiTypes.FLOAT, location=OpenApiParameter.QUERY,
+                     description='Longitude of the work site', required=False),
+    OpenApiParameter(name='require_all', type=OpenApiTypes.BOOL, location=OpenApiParameter.QUERY,
+                     description='Only volunteers with every required skill', required=False),
+    OpenApiParameter(name='limit', type=OpenApiTypes.INT, location=OpenApiParameter.QUERY,
+                     description=f'Number of matches (default {matching.DEFAULT_LIMIT}, max {matching.MAX_LIMIT})',
+                     required=False),
+]
+
+
+def _match_options(request, incident=None):
+    """
+    Matching options from the query string, or a 400 response. Distances are
+    measured from latitude/longitude or, like the nearby searches, from the
+    incident reporter's last known location.
+    """
+    params = request.query_params
+    try:
+        limit = min(int(params.get('limit', matching.DEFAULT_LIMIT)), matching.MAX_LIMIT)
+        origin = None
+        if params.get('latitude') or params.get('longitude'):
+            origin = (float(params['latitude']), float(params['longitude']))
+    except (KeyError, ValueError):
+        return Response(
+            {"detail": "limit must be an integer and latitude/longitude numbers given together"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if limit < 1:
+        return Response({"detail": "limit must be positive"}, status=status.HTTP_400_BAD_REQUEST)
+    if origin is None and incident is not None and incident.reporter.user.location:
+        origin = incident.reporter.user.location.coordinates
+    return {
+        'origin': origin,
+        'require_all': params.get('require_all', '').lower() in ('1', 'true'),
+        'limit': limit,
+    }
+
+
+def _volunteer_matches(matches):
+    volunteers = Volunteer.objects.select_related('user').in_bulk([match.volunteer_id for match in matches])
+    return [
+        {
+            'id': volunteer.id,
+            'name': volunteer.user.full_name,
+            'experience_level': volunteer.experience_level,
+            'rating': volunteer.rating,
+            'score': match.score,
+            'skill_coverage': match.skill_coverage,
+            'missing_skills': match.missing_skills,
+            'distance_km': match.distance_km,
+        }
+        for match in matches
+        # The snapshot may still hold volunteers deleted since it was built
+        if match.volunteer_id in volunteers
+        for volunteer in [volunteers[match.volunteer_id]]
+    ]
+
+
 class TaskViewSet(viewsets.ModelViewSet):
     serializer_class = TaskSerializer
     permission_classes = [AdminPermission|ResponderPermission|VolunteerPermission]
@@ -38,6 +119,7 @@ class TaskViewSet(viewsets.ModelViewSet):
     queryset = Task.objects.all()
     search_fields = ['title', 'description']
     ordering_fields = ['priority', 'due_date', 'created_at', 'status']
+    pagination_class = FeedPagination
 
     from django.db.models import Q
 
@@ -79,7 +161,9 @@ class TaskViewSet(viewsets.ModelViewSet):
             volunteer = Volunteer.objects.get(id=volunteer_id)
             
             # Check if volunteer has required skills
-            missing_skills = set(task.required_skills.all()) - set(volunteer.skills.all())
+            missing_skills = task.required_skills.exclude(
+                pk__in=volunteer.volunteerskill_set.values('skill_id')
+            ).only('name')
             if missing_skills:
                 return Response(
                     {
@@ -156,16 +240,78 @@ class TaskViewSet(viewsets.ModelViewSet):
             volunteer=volunteer
         ).values_list('tasks', flat=True)
 
+        # EXISTS instead of a join, so no distinct() is needed
         tasks = Task.objects.filter(
-            status='PENDING',
-            required_skills__in=volunteer.skills.all()
+            Exists(Task.required_skills.through.objects.filter(
+                task=OuterRef('pk'),
+                skill__volunteerskill__volunteer=volunteer
+            )),
+            status='PENDING'
         ).exclude(
             id__in=assigned_task_ids
-        ).distinct()
+        )
 
         serializer = self.get_serializer(tasks, many=True)
         return Response(serializer.data)
 
+    @extend_schema(
+        summary="Best volunteers for this task",
+        parameters=MATCH_PARAMETERS,
+        responses={200: OpenApiTypes.OBJECT}
+    )
+    @action(detail=True, methods=['get'])
+    def recommended_volunteers(self, request, pk=None):
+        """Available volunteers ranked by skill fit, availability, rating and distance"""
+        if not request.user.has_any_role('ADMIN', 'SUPERADMIN', 'RESPONDER'):
+            return Response(
+                {"detail": "Only admins and responders can view volunteer recommendations"},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        task = self.get_object()
+        options = _match_options(request, task.incident)
+        if isinstance(options, Response):
+            return options
+
+        return Response(_volunteer_matches(matching.volunteers_for_task(task, **options)))
+
+    @extend_schema(
+        summary="Best pending tasks for the requesting volunteer",
+        parameters=[MATCH_PARAMETERS[-1]],
+        responses={200: OpenApiTypes.OBJECT}
+    )
+    @action(detail=False, methods=['get'])
+    def recommended(self, request):
+        """Pending tasks ranked by how well they fit the volunteer's skills, availability and urgency"""
+        if not request.user.has_role('VOLUNTEER'):
+            return Response(
+                {"detail": "Must be a volunteer to view recommended tasks"},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        options = _match_options(request)
+        if isinstance(options, Response):
+            return options
+
+        matches = matching.tasks_for_volunteer(request.user.volunteer, limit=options['limit'])
+        tasks = Task.objects.select_related('incident').in_bulk([match.task_id for match in matches])
+        return Response([
+            {
+                'id': task.id,
+                'title': task.title,
+                'priority': task.priority,
+                'due_date': task.due_date,
+                'incident': {
+                    'id': task.incident.id,
+                    'title': task.incident.title,
+                    'priority': task.incident.priority,
+                },
+                'score': match.score,
+                'skill_coverage': match.skill_coverage,
+                'missing_skills': match.missing_skills,
+            }
+            for match in matches
+            for task in [tasks[match.task_id]]
+        ])
+
 
 
 
@@ -188,18 +334,18 @@ class IncidentCategoryViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def statistics(self, request, pk=None):
         category = self.get_object()
+        metrics = Incident.objects.filter(category=category).aggregate(
+            total=Count('pk'),
+            **aggregates.counts(resolved=Q(status__in=['RESOLVED', 'CLOSED'])),
+            **aggregates.averages(
+                'response_time_minutes',
+                average_response_time=~Q(status__in=aggregates.PENDING_STATUSES)
+            )
+        )
         stats = {
-            'total_incidents': Incident.objects.filter(category=category).count(),
-            'average_response_time': Incident.objects.filter(
-                category=category
-            ).exclude(
-                status__in=['REPORTED', 'VERIFIED']
-            ).aggregate(Avg('response_time'))['response_time__avg'],
-            'resolution_rate': Incident.objects.filter(
-                category=category,
-                status__in=['RESOLVED', 'CLOSED']
-            ).count() / Incident.objects.filter(category=category).count() * 100
-            if Incident.objects.filter(category=category).exists() else 0
+            'total_incidents': metrics['total'],
+            'average_response_time': metrics['average_response_time'],
+            'resolution_rate': aggregates.percentage(metrics['resolved'], metrics['total'])
         }
         return Response(stats)
 
@@ -211,13 +357,16 @@ class IncidentViewSet(viewsets.ModelViewSet):
     filterset_class = IncidentFilter
     search_fields = ['title', 'description', 'address']
     permission_classes = [AdminPermission|ResponderPermission|ReporterPermission]
+    pagination_class = FeedPagination
 
     # def def get_queryset(self):
     #     return super().get_queryset()  
 
     def get_queryset(self):
         user = self.request.user
-        queryset = Incident.objects.all()
+        queryset = Incident.objects.order_by('-created_at')
+        if self.action in ('list', 'retrieve'):
+            queryset = self._with_serializer_data(queryset)
 
         # If user has permission to view all incidents, return unfiltered queryset
         if user.has_perm('incidents.view_all_incidents'):
@@ -240,7 +389,22 @@ class IncidentViewSet(viewsets.ModelViewSet):
         if not conditions:
             conditions = Q(is_sensitive=False)
             
-        return queryset.filter(conditions)
+        # Joins through the assignment tables can repeat an incident
+        return queryset.filter(conditions).distinct()
+
+    @staticmethod
+    def _with_serializer_data(queryset):
+        """Load everything IncidentSerializer reads in a fixed number of queries"""
+        return queryset.select_related('category').prefetch_related(
+            'assigned_responders',
+            'assigned_volunteers',
+            'media_resource',
+            'required_skills',
+            'required_resources',
+        ).annotate(
+            responders_count=_count_subquery(IncidentAssignment),
+            volunteers_count=_count_subquery(IncidentVolunteer),
+        )
     
 
     @action(detail=True, methods=['post'])
@@ -257,11 +421,78 @@ class IncidentViewSet(viewsets.ModelViewSet):
         incident.verified_at = timezone.now()
         incident.status = 'VERIFIED'
         incident.save()
+        events.publish(events.INCIDENT_STATUS, incident, {
+            'previous_status': previous_status,
+            'status': 'VERIFIED',
+        })
     
-        send_incident_status_notification.delay(incident.id, previous_status, 'VERIFIED')
+        send_incident_status_notification.apply_async(
+            (incident.id, previous_status, 'VERIFIED'),
+            **incident_task_options(incident.priority)
+        )
 
         return Response({"status": "verified"})
     
+    @extend_schema(
+        request=IncidentBulkItemSerializer(many=True),
+        responses={201: OpenApiTypes.OBJECT, 207: OpenApiTypes.OBJECT, 400: OpenApiTypes.OBJECT}
+    )
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Create a batch of incidents, e.g. from partner agencies or SMS gateways.
+        Invalid items are reported by their index and skipped, the rest are created.
+        """
+        if not request.user.has_role('ADMIN'):
+            return Response(
+                {"detail": "Permission denied"},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        items = request.data
+        if not isinstance(items, list) or not items:
+            return Response(
+                {"detail": "Expected a non-empty list of incidents"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(items) > settings.INCIDENT_BULK_MAX_ITEMS:
+            return Response(
+                {"detail": f"A batch may contain at most {settings.INCIDENT_BULK_MAX_ITEMS} incidents"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        context = self.get_serializer_context()
+        context['prefetched'] = IncidentBulkItemSerializer.prefetch_related_objects(items)
+
+        valid_items, valid_indexes, errors = [], [], []
+        for index, item in enumerate(items):
+            serializer = IncidentBulkItemSerializer(data=item, context=context)
+            if serializer.is_valid():
+                valid_items.append(serializer.validated_data)
+                valid_indexes.append(index)
+            else:
+                errors.append({'index': index, 'errors': serializer.errors})
+
+        incidents = []
+        if valid_items:
+            incidents = IncidentBulkItemSerializer.bulk_create(valid_items, requested_by=request.user)
+
+        if not incidents:
+            response_status = status.HTTP_400_BAD_REQUEST
+        elif errors:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_201_CREATED
+
+        return Response({
+            'created': [
+                {'index': index, 'id': incident.id}
+                for index, incident in zip(valid_indexes, incidents)
+            ],
+            'errors': errors,
+            'total': len(items),
+        }, status=response_status)
+
     @action(detail=True, methods=['post'])
     def assign_responder(self, request, pk=None):
         if not request.user.has_role('ADMIN'):
@@ -279,7 +510,10 @@ class IncidentViewSet(viewsets.ModelViewSet):
             incident.assign_responder(responder, role)
 
             # Send notification to the assigned responder
-            send_responder_assignment_notification.delay(incident.id, responder.id)
+            send_responder_assignment_notification.apply_async(
+                (incident.id, responder.id),
+                **incident_task_options(incident.priority)
+            )
 
             return Response({"status": "assigned"})
         except Responder.DoesNotExist:
@@ -305,12 +539,16 @@ class IncidentViewSet(viewsets.ModelViewSet):
                 assignment.accepted_at = timezone.now()
                 assignment.save()
 
-                incident.status = 'RESPONDING'
+                previous_status = incident.status
+                incident.record_status_change('RESPONDING', assignment.accepted_at)
                 incident.save()
-                send_incident_status_notification.delay(
-                    incident.id,
-                    incident.status,
-                    'RESPONDING'
+                events.publish(events.INCIDENT_STATUS, incident, {
+                    'previous_status': previous_status,
+                    'status': 'RESPONDING',
+                })
+                send_incident_status_notification.apply_async(
+                    (incident.id, previous_status, 'RESPONDING'),
+                    **incident_task_options(incident.priority)
                 )
 
                 return Response({"status": "responded"})
@@ -338,14 +576,18 @@ class IncidentViewSet(viewsets.ModelViewSet):
 
         try:
             incident.assign_responder(responder, 'PRIMARY')
-            incident.status = 'RESPONDING'
+            previous_status = incident.status
+            incident.record_status_change('RESPONDING')
             incident.save()
+            events.publish(events.INCIDENT_STATUS, incident, {
+                'previous_status': previous_status,
+                'status': 'RESPONDING',
+            })
 
             # Send notification to other stakeholders
-            send_incident_status_notification.delay(
-                incident.id,
-                incident.status,
-                'RESPONDING'
+            send_incident_status_notification.apply_async(
+                (incident.id, previous_status, 'RESPONDING'),
+                **incident_task_options(incident.priority)
             )
 
             return Response({"status": "responded"})
@@ -359,11 +601,61 @@ class IncidentViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def timeline(self, request, pk=None):
         incident = self.get_object()
-        updates = incident.incident_timeline.all()
+        updates = incident.incident_timeline.select_related('user').prefetch_related('media_resource')
+
+        # The full timeline stays the default; cursor pages are opt-in
+        if FeedPagination.cursor_requested(request):
+            page = self.paginate_queryset(updates)
+            serializer = IncidentUpdateSerializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
         serializer = IncidentUpdateSerializer(updates, many=True)
         return Response(serializer.data)
     
     
+    def _get_search_point(self, params, incident):
+        """
+        Incidents no longer carry a geometry, so searches are centred on the
+        latitude/longitude query params or, failing that, the reporter's
+        last known location.
+        """
+        if 'latitude' in params:
+            return params['latitude'], params['longitude']
+
+        reporter_location = incident.reporter.user.location
+        if reporter_location:
+            return reporter_location.coordinates
+        return None
+
+    def _nearby_profiles_response(self, request, queryset, default_radius, key):
+        incident = self.get_object()
+        serializer = NearbySearchQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+        radius_km = params.get('radius', default_radius)
+        limit = params.get('limit', 10)
+        point = self._get_search_point(params, incident)
+
+        if point is None:
+            return Response(
+                {"detail": "Incident has no known location; provide latitude and longitude"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        profiles = nearby_profiles(queryset, point[0], point[1], radius_km, limit=limit)
+        data = [{
+            'id': profile.user.id,
+            'distance_km': round(distance, 3),
+            'location_updated_at': profile.user.location.location_updated_at,
+            'address': profile.user.location.address
+        } for profile, distance in profiles]
+
+        return Response({
+            'count': len(data),
+            'radius_km': radius_km,
+            key: data
+        })
+
     @extend_schema(
         parameters=[
             OpenApiParameter(
@@ -379,6 +671,20 @@ class IncidentViewSet(viewsets.ModelViewSet):
                 location=OpenApiParameter.QUERY,
                 description='Maximum number of results to return (default: 10)',
                 required=False
+            ),
+            OpenApiParameter(
+                name='latitude',
+                type=OpenApiTypes.FLOAT,
+                location=OpenApiParameter.QUERY,
+                description="Search centre latitude (default: reporter's location)",
+                required=False
+            ),
+            OpenApiParameter(
+                name='longitude',
+                type=OpenApiTypes.FLOAT,
+                location=OpenApiParameter.QUERY,
+                description="Search centre longitude (default: reporter's location)",
+                required=False
             )
         ],
         responses={200: dict},
@@ -386,45 +692,35 @@ class IncidentViewSet(viewsets.ModelViewSet):
     )
     @action(detail=True, methods=['GET'])
     def nearest_volunteers(self, request, pk=None):
-        pass
-        # """
-        # Find volunteers within a specified radius of the incident.
-        # Query params:
-        # - radius: search radius in kilometers (default: 5)
-        # - limit: maximum number of volunteers to return (default: 10)
-        # """
-        # incident = self.get_object()
-        # radius_km = float(request.query_params.get('radius', 5))
-        # limit = int(request.query_params.get('limit', 10))
-
-        # volunteers = (
-        #     Volunteer.objects
-        #     .select_related('user__location')
-        #     .filter(
-        #         user__location__location__isnull=False,
-        #         user__location__location__distance_lte=(
-        #             incident.location,
-
-        #         )
-        #     )
-        #     .annotate(
-        #         distance=Distance('user__location__location', incident.location)
-        #     )
-        #     .order_by('distance')[:limit]
-        # )
-
-        # volunteer_data = [{
-        #     'id': volunteer.user.id,
-        #     'distance_km': volunteer.distance.km,
-        #     'location_updated_at': volunteer.user.location.location_updated_at,
-        #     'address': volunteer.user.location.address
-        # } for volunteer in volunteers]
-
-        # return Response({
-        #     'count': len(volunteer_data),
-        #     'radius_km': radius_km,
-        #     'volunteers': volunteer_data
-        # })
+        """
+        Find available volunteers within a specified radius of the incident.
+        Query params:
+        - radius: search radius in kilometers (default: 5)
+        - limit: maximum number of volunteers to return (default: 10)
+        """
+        return self._nearby_profiles_response(
+            request,
+            Volunteer.objects.filter(is_available=True),
+            default_radius=5,
+            key='volunteers'
+        )
+
+    @extend_schema(
+        summary="Best volunteers for this incident",
+        parameters=MATCH_PARAMETERS,
+        responses={200: OpenApiTypes.OBJECT}
+    )
+    @action(detail=True, methods=['GET'])
+    def recommended_volunteers(self, request, pk=None):
+        """
+        Available volunteers ranked by skill fit, availability, rating and
+        distance, excluding those already on the incident.
+        """
+        incident = self.get_object()
+        options = _match_options(request, incident)
+        if isinstance(options, Response):
+            return options
+        return Response(_volunteer_matches(matching.volunteers_for_incident(incident, **options)))
 
     @extend_schema(
         parameters=[
@@ -441,6 +737,20 @@ class IncidentViewSet(viewsets.ModelViewSet):
                 location=OpenApiParameter.QUERY,
                 description='Maximum number of results to return (default: 10)',
                 required=False
+            ),
+            OpenApiParameter(
+                name='latitude',
+                type=OpenApiTypes.FLOAT,
+                location=OpenApiParameter.QUERY,
+                description="Search centre latitude (default: reporter's location)",
+                required=False
+            ),
+            OpenApiParameter(
+                name='longitude',
+                type=OpenApiTypes.FLOAT,
+                location=OpenApiParameter.QUERY,
+                description="Search centre longitude (default: reporter's location)",
+                required=False
             )
         ],
         responses={200: dict},
@@ -448,43 +758,32 @@ class IncidentViewSet(viewsets.ModelViewSet):
     )
     @action(detail=True, methods=['get'])
     def nearest_responders(self, request, pk=None):
-        pass
-        # """
-        # Find emergency responders within a specified radius of the incident.
-        # Returns responders ordered by distance.
-        # """
-        # incident = self.get_object()
-        # radius_km = float(request.query_params.get('radius', 10))  # Default 10km
-        # limit = int(request.query_params.get('limit', 10))  # Default 10 results
-
-        # responders = (
-        #     Responder.objects
-        #     .select_related('user__location')
-        #     .filter(
-        #         user__location__location__isnull=False,
-        #         user__location__location__distance_lte=(
-        #             incident.location,
-        #             D(km=radius_km)
-        #         )
-        #     )
-        #     .annotate(
-        #         distance=Distance('user__location__location', incident.location)
-        #     )
-        #     .order_by('distance')[:limit]
-        # )
-
-        # responder_data = [{
-        #     'id': responder.user.id,
-        #     'distance_km': responder.distance.km,
-        #     'location_updated_at': responder.user.location.location_updated_at,
-        #     'address': responder.user.location.address
-        # } for responder in responders]
-
-        # return Response({
-        #     'count': len(responder_data),
-        #     'radius_km': radius_km,
-        #     'responders': responder_data
-        # })
+        """
+        Find emergency responders within a specified radius of the incident.
+        Returns responders ordered by distance.
+        """
+        return self._nearby_profiles_response(
+            request,
+            Responder.objects.filter(user__is_active=True),
+            default_radius=10,
+            key='responders'
+        )
+
+    @extend_schema(parameters=[EXPORT_FORMAT_PARAMETER], responses={200: OpenApiTypes.BINARY})
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream every incident visible to the user, with the list filters applied"""
+        return export_response(
+            request,
+            self.filter_queryset(self.get_queryset()),
+            [
+                'id', 'title', 'status', 'priority', 'category', 'reporter', 'address',
+                'is_sensitive', 'estimated_people_affected', 'created_at', 'verified_at',
+                'first_response_at', 'resolved_at', 'response_time_minutes',
+            ],
+            'incidents',
+            category_name=F('category__name'),
+        )
     
 
 
@@ -495,26 +794,49 @@ class ResourceManagementViewSet(viewsets.ModelViewSet):
     filterset_class = IncidentResourceFilter
     permission_classes = [AdminPermission|ResponderPermission]
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve'):
+            queryset = queryset.select_related(
+                'resource', 'incident', 'requested_by', 'allocated_by', 'return_verified_by'
+            ).prefetch_related('ledger_entries__actor')
+        return queryset
+
     def perform_create(self, serializer):
         serializer.save(requested_by=self.request.user)
 
+    @extend_schema(parameters=[EXPORT_FORMAT_PARAMETER], responses={200: OpenApiTypes.BINARY})
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream every resource request, with the list filters applied"""
+        return export_response(
+            request,
+            self.filter_queryset(self.get_queryset()).order_by('requested_at', 'pk'),
+            [
+                'id', 'incident', 'resource', 'quantity_requested', 'quantity_allocated',
+                'status', 'priority', 'requested_at', 'allocated_at', 'expected_return_date',
+                'returned_at', 'return_status',
+            ],
+            'resource_requests',
+            resource_name=F('resource__name'),
+        )
+
     @action(detail=False, methods=['get'])
     def resource_needs(self, request):
-        resources = self.get_queryset().values(
-            'resource__name',
-            'resource__id',
-            'priority'
-        ).annotate(
-            total_requested=Sum('quantity_requested'),
-            total_allocated=Sum('quantity_allocated'),
-            pending_requests=Count('id', filter=Q(status='REQUESTED')),
-            shortage=F('total_requested') - F('total_allocated'),
-            urgent_requests=Count('id', filter=Q(priority__in=['HIGH', 'CRITICAL', 'EMERGENCY'])),
-            # avg_fulfillment_time=Avg(F('allocated_at') - F('requested_at'),
-            #                        filter=Q(allocated_at__isnull=False))
-        ).filter(shortage__gt=0)
-        
-        return Response(resources)
+        """Open shortages per resource and priority, read from the maintained demand counters"""
+        return Response([
+            {
+                'resource__name': counter.resource.name,
+                'resource__id': counter.resource_id,
+                'priority': counter.priority,
+                'total_requested': counter.quantity_requested,
+                'total_allocated': counter.quantity_allocated,
+                'pending_requests': counter.pending_count,
+                'shortage': counter.shortage,
+                'urgent_requests': counter.request_count if counter.priority in demand.URGENT_PRIORITIES else 0,
+            }
+            for counter in demand.shortages().select_related('resource')
+        ])
     
     @action(detail=False, methods=['get'])
     def expiring_soon(self, request):
@@ -530,110 +852,116 @@ class ResourceManagementViewSet(viewsets.ModelViewSet):
     
 
     
+    def _publish_allocation(self, resource):
+        events.publish(events.RESOURCE_ALLOCATION, resource.incident, {
+            'request': resource.pk,
+            'resource': resource.resource_id,
+            'quantity_allocated': resource.quantity_allocated,
+            'status': resource.status,
+        })
+
     @action(detail=True, methods=['post'])
     def allocate(self, request, pk=None):
         resource = self.get_object()
-        quantity = request.data.get('quantity', 0)
-        expected_return_date = request.data.get('expected_return_date')
-        
-        if quantity > resource.pending_quantity:
-            return Response(
-                {"detail": "Allocation exceeds requested quantity"},
-                status=status.HTTP_400_BAD_REQUEST
+        try:
+            expected_return_date = serializers.DateTimeField(allow_null=True).run_validation(
+                request.data.get('expected_return_date')
             )
-            
-        resource.quantity_allocated += quantity
-        resource.allocated_at = timezone.now()
-        resource.allocated_by = request.user
-
-        if expected_return_date:
-            resource.expected_return_date = expected_return_date
-        resource.update_status()
-        resource.save()
-        
+        except serializers.ValidationError as e:
+            return Response({"expected_return_date": e.detail}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            resource = allocation.allocate(
+                resource.pk,
+                allocation.parse_quantity(request.data.get('quantity', 0)),
+                request.user,
+                expected_return_date=expected_return_date,
+            )
+        except AllocationError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        self._publish_allocation(resource)
         # Trigger notifications
         send_allocation_notification.delay(resource.id)
         
         return Response(self.get_serializer(resource).data)
-    
 
-    
+    @extend_schema(request=ResourceAllocationBatchSerializer)
+    @action(detail=False, methods=['post'])
+    def allocate_batch(self, request):
+        """Allocate to many requests in one transaction; nothing is allocated if any item fails"""
+        serializer = ResourceAllocationBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        allowed = set(
+            self.get_queryset()
+            .filter(pk__in=[item['request'] for item in serializer.validated_data['allocations']])
+            .values_list('pk', flat=True)
+        )
+        items = serializer.validated_data['allocations']
+        if any(item['request'] not in allowed for item in items):
+            return Response({"detail": "Unknown resource request in batch"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            resources = allocation.allocate_many(items, request.user)
+        except AllocationError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        for resource in resources:
+            self._publish_allocation(resource)
+            send_allocation_notification.delay(resource.id)
+        return Response(self.get_serializer(resources, many=True).data)
 
     @action(detail=True, methods=['post'])
     def submit_return(self, request, pk=None):
         """Submit a return request that needs verification"""
-        with transaction.atomic():
-            resource = self.get_object()
-            quantity = request.data.get('quantity', resource.quantity_allocated)
-            notes = request.data.get('notes', '')
-            
-            if quantity > resource.quantity_allocated:
-                return Response(
-                    {"detail": "Return quantity exceeds allocation"},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            if quantity < resource.quantity_allocated:
-                # Handling partial return
-                resource.return_status = 'SUBMITTED'
-                resource.return_notes = notes
-                resource.partial_returns.append({
-                    'quantity': quantity,
-                    'date': timezone.now().isoformat(),
-                    'submitted_by': request.user.id,
-                    'status': 'PENDING'
-                })
-
-            else:
-                # Full return
-                resource.return_status = 'SUBMITTED'
-                resource.return_notes = notes
-            
-            resource.save()
-            send_return_submission_notification.delay(resource.id, quantity)
+        resource = self.get_object()
+        try:
+            quantity = allocation.parse_quantity(request.data.get('quantity', resource.quantity_allocated))
+            resource = allocation.submit_return(
+                resource.pk, quantity, request.user, request.data.get('notes', '')
+            )
+        except AllocationError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-            return Response(self.get_serializer(resource).data)
-       
+        send_return_submission_notification.delay(resource.id, quantity)
+        return Response(self.get_serializer(resource).data)
 
-        
     @action(detail=True, methods=['post'])
     def verify_return(self, request, pk=None):
         """Verify a return request (only allocated_by or admin can verify)"""
-        with transaction.atomic():
-            resource = self.get_object()
-            
-            # Check permissions
-            if not (request.user == resource.allocated_by or 
-                   request.user.has_role('ADMIN')):
-                return Response(
-                    {"detail": "Only resource allocator or admin can verify returns"},
-                    status=status.HTTP_403_FORBIDDEN
-                )
-            
-            verification_status = request.data.get('status', 'VERIFIED')
-            quantity = request.data.get('quantity', resource.quantity_allocated)
-            notes = request.data.get('notes', '')
-            if verification_status == 'VERIFIED':
-                resource.quantity_allocated -= quantity
-                resource.returned_at = timezone.now()
-                resource.return_verified_by = request.user
-                resource.return_verified_at = timezone.now()
-
-                if resource.quantity_allocated == 0:
-                        resource.status = 'RETURNED'
-                else:
-                    resource.status = 'PARTIALLY_ALLOCATED'
-                
-            elif verification_status == 'REJECTED':
-                resource.return_status = 'REJECTED'
-                resource.return_notes = notes
-            
-            resource.save()
+        resource = self.get_object()
+        
+        # Check permissions
+        if not (request.user == resource.allocated_by or 
+               request.user.has_role('ADMIN')):
+            return Response(
+                {"detail": "Only resource allocator or admin can verify returns"},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        verification_status = request.data.get('status', 'VERIFIED')
+        if verification_status not in ('VERIFIED', 'REJECTED'):
+            return Response(
+                {"detail": "status must be VERIFIED or REJECTED"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        quantity = request.data.get('quantity')
+        try:
+            resource = allocation.verify_return(
+                resource.pk,
+                # Defaults to the quantity submitted for return
+                None if quantity is None else allocation.parse_quantity(quantity),
+                request.user,
+                verified=verification_status == 'VERIFIED',
+                notes=request.data.get('notes', ''),
+            )
+        except AllocationError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Notify requested_by about verification
-            send_return_verification_notification.delay(resource.id, verification_status)
-            
-            return Response(self.get_serializer(resource).data)
+        if verification_status == 'VERIFIED':
+            self._publish_allocation(resource)
+        # Notify requested_by about verification
+        send_return_verification_notification.delay(resource.id, verification_status)
+        
+        return Response(self.get_serializer(resource).data)
 
     
     
@@ -671,14 +999,10 @@ class ResourceManagementViewSet(viewsets.ModelViewSet):
     def cancel(self, request, pk=None):
         """Cancel a resource request"""
         resource = self.get_object()
-        if resource.quantity_allocated > 0:
-            return Response(
-                {"detail": "Cannot cancel request with allocated resources"},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        resource.status = 'CANCELLED'
-        resource.save()
+        try:
+            resource = allocation.cancel(resource.pk)
+        except AllocationError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         return Response(self.get_serializer(resource).data)
 
 
@@ -52,7 +52,7 @@ class ReporterViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['post'])
     def verify_report(self, request, pk=None):
-        if not request.user.has_role('ADMIN') and not request.user.has_role('SUPERADMIN'):
+        if not request.user.has_any_role('ADMIN', 'SUPERADMIN'):
             return Response(
                 {'detail': 'Permission denied'},
                 status=status.HTTP_403_FORBIDDEN
@@ -0,0 +1,364 @@
+"""
+Volunteer-to-task matching.
+
+Every active volunteer's skills are held in one dense NumPy matrix
+(volunteers x skills) whose cells combine proficiency and verification, next
+to per-volunteer vectors for availability, rating, travel range and
+position. Ranking all candidates for a task or incident, or all open tasks
+for a volunteer, is then a few array operations over that snapshot instead
+of a join per skill.
+
+The snapshot is built from two queries and kept per process. Saving or
+deleting a volunteer or one of their skills bumps a shared version (see
+volunteer.signals), and snapshots older than MATRIX_MAX_AGE are rebuilt
+regardless, so ratings and positions never lag far behind.
+"""
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence
+import numpy as np
+from django.core.cache import cache
+from django.utils import timezone
+
+from incident.models import IncidentVolunteer, Task
+from .models import Volunteer, VolunteerSkill
+
+logger = logging.getLogger(__name__)
+
+
+# Seconds a snapshot is reused even if nothing invalidated it
+MATRIX_MAX_AGE = 60
+
+VERSION_KEY = 'volunteer:matching:version'
+
+# Unverified skills count for this fraction of their proficiency
+UNVERIFIED_WEIGHT = 0.75
+
+# Score given when a signal is unknown, e.g. an unrated volunteer
+NEUTRAL = 0.5
+
+# Availability slots, in the order of SkillMatrix.availability's columns
+SLOTS = ('weekday', 'weekend', 'emergency')
+
+# Incidents at these priorities are matched against emergency availability
+EMERGENCY_PRIORITIES = ('CRITICAL', 'EMERGENCY')
+
+VOLUNTEER_WEIGHTS = {'skills': 0.5, 'availability': 0.15, 'rating': 0.15, 'distance': 0.2}
+TASK_WEIGHTS = {'skills': 0.6, 'priority': 0.15, 'due': 0.15, 'availability': 0.1}
+
+# Tasks due further out than this get no urgency boost
+DUE_HORIZON_HOURS = 72
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+def haversine_km(latitude, longitude, latitudes, longitudes):
+    """Distances from one point to arrays of points, NaN where a point is missing"""
+    lat1, lng1 = np.radians(latitude), np.radians(longitude)
+    lat2, lng2 = np.radians(latitudes), np.radians(longitudes)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 6371.0 * 2 * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def _availability_score(availability, slot):
+    if not isinstance(availability, dict) or slot not in availability:
+        return NEUTRAL
+    return 1.0 if availability[slot] else 0.0
+
+
+def availability_slot(priority=None, when=None):
+    """The availability flag that matters for work of this incident priority at this time"""
+    if priority in EMERGENCY_PRIORITIES:
+        return 'emergency'
+    when = timezone.localtime(when or timezone.now())
+    return 'weekend' if when.weekday() >= 5 else 'weekday'
+
+
+# Snapshot
+
+class SkillMatrix:
+    """Skills and matching signals of every active volunteer as NumPy arrays"""
+
+    def __init__(self, volunteers, skill_rows):
+        self.volunteer_ids = np.array([row[0] for row in volunteers], dtype=np.int64)
+        self.row = {volunteer_id: i for i, volunteer_id in enumerate(self.volunteer_ids.tolist())}
+        self.rating = np.array([row[1] or 0.0 for row in volunteers], dtype=np.float32)
+        self.is_available = np.array([row[2] for row in volunteers], dtype=bool)
+        self.availability = np.array(
+            [[_availability_score(row[3], slot) for slot in SLOTS] for row in volunteers],
+            dtype=np.float32
+        ).reshape(len(volunteers), len(SLOTS))
+        self.max_travel = np.array([row[4] for row in volunteers], dtype=np.float32)
+        self.latitude = np.array(
+            [np.nan if row[5] is None else row[5] for row in volunteers], dtype=np.float64
+        )
+        self.longitude = np.array(
+            [np.nan if row[6] is None else row[6] for row in volunteers], dtype=np.float64
+        )
+
+        skill_ids = sorted({skill_id for _, skill_id, _, _ in skill_rows})
+        self.column = {skill_id: j for j, skill_id in enumerate(skill_ids)}
+        self.skills = np.zeros((len(volunteers), len(skill_ids)), dtype=np.float32)
+        for volunteer_id, skill_id, proficiency, verified in skill_rows:
+            i = self.row.get(volunteer_id)
+            if i is not None:
+                self.skills[i, self.column[skill_id]] = (
+                    proficiency / 5.0 * (1.0 if verified else UNVERIFIED_WEIGHT)
+                )
+
+    def __len__(self):
+        return len(self.volunteer_ids)
+
+    @classmethod
+    def build(cls):
+        volunteers = list(
+            Volunteer.objects.filter(user__is_active=True).order_by('pk').values_list(
+                'pk', 'rating', 'is_available', 'availability', 'max_travel_distance',
+                'user__location__latitude', 'user__location__longitude',
+            )
+        )
+        skill_rows = list(
+            VolunteerSkill.objects.filter(volunteer__user__is_active=True).values_list(
+                'volunteer_id', 'skill_id', 'proficiency_level', 'verified'
+            )
+        )
+        return cls(volunteers, skill_rows)
+
+    def skill_columns(self, skill_ids: Sequence[int]):
+        """(volunteers x len(skill_ids)) weights, zero for skills nobody has"""
+        matrix = np.zeros((len(self), len(skill_ids)), dtype=np.float32)
+        known = [(k, self.column[skill_id]) for k, skill_id in enumerate(skill_ids) if skill_id in self.column]
+        if known:
+            targets, columns = zip(*known)
+            matrix[:, list(targets)] = self.skills[:, list(columns)]
+        return matrix
+
+    def skill_vector(self, volunteer_id, skill_ids: Sequence[int]):
+        """One volunteer's weights for the given skills, None if they are not in the snapshot"""
+        i = self.row.get(volunteer_id)
+        if i is None:
+            return None
+        return self.skill_columns(skill_ids)[i]
+
+
+_snapshot = {'matrix': None, 'version': None, 'built_at': 0.0}
+_snapshot_lock = threading.Lock()
+
+
+def invalidate():
+    """Make every process rebuild its snapshot on next use"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, None)
+
+
+def get_matrix():
+    version = cache.get(VERSION_KEY)
+    with _snapshot_lock:
+        fresh = (
+            _snapshot['matrix'] is not None
+            and _snapshot['version'] == version
+            and time.monotonic() - _snapshot['built_at'] < MATRIX_MAX_AGE
+        )
+        if not fresh:
+            _snapshot.update(matrix=SkillMatrix.build(), version=version, built_at=time.monotonic())
+            logger.debug(f"Rebuilt volunteer skill matrix ({len(_snapshot['matrix'])} volunteers)")
+        return _snapshot['matrix']
+
+
+# Ranking
+
+@dataclass
+class VolunteerMatch:
+    volunteer_id: int
+    score: float
+    skill_coverage: float
+    missing_skills: List[int] = field(default_factory=list)
+    distance_km: Optional[float] = None
+
+
+@dataclass
+class TaskMatch:
+    task_id: int
+    score: float
+    skill_coverage: float
+    missing_skills: List[int] = field(default_factory=list)
+
+
+def _top(scores, eligible, limit):
+    """Indices of the highest eligible scores, best first"""
+    candidates = np.flatnonzero(eligible)
+    if len(candidates) > limit:
+        candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+def rank_volunteers(skill_ids: Sequence[int], priority=None, when=None, origin=None,
+                    exclude=(), require_all=False, limit=DEFAULT_LIMIT) -> List[VolunteerMatch]:
+    """
+    Best available volunteers for work needing skill_ids, in one pass over the snapshot.
+
+    Candidates must have at least one of the skills (all of them with
+    require_all) and, when origin (lat, lng) is given, be within their own
+    max travel distance of it. Volunteers without a known position are kept
+    but get no distance credit.
+    """
+    matrix = get_matrix()
+    if not len(matrix):
+        return []
+    skill_ids = list(skill_ids)
+
+    if skill_ids:
+        weights = matrix.skill_columns(skill_ids)
+        has_skill = weights > 0
+        coverage = has_skill.mean(axis=1)
+        skill_score = weights.mean(axis=1)
+        eligible = coverage == 1 if require_all else coverage > 0
+    else:
+        coverage = np.ones(len(matrix), dtype=np.float32)
+        skill_score = np.full(len(matrix), NEUTRAL, dtype=np.float32)
+        eligible = np.ones(len(matrix), dtype=bool)
+    eligible &= matrix.is_available
+    if exclude:
+        eligible &= ~np.isin(matrix.volunteer_ids, list(exclude))
+
+    slot = SLOTS.index(availability_slot(priority, when))
+    rating_score = np.where(matrix.rating > 0, matrix.rating / 5.0, NEUTRAL)
+    weights_used = dict(VOLUNTEER_WEIGHTS)
+    scores = (
+        VOLUNTEER_WEIGHTS['skills'] * skill_score
+        + VOLUNTEER_WEIGHTS['availability'] * matrix.availability[:, slot]
+        + VOLUNTEER_WEIGHTS['rating'] * rating_score
+    )
+
+    distance = None
+    if origin is not None:
+        distance = haversine_km(origin[0], origin[1], matrix.latitude, matrix.longitude)
+        # NaN distances compare False, so volunteers without a position stay eligible
+        eligible &= ~(distance > matrix.max_travel)
+        distance_score = np.clip(1 - distance / np.maximum(matrix.max_travel, 1), 0, 1)
+        scores = scores + VOLUNTEER_WEIGHTS['distance'] * np.nan_to_num(distance_score, nan=0.0)
+    else:
+        weights_used.pop('distance')
+    scores = scores / sum(weights_used.values())
+
+    matches = []
+    for i in _top(scores, eligible, limit):
+        matches.append(VolunteerMatch(
+            volunteer_id=int(matrix.volunteer_ids[i]),
+            score=round(float(scores[i]), 4),
+            skill_coverage=round(float(coverage[i]), 4),
+            missing_skills=[skill_ids[k] for k in np.flatnonzero(~has_skill[i])] if skill_ids else [],
+            distance_km=None if distance is None or np.isnan(distance[i]) else round(float(distance[i]), 3),
+        ))
+    return matches
+
+
+def rank_tasks(volunteer, tasks, requirements, limit=DEFAULT_LIMIT) -> List[TaskMatch]:
+    """
+    Best open tasks for one volunteer.
+
+    tasks holds (task_id, priority, due_date, incident_priority) rows and
+    requirements (task_id, skill_id) pairs. Tasks that need skills the
+    volunteer has none of are left out; tasks without requirements are open
+    to everyone.
+    """
+    if not tasks:
+        return []
+    task_ids = [row[0] for row in tasks]
+    task_index = {task_id: i for i, task_id in enumerate(task_ids)}
+    skill_ids = sorted({skill_id for _, skill_id in requirements})
+    skill_index = {skill_id: j for j, skill_id in enumerate(skill_ids)}
+
+    required = np.zeros((len(tasks), len(skill_ids)), dtype=bool)
+    for task_id, skill_id in requirements:
+        required[task_index[task_id], skill_index[skill_id]] = True
+
+    matrix = get_matrix()
+    vector = matrix.skill_vector(volunteer.pk, skill_ids)
+    if vector is None:
+        vector = np.zeros(len(skill_ids), dtype=np.float32)
+        for skill_id, proficiency, verified in volunteer.volunteerskill_set.filter(
+            skill_id__in=skill_ids
+        ).values_list('skill_id', 'proficiency_level', 'verified'):
+            vector[skill_index[skill_id]] = proficiency / 5.0 * (1.0 if verified else UNVERIFIED_WEIGHT)
+
+    required_count = required.sum(axis=1)
+    held = required & (vector > 0)
+    open_to_all = required_count == 0
+    denominator = np.maximum(required_count, 1)
+    coverage = np.where(open_to_all, 1.0, held.sum(axis=1) / denominator)
+    skill_score = np.where(open_to_all, NEUTRAL, (required * vector).sum(axis=1) / denominator)
+    eligible = open_to_all | (coverage > 0)
+
+    now = timezone.now()
+    priority_score = np.array([(row[1] or 3) / 5.0 for row in tasks])
+    hours_until_due = np.array([
+        np.inf if row[2] is None else (row[2] - now).total_seconds() / 3600 for row in tasks
+    ])
+    due_score = np.clip(1 - hours_until_due / DUE_HORIZON_HOURS, 0, 1)
+    availability = np.array([
+        _availability_score(volunteer.availability, availability_slot(row[3], row[2])) for row in tasks
+    ])
+
+    scores = (
+        TASK_WEIGHTS['skills'] * skill_score
+        + TASK_WEIGHTS['priority'] * priority_score
+        + TASK_WEIGHTS['due'] * due_score
+        + TASK_WEIGHTS['availability'] * availability
+    ) / sum(TASK_WEIGHTS.values())
+
+    return [
+        TaskMatch(
+            task_id=task_ids[i],
+            score=round(float(scores[i]), 4),
+            skill_coverage=round(float(coverage[i]), 4),
+            missing_skills=[skill_ids[j] for j in np.flatnonzero(required[i] & ~held[i])],
+        )
+        for i in _top(scores, eligible, limit)
+    ]
+
+
+# Entry points
+
+def assigned_volunteer_ids(task):
+    return set(IncidentVolunteer.objects.filter(tasks=task).values_list('volunteer_id', flat=True))
+
+
+def volunteers_for_task(task, origin=None, require_all=False, limit=DEFAULT_LIMIT):
+    """Volunteers best suited to a task, leaving out those already on it"""
+    return rank_volunteers(
+        list(task.required_skills.values_list('pk', flat=True)),
+        priority=task.incident.priority,
+        when=task.due_date,
+        origin=origin,
+        exclude=assigned_volunteer_ids(task),
+        require_all=require_all,
+        limit=limit,
+    )
+
+
+def volunteers_for_incident(incident, origin=None, require_all=False, limit=DEFAULT_LIMIT):
+    """Volunteers best suited to an incident, leaving out those already on it"""
+    return rank_volunteers(
+        list(incident.required_skills.values_list('pk', flat=True)),
+        priority=incident.priority,
+        origin=origin,
+        exclude=set(incident.incidentvolunteer_set.values_list('volunteer_id', flat=True)),
+        require_all=require_all,
+        limit=limit,
+    )
+
+
+def tasks_for_volunteer(volunteer, limit=DEFAULT_LIMIT):
+    """Pending tasks the volunteer is best suited to, leaving out those already assigned to them"""
+    pending = Task.objects.filter(status='PENDING').exclude(task_volunteers__volunteer=volunteer)
+    tasks = list(pending.values_list('pk', 'priority', 'due_date', 'incident__priority'))
+    requirements = list(
+        Task.required_skills.through.objects.filter(task__in=pending).values_list('task_id', 'skill_id')
+    )
+    return rank_tasks(volunteer, tasks, requirements, limit=limit)
@@ -0,0 +1,68 @@
+# Generated by Django 4.2.16 on 2026-10-18 10:48
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Sum
+
+
+BATCH_SIZE = 1000
+
+
+def drop_duplicate_ratings(apps, schema_editor):
+    """Keep only the latest rating each user gave each volunteer"""
+    VolunteerRating = apps.get_model('volunteer', 'VolunteerRating')
+    duplicates = VolunteerRating.objects.order_by().values('volunteer_id', 'rated_by_id').annotate(
+        latest=Max('id'), total=Count('id')
+    ).filter(total__gt=1)
+    for row in duplicates:
+        VolunteerRating.objects.filter(
+            volunteer_id=row['volunteer_id'], rated_by_id=row['rated_by_id']
+        ).exclude(id=row['latest']).delete()
+
+
+def backfill_rating_aggregates(apps, schema_editor):
+    Volunteer = apps.get_model('volunteer', 'Volunteer')
+    VolunteerRating = apps.get_model('volunteer', 'VolunteerRating')
+
+    totals = {
+        row['volunteer_id']: (row['total'], row['count'])
+        for row in VolunteerRating.objects.order_by().values('volunteer_id').annotate(
+            total=Sum('rating'), count=Count('id')
+        )
+    }
+
+    batch = []
+    for volunteer in Volunteer.objects.filter(id__in=list(totals)).iterator(chunk_size=BATCH_SIZE):
+        volunteer.rating_sum, volunteer.rating_count = totals[volunteer.id]
+        volunteer.rating = volunteer.rating_sum / volunteer.rating_count
+        batch.append(volunteer)
+        if len(batch) >= BATCH_SIZE:
+            Volunteer.objects.bulk_update(batch, ['rating', 'rating_sum', 'rating_count'])
+            batch = []
+    if batch:
+        Volunteer.objects.bulk_update(batch, ['rating', 'rating_sum', 'rating_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('volunteer', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='volunteer',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='volunteer',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(drop_duplicate_ratings, migrations.RunPython.noop),
+        migrations.RunPython(backfill_rating_aggregates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='volunteerrating',
+            constraint=models.UniqueConstraint(fields=('volunteer', 'rated_by'), name='unique_volunteer_rating_per_user'),
+        ),
+    ]
@@ -2,7 +2,9 @@ from django.db import models
 from django.core.validators import MinLengthValidator
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
-from typing import List
+from typing import List, Optional
+from django.db.models import Count, ExpressionWrapper, F, FloatField, Sum
+from django.db.models.functions import Cast
 # from django.contrib.gis.db import models
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.contrib.auth import get_user_model
@@ -70,16 +72,40 @@ class Volunteer(models.Model):
     max_travel_distance = models.IntegerField(default=10)  # in kilometers
     verified_hours = models.IntegerField(default=0)
     rating = models.FloatField(default=0.0)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
     is_available = models.BooleanField(default=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    @property
+    def average_rating(self) -> Optional[float]:
+        if not self.rating_count:
+            return None
+        return self.rating_sum / self.rating_count
+
+    def add_rating(self, score: int):
+        """
+        Fold one new rating into the cached aggregates with a single UPDATE.
+        Call inside the transaction that creates the VolunteerRating.
+        """
+        new_sum = F('rating_sum') + score
+        new_count = F('rating_count') + 1
+        Volunteer.objects.filter(pk=self.pk).update(
+            rating_sum=new_sum,
+            rating_count=new_count,
+            rating=ExpressionWrapper(Cast(new_sum, FloatField()) / new_count, output_field=FloatField()),
+        )
+        self.refresh_from_db(fields=['rating', 'rating_sum', 'rating_count'])
+
     def update_rating(self):
-        ratings = self.volunteerrating_set.all()
-        if ratings:
-            self.rating = sum([r.rating for r in ratings]) / len(ratings)
-            self.save()
+        """Recompute the cached aggregates from the ratings table"""
+        totals = self.volunteerrating_set.aggregate(total=Sum('rating'), count=Count('pk'))
+        self.rating_sum = totals['total'] or 0
+        self.rating_count = totals['count']
+        self.rating = self.average_rating or 0.0
+        self.save(update_fields=['rating', 'rating_sum', 'rating_count'])
 
     def __str__(self):
         return f"{self.user.full_name} (Experience Level: {self.experience_level})"
@@ -122,4 +148,9 @@ class VolunteerRating(models.Model):
         validators=[MinValueValidator(1), MaxValueValidator(5)]
     )
     comments = models.TextField(blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['volunteer', 'rated_by'], name='unique_volunteer_rating_per_user'),
+        ]
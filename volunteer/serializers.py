@@ -2,7 +2,7 @@ from rest_framework import serializers
 from accounts.serializers import UserSerializer
 from .models import Skill, Volunteer, VolunteerRating, VolunteerSkill
 from django.utils import timezone
-from django.db import transaction
+from django.db import IntegrityError, transaction
 # from django.contrib.gis.geos import Point
 from django.db.models import Avg, Count
 
@@ -47,25 +47,29 @@ class VolunteerRatingSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at', 'rated_by']
 
     def validate(self, attrs):
-        # Prevent self-rating
-        if attrs['rated_by'] == attrs['volunteer'].user:
+        # Prevent self-rating; the volunteer and rater come from the view's context
+        request = self.context.get('request')
+        volunteer = self.context.get('volunteer')
+        if request and volunteer and request.user.pk == volunteer.user_id:
             raise serializers.ValidationError("Cannot rate yourself")
-        
-        # Check if user has already rated this volunteer
-        if VolunteerRating.objects.filter(
-            volunteer=attrs['volunteer'],
-            rated_by=attrs['rated_by']
-        ).exists():
-            raise serializers.ValidationError("You have already rated this volunteer")
-            
         return attrs
 
+    def create(self, validated_data):
+        # The unique constraint rejects repeat ratings, so no exists() query is needed first
+        try:
+            with transaction.atomic():
+                rating = super().create(validated_data)
+                rating.volunteer.add_rating(rating.rating)
+        except IntegrityError:
+            raise serializers.ValidationError("You have already rated this volunteer")
+        return rating
+
 
 class VolunteerSerializer(serializers.ModelSerializer):
     skills = VolunteerSkillSerializer(source='volunteerskill_set', many=True, required=False)
     ratings = VolunteerRatingSerializer(source='volunteerrating_set', many=True, read_only=True)
     average_rating = serializers.FloatField(read_only=True)
-    total_ratings = serializers.IntegerField(read_only=True)
+    total_ratings = serializers.IntegerField(source='rating_count', read_only=True)
     # preferred_location = serializers.SerializerMethodField()
     latitude = serializers.FloatField(write_only=True, required=False)
     longitude = serializers.FloatField(write_only=True, required=False)
@@ -0,0 +1,13 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import matching
+from .models import Volunteer, VolunteerSkill
+
+
+@receiver([post_save, post_delete], sender=Volunteer)
+@receiver([post_save, post_delete], sender=VolunteerSkill)
+def invalidate_skill_matrix(sender, **kwargs):
+    # A snapshot rebuilt before the commit would read the old rows again
+    transaction.on_commit(matching.invalidate)
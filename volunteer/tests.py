@@ -1,3 +1,170 @@
-from django.test import TestCase
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.test import APITestCase
 
-# Create your tests here.
+from accounts import spatial
+from accounts.models import User, UserLocation
+from cddp.testing import create_admin, create_incident, create_user
+from incident.models import Task
+from reporters.models import Reporter
+from . import matching
+from .models import Volunteer, Skill, VolunteerSkill
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class VolunteerMatchingTest(APITestCase):
+    """Candidates are ranked by skill fit and availability in one pass"""
+
+    @classmethod
+    def setUpTestData(cls):
+        # Superuser so the task queryset is not scoped away
+        cls.admin = create_admin('matcher@example.com', is_superuser=True)
+        cls.first_aid = Skill.objects.create(name='First Aid', category='HEALTH', description='First aid')
+        cls.driving = Skill.objects.create(name='Driving', category='LOGISTICS', description='Driving')
+        cooking = Skill.objects.create(name='Cooking', category='HOSPITALITY', description='Cooking')
+
+        def volunteer(name, skills, **fields):
+            user = create_user(f'{name}@example.com', 'VOLUNTEER')
+            profile = Volunteer.objects.create(user=user, experience_level='INTERMEDIATE', **fields)
+            for skill, proficiency, verified in skills:
+                VolunteerSkill.objects.create(
+                    volunteer=profile, skill=skill, proficiency_level=proficiency, verified=verified
+                )
+            return profile
+
+        cls.expert = volunteer('expert', [(cls.first_aid, 5, True), (cls.driving, 4, True)], rating=4.5)
+        cls.partial = volunteer('partial', [(cls.first_aid, 3, False)])
+        cls.unavailable = volunteer('away', [(cls.first_aid, 5, True), (cls.driving, 5, True)], is_available=False)
+        cls.unrelated = volunteer('cook', [(cooking, 5, True)])
+
+        incident = create_incident(reporter=Reporter.objects.create(user=cls.admin))
+        cls.task = Task.objects.create(
+            title='Evacuate', description='Drive people out', incident=incident, created_by=cls.admin
+        )
+        cls.task.required_skills.set([cls.first_aid, cls.driving])
+        cls.cooking_task = Task.objects.create(
+            title='Cook', description='Feed people', incident=incident, created_by=cls.admin
+        )
+        cls.cooking_task.required_skills.set([cooking])
+
+    def setUp(self):
+        matching.invalidate()
+
+    def test_volunteers_for_task(self):
+        self.client.force_authenticate(self.admin)
+        url = reverse('tasks-recommended-volunteers', args=[self.task.pk])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([match['id'] for match in response.data], [self.expert.pk, self.partial.pk])
+        self.assertEqual(response.data[0]['skill_coverage'], 1)
+        self.assertEqual(response.data[1]['missing_skills'], [self.driving.pk])
+
+        response = self.client.get(url, {'require_all': 'true'})
+        self.assertEqual([match['id'] for match in response.data], [self.expert.pk])
+
+    def test_skips_volunteers_deleted_since_the_snapshot(self):
+        self.client.force_authenticate(self.admin)
+        url = reverse('tasks-recommended-volunteers', args=[self.task.pk])
+        self.client.get(url)
+
+        # The snapshot is only invalidated once the delete commits
+        self.expert.delete()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([match['id'] for match in response.data], [self.partial.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            VolunteerSkill.objects.create(volunteer=self.partial, skill=self.driving, proficiency_level=2)
+        response = self.client.get(url)
+        self.assertEqual(response.data[0]['skill_coverage'], 1)
+
+    def test_tasks_for_volunteer(self):
+        self.client.force_authenticate(self.partial.user)
+        response = self.client.get(reverse('tasks-recommended'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([task['id'] for task in response.data], [self.task.pk])
+        self.assertEqual(response.data[0]['skill_coverage'], 0.5)
+
+    def test_search_requires_every_skill(self):
+        self.client.force_authenticate(self.admin)
+        response = self.client.get(
+            reverse('volunteer-search-by-skills'), {'skills': f'{self.first_aid.pk},{self.driving.pk}'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({volunteer['id'] for volunteer in response.data['results']},
+                         {self.expert.pk, self.unavailable.pk})
+
+
+class VolunteerRatingAggregateTest(APITestCase):
+    """Ratings update the cached sum and count instead of re-aggregating"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.raters = [create_admin(f'rater{n}@example.com') for n in range(2)]
+        cls.volunteer = Volunteer.objects.create(
+            user=User.objects.create_user(email='rated@example.com', password='password'),
+            experience_level='BEGINNER'
+        )
+
+    def rate(self, user, score):
+        self.client.force_authenticate(User.objects.get(pk=user.pk))
+        return self.client.post(
+            reverse('volunteer-rate-volunteer', args=[self.volunteer.pk]), {'rating': score}, format='json'
+        )
+
+    def test_ratings_are_folded_in(self):
+        self.assertEqual(self.rate(self.raters[0], 5).status_code, 200)
+        self.assertEqual(self.rate(self.raters[1], 2).status_code, 200)
+
+        self.volunteer.refresh_from_db()
+        self.assertEqual((self.volunteer.rating_sum, self.volunteer.rating_count), (7, 2))
+        self.assertEqual(self.volunteer.rating, 3.5)
+
+        response = self.client.get(reverse('volunteer-detail', args=[self.volunteer.pk]))
+        self.assertEqual(response.data['average_rating'], 3.5)
+        self.assertEqual(response.data['total_ratings'], 2)
+
+    def test_rejects_repeat_ratings(self):
+        self.rate(self.raters[0], 5)
+        response = self.rate(self.raters[0], 1)
+        self.assertEqual(response.status_code, 400)
+
+        self.volunteer.refresh_from_db()
+        self.assertEqual((self.volunteer.rating_sum, self.volunteer.rating_count), (5, 1))
+
+
+class NearbyVolunteerSearchTest(APITestCase):
+    """Nearby searches validate their query before touching the spatial index"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin('searcher@example.com', is_superuser=True)
+        cls.near = Volunteer.objects.create(
+            user=create_user('near@example.com', location=UserLocation.objects.create(location='6.5,3.3')),
+            experience_level='BEGINNER'
+        )
+
+    def setUp(self):
+        spatial.location_index.clear()
+        self.client.force_authenticate(self.admin)
+
+    def search(self, **params):
+        return self.client.get(reverse('volunteer-find-nearby'), params)
+
+    def test_finds_volunteers_within_the_radius(self):
+        response = self.search(latitude=6.501, longitude=3.3, radius=5)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([volunteer['id'] for volunteer in response.data['results']], [self.near.pk])
+
+    def test_rejects_invalid_queries(self):
+        for params in (
+            {'latitude': 'inf', 'longitude': 3.3},
+            {'latitude': 'nan', 'longitude': 3.3},
+            {'latitude': 91, 'longitude': 3.3},
+            {'latitude': 6.5, 'longitude': -181},
+            {'latitude': 6.5, 'longitude': 3.3, 'radius': 0},
+            {'latitude': 6.5, 'longitude': 3.3, 'radius': 'inf'},
+            {'latitude': 6.5},
+            {},
+        ):
+            self.assertEqual(self.search(**params).status_code, 400, params)
@@ -12,9 +12,15 @@ from accounts.permissions import (
     VolunteerPermission, ReporterPermission, ResponderPermission
 )
 from .filters import SkillFilterSet, VolunteerSkillFilterSet, VolunteerFilter
-from django.db.models import Avg, Count, Q,F
+from django.db.models import Avg, Count, Q, F, Sum, OuterRef, Subquery, FloatField, ExpressionWrapper
+from django.db.models.functions import Cast, Coalesce, NullIf
 # from django.contrib.gis.geos import Point
 # from .services import VolunteerLocationService
+from accounts.serializers import NearbySearchQuerySerializer
+from accounts.spatial import nearby_profiles
+from cddp.exports import export_response, EXPORT_FORMAT_PARAMETER
+from incident.models import IncidentVolunteer
+from . import matching
 from .models import (
     Volunteer,
     VolunteerSkill,
@@ -118,9 +124,11 @@ class VolunteerViewSet(viewsets.ModelViewSet):
         return super().list(request, *args, **kwargs)
     
     def get_queryset(self):
-        queryset = super().get_queryset().annotate(
-            average_rating=Avg('volunteerrating__rating'),
-            total_ratings=Count('volunteerrating')
+        # Rating aggregates are cached on the row, see Volunteer.add_rating
+        queryset = super().get_queryset().select_related('user').prefetch_related(
+            'volunteerskill_set__skill',
+            'volunteerskill_set__verified_by',
+            'volunteerrating_set__rated_by',
         )
         # if self.action == 'list':
         #     # Filter active and available volunteers by default
@@ -130,6 +138,35 @@ class VolunteerViewSet(viewsets.ModelViewSet):
         #     )
         return queryset
     
+    @extend_schema(
+        summary="Export volunteers and their contributed hours",
+        parameters=[EXPORT_FORMAT_PARAMETER],
+        responses={200: OpenApiTypes.BINARY}
+    )
+    @action(detail=False, methods=['GET'])
+    def export(self, request):
+        # Summed in a subquery so the join does not multiply the rating aggregates
+        hours = IncidentVolunteer.objects.filter(
+            volunteer=OuterRef('pk')
+        ).order_by().values('volunteer').annotate(total=Sum('hours_contributed')).values('total')
+
+        return export_response(
+            request,
+            self.filter_queryset(self.get_queryset()),
+            [
+                'id', 'experience_level', 'verified_hours', 'rating', 'is_available', 'created_at',
+            ],
+            'volunteers',
+            average_rating=ExpressionWrapper(
+                Cast('rating_sum', FloatField()) / NullIf('rating_count', 0), output_field=FloatField()
+            ),
+            total_ratings=F('rating_count'),
+            email=F('user__email'),
+            first_name=F('user__first_name'),
+            last_name=F('user__last_name'),
+            hours_contributed=Coalesce(Subquery(hours, output_field=FloatField()), 0.0),
+        )
+
     @extend_schema(
         summary="Search volunteers by skills and availability",
         parameters=[
@@ -162,15 +199,17 @@ class VolunteerViewSet(viewsets.ModelViewSet):
         availability_days = request.query_params.get('availability_days')
 
         if skills:
-            skill_ids = [int(id) for id in skills.split(',')]
-            skill_query = Q()
-            for skill_id in skill_ids:
-                skill_query &= Q(skills__id=skill_id)
-            
+            skill_ids = {int(id) for id in skills.split(',')}
+            # Volunteers holding every requested skill, found in one grouped subquery
+            # instead of a join per skill
+            matching_skills = VolunteerSkill.objects.filter(skill_id__in=skill_ids)
             if min_proficiency:
-                skill_query &= Q(volunteerskill__proficiency_level__gte=int(min_proficiency))
-            
-            queryset = queryset.filter(skill_query)
+                matching_skills = matching_skills.filter(proficiency_level__gte=int(min_proficiency))
+            queryset = queryset.filter(
+                pk__in=matching_skills.values('volunteer').annotate(
+                    matched=Count('skill', distinct=True)
+                ).filter(matched=len(skill_ids)).values('volunteer')
+            )
 
         if availability_days:
             days = availability_days.split(',')
@@ -208,14 +247,16 @@ class VolunteerViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'])
     def rate_volunteer(self, request, pk=None):
         volunteer = self.get_object()
-        serializer = VolunteerRatingSerializer(data=request.data)
+        serializer = VolunteerRatingSerializer(
+            data=request.data,
+            context={'request': request, 'volunteer': volunteer}
+        )
         
         if serializer.is_valid():
             serializer.save(
                 volunteer=volunteer,
                 rated_by=request.user
             )
-            volunteer.update_rating()
             return Response(serializer.data)
         return Response(
             serializer.errors,
@@ -254,37 +295,36 @@ class VolunteerViewSet(viewsets.ModelViewSet):
     )
     @action(detail=False, methods=['GET'])
     def find_nearby(self, request):
+        serializer = NearbySearchQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+        if 'latitude' not in params:
+            return Response(
+                {'error': 'latitude and longitude are required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-        pass
-        # try:
-        #     latitude = float(request.query_params.get('latitude'))
-        #     longitude = float(request.query_params.get('longitude'))
-        #     radius = float(request.query_params.get('radius', 10.0))
-        #     point = Point(longitude, latitude, srid=4326)
-            
-        #     queryset = self.get_queryset().filter(
-        #         is_available=True,
-        #         preferred_location__distance_lte=(point, D(km=radius))
-        #     ).annotate(
-        #         distance=Distance('preferred_location', point)
-        #     )
+        try:
+            queryset = self.get_queryset().filter(is_available=True)
 
-        #     skills_required = request.query_params.get('skills_required')
-        #     if skills_required:
-        #         skill_ids = [int(id) for id in skills_required.split(',')]
-        #         queryset = queryset.filter(skills__id__in=skill_ids)
-
-        #     queryset = queryset.order_by('distance')
-            
-        #     page = self.paginate_queryset(queryset)
-        #     serializer = self.get_serializer(page, many=True)
-        #     return self.get_paginated_response(serializer.data)
-            
-        # except (ValueError, TypeError):
-        #     return Response(
-        #         {'error': 'Invalid parameters provided'},
-        #         status=status.HTTP_400_BAD_REQUEST
-        #     )
+            skills_required = request.query_params.get('skills_required')
+            if skills_required:
+                skill_ids = [int(id) for id in skills_required.split(',')]
+                queryset = queryset.filter(skills__id__in=skill_ids).distinct()
+        except (ValueError, TypeError):
+            return Response(
+                {'error': 'Invalid parameters provided'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        nearby = nearby_profiles(queryset, params['latitude'], params['longitude'], params.get('radius', 10.0))
+        distances = {volunteer.id: distance for volunteer, distance in nearby}
+
+        page = self.paginate_queryset([volunteer for volunteer, _ in nearby])
+        serializer = self.get_serializer(page, many=True)
+        for item in serializer.data:
+            item['distance_km'] = round(distances[item['id']], 3)
+        return self.get_paginated_response(serializer.data)
    
 
 
@@ -472,6 +512,8 @@ class VolunteerSkillViewSet(viewsets.ModelViewSet):
             verified=True,
             verified_by=request.user
         )
+        # update() skips the signals that refresh the matching snapshot
+        matching.invalidate()
         
         return Response({
             'verified_count': updated_count,